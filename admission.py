@@ -0,0 +1,288 @@
+import asyncio
+import json
+from collections import deque
+from typing import Dict, Optional
+
+import anyio
+
+from config import settings
+from metrics import Counter
+
+# Admission control of the HTTP requests, gated by the ADMISSION settings. Ingest requests and the reads of the
+# cumulative count and latest timestamp of a device go through separate lanes, each with its own limit of requests
+# in flight and its own queue, so a storm of writes queues and sheds writes only. Requests of the other endpoints
+# are not limited.
+
+LANE_INGEST = "ingest"
+LANE_READ = "read"
+
+SHED_QUEUE_FULL = "queue_full"
+SHED_TIMEOUT = "timeout"
+
+INGEST_PATHS = frozenset(["/api/devices/readings", "/api/devices/readings/batch", "/api/devices/readings/stream"])
+READ_SUFFIXES = ("/cumulative_count", "/latest_timestamp")
+
+
+class AdmissionLane:
+    """
+    Limit of the requests of one kind in flight, with a bounded queue of the requests waiting for a slot.
+
+    A request is admitted at once while fewer than `max_in_flight` requests are in flight and none is waiting,
+    and is otherwise queued, first in first out. A request is shed when the queue is full or when it waited
+    `queue_timeout_s` seconds without a slot. A released slot is handed to the first waiting request, so the
+    number of requests in flight never goes above the limit, even briefly.
+
+    The lane is used from the event loop only, so it needs no lock.
+
+    Attributes:
+        name (str): The name of the lane, used in the metrics.
+        max_in_flight (int): The maximum number of requests in flight.
+        queue_size (int): The maximum number of requests waiting for a slot.
+        queue_timeout_s (float): The longest a request waits for a slot before it is shed.
+        in_flight (int): The number of requests in flight.
+        admitted (int): The number of requests admitted since the lane was created.
+        shed (Dict[str, int]): The number of requests shed since the lane was created, by reason.
+    """
+
+    def __init__(self, name: str, max_in_flight: int, queue_size: int, queue_timeout_s: float):
+        """
+        Initialize the AdmissionLane.
+
+        Args:
+            name (str): The name of the lane, used in the metrics.
+            max_in_flight (int): The maximum number of requests in flight.
+            queue_size (int): The maximum number of requests waiting for a slot, 0 to shed at once.
+            queue_timeout_s (float): The longest a request waits for a slot before it is shed.
+
+        Raises:
+            ValueError: If the limit or the timeout is not positive, or the queue size is negative.
+        """
+        if max_in_flight < 1 or queue_size < 0 or queue_timeout_s <= 0:
+            raise ValueError("The limit and the queue timeout must be positive and the queue size not negative")
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.queue_size = queue_size
+        self.queue_timeout_s = queue_timeout_s
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed: Dict[str, int] = {SHED_QUEUE_FULL: 0, SHED_TIMEOUT: 0}
+        self._waiters = deque()  # Futures of the queued requests, resolved when a slot is handed to them
+
+    @property
+    def queued(self) -> int:
+        """Return the number of requests waiting for a slot."""
+        return len(self._waiters)
+
+    async def acquire(self) -> Optional[str]:
+        """
+        Take a slot of the lane, waiting for one if the lane is full.
+
+        Returns:
+            Optional[str]: None if the request was admitted, or the reason it was shed: "queue_full" or "timeout".
+        """
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return None
+        if len(self._waiters) >= self.queue_size:
+            self.shed[SHED_QUEUE_FULL] += 1
+            return SHED_QUEUE_FULL
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout_s)
+        except asyncio.TimeoutError:
+            self._remove(waiter)
+            self.shed[SHED_TIMEOUT] += 1
+            return SHED_TIMEOUT
+        except BaseException:
+            # A slot handed to a cancelled request is passed on, otherwise it would never be released
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                self._remove(waiter)
+            raise
+        self.admitted += 1
+        return None
+
+    def _remove(self, waiter: asyncio.Future):
+        """Remove a request from the queue, if it is still in it."""
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self):
+        """Release the slot of a request, handing it to the first waiting request if any."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            # Requests that timed out or were cancelled are done already and are skipped
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self) -> dict:
+        """
+        Report the state of the lane.
+
+        Returns:
+            dict: The limits of the lane, the requests in flight and waiting, and the number of requests admitted
+            and shed by reason.
+        """
+        return {
+            "max_in_flight": self.max_in_flight,
+            "queue_size": self.queue_size,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "shed": dict(self.shed),
+        }
+
+
+class AdmissionController:
+    """
+    Lanes of the requests subject to admission control, and the lane of each request.
+
+    Ingest requests (the POST requests adding readings) go through the ingest lane and the reads of the
+    cumulative count and latest timestamp of a device through the read lane. The sync handlers of both run in
+    the threadpool, so the threadpool is sized to hold both lanes in full: the threads the ingest lane cannot use
+    are kept for the reads.
+
+    Attributes:
+        lanes (Dict[str, AdmissionLane]): The lanes, by name.
+        retry_after_s (int): The delay sent in the Retry-After header of the shed requests.
+        threads (int): The size of the threadpool holding the requests in flight of every lane.
+    """
+
+    def __init__(self, ingest_max_in_flight=24, ingest_queue_size=100, read_max_in_flight=16, read_queue_size=1000,
+                 queue_timeout_s=1.0, retry_after_s=1):
+        """
+        Initialize the AdmissionController.
+
+        Args:
+            ingest_max_in_flight (int): The maximum number of ingest requests in flight. Defaults to 24.
+            ingest_queue_size (int): The maximum number of ingest requests waiting. Defaults to 100.
+            read_max_in_flight (int): The maximum number of reads in flight. Defaults to 16.
+            read_queue_size (int): The maximum number of reads waiting. Defaults to 1000.
+            queue_timeout_s (float): The longest a request waits for a slot before it is shed. Defaults to 1 second.
+            retry_after_s (int): The delay sent in the Retry-After header of the shed requests. Defaults to 1.
+        """
+        self.lanes = {
+            LANE_INGEST: AdmissionLane(LANE_INGEST, ingest_max_in_flight, ingest_queue_size, queue_timeout_s),
+            LANE_READ: AdmissionLane(LANE_READ, read_max_in_flight, read_queue_size, queue_timeout_s),
+        }
+        self.retry_after_s = retry_after_s
+        self.threads = ingest_max_in_flight + read_max_in_flight
+
+    def lane(self, method: str, path: str) -> Optional[AdmissionLane]:
+        """
+        Return the lane of a request.
+
+        Args:
+            method (str): The HTTP method of the request.
+            path (str): The path of the request.
+
+        Returns:
+            Optional[AdmissionLane]: The lane of the request, or None if it is not subject to admission control.
+        """
+        if method == "POST" and path in INGEST_PATHS:
+            return self.lanes[LANE_INGEST]
+        if method == "GET" and path.startswith("/api/devices/") and path.endswith(READ_SUFFIXES):
+            return self.lanes[LANE_READ]
+        return None
+
+    def reserve_threads(self):
+        """Grow the threadpool of the running event loop to hold the requests in flight of every lane."""
+        limiter = anyio.to_thread.current_default_thread_limiter()
+        if limiter.total_tokens < self.threads:
+            limiter.total_tokens = self.threads
+
+    def stats(self) -> dict:
+        """
+        Report the state of the lanes.
+
+        Returns:
+            dict: The statistics of each lane, by name, and the Retry-After delay.
+        """
+        return {"retry_after_s": self.retry_after_s, **{name: lane.stats() for name, lane in self.lanes.items()}}
+
+
+class AdmissionControlMiddleware:
+    """
+    ASGI middleware admitting the requests through the lanes of an AdmissionController.
+
+    A request is admitted before its body is read, and holds its slot until its response is complete, streamed
+    bodies included. A shed request gets a 429 response with a Retry-After header without running its handler.
+    """
+
+    def __init__(self, app, controller: AdmissionController, shed_counter: Optional[Counter] = None):
+        """
+        Initialize the middleware.
+
+        Args:
+            app: The ASGI application.
+            controller (AdmissionController): The lanes the requests go through.
+            shed_counter (Counter): The counter of the shed requests, with the labels "lane" and "reason".
+                Defaults to none.
+        """
+        self.app = app
+        self.controller = controller
+        self.shed_counter = shed_counter
+
+    async def __call__(self, scope, receive, send):
+        lane = self.controller.lane(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if lane is None:
+            await self.app(scope, receive, send)
+            return
+        self.controller.reserve_threads()
+
+        reason = await lane.acquire()
+        if reason is not None:
+            if self.shed_counter is not None:
+                self.shed_counter.labels(lane.name, reason).inc()
+            await self._send_shed(send, lane)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            lane.release()
+
+    async def _send_shed(self, send, lane: AdmissionLane):
+        """Send the 429 response of a shed request."""
+        body = json.dumps({"message": f"Too many {lane.name} requests, retry later"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(self.controller.retry_after_s).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def create_admission_controller(settings) -> Optional[AdmissionController]:
+    """
+    Create the admission controller configured by the ADMISSION settings.
+
+    Args:
+        settings (Settings): The settings instance to read the admission options from.
+
+    Returns:
+        Optional[AdmissionController]: The controller, or None if admission control is disabled.
+    """
+    if not settings.ADMISSION_ENABLED:
+        return None
+    return AdmissionController(ingest_max_in_flight=settings.ADMISSION_INGEST_MAX_IN_FLIGHT,
+                               ingest_queue_size=settings.ADMISSION_INGEST_QUEUE_SIZE,
+                               read_max_in_flight=settings.ADMISSION_READ_MAX_IN_FLIGHT,
+                               read_queue_size=settings.ADMISSION_READ_QUEUE_SIZE,
+                               queue_timeout_s=settings.ADMISSION_QUEUE_TIMEOUT_S,
+                               retry_after_s=settings.ADMISSION_RETRY_AFTER_S)
+
+
+# Initialize the admission controller, if enabled.
+admission_controller = create_admission_controller(settings)
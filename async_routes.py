@@ -0,0 +1,240 @@
+import uuid
+from datetime import datetime
+from typing import Literal, Optional
+from fastapi import APIRouter, Header, Query, Request, Response, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from admission import admission_controller
+from binary_ingest import BinaryDecodeRoute
+from config import settings
+from ingest_pipeline import ingest_pipeline
+from models import DeviceIds, DeviceReadings, DeviceReadingsBatch
+from response_cache import response_cache
+from stream_ingest import NDJSON_MEDIA_TYPES, UploadIngest, UploadResponse, create_upload_reader
+from streaming import encode_json, stream_json_list
+
+# Async handlers used when INGEST_MODE is "async". They run on the event loop instead of the threadpool and
+# serve the same paths and responses as the sync handlers in main.py, so the two modes can be compared.
+router = APIRouter()
+
+
+class PipelineDecodeRoute(BinaryDecodeRoute):
+    """Route decoding the readings of binary bodies, added through the writers of the shards."""
+    add_encoded_readings_batch = staticmethod(ingest_pipeline.add_encoded_readings_batch)
+
+
+# The readings endpoint also accepts MessagePack and packed bodies, decoded by its route
+readings_router = APIRouter(route_class=PipelineDecodeRoute)
+
+
+async def _on_loop(chunks):
+    """Produce the chunks of a streamed response on the event loop, where the shard state can be read."""
+    for chunk in chunks:
+        yield chunk
+
+
+@readings_router.post("/api/devices/readings")
+async def update_readings(readings: DeviceReadings, response: Response):
+    """
+    Endpoint to add or update readings for a device, through the writer of the device's shard.
+
+    Args:
+        readings (DeviceReadings): The readings data containing the device ID and associated readings.
+        response (Response): The response object for setting the status code.
+
+    Returns:
+        dict: A success message or an error message with 500 status if the update fails.
+    """
+    err = await ingest_pipeline.add_device_readings(readings)
+    if err:
+        response.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+        return {"message": err}
+    return {"message": "Readings updated successfully"}
+
+
+router.include_router(readings_router)
+
+
+@router.post("/api/devices/readings/batch")
+async def update_readings_batch(batch: DeviceReadingsBatch):
+    """
+    Endpoint to add or update readings for many devices in a single request, through the writers of their shards.
+
+    Args:
+        batch (DeviceReadingsBatch): The readings data for each device.
+
+    Returns:
+        dict: A JSON object with one result per device, in order of first appearance in the request.
+    """
+    errors = await ingest_pipeline.add_device_readings_batch(batch.devices)
+    results = []
+    for device_id, err in errors.items():
+        if err:
+            results.append({"id": device_id, "success": False, "message": err})
+        else:
+            results.append({"id": device_id, "success": True, "message": "Readings updated successfully"})
+    return {"results": results}
+
+
+@router.post("/api/devices/readings/stream")
+async def stream_readings(request: Request):
+    """
+    Endpoint to add readings for many devices from a large upload, read as it arrives, through the writers of
+    their shards.
+
+    Args:
+        request (Request): The request, whose body is read as a stream.
+
+    Returns:
+        Response: A stream of NDJSON progress, error and done events, or a 415 status for another content type.
+    """
+    reader = create_upload_reader(request.headers.get("content-type"), settings.STREAM_INGEST_MAX_LINE_BYTES)
+    if reader is None:
+        return JSONResponse({"message": "Unsupported content type"},
+                            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+    upload = UploadIngest(reader, ingest_pipeline.add_encoded_readings_batch, settings.STREAM_INGEST_BATCH_SIZE,
+                          settings.STREAM_INGEST_MAX_ERRORS)
+    return UploadResponse(upload.run(request.stream()), media_type=NDJSON_MEDIA_TYPES[0])
+
+
+@router.get("/api/devices/{device_id}/cumulative_count")
+async def get_cumulative_count(device_id: uuid.UUID, response: Response, if_none_match: Optional[str] = Header(None)):
+    """
+    Endpoint to retrieve the cumulative count of readings for a specified device from its shard, with the version
+    of the device as ETag.
+
+    Args:
+        device_id (uuid.UUID): The unique identifier of the device.
+        response (Response): The response object for setting the status code.
+        if_none_match (str): The ETags of the representations the client holds, if any.
+
+    Returns:
+        Response: A JSON object with the cumulative count or an error message if the device is not found.
+    """
+    version = ingest_pipeline.get_device_version(device_id)
+    if version is not None:
+        return response_cache.respond(
+            ("cumulative_count", device_id), version, if_none_match,
+            lambda: encode_json({"cumulative_count": ingest_pipeline.get_cumulative_count(device_id)[0]}))
+    count, err = ingest_pipeline.get_cumulative_count(device_id)
+    if err:
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return {"message": err}
+    return {"cumulative_count": count}
+
+
+@router.get("/api/devices/{device_id}/latest_timestamp")
+async def get_latest_timestamp(device_id: uuid.UUID, response: Response, if_none_match: Optional[str] = Header(None)):
+    """
+    Endpoint to retrieve the latest timestamp of readings for a specified device from its shard, with the version
+    of the device as ETag.
+
+    Args:
+        device_id (uuid.UUID): The unique identifier of the device.
+        response (Response): The response object for setting the status code.
+        if_none_match (str): The ETags of the representations the client holds, if any.
+
+    Returns:
+        Response: A JSON object with the latest timestamp or an error message if the device is not found.
+    """
+    version = ingest_pipeline.get_device_version(device_id)
+    if version is not None:
+        return response_cache.respond(
+            ("latest_timestamp", device_id), version, if_none_match,
+            lambda: encode_json({"latest_timestamp": ingest_pipeline.get_latest_timestamp(device_id)[0]}))
+    timestamp, err = ingest_pipeline.get_latest_timestamp(device_id)
+    if err:
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return {"message": err}
+    return {"latest_timestamp": timestamp}
+
+
+@router.post("/api/devices/summaries")
+async def get_device_summaries(request: DeviceIds):
+    """
+    Endpoint to retrieve the cumulative count and latest timestamp of many devices from their shards, streamed.
+
+    Args:
+        request (DeviceIds): The unique identifiers of the devices.
+
+    Returns:
+        StreamingResponse: A JSON object with one entry per device, in the order of the request.
+    """
+    pages = ingest_pipeline.get_device_summaries(request.ids)
+    return StreamingResponse(_on_loop(stream_json_list("devices", pages)), media_type="application/json")
+
+
+@router.get("/api/devices/summaries")
+async def scan_device_summaries(cursor: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=1)):
+    """
+    Endpoint to retrieve the cumulative count and latest timestamp of every device, shard by shard, streamed.
+
+    Args:
+        cursor (int): The cursor returned by the previous request, or 0 to start from the first device.
+        limit (int): The maximum number of devices to return. Defaults to every device.
+
+    Returns:
+        StreamingResponse: A JSON object with the summary of each device and the `next_cursor`.
+    """
+    scan = ingest_pipeline.scan_device_summaries(cursor=cursor, limit=limit)
+    return StreamingResponse(_on_loop(stream_json_list("devices", scan, tail=lambda: {"next_cursor": scan.cursor})),
+                             media_type="application/json")
+
+
+@router.get("/api/devices/top")
+async def get_top_devices(response: Response, k: int = Query(10, ge=1)):
+    """
+    Endpoint to retrieve the devices with the highest cumulative counts, merged from the index of every shard.
+
+    Args:
+        response (Response): The response object for setting the status code.
+        k (int): The number of devices to return. Defaults to 10.
+
+    Returns:
+        dict: A JSON object with the `id` and `cumulative_count` of each device, the highest count first, or an
+        error message.
+    """
+    try:
+        return {"devices": ingest_pipeline.get_top_devices(k)}
+    except ValueError as e:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {"message": str(e)}
+
+
+@router.get("/api/devices/{device_id}/counts")
+async def get_counts(device_id: uuid.UUID, response: Response, start: datetime = Query(alias="from"),
+                     end: datetime = Query(alias="to"), step: Optional[Literal["minute", "hour", "day"]] = None):
+    """
+    Endpoint to retrieve the count of readings of a device over a time range from the rollups of its shard.
+
+    Args:
+        device_id (uuid.UUID): The unique identifier of the device.
+        response (Response): The response object for setting the status code.
+        start (datetime): The `from` query parameter, the start of the range, included.
+        end (datetime): The `to` query parameter, the end of the range, excluded.
+        step (str): The bucket size, "minute", "hour" or "day". Defaults to the finest one covering the range.
+
+    Returns:
+        dict: A JSON object with the bucket size, the total count and the count per bucket, or an error message.
+    """
+    try:
+        counts, err = ingest_pipeline.get_counts(device_id, start, end, step)
+    except ValueError as e:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {"message": str(e)}
+    if err:
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return {"message": err}
+    return counts
+
+
+@router.get("/api/admin/stats")
+async def get_store_stats():
+    """
+    Endpoint to retrieve the size and usage of the stores of every shard and the pending writes per shard.
+
+    Returns:
+        dict: A JSON object with the statistics of the pipeline, of each shard, of the response cache and of
+        admission control, which is null if disabled.
+    """
+    return {**ingest_pipeline.get_store_stats(), "response_cache": response_cache.stats(),
+            "admission": admission_controller.stats() if admission_controller is not None else None}
@@ -0,0 +1 @@
+"""Benchmarks for the device readings service. Run a benchmark with `python -m benchmarks.<name>`."""
@@ -0,0 +1,68 @@
+"""
+Benchmark of the binary bodies of POST /api/devices/readings against the JSON bodies.
+
+Encodes the same readings as JSON, as MessagePack (when msgpack is installed) and in the packed format, for bodies
+of 1, 100 and 10,000 readings, and reports the bytes on the wire and the time to decode each body into the
+readings added by the service: with pydantic and with the fast path for JSON, and with `binary_ingest` for the
+binary formats.
+
+Usage:
+    python -m benchmarks.binary_ingest [--sizes 1 100 10000] [--readings 200000]
+"""
+import argparse
+import json
+
+from benchmarks.ingest_decode import decode_pydantic, make_body, measure
+from binary_ingest import decode_msgpack, decode_packed, encode_packed, msgpack
+from fast_ingest import decode_device_readings
+
+
+def encode_bodies(json_body: bytes) -> dict:
+    """
+    Encode the readings of a JSON body in every format.
+
+    Args:
+        json_body (bytes): The JSON body, as sent today.
+
+    Returns:
+        dict: The body and the decoder of each format, by name.
+    """
+    device_id, readings = decode_device_readings(json_body)
+    bodies = {
+        "json (pydantic)": (json_body, decode_pydantic),
+        "json (fast)": (json_body, decode_device_readings),
+        "packed": (encode_packed(device_id, readings), lambda body: decode_packed(body)[0]),
+    }
+    if msgpack is not None:
+        body = msgpack.packb({"id": device_id.bytes, "readings": [list(reading) for reading in readings]})
+        bodies["msgpack"] = (body, lambda body: decode_msgpack(body)[0])
+    return bodies
+
+
+def main():
+    """Run the benchmark for every payload size and print a table of the results."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 100, 10_000])
+    parser.add_argument("--readings", type=int, default=200_000, help="Readings decoded per size and format")
+    args = parser.parse_args()
+    if msgpack is None:
+        print("msgpack is not installed, MessagePack is left out")
+
+    print(f"{'readings':>10}  {'format':<16}{'bytes':>12}{'B/reading':>11}{'decode us':>12}{'us/reading':>12}"
+          f"{'vs pydantic':>13}")
+    for size in args.sizes:
+        json_body = make_body(size)
+        expected = decode_pydantic(json_body)
+        repeat = max(1, args.readings // size)
+        pydantic_us = None
+        for name, (body, decode) in encode_bodies(json_body).items():
+            # Every format decodes to the same readings, in the same order
+            assert decode(body) == expected, name
+            decode_us = measure(decode, body, repeat)
+            pydantic_us = pydantic_us or decode_us
+            print(f"{size:>10,}  {name:<16}{len(body):>12,}{len(body) / size:>11,.1f}{decode_us:>12,.1f}"
+                  f"{decode_us / size:>12,.3f}{pydantic_us / decode_us:>12.1f}x")
+
+
+if __name__ == "__main__":
+    main()
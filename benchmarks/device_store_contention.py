@@ -0,0 +1,75 @@
+"""
+Contention benchmark for the device stores.
+
+Runs `get_or_create_device_reading` followed by `increment_count`, as the ingest handler does, from a
+threadpool of increasing size and reports the throughput of each device store backend.
+
+Usage:
+    python -m benchmarks.device_store_contention [--devices 1000] [--ops 200000] [--workers 1 2 4 8 16 32]
+"""
+import argparse
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from stores.in_mem_device_store import InMemoryDeviceStore
+from stores.striped_device_store import StripedDeviceStore
+
+BACKENDS = {
+    "memory": lambda capacity: InMemoryDeviceStore(capacity=capacity),
+    "striped": lambda capacity: StripedDeviceStore(capacity=capacity, stripes=16),
+}
+
+
+def _worker(device_store, device_ids, ops):
+    """Apply `ops` increments, cycling over the given devices."""
+    num_devices = len(device_ids)
+    for i in range(ops):
+        device_store.get_or_create_device_reading(device_ids[i % num_devices]).increment_count(1)
+
+
+def run(backend: str, workers: int, device_ids: list, ops: int) -> float:
+    """
+    Run the contention workload for a backend and threadpool size.
+
+    Args:
+        backend (str): The name of the device store backend.
+        workers (int): The number of threads in the pool.
+        device_ids (list): The devices to update.
+        ops (int): The total number of updates, split evenly over the workers.
+
+    Returns:
+        float: The throughput in updates per second.
+    """
+    device_store = BACKENDS[backend](len(device_ids))
+    ops_per_worker = ops // workers
+    # Each worker starts at a different device so they contend on different stripes
+    slices = [device_ids[i:] + device_ids[:i] for i in range(0, workers * 7, 7)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for worker_device_ids in slices:
+            pool.submit(_worker, device_store, worker_device_ids, ops_per_worker)
+    elapsed = time.perf_counter() - start
+
+    total = sum(device_store.get_device_reading(device_id).total_count for device_id in device_ids)
+    assert total == ops_per_worker * workers, f"{backend}: lost updates ({total} != {ops_per_worker * workers})"
+    return ops_per_worker * workers / elapsed
+
+
+def main():
+    """Run the benchmark for every backend and threadpool size and print a table of the results."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--ops", type=int, default=200_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    device_ids = [uuid.uuid4() for _ in range(args.devices)]
+    print(f"{'backend':<10}{'workers':>8}{'ops/s':>14}")
+    for backend in BACKENDS:
+        for workers in args.workers:
+            print(f"{backend:<10}{workers:>8}{run(backend, workers, device_ids, args.ops):>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
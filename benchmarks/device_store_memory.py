@@ -0,0 +1,101 @@
+"""
+Memory and throughput benchmark for the device stores.
+
+Fills each device store backend with the given number of devices, each with one count update and one timestamp
+update, and reports the memory allocated per device as measured by tracemalloc. Then replays updates over the
+filled store, as the ingest handler does, and reports the single-threaded throughput.
+
+Usage:
+    python -m benchmarks.device_store_memory [--devices 100000] [--ops 200000]
+"""
+import argparse
+import datetime
+import time
+import tracemalloc
+import uuid
+
+from stores.columnar_device_store import ColumnarDeviceStore
+from stores.in_mem_device_store import InMemoryDeviceStore
+from stores.striped_device_store import StripedDeviceStore
+
+BACKENDS = {
+    "memory": lambda capacity: InMemoryDeviceStore(capacity=capacity),
+    "striped": lambda capacity: StripedDeviceStore(capacity=capacity, stripes=16),
+    "columnar": lambda capacity: ColumnarDeviceStore(capacity=capacity, stripes=16),
+}
+
+
+def _update(device_store, device_id, timestamp):
+    """Apply one update to a device, as the ingest handler does."""
+    device_reading = device_store.get_or_create_device_reading(device_id)
+    device_reading.increment_count(1)
+    device_reading.update_latest_timestamp(timestamp)
+
+
+def measure_memory(backend: str, device_ids: list, timestamps: list) -> float:
+    """
+    Fill a store of the backend with the given devices and measure the memory it allocated.
+
+    The device ids and timestamps are allocated beforehand, so only the memory held by the store is counted.
+
+    Args:
+        backend (str): The name of the device store backend.
+        device_ids (list): The devices to create.
+        timestamps (list): One timestamp per device.
+
+    Returns:
+        float: The memory allocated per device, in bytes.
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    device_store = BACKENDS[backend](len(device_ids))
+    for device_id, timestamp in zip(device_ids, timestamps):
+        _update(device_store, device_id, timestamp)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(device_ids)
+
+
+def measure_throughput(backend: str, device_ids: list, timestamps: list, ops: int) -> float:
+    """
+    Replay updates over a filled store of the backend.
+
+    Args:
+        backend (str): The name of the device store backend.
+        device_ids (list): The devices to update.
+        timestamps (list): One timestamp per device.
+        ops (int): The number of updates.
+
+    Returns:
+        float: The throughput in updates per second.
+    """
+    device_store = BACKENDS[backend](len(device_ids))
+    for device_id, timestamp in zip(device_ids, timestamps):
+        _update(device_store, device_id, timestamp)
+
+    num_devices = len(device_ids)
+    start = time.perf_counter()
+    for i in range(ops):
+        _update(device_store, device_ids[i % num_devices], timestamps[i % num_devices])
+    return ops / (time.perf_counter() - start)
+
+
+def main():
+    """Run the benchmark for every backend and print a table of the results."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=100_000)
+    parser.add_argument("--ops", type=int, default=200_000)
+    args = parser.parse_args()
+
+    device_ids = [uuid.uuid4() for _ in range(args.devices)]
+    now = datetime.datetime.now(datetime.timezone.utc)
+    timestamps = [now + datetime.timedelta(seconds=i) for i in range(args.devices)]
+    print(f"{'backend':<10}{'bytes/device':>14}{'updates/s':>14}")
+    for backend in BACKENDS:
+        bytes_per_device = measure_memory(backend, device_ids, timestamps)
+        throughput = measure_throughput(backend, device_ids, timestamps, args.ops)
+        print(f"{backend:<10}{bytes_per_device:>14,.0f}{throughput:>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
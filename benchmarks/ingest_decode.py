@@ -0,0 +1,113 @@
+"""
+Benchmark of the decoders of POST /api/devices/readings bodies.
+
+Decodes bodies of 1, 100 and 10,000 readings with the pydantic path (JSON parsing and model validation as done by
+FastAPI, then the conversion of each timestamp to epoch microseconds) and with the fast path of `fast_ingest`,
+and reports the time per body and per reading of each. Then adds the decoded readings to a service backed by
+the in-memory stores, and reports the time per body of decoding and ingesting together.
+
+Usage:
+    python -m benchmarks.ingest_decode [--sizes 1 100 10000] [--readings 200000]
+"""
+import argparse
+import datetime
+import json
+import time
+import uuid
+
+from device_readings_service import DeviceReadingsService
+from fast_ingest import decode_device_readings
+from models import DeviceReadings
+from stores.epoch import to_epoch_us, utc_offset_seconds
+from stores.in_mem_device_store import InMemoryDeviceStore
+from stores.in_memory_ts_store import InMemoryTimestampStore
+
+
+def make_body(size: int) -> bytes:
+    """Return the body of a request with `size` readings one second apart, with microseconds and a UTC offset."""
+    start = datetime.datetime(2024, 10, 11, 2, 11, 43, 862000, tzinfo=datetime.timezone.utc)
+    readings = [{"timestamp": (start + datetime.timedelta(seconds=i)).isoformat(), "count": i % 10}
+                for i in range(size)]
+    return json.dumps({"id": str(uuid.uuid4()), "readings": readings}).encode()
+
+
+def decode_pydantic(body: bytes):
+    """Decode a body the way the pydantic handler does, up to the readings encoded for the stores."""
+    device_readings = DeviceReadings.model_validate(json.loads(body))
+    return device_readings.id, [(to_epoch_us(reading.timestamp), reading.count, utc_offset_seconds(reading.timestamp))
+                                for reading in device_readings.readings]
+
+
+def ingest_pydantic(service: DeviceReadingsService, body: bytes):
+    """Decode a body with pydantic and add its readings, as the regular handler does."""
+    service.add_device_readings(DeviceReadings.model_validate(json.loads(body)))
+
+
+def ingest_fast(service: DeviceReadingsService, body: bytes):
+    """Decode a body with the fast path and add its readings, as the fast handler does."""
+    service.add_encoded_readings(*decode_device_readings(body))
+
+
+def measure(fn, body: bytes, repeat: int) -> float:
+    """
+    Call a function on a body repeatedly.
+
+    Args:
+        fn (Callable): The function, called with the body.
+        body (bytes): The body of the request.
+        repeat (int): The number of calls.
+
+    Returns:
+        float: The mean time per call, in microseconds.
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(body)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def measure_ingest(ingest, body: bytes, repeat: int) -> float:
+    """
+    Add a body to a new service repeatedly, clearing the stores between calls so every reading is accepted.
+
+    Args:
+        ingest (Callable): The function decoding and adding the body, called with the service and the body.
+        body (bytes): The body of the request.
+        repeat (int): The number of calls.
+
+    Returns:
+        float: The mean time per call, in microseconds.
+    """
+    ts_store = InMemoryTimestampStore(capacity=1_000_000)
+    service = DeviceReadingsService(InMemoryDeviceStore(capacity=1), ts_store)
+    elapsed = 0.0
+    for _ in range(repeat):
+        ts_store.clear()
+        start = time.perf_counter()
+        ingest(service, body)
+        elapsed += time.perf_counter() - start
+    return elapsed / repeat * 1e6
+
+
+def main():
+    """Run the benchmark for every payload size and print a table of the results."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 100, 10_000])
+    parser.add_argument("--readings", type=int, default=200_000, help="Readings decoded per size and decoder")
+    args = parser.parse_args()
+
+    print(f"{'readings':>10}{'pydantic us':>14}{'fast us':>12}{'us/reading':>12}{'speedup':>10}"
+          f"{'ingest speedup':>16}")
+    for size in args.sizes:
+        body = make_body(size)
+        assert decode_device_readings(body) == decode_pydantic(body)
+        repeat = max(1, args.readings // size)
+        pydantic_us = measure(decode_pydantic, body, repeat)
+        fast_us = measure(decode_device_readings, body, repeat)
+        ingest_speedup = measure_ingest(ingest_pydantic, body, repeat) / measure_ingest(ingest_fast, body, repeat)
+        print(f"{size:>10,}{pydantic_us:>14,.1f}{fast_us:>12,.1f}{fast_us / size:>12,.2f}"
+              f"{pydantic_us / fast_us:>10.2f}x{ingest_speedup:>15.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Redis store benchmark.
+
+Sends requests of several readings each to the service from a threadpool, as the sync handlers run, and reports
+the requests per second with the in-memory stores and with the Redis store at the given URL.
+
+Usage:
+    python -m benchmarks.redis_store [--url redis://localhost:6379/0] [--requests 5000] [--readings 10]
+        [--workers 16]
+"""
+import argparse
+import datetime
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+
+from device_readings_service import DeviceReadingsService
+from models import DeviceReadings, Reading
+from stores.in_mem_device_store import InMemoryDeviceStore
+from stores.in_memory_ts_store import InMemoryTimestampStore
+from stores.redis_store import RedisStore
+
+# Key prefix of the benchmark, deleted once it is done.
+PREFIX = "device_readings_benchmark"
+
+
+def _payloads(requests: int, readings: int) -> list:
+    """Build requests with unique readings spread over 100 devices."""
+    device_ids = [uuid.uuid4() for _ in range(100)]
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return [DeviceReadings(id=device_ids[i % 100], readings=[
+        Reading(timestamp=now + datetime.timedelta(microseconds=i * readings + j), count=1) for j in range(readings)])
+        for i in range(requests)]
+
+
+def run(service: DeviceReadingsService, payloads: list, workers: int) -> float:
+    """
+    Send the requests to the service from a threadpool.
+
+    Args:
+        service (DeviceReadingsService): The service under test.
+        payloads (list): The requests.
+        workers (int): The number of threads in the pool.
+
+    Returns:
+        float: The throughput in requests per second.
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        errors = [err for err in pool.map(service.add_device_readings, payloads) if err]
+    elapsed = time.perf_counter() - start
+    assert not errors, f"{len(errors)} requests failed: {errors[0]}"
+    return len(payloads) / elapsed
+
+
+def main():
+    """Run the benchmark with each backend and print a table of the results."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="redis://localhost:6379/0")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--readings", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=16)
+    args = parser.parse_args()
+
+    payloads = _payloads(args.requests, args.readings)
+    capacity = args.requests * args.readings
+    print(f"{'backend':<10}{'requests/s':>14}")
+
+    service = DeviceReadingsService(device_store=InMemoryDeviceStore(capacity=100),
+                                    ts_store=InMemoryTimestampStore(capacity=capacity))
+    print(f"{'memory':<10}{run(service, payloads, args.workers):>14,.0f}")
+
+    store = RedisStore.from_url(args.url, max_connections=args.workers, device_capacity=100, ts_capacity=capacity,
+                                prefix=PREFIX)
+    try:
+        store.client.ping()
+    except redis.ConnectionError:
+        print(f"{'redis':<10}{'unreachable':>14}")
+        return
+    store.clear()
+    try:
+        service = DeviceReadingsService(device_store=store, ts_store=store)
+        print(f"{'redis':<10}{run(service, payloads, args.workers):>14,.0f}")
+    finally:
+        store.clear()
+
+
+if __name__ == "__main__":
+    main()
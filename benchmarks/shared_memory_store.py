@@ -0,0 +1,96 @@
+"""
+Multi-process benchmark for the shared memory store.
+
+Runs an increasing number of worker processes, as `uvicorn main:app --workers N` does, each sending requests
+of several readings to its own service attached to one shared memory segment, and reports the total
+throughput and the scaling over a single process. The counts of every device are checked at the end.
+
+Usage:
+    python -m benchmarks.shared_memory_store [--devices 1000] [--requests 20000] [--readings 10]
+        [--workers 1 2 4 8]
+"""
+import argparse
+import datetime
+import multiprocessing
+import time
+import uuid
+
+from device_readings_service import DeviceReadingsService
+from models import DeviceReadings, Reading
+from stores.shared_memory_store import SharedMemoryStore
+
+
+def _worker(name, device_ids, worker, requests, readings, capacities, barrier):
+    """Attach to the segment, build the requests, then send them once every process is ready."""
+    store = SharedMemoryStore(name, *capacities)
+    service = DeviceReadingsService(device_store=store, ts_store=store)
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    num_devices = len(device_ids)
+    payloads = [DeviceReadings(id=device_ids[(worker * 7 + i) % num_devices], readings=[
+        Reading(timestamp=start + datetime.timedelta(microseconds=(worker * requests + i) * readings + j), count=1)
+        for j in range(readings)]) for i in range(requests)]
+    barrier.wait()
+    for payload in payloads:
+        service.add_device_readings(payload)
+    store.close()
+
+
+def run(workers: int, device_ids: list, requests: int, readings: int) -> float:
+    """
+    Run the workload with a number of processes sharing a new segment.
+
+    Args:
+        workers (int): The number of processes.
+        device_ids (list): The devices to update.
+        requests (int): The total number of requests, split evenly over the processes.
+        readings (int): The number of readings per request.
+
+    Returns:
+        float: The throughput in requests per second.
+    """
+    requests_per_worker = requests // workers
+    capacities = (len(device_ids), requests_per_worker * workers * readings, 16)
+    store = SharedMemoryStore(f"device_readings_benchmark_{uuid.uuid4().hex[:8]}", *capacities)
+    try:
+        context = multiprocessing.get_context("spawn")
+        barrier = context.Barrier(workers + 1)
+        processes = [context.Process(target=_worker, args=(store.name, device_ids, worker, requests_per_worker,
+                                                           readings, capacities, barrier))
+                     for worker in range(workers)]
+        for process in processes:
+            process.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        total = sum(store.get_device_reading(device_id).total_count for device_id in device_ids)
+        expected = requests_per_worker * workers * readings
+        assert total == expected, f"lost updates ({total} != {expected})"
+        return requests_per_worker * workers / elapsed
+    finally:
+        store.unlink()
+        store.close()
+
+
+def main():
+    """Run the benchmark for every number of processes and print a table of the results."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--readings", type=int, default=10)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    device_ids = [uuid.uuid4() for _ in range(args.devices)]
+    print(f"{'workers':>8}{'requests/s':>14}{'scaling':>10}")
+    baseline = None
+    for workers in args.workers:
+        throughput = run(workers, device_ids, args.requests, args.readings)
+        baseline = baseline or throughput
+        print(f"{workers:>8}{throughput:>14,.0f}{throughput / baseline:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+"""
+Benchmark suite for regression tracking.
+
+Runs the benchmarks below and writes their metrics to a JSON file, and compares two such files, failing when a
+metric regressed by more than a threshold:
+
+- `ts_store`: `InMemoryTimestampStore.check_and_add_timestamp` for new timestamps with the store empty, half full
+  and full (every insert evicting the oldest timestamp), and for duplicates.
+- `device_store`: `InMemoryDeviceStore.get_or_create_device_reading` and `increment_count` from threadpools of
+  1, 4 and 16 workers.
+- `service`: `DeviceReadingsService.add_device_readings` over requests of 1, 10, 100 and 1000 readings, with 0%,
+  50% and 90% of the readings being duplicates.
+- `http`: throughput and p50/p99 latency of `POST /api/devices/readings` and
+  `GET /api/devices/{device_id}/cumulative_count` on `main.app`, through the ASGI test client.
+
+Each benchmark is repeated and the best result of each metric is kept. `--scale` shrinks or grows the number of
+operations of every benchmark, for quick runs.
+
+Usage:
+    python -m benchmarks.suite run [--output benchmarks.json] [--scale 1.0] [--repeat 3]
+        [--only ts_store device_store service http]
+    python -m benchmarks.suite compare baseline.json benchmarks.json [--threshold 0.1]
+"""
+import argparse
+import datetime
+import json
+import platform
+import random
+import sys
+import time
+import uuid
+from typing import Callable, Dict, List
+
+from benchmarks.device_store_contention import run as run_contention
+from device_readings_service import DeviceReadingsService
+from models import DeviceReadings, Reading
+from stores.in_mem_device_store import InMemoryDeviceStore
+from stores.in_memory_ts_store import InMemoryTimestampStore
+
+# Version of the layout of the result files.
+RESULTS_VERSION = 1
+
+HIGHER = "higher"
+LOWER = "lower"
+
+START = datetime.datetime(2024, 10, 11, tzinfo=datetime.timezone.utc)
+
+
+def _metric(value: float, unit: str, better: str = HIGHER) -> dict:
+    """Return a metric of the results, with the direction in which it improves."""
+    return {"value": value, "unit": unit, "better": better}
+
+
+def bench_ts_store(scale: float) -> Dict[str, dict]:
+    """
+    Measure `check_and_add_timestamp` on the in-memory timestamp store at different fill levels.
+
+    Args:
+        scale (float): The factor applied to the number of operations.
+
+    Returns:
+        Dict[str, dict]: The operations per second of each fill level and of duplicates.
+    """
+    ops = max(1000, int(200_000 * scale))
+    capacity = 2 * ops
+    device_ids = [uuid.uuid4() for _ in range(100)]
+    metrics = {}
+    for fill in (0, 50, 100):
+        ts_store = InMemoryTimestampStore(capacity=capacity)
+        prefill = capacity * fill // 100
+        for i in range(prefill):
+            ts_store.check_and_add_timestamp(device_ids[i % 100], i)
+        start = time.perf_counter()
+        for i in range(prefill, prefill + ops):
+            ts_store.check_and_add_timestamp(device_ids[i % 100], i)
+        metrics[f"ts_store.new.fill_{fill}"] = _metric(ops / (time.perf_counter() - start), "ops/s")
+
+        if fill == 100:
+            # Every key of the last `ops` inserts is still held, so they are all duplicates
+            start = time.perf_counter()
+            for i in range(prefill, prefill + ops):
+                ts_store.check_and_add_timestamp(device_ids[i % 100], i)
+            metrics["ts_store.duplicate.fill_100"] = _metric(ops / (time.perf_counter() - start), "ops/s")
+    return metrics
+
+
+def bench_device_store(scale: float) -> Dict[str, dict]:
+    """
+    Measure `get_or_create_device_reading` on the in-memory device store under thread contention.
+
+    Args:
+        scale (float): The factor applied to the number of operations.
+
+    Returns:
+        Dict[str, dict]: The operations per second of each threadpool size.
+    """
+    ops = max(1000, int(200_000 * scale))
+    device_ids = [uuid.uuid4() for _ in range(min(1000, ops // 16))]
+    return {f"device_store.workers_{workers}": _metric(run_contention("memory", workers, device_ids, ops), "ops/s")
+            for workers in (1, 4, 16)}
+
+
+def _payloads(batch_size: int, duplicate_percent: int, readings: int, devices: List[uuid.UUID]
+              ) -> List[DeviceReadings]:
+    """
+    Build requests of `batch_size` readings where `duplicate_percent` of the readings repeat an earlier one.
+
+    Args:
+        batch_size (int): The number of readings per request.
+        duplicate_percent (int): The share of readings that are duplicates, in percent.
+        readings (int): The total number of readings.
+        devices (List[uuid.UUID]): The devices the requests are spread over.
+
+    Returns:
+        List[DeviceReadings]: The requests.
+    """
+    rng = random.Random(batch_size * 100 + duplicate_percent)
+    sent = {device_id: [] for device_id in devices}
+    payloads = []
+    for request in range(max(1, readings // batch_size)):
+        device_id = devices[request % len(devices)]
+        device_sent = sent[device_id]
+        batch = []
+        for _ in range(batch_size):
+            if device_sent and rng.randrange(100) < duplicate_percent:
+                timestamp = rng.choice(device_sent)
+            else:
+                timestamp = START + datetime.timedelta(seconds=len(device_sent))
+                device_sent.append(timestamp)
+            batch.append(Reading(timestamp=timestamp, count=1))
+        payloads.append(DeviceReadings(id=device_id, readings=batch))
+    return payloads
+
+
+def bench_service(scale: float) -> Dict[str, dict]:
+    """
+    Measure `add_device_readings` across batch sizes and duplicate ratios, with the in-memory stores.
+
+    Args:
+        scale (float): The factor applied to the number of readings.
+
+    Returns:
+        Dict[str, dict]: The readings per second of each batch size and duplicate ratio.
+    """
+    readings = max(1000, int(100_000 * scale))
+    devices = [uuid.uuid4() for _ in range(100)]
+    metrics = {}
+    for batch_size in (1, 10, 100, 1000):
+        for duplicate_percent in (0, 50, 90):
+            payloads = _payloads(batch_size, duplicate_percent, readings, devices)
+            service = DeviceReadingsService(device_store=InMemoryDeviceStore(capacity=len(devices)),
+                                            ts_store=InMemoryTimestampStore(capacity=readings))
+            start = time.perf_counter()
+            for payload in payloads:
+                service.add_device_readings(payload)
+            elapsed = time.perf_counter() - start
+            metrics[f"service.batch_{batch_size}.duplicates_{duplicate_percent}"] = _metric(
+                len(payloads) * batch_size / elapsed, "readings/s")
+    return metrics
+
+
+def _percentile(latencies: List[float], percent: int) -> float:
+    """Return a percentile of sorted latencies, in milliseconds."""
+    return latencies[min(len(latencies) - 1, len(latencies) * percent // 100)] * 1000
+
+
+def _request_metrics(name: str, send: Callable[[int], None], requests: int) -> Dict[str, dict]:
+    """Send requests one after the other and return their throughput and latency percentiles."""
+    latencies = []
+    start = time.perf_counter()
+    for i in range(requests):
+        sent = time.perf_counter()
+        send(i)
+        latencies.append(time.perf_counter() - sent)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        f"http.{name}.throughput": _metric(requests / elapsed, "requests/s"),
+        f"http.{name}.p50": _metric(_percentile(latencies, 50), "ms", LOWER),
+        f"http.{name}.p99": _metric(_percentile(latencies, 99), "ms", LOWER),
+    }
+
+
+def bench_http(scale: float) -> Dict[str, dict]:
+    """
+    Measure the throughput and latency of the ingest and read endpoints of `main.app`.
+
+    The requests go through the whole application (routing, validation, the service and the stores configured
+    in the settings) in process, without a network, so the stores are cleared before and after.
+
+    Args:
+        scale (float): The factor applied to the number of requests.
+
+    Returns:
+        Dict[str, dict]: The requests per second and p50/p99 latencies of each endpoint.
+    """
+    from fastapi.testclient import TestClient
+    from device_readings_service import device_readings_service
+    from main import app
+    from response_cache import response_cache
+
+    def clear():
+        device_readings_service.device_store.clear()
+        device_readings_service.ts_store.clear()
+        if device_readings_service.rollups is not None:
+            device_readings_service.rollups.clear()
+        if device_readings_service.top_devices is not None:
+            device_readings_service.top_devices.clear()
+        response_cache.clear()
+
+    requests = max(100, int(5000 * scale))
+    device_ids = [str(uuid.uuid4()) for _ in range(50)]
+    client = TestClient(app)
+    clear()
+    try:
+        def post(i):
+            timestamp = (START + datetime.timedelta(seconds=i)).isoformat()
+            client.post("/api/devices/readings",
+                        json={"id": device_ids[i % 50], "readings": [{"timestamp": timestamp, "count": 1}]})
+
+        def get(i):
+            client.get(f"/api/devices/{device_ids[i % 50]}/cumulative_count")
+
+        metrics = _request_metrics("post_readings", post, requests)
+        metrics.update(_request_metrics("get_cumulative_count", get, requests))
+    finally:
+        clear()
+    return metrics
+
+
+BENCHMARKS = {
+    "ts_store": bench_ts_store,
+    "device_store": bench_device_store,
+    "service": bench_service,
+    "http": bench_http,
+}
+
+
+def run(names: List[str], scale: float, repeat: int) -> dict:
+    """
+    Run benchmarks, keeping the best value of each metric over the repeats.
+
+    Args:
+        names (List[str]): The names of the benchmarks to run.
+        scale (float): The factor applied to the number of operations.
+        repeat (int): The number of runs of each benchmark.
+
+    Returns:
+        dict: The results, with the metrics and the environment they were measured in.
+    """
+    metrics = {}
+    for name in names:
+        for _ in range(repeat):
+            for key, metric in BENCHMARKS[name](scale).items():
+                best = metrics.get(key)
+                if best is None or (metric["value"] > best["value"]) == (metric["better"] == HIGHER):
+                    metrics[key] = metric
+    return {
+        "version": RESULTS_VERSION,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": scale,
+        "repeat": repeat,
+        "metrics": metrics,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> List[dict]:
+    """
+    Compare the metrics of two results.
+
+    A metric regressed if it moved in the wrong direction by more than `threshold` of its baseline value.
+    Metrics present in only one of the results are reported but never regress.
+
+    Args:
+        baseline (dict): The reference results.
+        current (dict): The results to check.
+        threshold (float): The largest accepted relative change in the wrong direction, such as 0.1 for 10%.
+
+    Returns:
+        List[dict]: One row per metric, with its `name`, `baseline` and `current` values (None if missing),
+        relative `change` and whether it `regressed`.
+    """
+    rows = []
+    baseline_metrics, current_metrics = baseline["metrics"], current["metrics"]
+    for name in sorted(baseline_metrics.keys() | current_metrics.keys()):
+        before, after = baseline_metrics.get(name), current_metrics.get(name)
+        row = {"name": name, "baseline": before and before["value"], "current": after and after["value"],
+               "change": None, "regressed": False}
+        if before and after and before["value"]:
+            row["change"] = change = (after["value"] - before["value"]) / before["value"]
+            row["regressed"] = (-change if after["better"] == HIGHER else change) > threshold
+        rows.append(row)
+    return rows
+
+
+def _print_metrics(metrics: Dict[str, dict]):
+    """Print a table of metrics."""
+    print(f"{'metric':<44}{'value':>16} unit")
+    for name, metric in metrics.items():
+        print(f"{name:<44}{metric['value']:>16,.2f} {metric['unit']}")
+
+
+def _print_comparison(rows: List[dict]):
+    """Print a table of compared metrics."""
+    print(f"{'metric':<44}{'baseline':>16}{'current':>16}{'change':>10}")
+    for row in rows:
+        baseline = "-" if row["baseline"] is None else f"{row['baseline']:,.2f}"
+        current = "-" if row["current"] is None else f"{row['current']:,.2f}"
+        change = "-" if row["change"] is None else f"{row['change']:+.1%}"
+        print(f"{row['name']:<44}{baseline:>16}{current:>16}{change:>10}{'  REGRESSED' if row['regressed'] else ''}")
+
+
+def main() -> int:
+    """Run or compare the benchmarks, returning the exit status."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="Run the benchmarks and write their results")
+    run_parser.add_argument("--output", default="benchmarks.json")
+    run_parser.add_argument("--scale", type=float, default=1.0)
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    compare_parser = commands.add_parser("compare", help="Compare results, failing on regressions")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        results = run(args.only, args.scale, args.repeat)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        _print_metrics(results["metrics"])
+        print(f"Results written to {args.output}")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    rows = compare(baseline, current, args.threshold)
+    _print_comparison(rows)
+    regressions = sum(row["regressed"] for row in rows)
+    if regressions:
+        print(f"{regressions} metric(s) regressed by more than {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Cost of the top devices index on the ingest hot path.
+
+Measures the time of one `TopDevices.update` while the counts of many devices grow, for several index
+capacities, and the throughput of `add_device_readings` with and without the index.
+
+Usage:
+    python -m benchmarks.top_devices [--devices 10000] [--ops 200000] [--capacities 10 100 1000]
+"""
+import argparse
+import datetime
+import random
+import time
+import uuid
+
+from device_readings_service import DeviceReadingsService
+from models import DeviceReadings, Reading
+from stores.in_mem_device_store import InMemoryDeviceStore
+from stores.in_memory_ts_store import InMemoryTimestampStore
+from stores.top_devices import TopDevices
+
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def bench_update(capacity: int, device_ids: list, ops: int) -> float:
+    """
+    Time the updates of the index with the growing counts of devices picked with a skewed distribution.
+
+    Args:
+        capacity (int): The capacity of the index.
+        device_ids (list): The devices to update.
+        ops (int): The number of updates.
+
+    Returns:
+        float: The mean time of an update in nanoseconds.
+    """
+    top_devices = TopDevices(capacity=capacity)
+    counts = dict.fromkeys(device_ids, 0)
+    rng = random.Random(1)
+    # A few devices send most readings, as with real fleets
+    picks = rng.choices(device_ids, weights=[1 / (rank + 1) for rank in range(len(device_ids))], k=ops)
+    start = time.perf_counter()
+    for device_id in picks:
+        count = counts[device_id] = counts[device_id] + 1
+    loop = time.perf_counter() - start
+
+    counts = dict.fromkeys(device_ids, 0)
+    start = time.perf_counter()
+    for device_id in picks:
+        count = counts[device_id] = counts[device_id] + 1
+        top_devices.update(device_id, count)
+    # Only the time of the updates is reported, without that of the loop counting the readings
+    return (time.perf_counter() - start - loop) / ops * 1e9
+
+
+def bench_service(top_devices, device_ids: list, ops: int) -> float:
+    """
+    Measure the throughput of `add_device_readings` with one reading per request.
+
+    Args:
+        top_devices (Optional[TopDevices]): The index of the service, or None.
+        device_ids (list): The devices to update.
+        ops (int): The number of requests.
+
+    Returns:
+        float: The requests per second.
+    """
+    service = DeviceReadingsService(device_store=InMemoryDeviceStore(capacity=len(device_ids)),
+                                    ts_store=InMemoryTimestampStore(capacity=ops), top_devices=top_devices)
+    requests = [DeviceReadings(id=device_ids[i % len(device_ids)],
+                               readings=[Reading(timestamp=START + datetime.timedelta(seconds=i), count=1)])
+                for i in range(ops)]
+    start = time.perf_counter()
+    for device_readings in requests:
+        service.add_device_readings(device_readings)
+    return ops / (time.perf_counter() - start)
+
+
+def main():
+    """Run the benchmarks and print the cost of an update and the service throughput with and without the index."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=10_000)
+    parser.add_argument("--ops", type=int, default=200_000)
+    parser.add_argument("--capacities", type=int, nargs="+", default=[10, 100, 1000])
+    args = parser.parse_args()
+
+    device_ids = [uuid.uuid4() for _ in range(args.devices)]
+    print(f"{'capacity':>10}{'ns/update':>12}")
+    for capacity in args.capacities:
+        print(f"{capacity:>10}{bench_update(capacity, device_ids, args.ops):>12,.0f}")
+
+    # Best of three alternating runs, so both setups see the same machine load
+    ops = args.ops // 4
+    without = with_index = 0.0
+    for _ in range(3):
+        without = max(without, bench_service(None, device_ids, ops))
+        with_index = max(with_index, bench_service(TopDevices(capacity=max(args.capacities)), device_ids, ops))
+    print(f"add_device_readings: {without:,.0f} req/s without the index, {with_index:,.0f} req/s with it "
+          f"(overhead {without / with_index - 1:+.1%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Write-ahead log benchmark.
+
+Measures the ingest throughput of the service with a write-ahead log under each fsync policy, from a threadpool
+as the sync handlers run, and the time to replay the log into empty stores on startup.
+
+Usage:
+    python -m benchmarks.wal [--requests 5000] [--workers 16] [--group-commit-ms 5]
+        [--recovery-records 1000000] [--dir /tmp]
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from device_readings_service import DeviceReadingsService
+from models import DeviceReadings, Reading
+from persistence.wal import FSYNC_ALWAYS, FSYNC_GROUP, FSYNC_NONE, WriteAheadLog
+from stores.in_mem_device_store import InMemoryDeviceStore
+from stores.in_memory_ts_store import InMemoryTimestampStore
+from stores.epoch import to_epoch_us
+
+
+def _service(path: str, fsync_policy: str, num_devices: int, num_readings: int,
+             group_commit_ms=5.0) -> DeviceReadingsService:
+    """Create a service over empty stores sized for the workload, logging to the given path."""
+    return DeviceReadingsService(device_store=InMemoryDeviceStore(capacity=num_devices),
+                                 ts_store=InMemoryTimestampStore(capacity=num_readings),
+                                 wal=WriteAheadLog(path, fsync_policy=fsync_policy, group_commit_ms=group_commit_ms))
+
+
+def measure_ingest(directory: str, fsync_policy: str, requests: int, workers: int, group_commit_ms: float) -> float:
+    """
+    Send single-reading requests to a service with a fresh log from a threadpool.
+
+    Args:
+        directory (str): The directory of the log file.
+        fsync_policy (str): The fsync policy of the log.
+        requests (int): The number of requests.
+        workers (int): The number of threads in the pool.
+        group_commit_ms (float): The interval between fsyncs with the "group" policy.
+
+    Returns:
+        float: The throughput in requests per second.
+    """
+    path = os.path.join(directory, f"ingest-{fsync_policy}.wal")
+    device_ids = [uuid.uuid4() for _ in range(100)]
+    now = datetime.datetime.now(datetime.timezone.utc)
+    payloads = [DeviceReadings(id=device_ids[i % 100],
+                               readings=[Reading(timestamp=now + datetime.timedelta(microseconds=i), count=1)])
+                for i in range(requests)]
+    service = _service(path, fsync_policy, len(device_ids), requests, group_commit_ms)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(service.add_device_readings, payloads))
+    elapsed = time.perf_counter() - start
+    service.wal.close()
+    os.remove(path)
+    return requests / elapsed
+
+
+def measure_recovery(directory: str, num_records: int) -> float:
+    """
+    Write a log of the given number of records and replay it into empty stores.
+
+    Args:
+        directory (str): The directory of the log file.
+        num_records (int): The number of records in the log.
+
+    Returns:
+        float: The replay time in seconds per million records.
+    """
+    path = os.path.join(directory, "recovery.wal")
+    device_ids = [uuid.uuid4().bytes for _ in range(1000)]
+    epoch_us = to_epoch_us(datetime.datetime.now(datetime.timezone.utc))
+    wal = WriteAheadLog(path, fsync_policy=FSYNC_NONE)
+    for start in range(0, num_records, 10_000):
+        wal.append([(device_ids[i % 1000], epoch_us + i, 1, 0) for i in range(start, min(start + 10_000, num_records))])
+    wal.close()
+
+    service = _service(path, FSYNC_NONE, len(device_ids), num_records)
+    start = time.perf_counter()
+    replayed = service.replay(service.wal.records())
+    elapsed = time.perf_counter() - start
+    assert replayed == num_records, f"replayed {replayed} of {num_records} records"
+    service.wal.close()
+    os.remove(path)
+    return elapsed / num_records * 1_000_000
+
+
+def main():
+    """Run the ingest benchmark for every fsync policy and the recovery benchmark, and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--group-commit-ms", type=float, default=5.0)
+    parser.add_argument("--recovery-records", type=int, default=1_000_000)
+    parser.add_argument("--dir", default=None, help="Directory of the log files, on the disk to measure")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        print(f"{'fsync policy':<14}{'requests/s':>14}")
+        for fsync_policy in (FSYNC_ALWAYS, FSYNC_GROUP, FSYNC_NONE):
+            throughput = measure_ingest(directory, fsync_policy, args.requests, args.workers, args.group_commit_ms)
+            print(f"{fsync_policy:<14}{throughput:>14,.0f}")
+        print(f"recovery: {measure_recovery(directory, args.recovery_records):.2f}s per million records")
+
+
+if __name__ == "__main__":
+    main()
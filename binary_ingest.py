@@ -0,0 +1,210 @@
+import struct
+import uuid
+from operator import itemgetter
+from time import perf_counter
+from typing import Callable, List, Optional, Tuple
+
+from fastapi import Request, Response, status
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+from device_readings_service import device_readings_service
+from metrics import ingest_phase_seconds
+from profiling import ProfiledRoute, profiled
+from stores.ingest import IngestReading
+
+try:
+    import msgpack
+except ImportError:  # MessagePack bodies are refused with a 415 status without it
+    msgpack = None
+
+# Binary bodies of POST /api/devices/readings, selected by their content type, for gateways sending epoch integers
+# instead of JSON with RFC 3339 strings. Both formats decode straight into the (epoch_us, count, utc_offset)
+# readings added by the service, without building pydantic models or datetimes. Bodies of any other content type
+# go through the regular handler of the route.
+#
+# MessagePack (application/msgpack): a map of "id", the 16 bytes of the device UUID as bin or its string form, and
+# "readings", an array of [epoch_us, count] readings or [epoch_us, count, utc_offset] with the UTC offset of the
+# reading in seconds. Readings without an offset are in UTC.
+#
+# Packed (application/vnd.device-readings.packed): fixed little-endian structs with no padding. A 24 bytes header
+# of the magic b"DRP1", the 16 bytes of the device UUID and the number of readings as uint32, then 16 bytes per
+# reading of the epoch microseconds as int64, the count as int32 and the UTC offset in seconds as int32.
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+PACKED_MEDIA_TYPE = "application/vnd.device-readings.packed"
+
+PACKED_MAGIC = b"DRP1"
+PACKED_HEADER = struct.Struct("<4s16sI")
+PACKED_READING = struct.Struct("<qii")
+
+# Epoch microseconds of the readings, a day inside the range of datetimes so that every UTC offset fits.
+MIN_EPOCH_US = -62135596800 * 1_000_000 + 86400 * 1_000_000
+MAX_EPOCH_US = 253402300799 * 1_000_000 - 86400 * 1_000_000
+# UTC offsets in seconds, strictly within a day as required by `datetime.timezone`.
+MAX_UTC_OFFSET = 86399
+
+# Time spent decoding the binary bodies, reported with the other phases of adding readings.
+_DECODE_SECONDS = ingest_phase_seconds.labels("decode")
+# Readings decoded from binary bodies are added in the threadpool, profiled for profiled requests.
+_add_encoded_readings_batch = profiled(device_readings_service.add_encoded_readings_batch)
+
+
+def _check_readings(readings: List[IngestReading]) -> str:
+    """
+    Check that the epoch microseconds and the UTC offsets of decoded readings can be converted to datetimes.
+
+    Args:
+        readings (List[IngestReading]): The decoded readings.
+
+    Returns:
+        str: An empty string if the readings are valid, or an error message.
+    """
+    if not readings:
+        return ""
+    # Minimums and maximums are computed in C, without a Python loop over the readings
+    epochs = list(map(itemgetter(0), readings))
+    if min(epochs) < MIN_EPOCH_US or max(epochs) > MAX_EPOCH_US:
+        return "Timestamp out of range"
+    offsets = list(map(itemgetter(2), readings))
+    if min(offsets) < -MAX_UTC_OFFSET or max(offsets) > MAX_UTC_OFFSET:
+        return "UTC offset out of range"
+    return ""
+
+
+def encode_packed(device_id: uuid.UUID, readings: List[IngestReading]) -> bytes:
+    """
+    Encode the readings of a device in the packed format, as sent by gateways.
+
+    Args:
+        device_id (uuid.UUID): The unique identifier of the device.
+        readings (List[IngestReading]): The epoch microseconds, count and UTC offset in seconds of each reading.
+
+    Returns:
+        bytes: The packed body.
+    """
+    header = PACKED_HEADER.pack(PACKED_MAGIC, device_id.bytes, len(readings))
+    return header + b"".join(PACKED_READING.pack(*reading) for reading in readings)
+
+
+def decode_packed(body: bytes) -> (Optional[Tuple[uuid.UUID, List[IngestReading]]], str):
+    """
+    Decode a body in the packed format.
+
+    Args:
+        body (bytes): The body of the request.
+
+    Returns:
+        (Optional[Tuple[uuid.UUID, List[IngestReading]]], str): The device ID and its readings, or None and an
+        error message if the body is not a valid packed body.
+    """
+    if len(body) < PACKED_HEADER.size:
+        return None, "Body shorter than the packed header"
+    magic, device_id, size = PACKED_HEADER.unpack_from(body)
+    if magic != PACKED_MAGIC:
+        return None, "Not a packed body"
+    if len(body) != PACKED_HEADER.size + size * PACKED_READING.size:
+        return None, "Body size does not match the number of readings"
+    readings = list(PACKED_READING.iter_unpack(memoryview(body)[PACKED_HEADER.size:]))
+    err = _check_readings(readings)
+    if err:
+        return None, err
+    return (uuid.UUID(bytes=device_id), readings), ""
+
+
+def decode_msgpack(body: bytes) -> (Optional[Tuple[uuid.UUID, List[IngestReading]]], str):
+    """
+    Decode a MessagePack body.
+
+    Args:
+        body (bytes): The body of the request.
+
+    Returns:
+        (Optional[Tuple[uuid.UUID, List[IngestReading]]], str): The device ID and its readings, or None and an
+        error message if the body is not a valid MessagePack body.
+    """
+    try:
+        payload = msgpack.unpackb(body, use_list=False)
+    except (ValueError, msgpack.UnpackException):
+        return None, "Invalid MessagePack body"
+    if type(payload) is not dict:
+        return None, "Invalid MessagePack body"
+    device_id = payload.get("id")
+    readings = payload.get("readings")
+    try:
+        if type(device_id) is bytes:
+            device_id = uuid.UUID(bytes=device_id)
+        elif type(device_id) is str:
+            device_id = uuid.UUID(device_id)
+        else:
+            return None, "Invalid device id"
+    except ValueError:
+        return None, "Invalid device id"
+    if type(readings) is not tuple:
+        return None, "Invalid readings"
+
+    decoded = []
+    for reading in readings:
+        if type(reading) is not tuple or not 2 <= len(reading) <= 3:
+            return None, "Invalid reading"
+        utc_offset = reading[2] if len(reading) == 3 else 0
+        # Booleans and floats are not accepted as integers
+        if type(reading[0]) is not int or type(reading[1]) is not int or type(utc_offset) is not int:
+            return None, "Invalid reading"
+        decoded.append((reading[0], reading[1], utc_offset))
+    err = _check_readings(decoded)
+    if err:
+        return None, err
+    return (device_id, decoded), ""
+
+
+def _media_type(content_type: Optional[str]) -> str:
+    """Return the media type of a Content-Type header, in lower case and without its parameters."""
+    return (content_type or "").split(";", 1)[0].strip().lower()
+
+
+class BinaryDecodeRoute(ProfiledRoute):
+    """
+    Route decoding the readings of MessagePack and packed bodies, selected by their content type.
+
+    Bodies of other content types go through the regular handler of the route. The decoded readings are added
+    with `add_encoded_readings_batch`, which adds them to the service in the threadpool and is overridden by the
+    routes of the async ingest mode.
+    """
+
+    @staticmethod
+    async def add_encoded_readings_batch(readings_by_device: dict) -> dict:
+        """Add decoded readings to the service in the threadpool, profiled for profiled requests."""
+        return await run_in_threadpool(_add_encoded_readings_batch, readings_by_device)
+
+    def get_route_handler(self) -> Callable:
+        """Return the request handler, decoding binary bodies before the regular handler."""
+        route_handler = super().get_route_handler()
+        add_encoded_readings_batch = self.add_encoded_readings_batch
+
+        async def handler(request: Request) -> Response:
+            media_type = _media_type(request.headers.get("content-type"))
+            if media_type == PACKED_MEDIA_TYPE:
+                decode = decode_packed
+            elif media_type in MSGPACK_MEDIA_TYPES:
+                if msgpack is None:
+                    return JSONResponse({"message": "Unsupported content type"},
+                                        status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+                decode = decode_msgpack
+            else:
+                return await route_handler(request)
+
+            body = await request.body()
+            start = perf_counter()
+            decoded, err = decode(body)
+            if err:
+                return JSONResponse({"message": err}, status_code=status.HTTP_400_BAD_REQUEST)
+            _DECODE_SECONDS.observe(perf_counter() - start)
+            device_id, readings = decoded
+            err = (await add_encoded_readings_batch({device_id: readings}))[device_id]
+            if err:
+                return JSONResponse({"message": err}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return JSONResponse({"message": "Readings updated successfully"})
+
+        return handler
+
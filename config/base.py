@@ -4,4 +4,120 @@ from pydantic.v1 import BaseSettings
 class Settings(BaseSettings):
     PROJECT_SLUG = "device_readings"
     DEVICE_STORE_CAPACITY: int = 100
+    # Device store backend: "memory" (one dictionary), "striped" (DEVICE_STORE_STRIPES lock-striped shards),
+    # "columnar" (typed array columns indexed by device, with DEVICE_STORE_STRIPES update locks), "redis" or
+    # "shared" (a shared memory segment used by every worker process on the host).
+    DEVICE_STORE_BACKEND: str = "memory"
+    DEVICE_STORE_STRIPES: int = 16
+    # Eviction from the "memory" device store once it holds DEVICE_STORE_CAPACITY devices: "none" rejects new
+    # devices with "Capacity exceeded", "lru" evicts the least recently used device, "idle" the least recently
+    # used device if unused for DEVICE_STORE_IDLE_TTL_S seconds, and "lfu" the least updated of the
+    # DEVICE_STORE_EVICTION_SAMPLE least recently used devices. Evicted devices are written to the SQLite database
+    # at DEVICE_STORE_SPILL_PATH and loaded back on their next access, or dropped if the path is empty.
+    DEVICE_STORE_EVICTION: str = "none"
+    DEVICE_STORE_IDLE_TTL_S: float = 3600.0
+    DEVICE_STORE_EVICTION_SAMPLE: int = 16
+    DEVICE_STORE_SPILL_PATH: str = ""
     TIMESTAMP_STORE_CAPACITY: int = 10000
+    # Timestamp store backend: "ordered" (one global store bounded by TIMESTAMP_STORE_CAPACITY),
+    # "partitioned" (one history per device bounded by TIMESTAMP_STORE_CAPACITY_PER_DEVICE),
+    # "watermark" (a high-watermark and a bitmap of TIMESTAMP_WINDOW_SLOTS slots per device, each slot of
+    # TIMESTAMP_WINDOW_RESOLUTION_US microseconds; readings in the same slot are duplicates, so coarser slots
+    # only suit devices sending at most one reading per slot),
+    # "redis" (one global store bounded by TIMESTAMP_STORE_CAPACITY), "shared" (a shared memory segment
+    # holding TIMESTAMP_STORE_CAPACITY keys split between DEVICE_STORE_STRIPES stripes) or "ttl" (every key
+    # seen in the last TIMESTAMP_STORE_RETENTION_S seconds, expired in buckets of TIMESTAMP_STORE_BUCKET_S).
+    TIMESTAMP_STORE_BACKEND: str = "ordered"
+    TIMESTAMP_STORE_CAPACITY_PER_DEVICE: int = 1000
+    TIMESTAMP_STORE_RETENTION_S: float = 86400.0
+    TIMESTAMP_STORE_BUCKET_S: float = 60.0
+    TIMESTAMP_WINDOW_SLOTS: int = 3600
+    TIMESTAMP_WINDOW_RESOLUTION_US: int = 1
+    # What the watermark backend does with readings older than its window: "reject" them as duplicates or
+    # check them against an "exact" ordered store bounded by TIMESTAMP_STORE_CAPACITY, which also receives the
+    # slots seen as they fall off the window.
+    TIMESTAMP_WINDOW_LATE_POLICY: str = "reject"
+    # Optional Bloom filter tier in front of the timestamp store, remembering readings over a longer horizon.
+    # Each of the TIMESTAMP_BLOOM_GENERATIONS generations holds TIMESTAMP_BLOOM_CAPACITY readings, and filter
+    # hits are either rejected or checked against the timestamp store (TIMESTAMP_BLOOM_HIT_POLICY "reject" or
+    # "exact"). With "exact" only hits are recorded in the timestamp store, so the first resend of a reading is
+    # accepted.
+    TIMESTAMP_BLOOM_ENABLED: bool = False
+    TIMESTAMP_BLOOM_CAPACITY: int = 1_000_000
+    TIMESTAMP_BLOOM_FPR: float = 0.001
+    TIMESTAMP_BLOOM_GENERATIONS: int = 4
+    TIMESTAMP_BLOOM_HIT_POLICY: str = "reject"
+    # Ingest mode: "sync" handlers run in the threadpool against the shared stores, "async" handlers hand
+    # readings to INGEST_SHARDS single-writer tasks, sharded by device, through queues of INGEST_QUEUE_SIZE.
+    INGEST_MODE: str = "sync"
+    INGEST_SHARDS: int = 8
+    INGEST_QUEUE_SIZE: int = 1024
+    # Decoder of POST /api/devices/readings bodies: "pydantic" models, or the "fast" path parsing canonical
+    # payloads with orjson straight to epoch microseconds (sync mode only, other payloads still use pydantic).
+    INGEST_DECODER: str = "pydantic"
+    # Streaming uploads of NDJSON or JSON arrays: readings are added STREAM_INGEST_BATCH_SIZE at a time, lines and
+    # array elements over STREAM_INGEST_MAX_LINE_BYTES are rejected, and the first STREAM_INGEST_MAX_ERRORS errors
+    # are reported.
+    STREAM_INGEST_BATCH_SIZE: int = 5000
+    STREAM_INGEST_MAX_LINE_BYTES: int = 1_048_576
+    STREAM_INGEST_MAX_ERRORS: int = 100
+    # Write-ahead log of accepted readings, replayed on startup. WAL_FSYNC_POLICY is "always" (fsync every
+    # request), "group" (one fsync every WAL_GROUP_COMMIT_MS shared by concurrent requests) or "none". Not
+    # supported with INGEST_MODE=async.
+    WAL_ENABLED: bool = False
+    WAL_PATH: str = "data/readings.wal"
+    WAL_FSYNC_POLICY: str = "group"
+    WAL_GROUP_COMMIT_MS: float = 5.0
+    # Snapshots of the stores built from the write-ahead log every SNAPSHOT_INTERVAL_S seconds (0 disables the
+    # periodic snapshots), after which the log is truncated. They require WAL_ENABLED.
+    SNAPSHOT_ENABLED: bool = False
+    SNAPSHOT_PATH: str = "data/readings.snapshot"
+    SNAPSHOT_INTERVAL_S: float = 300.0
+    # Redis server used by the "redis" store backends, shared by every worker and host using it.
+    REDIS_URL: str = "redis://localhost:6379/0"
+    REDIS_KEY_PREFIX: str = "device_readings"
+    REDIS_MAX_CONNECTIONS: int = 50
+    # Shared memory segment used by the "shared" store backends, shared by every worker process on the host.
+    # It outlives the processes, and a segment with the same name and a different layout is rejected.
+    SHARED_MEMORY_NAME: str = "device_readings"
+    # Per-device rollups of accepted counts in minute, hour and day buckets, for counts over time windows. Each
+    # ROLLUP_*_RETENTION is the number of buckets kept, at 16 bytes per bucket per device (0 disables the size),
+    # about 40KB per device with the defaults, for every device of the device store: rollups are dropped with the
+    # devices evicted from it. Readings more than ROLLUP_MAX_FUTURE_S seconds ahead of the clock are left out.
+    # Refused at startup with the Redis and shared memory stores, whose devices are updated by every worker process.
+    ROLLUPS_ENABLED: bool = False
+    ROLLUP_MINUTE_RETENTION: int = 1440
+    ROLLUP_HOUR_RETENTION: int = 720
+    ROLLUP_DAY_RETENTION: int = 365
+    ROLLUP_MAX_FUTURE_S: float = 3600.0
+    # Index of the TOP_DEVICES_CAPACITY devices with the highest cumulative counts, updated as readings are
+    # accepted and served by the top devices endpoint (0 disables the index). Not maintained by the Redis and
+    # shared memory stores, which update the counts inside the store.
+    TOP_DEVICES_CAPACITY: int = 100
+    # Pre-serialized bodies of the cumulative count and latest timestamp reads, kept for the current version of
+    # up to RESPONSE_CACHE_CAPACITY devices and endpoints (0 disables the cache, ETags are still sent).
+    RESPONSE_CACHE_CAPACITY: int = 10000
+    # Admission control of the ingest requests and of the cumulative count and latest timestamp reads, which go
+    # through separate lanes. Each lane runs up to *_MAX_IN_FLIGHT requests and queues up to *_QUEUE_SIZE more for
+    # ADMISSION_QUEUE_TIMEOUT_S seconds; the others are shed with a 429 and a Retry-After of ADMISSION_RETRY_AFTER_S
+    # seconds. The threadpool is grown to hold both lanes, so the reads keep their threads during write storms.
+    ADMISSION_ENABLED: bool = False
+    ADMISSION_INGEST_MAX_IN_FLIGHT: int = 24
+    ADMISSION_INGEST_QUEUE_SIZE: int = 100
+    ADMISSION_READ_MAX_IN_FLIGHT: int = 16
+    ADMISSION_READ_QUEUE_SIZE: int = 1000
+    ADMISSION_QUEUE_TIMEOUT_S: float = 1.0
+    ADMISSION_RETRY_AFTER_S: int = 1
+    # Profiling of the running process. With PROFILING_ENABLED, requests sent with the PROFILING_HEADER header run
+    # under cProfile and the last PROFILING_MAX_PROFILES profiles are kept. With PROFILING_SAMPLER_ENABLED, the
+    # stacks of the application are sampled every PROFILING_SAMPLE_INTERVAL_MS and aggregated over windows of
+    # PROFILING_WINDOW_S seconds, the last PROFILING_WINDOWS of which are kept and written to PROFILING_DUMP_DIR
+    # if set.
+    PROFILING_ENABLED: bool = False
+    PROFILING_HEADER: str = "X-Profile"
+    PROFILING_MAX_PROFILES: int = 20
+    PROFILING_SAMPLER_ENABLED: bool = False
+    PROFILING_SAMPLE_INTERVAL_MS: float = 10.0
+    PROFILING_WINDOW_S: float = 60.0
+    PROFILING_WINDOWS: int = 10
+    PROFILING_DUMP_DIR: str = ""
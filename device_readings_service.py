@@ -1,11 +1,113 @@
+from config import settings
+from metrics import ingest_phase_seconds, readings_per_request
+from persistence.snapshot import (SnapshotBackedDeviceStore, SnapshotBackedTimestampStore, create_checkpointer,
+                                  open_snapshot)
+from persistence.wal import COUNT_MAX, COUNT_MIN, WalRecord, WriteAheadLog, create_wal
 from stores.device_store import DeviceStoreIface
-from stores.in_mem_device_store import in_mem_device_store
-from stores.in_memory_ts_store import in_mem_ts_store
+from stores.epoch import from_epoch_us, to_epoch_us, utc_offset_seconds
+from stores.evicting_device_store import EvictingDeviceStore
+from stores.factory import create_device_store, create_rollup_store, create_top_devices, create_ts_store
+from stores.ingest import IngestReading, ReadingsIngestIface
+from stores.rollup_store import RollupStore
+from stores.top_devices import TopDevices
 from stores.ts_store import TimeStampStoreIface
-from models import DeviceReadings
+from models import DeviceReadings, Reading
 
 import uuid
 from datetime import datetime
+from itertools import islice
+from operator import itemgetter
+from time import perf_counter
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Number of devices read from the device store at a time by the bulk reads.
+SUMMARY_PAGE_SIZE = 1000
+
+# Number of readings from which the readings of a device are deduped with one timestamp store call and applied
+# once, instead of reading by reading.
+BATCH_MIN_READINGS = 8
+
+# Error returned for the readings of a device when a count does not fit in the write-ahead log.
+COUNT_OUT_OF_RANGE = f"Count out of range, counts must be between {COUNT_MIN} and {COUNT_MAX}"
+
+# Bind the metrics of the hot paths once, so each request only observes the values.
+_DECODE_SECONDS = ingest_phase_seconds.labels("decode")
+_DEDUPE_SECONDS = ingest_phase_seconds.labels("dedupe")
+_UPDATE_SECONDS = ingest_phase_seconds.labels("update")
+_INGEST_SECONDS = ingest_phase_seconds.labels("ingest")
+_WAL_SECONDS = ingest_phase_seconds.labels("wal")
+_ACCEPTED_READINGS = readings_per_request.labels("accepted")
+_DUPLICATE_READINGS = readings_per_request.labels("duplicate")
+
+
+def _observe_readings(accepted: int, total: int):
+    """
+    Record the readings of a device accepted and rejected as duplicates by a request.
+
+    Args:
+        accepted (int): The number of readings accepted.
+        total (int): The number of readings of the device in the request.
+    """
+    _ACCEPTED_READINGS.observe(accepted)
+    _DUPLICATE_READINGS.observe(total - accepted)
+
+
+def encode_readings(readings: Iterable[Reading]) -> List[IngestReading]:
+    """
+    Convert readings to the (epoch_us, count, utc_offset) form the stores ingest.
+
+    Args:
+        readings (Iterable[Reading]): The readings to convert.
+
+    Returns:
+        List[IngestReading]: The epoch microseconds, count and UTC offset of each reading, in order.
+    """
+    return [(to_epoch_us(reading.timestamp), reading.count, utc_offset_seconds(reading.timestamp))
+            for reading in readings]
+
+
+class DeviceSummaryScan:
+    """
+    Pages of device summaries read by a scan of a device store, with the cursor to resume the scan from.
+
+    Iterating reads the store a page at a time, so only one page is held in memory. Once the iteration is
+    over, `cursor` is the cursor of the next page, or 0 if every device was read.
+
+    Attributes:
+        cursor (int): The cursor of the next page.
+        limit (int): The maximum number of devices to read, or None to read every device.
+    """
+
+    def __init__(self, scan_devices: Callable[[int, int], Tuple[int, List[uuid.UUID]]],
+                 summaries: Callable[[List[uuid.UUID]], List[dict]], cursor=0, limit=None,
+                 page_size=SUMMARY_PAGE_SIZE):
+        """
+        Initialize the scan.
+
+        Args:
+            scan_devices (Callable[[int, int], Tuple[int, List[uuid.UUID]]]): Returns a page of devices, as
+                `DeviceStoreIface.scan_devices`.
+            summaries (Callable[[List[uuid.UUID]], List[dict]]): Returns the summaries of a page of devices.
+            cursor (int): The cursor to start from. Defaults to 0, the first device.
+            limit (int): The maximum number of devices to read. Defaults to every device.
+            page_size (int): The number of devices read at a time. Defaults to SUMMARY_PAGE_SIZE.
+        """
+        self._scan_devices = scan_devices
+        self._summaries = summaries
+        self.cursor = cursor
+        self.limit = limit
+        self._page_size = page_size
+
+    def __iter__(self) -> Iterator[List[dict]]:
+        remaining = self.limit
+        while True:
+            count = self._page_size if remaining is None else min(self._page_size, remaining)
+            self.cursor, device_ids = self._scan_devices(self.cursor, count)
+            yield self._summaries(device_ids)
+            if remaining is not None:
+                remaining -= len(device_ids)
+            if not self.cursor or (remaining is not None and remaining <= 0):
+                return
 
 
 class DeviceReadingsService:
@@ -15,18 +117,43 @@ class DeviceReadingsService:
     This class provides methods for adding readings to a device, retrieving cumulative counts,
     and getting the latest timestamp for a device. It relies on external storage interfaces
     for managing device data and timestamps.
+
+    If a write-ahead log is given, every accepted reading is appended to it and committed before
+    the request returns, so the stores can be rebuilt with `replay` after a restart.
+
+    If the same store is used for devices and timestamps and it implements ReadingsIngestIface, readings
+    are ingested through it in a single operation per request instead of reading by reading.
+
+    If a rollup store is given, accepted counts are also added to per-device time buckets, so counts over a
+    time window can be queried with `get_counts`.
+
+    If a top devices index is given, the cumulative count of a device is recorded in it after each update, so
+    the devices with the highest counts can be queried with `get_top_devices`. It is not maintained with an
+    ingest store, which updates the counts inside the store.
     """
 
-    def __init__(self, device_store: DeviceStoreIface, ts_store: TimeStampStoreIface):
+    def __init__(self, device_store: DeviceStoreIface, ts_store: TimeStampStoreIface,
+                 wal: Optional[WriteAheadLog] = None, rollups: Optional[RollupStore] = None,
+                 top_devices: Optional[TopDevices] = None):
         """
         Initialize the DeviceReadingsService with a device store and a timestamp store.
 
         Args:
             device_store (DeviceStoreIface): The store interface for managing device readings.
             ts_store (TimeStampStoreIface): The store interface for managing timestamps.
+            wal (WriteAheadLog): The log accepted readings are written to. Defaults to no log.
+            rollups (RollupStore): The time buckets accepted counts are added to. Defaults to no rollups.
+            top_devices (TopDevices): The index of the devices with the highest counts. Defaults to no index.
         """
         self.device_store = device_store
         self.ts_store = ts_store
+        self.wal = wal
+        self.rollups = rollups
+        self.checkpointer = None  # Set when snapshots are enabled, to report them in the stats
+        self.ingest_store = None
+        if device_store is ts_store and isinstance(device_store, ReadingsIngestIface):
+            self.ingest_store = device_store
+        self.top_devices = top_devices if self.ingest_store is None else None
 
     def add_device_readings(self, device_readings: DeviceReadings) -> str:
         """
@@ -36,26 +163,371 @@ class DeviceReadingsService:
         cumulative count and latest timestamp. If the device entry cannot be created, a
         ValueError is raised.
 
+        From BATCH_MIN_READINGS readings, the readings are processed like a batch of one device by
+        `add_device_readings_batch`, with the same results and fewer store calls.
+
         Args:
             device_readings (DeviceReadings): The readings to be added for a specific device.
 
         Returns:
-            str: An empty string if successful, or an error message if the device cannot be created.
+            str: An empty string if successful, or an error message if the device cannot be created or a count
+            does not fit in the write-ahead log.
         """
+        if self.ingest_store is not None:
+            return self._ingest({device_readings.id: device_readings.readings})[device_readings.id]
+        if len(device_readings.readings) >= BATCH_MIN_READINGS:
+            return self.add_device_readings_batch([device_readings])[device_readings.id]
+        err = self._check_counts(reading.count for reading in device_readings.readings)
+        if err:
+            return err
+
+        start = perf_counter()
         try:
             device_reading = self.device_store.get_or_create_device_reading(device_readings.id)
         except ValueError as e:
             return str(e)
+        created = perf_counter()
 
-        # Process each reading for the device
-        for reading in device_readings.readings:
-            # Convert timestamp to Unix epoch format for storage and checking
-            if self.ts_store.check_and_add_timestamp(device_readings.id, reading.timestamp.timestamp()):
+        # Convert timestamps to integer Unix epoch microseconds for storage and checking
+        readings = device_readings.readings
+        epochs_us = [to_epoch_us(reading.timestamp) for reading in readings]
+        decoded = perf_counter()
+        added = [self.ts_store.check_and_add_timestamp(device_readings.id, epoch_us) for epoch_us in epochs_us]
+        deduped = perf_counter()
+
+        # Apply each new reading to the device
+        accepted = 0
+        wal_records = []
+        rollup_readings = []
+        for reading, epoch_us, is_new in zip(readings, epochs_us, added):
+            if is_new:
+                accepted += 1
                 device_reading.increment_count(reading.count)
                 device_reading.update_latest_timestamp(reading.timestamp)
+                if self.wal is not None:
+                    wal_records.append((device_readings.id.bytes, epoch_us, reading.count,
+                                        utc_offset_seconds(reading.timestamp)))
+                if self.rollups is not None:
+                    rollup_readings.append((epoch_us, reading.count))
+        if rollup_readings:
+            self.rollups.add(device_readings.id, rollup_readings)
+        if accepted and self.top_devices is not None:
+            self.top_devices.update(device_readings.id, device_reading.total_count)
+        updated = perf_counter()
+
+        self._observe_phases(decoded - created, deduped - decoded, created - start + updated - deduped)
+        _observe_readings(accepted, len(readings))
+        if wal_records:
+            self._commit(wal_records)
+        return ""
+
+    def add_device_readings_batch(self, batch: List[DeviceReadings]) -> Dict[uuid.UUID, str]:
+        """
+        Add readings for many devices, reporting success or failure per device.
+
+        Readings are grouped by device first, so each device is looked up in the device store once and
+        its timestamps are deduplicated with a single `check_and_add_timestamps` call. The accepted counts
+        are summed and applied with one `increment_count`, and the most recent accepted timestamp with
+        one `update_latest_timestamp`. A failure for one device (for example "Capacity exceeded") does not
+        affect the other devices in the batch.
+
+        Args:
+            batch (List[DeviceReadings]): The readings for each device. A device may appear more than once.
+
+        Returns:
+            Dict[uuid.UUID, str]: For each device, in order of first appearance, an empty string if
+            successful or an error message if the device cannot be created or a count does not fit in the
+            write-ahead log.
+        """
+        readings_by_device = {}
+        for device_readings in batch:
+            readings_by_device.setdefault(device_readings.id, []).extend(device_readings.readings)
+        if self.ingest_store is not None:
+            return self._ingest(readings_by_device)
+
+        results = {}
+        wal_records = []
+        decode_seconds = dedupe_seconds = update_seconds = 0.0
+        for device_id, readings in readings_by_device.items():
+            err = self._check_counts(reading.count for reading in readings)
+            if err:
+                results[device_id] = err
+                continue
+            start = perf_counter()
+            try:
+                device_reading = self.device_store.get_or_create_device_reading(device_id)
+            except ValueError as e:
+                results[device_id] = str(e)
+                continue
+
+            created = perf_counter()
+            epochs_us = [to_epoch_us(reading.timestamp) for reading in readings]
+            decoded = perf_counter()
+            added = self._check_and_add_unique(device_id, epochs_us)
+            deduped = perf_counter()
+            accepted = [(reading, epoch_us) for reading, epoch_us, is_new in zip(readings, epochs_us, added)
+                        if is_new]
+            if accepted:
+                device_reading.increment_count(sum(reading.count for reading, _ in accepted))
+                # The most recent reading is picked by epoch, and its own datetime is stored
+                device_reading.update_latest_timestamp(max(accepted, key=itemgetter(1))[0].timestamp)
+                if self.top_devices is not None:
+                    self.top_devices.update(device_id, device_reading.total_count)
+                if self.rollups is not None:
+                    self.rollups.add(device_id, [(epoch_us, reading.count) for reading, epoch_us in accepted])
+                if self.wal is not None:
+                    wal_records.extend(
+                        (device_id.bytes, epoch_us, reading.count, utc_offset_seconds(reading.timestamp))
+                        for reading, epoch_us in accepted)
+            results[device_id] = ""
+            decode_seconds += decoded - created
+            dedupe_seconds += deduped - decoded
+            update_seconds += created - start + perf_counter() - deduped
+            _observe_readings(len(accepted), len(readings))
+
+        self._observe_phases(decode_seconds, dedupe_seconds, update_seconds)
+        if wal_records:
+            # One commit for the whole batch
+            self._commit(wal_records)
+        return results
+
+    def add_encoded_readings(self, device_id: uuid.UUID, readings: List[IngestReading]) -> str:
+        """
+        Add readings already converted to epoch microseconds to a device, as decoded by the fast decode path.
+
+        The readings have the same effect as `add_device_readings` with the same readings.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            readings (List[IngestReading]): The epoch microseconds, count and UTC offset of each reading.
+
+        Returns:
+            str: An empty string if successful, or an error message if the device cannot be created or a count
+            does not fit in the write-ahead log.
+        """
+        return self.add_encoded_readings_batch({device_id: readings})[device_id]
+
+    def add_encoded_readings_batch(self, readings_by_device: Dict[uuid.UUID, List[IngestReading]]
+                                   ) -> Dict[uuid.UUID, str]:
+        """
+        Add readings already converted to epoch microseconds for many devices, reporting success or failure per
+        device.
+
+        The readings of each device are processed like those of a device in `add_device_readings_batch`.
+
+        Args:
+            readings_by_device (Dict[uuid.UUID, List[IngestReading]]): The epoch microseconds, count and UTC
+                offset of the readings of each device.
+
+        Returns:
+            Dict[uuid.UUID, str]: For each device, an empty string if successful or an error message if the
+            device cannot be created or a count does not fit in the write-ahead log.
+        """
+        if self.ingest_store is not None:
+            return self._ingest_encoded(readings_by_device)
+
+        results = {}
+        wal_records = []
+        dedupe_seconds = update_seconds = 0.0
+        for device_id, readings in readings_by_device.items():
+            err = self._check_counts(count for _, count, _ in readings)
+            if err:
+                results[device_id] = err
+                continue
+            start = perf_counter()
+            try:
+                device_reading = self.device_store.get_or_create_device_reading(device_id)
+            except ValueError as e:
+                results[device_id] = str(e)
+                continue
 
+            created = perf_counter()
+            added = self._check_and_add_unique(device_id, [epoch_us for epoch_us, _, _ in readings])
+            deduped = perf_counter()
+            accepted = [reading for reading, is_new in zip(readings, added) if is_new]
+            if accepted:
+                device_reading.increment_count(sum(count for _, count, _ in accepted))
+                epoch_us, _, utc_offset = max(accepted)
+                device_reading.update_latest_timestamp(from_epoch_us(epoch_us, utc_offset))
+                if self.top_devices is not None:
+                    self.top_devices.update(device_id, device_reading.total_count)
+                if self.rollups is not None:
+                    self.rollups.add(device_id, [(epoch_us, count) for epoch_us, count, _ in accepted])
+                if self.wal is not None:
+                    wal_records.extend((device_id.bytes, *reading) for reading in accepted)
+            results[device_id] = ""
+            dedupe_seconds += deduped - created
+            update_seconds += created - start + perf_counter() - deduped
+            _observe_readings(len(accepted), len(readings))
+
+        self._observe_phases(None, dedupe_seconds, update_seconds)
+        if wal_records:
+            self._commit(wal_records)
+        return results
+
+    def _check_counts(self, counts: Iterable[int]) -> str:
+        """
+        Check that the counts of the readings of a device can be written to the write-ahead log, before any
+        store is updated, so a reading is never applied in memory without being logged.
+
+        Args:
+            counts (Iterable[int]): The count of each reading.
+
+        Returns:
+            str: An empty string if the counts fit, or there is no log, or an error message otherwise.
+        """
+        if self.wal is not None and any(count < COUNT_MIN or count > COUNT_MAX for count in counts):
+            return COUNT_OUT_OF_RANGE
         return ""
 
+    def _check_and_add_unique(self, device_id: uuid.UUID, epochs_us: List[int]) -> List[bool]:
+        """
+        Check the timestamps of a device against the timestamp store in one call, sending each distinct
+        timestamp once.
+
+        Repeated timestamps are dropped before the store is called, and only their first occurrence can be new,
+        which gives the same flags as checking the timestamps one by one.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            epochs_us (List[int]): The timestamps, in arrival order.
+
+        Returns:
+            List[bool]: One flag per timestamp, True if the timestamp was new.
+        """
+        unique = list(dict.fromkeys(epochs_us))
+        if len(unique) == len(epochs_us):
+            return self.ts_store.check_and_add_timestamps(device_id, epochs_us)
+        is_new = dict(zip(unique, self.ts_store.check_and_add_timestamps(device_id, unique)))
+        added = []
+        for epoch_us in epochs_us:
+            added.append(is_new[epoch_us])
+            is_new[epoch_us] = False
+        return added
+
+    def _ingest(self, readings_by_device: Dict[uuid.UUID, List[Reading]]) -> Dict[uuid.UUID, str]:
+        """
+        Add readings for many devices through the ingest store, in a single operation.
+
+        Args:
+            readings_by_device (Dict[uuid.UUID, List[Reading]]): The readings of each device.
+
+        Returns:
+            Dict[uuid.UUID, str]: For each device, an empty string if successful or an error message if the
+            device cannot be created.
+        """
+        start = perf_counter()
+        encoded = {device_id: encode_readings(readings) for device_id, readings in readings_by_device.items()}
+        _DECODE_SECONDS.observe(perf_counter() - start)
+        return self._ingest_encoded(encoded)
+
+    def _ingest_encoded(self, encoded: Dict[uuid.UUID, List[IngestReading]]) -> Dict[uuid.UUID, str]:
+        """
+        Add readings already converted to epoch microseconds for many devices through the ingest store.
+
+        Args:
+            encoded (Dict[uuid.UUID, List[IngestReading]]): The readings of each device.
+
+        Returns:
+            Dict[uuid.UUID, str]: For each device, an empty string if successful or an error message if the
+            device cannot be created.
+        """
+        results = {}
+        for device_id, readings in encoded.items():
+            results[device_id] = self._check_counts(count for _, count, _ in readings)
+        if any(results.values()):
+            encoded = {device_id: readings for device_id, readings in encoded.items() if not results[device_id]}
+        wal_records = []
+        start = perf_counter()
+        ingested = self.ingest_store.ingest_readings(encoded)
+        _INGEST_SECONDS.observe(perf_counter() - start)
+        for device_id, (added, err) in ingested.items():
+            results[device_id] = err
+            if not err:
+                _observe_readings(sum(added), len(added))
+            if self.rollups is not None and any(added):
+                self.rollups.add(device_id, [(epoch_us, count) for (epoch_us, count, _), is_new
+                                             in zip(encoded[device_id], added) if is_new])
+            if self.wal is not None:
+                wal_records.extend((device_id.bytes, *reading)
+                                   for reading, is_new in zip(encoded[device_id], added) if is_new)
+
+        if wal_records:
+            self._commit(wal_records)
+        return results
+
+    @staticmethod
+    def _observe_phases(decode_seconds: Optional[float], dedupe_seconds: float, update_seconds: float):
+        """
+        Record the time a request spent in each phase of adding readings.
+
+        Args:
+            decode_seconds (Optional[float]): The time spent converting timestamps, or None if they were
+                already converted.
+            dedupe_seconds (float): The time spent checking timestamps against the timestamp store.
+            update_seconds (float): The time spent getting the devices and applying the accepted readings.
+        """
+        if decode_seconds is not None:
+            _DECODE_SECONDS.observe(decode_seconds)
+        _DEDUPE_SECONDS.observe(dedupe_seconds)
+        _UPDATE_SECONDS.observe(update_seconds)
+
+    def _commit(self, wal_records: List[tuple]):
+        """
+        Write accepted readings to the write-ahead log in one commit, recording the time it took.
+
+        Args:
+            wal_records (List[tuple]): The device id bytes, epoch microseconds, count and UTC offset of each
+                reading.
+        """
+        start = perf_counter()
+        self.wal.commit(self.wal.append(wal_records))
+        _WAL_SECONDS.observe(perf_counter() - start)
+
+    def replay(self, records: Iterable[WalRecord]) -> int:
+        """
+        Rebuild the stores from the readings accepted before a restart, in the order they were logged.
+
+        Every timestamp is added back to the timestamp store so that re-sent readings are still rejected.
+        Counts and latest timestamps are summed per device and applied once per device, as are the rollups.
+        Readings of devices that no longer fit in the device store are skipped.
+
+        Args:
+            records (Iterable[WalRecord]): The readings read from the write-ahead log.
+
+        Returns:
+            int: The number of readings read from the log.
+        """
+        device_ids = {}
+        counts = {}
+        latest = {}
+        rollup_readings = {}
+        replayed = 0
+        for device_bytes, epoch_us, count, utc_offset in records:
+            device_id = device_ids.get(device_bytes)
+            if device_id is None:
+                device_id = device_ids[device_bytes] = uuid.UUID(bytes=device_bytes)
+            self.ts_store.check_and_add_timestamp(device_id, epoch_us)
+            counts[device_id] = counts.get(device_id, 0) + count
+            if device_id not in latest or epoch_us > latest[device_id][0]:
+                latest[device_id] = (epoch_us, utc_offset)
+            if self.rollups is not None:
+                rollup_readings.setdefault(device_id, []).append((epoch_us, count))
+            replayed += 1
+
+        for device_id, count in counts.items():
+            try:
+                device_reading = self.device_store.get_or_create_device_reading(device_id)
+            except ValueError:
+                continue
+            device_reading.increment_count(count)
+            device_reading.update_latest_timestamp(from_epoch_us(*latest[device_id]))
+            if self.top_devices is not None:
+                self.top_devices.update(device_id, device_reading.total_count)
+            if self.rollups is not None:
+                self.rollups.add(device_id, rollup_readings[device_id])
+        return replayed
+
     def get_cumulative_count(self, device_id: uuid.UUID) -> (int, str):
         """
         Retrieve the cumulative count of readings for a given device.
@@ -86,6 +558,180 @@ class DeviceReadingsService:
             return None, f"Device with id {device_id} not found"
         return device_reading.latest_timestamp, None
 
+    def get_device_version(self, device_id: uuid.UUID) -> Optional[str]:
+        """
+        Retrieve a tag of the current count and latest timestamp of a device, which changes whenever they change.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+
+        Returns:
+            Optional[str]: The tag, or None if the device is not found.
+        """
+        return self.device_store.get_device_version(device_id)
+
+    def get_device_summaries(self, device_ids: Iterable[uuid.UUID]) -> Iterator[List[dict]]:
+        """
+        Retrieve the cumulative count and latest timestamp of many devices, a page at a time.
+
+        Each device is read from the device store once, and only one page is held in memory.
+
+        Args:
+            device_ids (Iterable[uuid.UUID]): The unique identifiers of the devices.
+
+        Returns:
+            Iterator[List[dict]]: Pages of summaries in the order of the devices. A summary holds the `id`, the
+            `cumulative_count` and the `latest_timestamp` of a device, or its `id` and an error `message` if it
+            is not found.
+        """
+        device_ids = iter(device_ids)
+        while True:
+            page = list(islice(device_ids, SUMMARY_PAGE_SIZE))
+            if not page:
+                return
+            yield self._summaries(page)
+
+    def scan_device_summaries(self, cursor=0, limit=None) -> DeviceSummaryScan:
+        """
+        Retrieve the cumulative count and latest timestamp of every device, by scanning the device store.
+
+        Args:
+            cursor (int): The cursor returned by a previous scan, or 0 to start from the first device.
+            limit (int): The maximum number of devices to read. Defaults to every device.
+
+        Returns:
+            DeviceSummaryScan: The pages of summaries, and the cursor to resume from once they are read. Reading
+            them raises NotImplementedError if the device store cannot be scanned.
+        """
+        return DeviceSummaryScan(self.device_store.scan_devices, self._summaries, cursor=cursor, limit=limit)
+
+    def _summaries(self, device_ids: List[uuid.UUID]) -> List[dict]:
+        """Return the summaries of a page of devices."""
+        summaries = []
+        for device_id, device_reading in self.device_store.get_device_readings(device_ids):
+            if device_reading is None:
+                summaries.append({"id": device_id, "message": f"Device with id {device_id} not found"})
+            else:
+                summaries.append({"id": device_id, "cumulative_count": device_reading.total_count,
+                                  "latest_timestamp": device_reading.latest_timestamp})
+        return summaries
+
+    def get_counts(self, device_id: uuid.UUID, start: datetime, end: datetime, step: Optional[str] = None
+                   ) -> (dict, str):
+        """
+        Retrieve the count of readings of a device over a time range, in total and per time bucket.
+
+        The total is computed from prefix sums of the rollups, without scanning readings. The range is widened
+        to whole buckets, and buckets outside the retention of the bucket size are left out.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            start (datetime): The start of the range, included.
+            end (datetime): The end of the range, excluded.
+            step (str): The bucket size, "minute", "hour" or "day". Defaults to the finest bucket size whose
+                retention covers the start of the range.
+
+        Returns:
+            tuple: A tuple containing the counts (dict with `step`, `total` and `counts`, a list of bucket
+            `start` and `count`, and `since` if the rollups of the device only cover its readings since then) and
+            an error message (str) if the device is not found.
+
+        Raises:
+            ValueError: If rollups are disabled, the bucket size is not enabled or the range is empty.
+        """
+        if self.rollups is None:
+            raise ValueError("Rollups are not enabled")
+        start_us, end_us = to_epoch_us(start), to_epoch_us(end)
+        if start_us >= end_us:
+            raise ValueError("The start of the range must be before its end")
+        if not self.device_store.get_device_reading(device_id):
+            return None, f"Device with id {device_id} not found"
+        if step is None:
+            step = self.rollups.choose_step(device_id, start_us)
+        total, buckets, since_us = self.rollups.get_counts(device_id, start_us, end_us, step)
+        counts = {"step": step, "total": total,
+                  "counts": [{"start": from_epoch_us(bucket_us, 0), "count": count} for bucket_us, count in buckets]}
+        if since_us is not None:
+            counts["since"] = from_epoch_us(since_us, 0)
+        return counts, None
+
+    def get_top_devices(self, k: int) -> List[dict]:
+        """
+        Retrieve the devices with the highest cumulative counts from the top devices index, without scanning the
+        device store.
+
+        Args:
+            k (int): The number of devices to return.
+
+        Returns:
+            List[dict]: The `id` and `cumulative_count` of up to `k` devices, the highest count first.
+
+        Raises:
+            ValueError: If the index is disabled or `k` exceeds its capacity.
+        """
+        if self.top_devices is None:
+            raise ValueError("Top devices are disabled")
+        if k > self.top_devices.capacity:
+            raise ValueError(f"k must be at most {self.top_devices.capacity}")
+        return [{"id": device_id, "cumulative_count": count} for device_id, count in self.top_devices.top(k)]
+
+    def get_store_stats(self) -> dict:
+        """
+        Report the size and usage of the stores, for monitoring and sizing.
+
+        Returns:
+            dict: The statistics reported by the timestamp store.
+        """
+        stats = {"timestamp_store": self.ts_store.stats()}
+        if self.wal is not None:
+            stats["wal"] = self.wal.stats()
+        if self.checkpointer is not None:
+            stats["snapshot"] = self.checkpointer.stats()
+        if self.rollups is not None:
+            stats["rollups"] = self.rollups.stats()
+        if self.top_devices is not None:
+            stats["top_devices"] = self.top_devices.stats()
+        return stats
+
+
+def _create_service(settings) -> DeviceReadingsService:
+    """
+    Create the service with the configured stores, restored from the latest snapshot and write-ahead log.
+
+    The devices and dedupe keys of the snapshot are loaded lazily, and only the log records written after the
+    snapshot are replayed.
+
+    Args:
+        settings (Settings): The settings instance to read the stores and persistence options from.
+
+    Returns:
+        DeviceReadingsService: The service, ready to serve requests.
+    """
+    device_store = create_device_store(settings)
+    ts_store = create_ts_store(settings)
+    rollups = create_rollup_store(settings)
+    if rollups is not None and isinstance(device_store, EvictingDeviceStore):
+        # Rollups of evicted devices are dropped with them, so they are bounded by the device store as well, and
+        # restarted for devices loaded back from the spill tier
+        device_store.eviction_listeners.append(rollups.remove)
+        device_store.load_listeners.append(rollups.restart)
+    wal = create_wal(settings)
+    snapshot = open_snapshot(settings.SNAPSHOT_PATH) if wal is not None and settings.SNAPSHOT_ENABLED else None
+    if snapshot is not None:
+        device_store = SnapshotBackedDeviceStore(device_store, snapshot)
+        ts_store = SnapshotBackedTimestampStore(ts_store, snapshot)
+
+    service = DeviceReadingsService(device_store=device_store, ts_store=ts_store, wal=wal,
+                                    rollups=rollups, top_devices=create_top_devices(settings))
+    if snapshot is not None and service.top_devices is not None:
+        # Devices of the snapshot are loaded on first use, so their counts are indexed from the snapshot
+        for device_bytes, total_count, _, _ in snapshot.devices():
+            service.top_devices.update(uuid.UUID(bytes=device_bytes), total_count)
+    if wal is not None:
+        service.replay(wal.records(start_sequence=snapshot.wal_sequence if snapshot is not None else None))
+        service.checkpointer = create_checkpointer(settings, wal)
+    return service
+
 
-# Initialize the DeviceReadingsService with in-memory stores.
-device_readings_service = DeviceReadingsService(device_store=in_mem_device_store, ts_store=in_mem_ts_store)
\ No newline at end of file
+# Initialize the DeviceReadingsService with in-memory stores, restored from disk if persistence is enabled.
+device_readings_service = _create_service(settings)
@@ -0,0 +1,178 @@
+import re
+import uuid
+from datetime import datetime
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+import orjson
+from fastapi import APIRouter, Request, Response, status
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+from binary_ingest import BinaryDecodeRoute
+from device_readings_service import device_readings_service
+from metrics import ingest_phase_seconds
+from profiling import profiled
+from models import DeviceReadings
+from stores.epoch import NAIVE_OFFSET, to_epoch_us
+from stores.ingest import IngestReading
+
+# Fast decode path of POST /api/devices/readings, used when INGEST_DECODER is "fast". Bodies are parsed with
+# orjson and the timestamps converted straight to epoch microseconds, without building pydantic models or
+# datetimes. The decoder only accepts the canonical form of a payload: anything else, valid or not, is handed to
+# the regular pydantic handler, so validation errors are unchanged.
+
+# Names of the decoders, selected with the INGEST_DECODER setting.
+INGEST_DECODER_PYDANTIC = "pydantic"
+INGEST_DECODER_FAST = "fast"
+
+# RFC 3339 timestamps as sent by devices: the minute, the seconds, an optional fraction and an optional offset.
+_TIMESTAMP = re.compile(r"(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}):([0-5]\d)(?:\.(\d{1,6}))?(Z|[+-]\d{2}:\d{2})?")
+_UUID = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+_JSON_MEDIA_TYPE = re.compile(r"application/(?:[\w.+-]+\+)?json", re.IGNORECASE)
+# Time spent decoding the bodies accepted by the fast path, reported with the other phases of adding readings.
+_DECODE_SECONDS = ingest_phase_seconds.labels("decode")
+# Readings decoded by the fast path are added in the threadpool, profiled for profiled requests.
+_add_encoded_readings = profiled(device_readings_service.add_encoded_readings)
+
+
+class TimestampDecoder:
+    """
+    Converts the timestamps of a payload to epoch microseconds.
+
+    Readings of a payload are usually close in time and share their offset, so the epoch of each minute and the
+    offset of each suffix are parsed once and cached. Naive timestamps are local times, which are converted
+    with `to_epoch_us` one by one.
+    """
+    __slots__ = ("_minutes", "_offsets")
+
+    def __init__(self):
+        """Initialize an empty TimestampDecoder."""
+        self._minutes: Dict[str, int] = {}
+        self._offsets: Dict[str, int] = {"Z": 0}
+
+    def decode(self, timestamp: str) -> Optional[Tuple[int, int]]:
+        """
+        Convert a timestamp to epoch microseconds.
+
+        Args:
+            timestamp (str): The timestamp, in the canonical RFC 3339 form.
+
+        Returns:
+            Optional[Tuple[int, int]]: The epoch microseconds and the UTC offset in seconds (NAIVE_OFFSET for a
+            naive timestamp), or None if the timestamp is not in the canonical form or is not a valid date.
+        """
+        match = _TIMESTAMP.fullmatch(timestamp)
+        if match is None:
+            return None
+        minute, second, fraction, suffix = match.groups()
+        try:
+            if suffix is None:
+                return to_epoch_us(datetime.fromisoformat(timestamp)), NAIVE_OFFSET
+            offset = self._offsets.get(suffix)
+            if offset is None:
+                hours, minutes = int(suffix[1:3]), int(suffix[4:6])
+                if hours > 23 or minutes > 59:
+                    return None
+                offset = self._offsets[suffix] = (hours * 3600 + minutes * 60) * (-1 if suffix[0] == "-" else 1)
+            minute_us = self._minutes.get(minute)
+            if minute_us is None:
+                # Minutes are computed in UTC, the offset is subtracted per timestamp
+                minute_us = self._minutes[minute] = to_epoch_us(datetime.fromisoformat(minute + "+00:00"))
+        except ValueError:
+            return None
+        epoch_us = minute_us + int(second) * 1_000_000 - offset * 1_000_000
+        if fraction is not None:
+            epoch_us += int(fraction.ljust(6, "0"))
+        return epoch_us, offset
+
+
+def decode_device_readings(body: bytes) -> Optional[Tuple[uuid.UUID, List[IngestReading]]]:
+    """
+    Decode the body of a POST /api/devices/readings request, without validating it with pydantic.
+
+    Args:
+        body (bytes): The JSON body of the request.
+
+    Returns:
+        Optional[Tuple[uuid.UUID, List[IngestReading]]]: The device ID and its readings, or None if the body is
+        not in the canonical form and must be validated by pydantic.
+    """
+    try:
+        payload = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        return None
+    if type(payload) is not dict:
+        return None
+    device_id = payload.get("id")
+    readings = payload.get("readings")
+    if type(device_id) is not str or _UUID.fullmatch(device_id) is None or type(readings) is not list:
+        return None
+
+    decode = TimestampDecoder().decode
+    decoded = []
+    for reading in readings:
+        if type(reading) is not dict:
+            return None
+        count = reading.get("count")
+        timestamp = reading.get("timestamp")
+        # Booleans and floats are accepted by pydantic but not by the fast path
+        if type(count) is not int or type(timestamp) is not str:
+            return None
+        parsed = decode(timestamp)
+        if parsed is None:
+            return None
+        decoded.append((parsed[0], count, parsed[1]))
+    return uuid.UUID(device_id), decoded
+
+
+class FastDecodeRoute(BinaryDecodeRoute):
+    """
+    Route decoding the readings of JSON bodies with `decode_device_readings`.
+
+    Bodies the fast path does not decode go through the regular handler of the route, which validates them, and
+    binary bodies are decoded as by `BinaryDecodeRoute`.
+    """
+
+    def get_route_handler(self) -> Callable:
+        """Return the request handler, trying the fast path before the regular handler."""
+        route_handler = super().get_route_handler()
+
+        async def handler(request: Request) -> Response:
+            content_type = request.headers.get("content-type")
+            if content_type is None or _JSON_MEDIA_TYPE.fullmatch(content_type.split(";", 1)[0].strip()):
+                # The body is cached on the request, so the regular handler does not read it again
+                body = await request.body()
+                start = perf_counter()
+                decoded = decode_device_readings(body)
+                if decoded is not None:
+                    _DECODE_SECONDS.observe(perf_counter() - start)
+                    err = await run_in_threadpool(_add_encoded_readings, *decoded)
+                    if err:
+                        return JSONResponse({"message": err}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                    return JSONResponse({"message": "Readings updated successfully"})
+            return await route_handler(request)
+
+        return handler
+
+
+router = APIRouter(route_class=FastDecodeRoute)
+
+
+@router.post("/api/devices/readings")
+def update_readings(readings: DeviceReadings, response: Response):
+    """
+    Add or update readings for a device, for payloads the fast path does not decode.
+
+    Args:
+        readings (DeviceReadings): The readings data containing the device ID and associated readings.
+        response (Response): The response object for setting the status code.
+
+    Returns:
+        dict: A success message or an error message with 500 status if the update fails.
+    """
+    err = device_readings_service.add_device_readings(readings)
+    if err:
+        response.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+        return {"message": err}
+    return {"message": "Readings updated successfully"}
@@ -0,0 +1,357 @@
+import asyncio
+import heapq
+import uuid
+from datetime import datetime
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from config import settings
+from device_readings_service import SUMMARY_PAGE_SIZE, DeviceReadingsService, DeviceSummaryScan
+from models import DeviceReadings
+from stores.device_store import scan_partitioned
+from stores.factory import create_rollup_store, create_top_devices, create_ts_store
+from stores.ingest import IngestReading
+from stores.single_writer_device_store import CapacityBudget, SingleWriterDeviceStore
+
+# Names of the ingest modes, selected with the INGEST_MODE setting.
+INGEST_MODE_SYNC = "sync"
+INGEST_MODE_ASYNC = "async"
+
+
+class _Shard:
+    """
+    State owned by a single shard: its service over lock-free stores, its queue and its writer task.
+
+    Queue items are `(fn, args, future)` tuples. The writer task applies `fn(*args)` and resolves `future`.
+    """
+    __slots__ = ("service", "queue", "writer")
+
+    def __init__(self, service: DeviceReadingsService):
+        self.service = service
+        self.queue = None
+        self.writer = None
+
+
+class ShardedIngestPipeline:
+    """
+    Ingest pipeline for async handlers, with a single writer per shard.
+
+    Devices are sharded by their UUID. Each shard owns a DeviceReadingsService over its own lock-free device
+    store and timestamp store, and all writes to a shard go through its bounded `asyncio.Queue` to its writer
+    task, so writes to a shard never run concurrently and the stores need no locking. A full queue makes
+    producers wait, which pushes back on clients. The device capacity is shared by all shards through a
+    CapacityBudget, which is safe because every shard runs on the same event loop.
+
+    The writer of a shard is started when work is queued and exits once the queue is drained, so no task is
+    left pending between requests. The queues are recreated if the pipeline is used from another event loop.
+
+    Reads are served directly from the shard state on the event loop, without a lock and without going
+    through the queue.
+
+    Attributes:
+        shards (List[_Shard]): The shards of the pipeline.
+        queue_size (int): The maximum number of pending writes per shard.
+    """
+
+    def __init__(self, shards=8, queue_size=1024, device_capacity=100, ts_store_factory=None):
+        """
+        Initialize the ShardedIngestPipeline.
+
+        Args:
+            shards (int): The number of shards. Defaults to 8.
+            queue_size (int): The maximum number of pending writes per shard. Defaults to 1024.
+            device_capacity (int): The maximum number of devices across all shards. Defaults to 100.
+            ts_store_factory (Callable[[], TimeStampStoreIface]): Creates the timestamp store of a shard.
+                Defaults to the store configured in the settings, with its capacity split between the shards.
+        """
+        if ts_store_factory is None:
+            ts_store_factory = lambda: create_ts_store(settings, shards=shards)  # noqa: E731
+        self.queue_size = queue_size
+        self.budget = CapacityBudget(device_capacity)
+        self.shards = [
+            _Shard(DeviceReadingsService(device_store=SingleWriterDeviceStore(budget=self.budget),
+                                         ts_store=ts_store_factory(), rollups=create_rollup_store(settings),
+                                         top_devices=create_top_devices(settings)))
+            for _ in range(shards)
+        ]
+        self._loop = None
+
+    def _shard(self, device_id: uuid.UUID) -> _Shard:
+        """Return the shard owning a device."""
+        return self.shards[device_id.int % len(self.shards)]
+
+    def _bind_loop(self) -> asyncio.AbstractEventLoop:
+        """
+        Return the running event loop, recreating the queues if it is not the loop they were created on.
+
+        Returns:
+            asyncio.AbstractEventLoop: The running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            for shard in self.shards:
+                shard.queue = asyncio.Queue(maxsize=self.queue_size)
+                shard.writer = None
+            self._loop = loop
+        return loop
+
+    async def _submit(self, shard: _Shard, fn, *args):
+        """
+        Queue a write on a shard and wait for its result.
+
+        Args:
+            shard (_Shard): The shard owning the data written.
+            fn (Callable): The write, called by the writer task of the shard.
+            *args: The arguments of the write.
+
+        Returns:
+            The result of the write.
+        """
+        loop = self._bind_loop()
+        future = loop.create_future()
+        await shard.queue.put((fn, args, future))
+        if shard.writer is None or shard.writer.done():
+            shard.writer = loop.create_task(self._drain(shard))
+        return await future
+
+    @staticmethod
+    async def _drain(shard: _Shard):
+        """
+        Apply the queued writes of a shard until its queue is empty.
+
+        There is no await between the last emptiness check and the return, so a write queued afterwards
+        always finds the writer done and starts a new one.
+
+        Args:
+            shard (_Shard): The shard to drain.
+        """
+        queue = shard.queue
+        while not queue.empty():
+            fn, args, future = queue.get_nowait()
+            try:
+                result = fn(*args)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+    async def add_device_readings(self, device_readings: DeviceReadings) -> str:
+        """
+        Add readings to a device through the writer of its shard.
+
+        Args:
+            device_readings (DeviceReadings): The readings to be added for a specific device.
+
+        Returns:
+            str: An empty string if successful, or an error message if the device cannot be created.
+        """
+        shard = self._shard(device_readings.id)
+        return await self._submit(shard, shard.service.add_device_readings, device_readings)
+
+    async def add_device_readings_batch(self, batch: List[DeviceReadings]) -> Dict[uuid.UUID, str]:
+        """
+        Add readings for many devices, with one write per shard involved, applied concurrently.
+
+        Args:
+            batch (List[DeviceReadings]): The readings for each device. A device may appear more than once.
+
+        Returns:
+            Dict[uuid.UUID, str]: For each device, in order of first appearance, an empty string if
+            successful or an error message if the device cannot be created.
+        """
+        batch_by_shard = {}
+        for device_readings in batch:
+            batch_by_shard.setdefault(device_readings.id.int % len(self.shards), []).append(device_readings)
+
+        shard_results = await asyncio.gather(*[
+            self._submit(self.shards[index], self.shards[index].service.add_device_readings_batch, shard_batch)
+            for index, shard_batch in batch_by_shard.items()
+        ])
+        errors = {}
+        for results in shard_results:
+            errors.update(results)
+        return {device_readings.id: errors[device_readings.id] for device_readings in batch}
+
+    async def add_encoded_readings_batch(self, readings_by_device: Dict[uuid.UUID, List[IngestReading]]
+                                         ) -> Dict[uuid.UUID, str]:
+        """
+        Add readings already converted to epoch microseconds for many devices, with one write per shard
+        involved, applied concurrently.
+
+        Args:
+            readings_by_device (Dict[uuid.UUID, List[IngestReading]]): The epoch microseconds, count and UTC
+                offset of the readings of each device.
+
+        Returns:
+            Dict[uuid.UUID, str]: For each device, an empty string if successful or an error message if the
+            device cannot be created.
+        """
+        batch_by_shard = {}
+        for device_id, readings in readings_by_device.items():
+            batch_by_shard.setdefault(device_id.int % len(self.shards), {})[device_id] = readings
+
+        shard_results = await asyncio.gather(*[
+            self._submit(self.shards[index], self.shards[index].service.add_encoded_readings_batch, shard_batch)
+            for index, shard_batch in batch_by_shard.items()
+        ])
+        errors = {}
+        for results in shard_results:
+            errors.update(results)
+        return {device_id: errors[device_id] for device_id in readings_by_device}
+
+    def get_cumulative_count(self, device_id: uuid.UUID) -> (int, str):
+        """
+        Retrieve the cumulative count of readings for a given device from its shard.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+
+        Returns:
+            tuple: A tuple containing the cumulative count (int) and an error message (str) if the device is not found.
+        """
+        return self._shard(device_id).service.get_cumulative_count(device_id)
+
+    def get_latest_timestamp(self, device_id: uuid.UUID) -> (datetime, str):
+        """
+        Retrieve the latest timestamp of readings for a given device from its shard.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+
+        Returns:
+            tuple: A tuple containing the latest timestamp (datetime) and an error message (str) if the device is not found.
+        """
+        return self._shard(device_id).service.get_latest_timestamp(device_id)
+
+    def get_device_version(self, device_id: uuid.UUID) -> Optional[str]:
+        """
+        Retrieve a tag of the current count and latest timestamp of a device from its shard.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+
+        Returns:
+            Optional[str]: The tag, or None if the device is not found.
+        """
+        return self._shard(device_id).service.get_device_version(device_id)
+
+    def _summaries(self, device_ids: List[uuid.UUID]) -> List[dict]:
+        """Return the summaries of a page of devices, each read from its shard."""
+        return [self._shard(device_id).service._summaries([device_id])[0] for device_id in device_ids]
+
+    def get_device_summaries(self, device_ids: Iterable[uuid.UUID]) -> Iterator[List[dict]]:
+        """
+        Retrieve the cumulative count and latest timestamp of many devices from their shards, a page at a time.
+
+        Args:
+            device_ids (Iterable[uuid.UUID]): The unique identifiers of the devices.
+
+        Returns:
+            Iterator[List[dict]]: Pages of summaries in the order of the devices.
+        """
+        device_ids = iter(device_ids)
+        while True:
+            page = list(islice(device_ids, SUMMARY_PAGE_SIZE))
+            if not page:
+                return
+            yield self._summaries(page)
+
+    def scan_device_summaries(self, cursor=0, limit=None) -> DeviceSummaryScan:
+        """
+        Retrieve the cumulative count and latest timestamp of every device, scanning the shards one after the other.
+
+        Args:
+            cursor (int): The cursor returned by a previous scan, or 0 to start from the first device.
+            limit (int): The maximum number of devices to read. Defaults to every device.
+
+        Returns:
+            DeviceSummaryScan: The pages of summaries, and the cursor to resume from once they are read.
+        """
+        scans = [shard.service.device_store.scan_devices for shard in self.shards]
+        return DeviceSummaryScan(lambda scan_cursor, count: scan_partitioned(scans, scan_cursor, count),
+                                 self._summaries, cursor=cursor, limit=limit)
+
+    def get_counts(self, device_id: uuid.UUID, start: datetime, end: datetime, step: Optional[str] = None
+                   ) -> (dict, str):
+        """
+        Retrieve the count of readings of a device over a time range from the rollups of its shard.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            start (datetime): The start of the range, included.
+            end (datetime): The end of the range, excluded.
+            step (str): The bucket size, "minute", "hour" or "day". Defaults to the finest one covering the range.
+
+        Returns:
+            tuple: A tuple containing the counts (dict) and an error message (str) if the device is not found.
+
+        Raises:
+            ValueError: If rollups are disabled, the bucket size is not enabled or the range is empty.
+        """
+        return self._shard(device_id).service.get_counts(device_id, start, end, step)
+
+    def get_top_devices(self, k: int) -> List[dict]:
+        """
+        Retrieve the devices with the highest cumulative counts, merging the top devices index of every shard.
+
+        Args:
+            k (int): The number of devices to return.
+
+        Returns:
+            List[dict]: The `id` and `cumulative_count` of up to `k` devices, the highest count first.
+
+        Raises:
+            ValueError: If the index is disabled or `k` exceeds its capacity.
+        """
+        tops = [shard.service.get_top_devices(k) for shard in self.shards]
+        return heapq.nlargest(k, (device for top in tops for device in top),
+                              key=lambda device: device["cumulative_count"])
+
+    def get_store_stats(self) -> dict:
+        """
+        Report the size and usage of the stores of every shard, and the pending writes of each shard.
+
+        Returns:
+            dict: The statistics of the pipeline and of each shard.
+        """
+        return {
+            "ingest": {
+                "mode": INGEST_MODE_ASYNC,
+                "devices": self.budget.used,
+                "queue_size": self.queue_size,
+                "pending": [shard.queue.qsize() if shard.queue else 0 for shard in self.shards],
+            },
+            "shards": [shard.service.get_store_stats() for shard in self.shards],
+        }
+
+    def clear(self):
+        """Clear the stores of every shard, resetting them to an empty state."""
+        for shard in self.shards:
+            shard.service.device_store.clear()
+            shard.service.ts_store.clear()
+            if shard.service.rollups is not None:
+                shard.service.rollups.clear()
+            if shard.service.top_devices is not None:
+                shard.service.top_devices.clear()
+
+
+def create_ingest_pipeline(settings) -> Optional[ShardedIngestPipeline]:
+    """
+    Create the ingest pipeline used by the async handlers, with the configured shards.
+
+    Args:
+        settings (Settings): The settings instance to read the ingest options from.
+
+    Returns:
+        Optional[ShardedIngestPipeline]: The pipeline, or None if INGEST_MODE is not "async".
+    """
+    if settings.INGEST_MODE != INGEST_MODE_ASYNC:
+        return None
+    return ShardedIngestPipeline(shards=settings.INGEST_SHARDS, queue_size=settings.INGEST_QUEUE_SIZE,
+                                 device_capacity=settings.DEVICE_STORE_CAPACITY)
+
+
+# Initialize the ingest pipeline, in async ingest mode only, so the sync mode does not build the stores of the shards.
+ingest_pipeline = create_ingest_pipeline(settings)
@@ -1,12 +1,53 @@
 import uuid
-from fastapi import FastAPI, Response, status
+from datetime import datetime
+from functools import partial
+from typing import Literal, Optional
+from fastapi import APIRouter, FastAPI, Header, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from admission import AdmissionControlMiddleware, admission_controller
+from binary_ingest import BinaryDecodeRoute
+from config import settings
 from device_readings_service import device_readings_service
-from models import DeviceReadings
+from fast_ingest import INGEST_DECODER_FAST, router as fast_ingest_router
+from ingest_pipeline import INGEST_MODE_ASYNC, ingest_pipeline
+from metrics import (RequestMetricsMiddleware, admission_shed, register_admission_metrics, register_service_metrics,
+                     registry, request_duration_seconds)
+from profiling import ProfiledRoute, ProfilingMiddleware, format_pstats, profiled, request_profiles, stack_sampler
+from models import DeviceIds, DeviceReadings, DeviceReadingsBatch
+from response_cache import response_cache
+from stream_ingest import NDJSON_MEDIA_TYPES, UploadIngest, UploadResponse, create_upload_reader
+from streaming import encode_json, stream_json_list
 
 app = FastAPI()
+app.router.route_class = ProfiledRoute  # Profiles the sync handlers in the threadpool for profiled requests
+if admission_controller is not None:
+    # Added first, so the shed requests are still timed by the middlewares below
+    app.add_middleware(AdmissionControlMiddleware, controller=admission_controller, shed_counter=admission_shed)
+    register_admission_metrics(registry, admission_controller)
+app.add_middleware(RequestMetricsMiddleware, histogram=request_duration_seconds)
+if settings.PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware, store=request_profiles, header=settings.PROFILING_HEADER)
 
+if settings.INGEST_MODE == INGEST_MODE_ASYNC:
+    # Routes are matched in order, so the async handlers registered here take precedence over the sync ones below
+    from async_routes import router as async_router
+    app.include_router(async_router)
+    # The stores written by the async handlers are those of the shards of the pipeline
+    register_service_metrics(registry, lambda: [shard.service for shard in ingest_pipeline.shards],
+                             pipeline=ingest_pipeline)
+else:
+    register_service_metrics(registry, lambda: [device_readings_service])
 
-@app.post("/api/devices/readings")
+if settings.INGEST_DECODER == INGEST_DECODER_FAST:
+    # Registered before the sync handler of the same path, which it replaces
+    app.include_router(fast_ingest_router)
+
+# The readings endpoint also accepts MessagePack and packed bodies, decoded by its route
+readings_router = APIRouter(route_class=BinaryDecodeRoute)
+
+
+@readings_router.post("/api/devices/readings")
 def update_readings(readings: DeviceReadings, response: Response):
     """
     Endpoint to add or update readings for a device.
@@ -19,6 +60,10 @@ def update_readings(readings: DeviceReadings, response: Response):
         readings (DeviceReadings): The readings data containing the device ID and associated readings.
         response (Response): The response object for setting the status code.
 
+    Bodies sent as MessagePack (`application/msgpack`) or in the packed format
+    (`application/vnd.device-readings.packed`) hold epoch microseconds instead of RFC 3339 strings, see
+    `binary_ingest`, and are decoded without building the models.
+
     Example JSON payload:
     {
         "id": "6e7b58d7-0e4f-4b6c-8b9a-0b9f9b9c9d6f",
@@ -44,21 +89,110 @@ def update_readings(readings: DeviceReadings, response: Response):
     return {"message": "Readings updated successfully"}
 
 
+app.include_router(readings_router)
+
+
+@app.post("/api/devices/readings/batch")
+def update_readings_batch(batch: DeviceReadingsBatch):
+    """
+    Endpoint to add or update readings for many devices in a single request.
+
+    Each device is processed independently, so a failure for one device (for example when the device store
+    capacity is exceeded) is reported in that device's result and does not fail the whole request.
+
+    Args:
+        batch (DeviceReadingsBatch): The readings data for each device.
+
+    Example JSON payload:
+    {
+        "devices": [
+            {
+                "id": "6e7b58d7-0e4f-4b6c-8b9a-0b9f9b9c9d6f",
+                "readings": [
+                    {
+                        "timestamp": "2021-09-30T12:00:00",
+                        "count": 5
+                    }
+                ]
+            },
+            {
+                "id": "36d5658a-6908-479e-887e-a949ec199272",
+                "readings": [
+                    {
+                        "timestamp": "2021-09-30T12:05:00",
+                        "count": 3
+                    }
+                ]
+            }
+        ]
+    }
+
+    Returns:
+        dict: A JSON object with one result per device, in order of first appearance in the request.
+    """
+    errors = device_readings_service.add_device_readings_batch(batch.devices)
+    results = []
+    for device_id, err in errors.items():
+        if err:
+            results.append({"id": device_id, "success": False, "message": err})
+        else:
+            results.append({"id": device_id, "success": True, "message": "Readings updated successfully"})
+    return {"results": results}
+
+
+@app.post("/api/devices/readings/stream")
+async def stream_readings(request: Request):
+    """
+    Endpoint to add readings for many devices from a large upload, read as it arrives.
+
+    The upload is NDJSON with one DeviceReadings object per line (`application/x-ndjson`, the default), or a
+    JSON array of DeviceReadings objects (`application/json`). Readings are added in micro-batches as the upload
+    is read, so it is never held in memory.
+
+    Example NDJSON upload:
+    {"id": "6e7b58d7-0e4f-4b6c-8b9a-0b9f9b9c9d6f", "readings": [{"timestamp": "2021-09-30T12:00:00", "count": 5}]}
+    {"id": "6e7b58d7-0e4f-4b6c-8b9a-0b9f9b9c9d6f", "readings": [{"timestamp": "2021-09-30T12:05:00", "count": 3}]}
+
+    Args:
+        request (Request): The request, whose body is read as a stream.
+
+    Returns:
+        Response: A stream of NDJSON progress, error and done events, or a 415 status for another content type.
+    """
+    reader = create_upload_reader(request.headers.get("content-type"), settings.STREAM_INGEST_MAX_LINE_BYTES)
+    if reader is None:
+        return JSONResponse({"message": "Unsupported content type"},
+                            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+    add_batch = partial(run_in_threadpool, profiled(device_readings_service.add_encoded_readings_batch))
+    upload = UploadIngest(reader, add_batch, settings.STREAM_INGEST_BATCH_SIZE, settings.STREAM_INGEST_MAX_ERRORS)
+    return UploadResponse(upload.run(request.stream()), media_type=NDJSON_MEDIA_TYPES[0])
+
+
 @app.get("/api/devices/{device_id}/cumulative_count")
-def get_cumulative_count(device_id: uuid.UUID, response: Response):
+def get_cumulative_count(device_id: uuid.UUID, response: Response, if_none_match: Optional[str] = Header(None)):
     """
     Endpoint to retrieve the cumulative count of readings for a specified device.
 
     This endpoint returns the total count of all readings recorded for a device identified by `device_id`.
     If the device is not found, it returns a 404 Not Found status.
 
+    The version of the device is sent as ETag. If the If-None-Match header holds the current version, it
+    returns a 304 Not Modified status without a body, and bodies of unchanged devices come from the response
+    cache.
+
     Args:
         device_id (uuid.UUID): The unique identifier of the device.
         response (Response): The response object for setting the status code.
+        if_none_match (str): The ETags of the representations the client holds, if any.
 
     Returns:
-        dict: A JSON object with the cumulative count or an error message if the device is not found.
+        Response: A JSON object with the cumulative count or an error message if the device is not found.
     """
+    version = device_readings_service.get_device_version(device_id)
+    if version is not None:
+        return response_cache.respond(
+            ("cumulative_count", device_id), version, if_none_match,
+            lambda: encode_json({"cumulative_count": device_readings_service.get_cumulative_count(device_id)[0]}))
     count, err = device_readings_service.get_cumulative_count(device_id)
     if err:
         response.status_code = status.HTTP_404_NOT_FOUND
@@ -67,22 +201,221 @@ def get_cumulative_count(device_id: uuid.UUID, response: Response):
 
 
 @app.get("/api/devices/{device_id}/latest_timestamp")
-def get_latest_timestamp(device_id: uuid.UUID, response: Response):
+def get_latest_timestamp(device_id: uuid.UUID, response: Response, if_none_match: Optional[str] = Header(None)):
     """
     Endpoint to retrieve the latest timestamp of readings for a specified device.
 
     This endpoint returns the most recent timestamp recorded for a device identified by `device_id`.
     If the device is not found, it returns a 404 Not Found status.
 
+    The version of the device is sent as ETag. If the If-None-Match header holds the current version, it
+    returns a 304 Not Modified status without a body, and bodies of unchanged devices come from the response
+    cache.
+
     Args:
         device_id (uuid.UUID): The unique identifier of the device.
         response (Response): The response object for setting the status code.
+        if_none_match (str): The ETags of the representations the client holds, if any.
 
     Returns:
-        dict: A JSON object with the latest timestamp or an error message if the device is not found.
+        Response: A JSON object with the latest timestamp or an error message if the device is not found.
     """
+    version = device_readings_service.get_device_version(device_id)
+    if version is not None:
+        return response_cache.respond(
+            ("latest_timestamp", device_id), version, if_none_match,
+            lambda: encode_json({"latest_timestamp": device_readings_service.get_latest_timestamp(device_id)[0]}))
     timestamp, err = device_readings_service.get_latest_timestamp(device_id)
     if err:
         response.status_code = status.HTTP_404_NOT_FOUND
         return {"message": err}
     return {"latest_timestamp": timestamp}
+
+
+@app.post("/api/devices/summaries")
+def get_device_summaries(request: DeviceIds):
+    """
+    Endpoint to retrieve the cumulative count and latest timestamp of many devices in one request.
+
+    The devices are read a page at a time and the response is streamed, so server memory stays flat for large
+    lists. Unknown devices are reported in their entry and do not fail the request.
+
+    Args:
+        request (DeviceIds): The unique identifiers of the devices.
+
+    Example JSON payload:
+    {
+        "ids": ["6e7b58d7-0e4f-4b6c-8b9a-0b9f9b9c9d6f", "36d5658a-6908-479e-887e-a949ec199272"]
+    }
+
+    Returns:
+        StreamingResponse: A JSON object with one entry per device, in the order of the request, holding its
+        `id`, `cumulative_count` and `latest_timestamp`, or its `id` and an error `message`.
+    """
+    pages = device_readings_service.get_device_summaries(request.ids)
+    return StreamingResponse(stream_json_list("devices", pages), media_type="application/json")
+
+
+@app.get("/api/devices/summaries")
+def scan_device_summaries(cursor: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=1)):
+    """
+    Endpoint to retrieve the cumulative count and latest timestamp of every device, by scanning the device store.
+
+    Without a limit every device is returned in one streamed response. With a limit, the response holds about
+    `limit` devices and a `next_cursor` to pass as `cursor` to get the next ones, until it is 0.
+
+    Args:
+        cursor (int): The cursor returned by the previous request, or 0 to start from the first device.
+        limit (int): The maximum number of devices to return. Defaults to every device.
+
+    Returns:
+        StreamingResponse: A JSON object with the `id`, `cumulative_count` and `latest_timestamp` of each device
+        and the `next_cursor`.
+    """
+    scan = device_readings_service.scan_device_summaries(cursor=cursor, limit=limit)
+    return StreamingResponse(stream_json_list("devices", scan, tail=lambda: {"next_cursor": scan.cursor}),
+                             media_type="application/json")
+
+
+@app.get("/api/devices/top")
+def get_top_devices(response: Response, k: int = Query(10, ge=1)):
+    """
+    Endpoint to retrieve the devices with the highest cumulative counts.
+
+    The devices come from an index of the TOP_DEVICES_CAPACITY devices with the highest counts, updated as
+    readings are accepted, so the response does not depend on the number of devices. If the index is disabled
+    or `k` exceeds its capacity, it returns a 400 Bad Request status.
+
+    Args:
+        response (Response): The response object for setting the status code.
+        k (int): The number of devices to return. Defaults to 10.
+
+    Returns:
+        dict: A JSON object with the `id` and `cumulative_count` of each device, the highest count first, or an
+        error message.
+    """
+    try:
+        return {"devices": device_readings_service.get_top_devices(k)}
+    except ValueError as e:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {"message": str(e)}
+
+
+@app.get("/api/devices/{device_id}/counts")
+def get_counts(device_id: uuid.UUID, response: Response, start: datetime = Query(alias="from"),
+               end: datetime = Query(alias="to"), step: Optional[Literal["minute", "hour", "day"]] = None):
+    """
+    Endpoint to retrieve the count of readings of a device over a time range, in total and per time bucket.
+
+    The counts come from minute, hour and day rollups maintained as readings are accepted, and the total is
+    computed from prefix sums in O(log n). The range is widened to whole buckets, and buckets outside the
+    retention of the bucket size are left out. If the range is invalid or the bucket size is not enabled, it
+    returns a 400 Bad Request status, and if the device is not found, a 404 Not Found status.
+
+    Args:
+        device_id (uuid.UUID): The unique identifier of the device.
+        response (Response): The response object for setting the status code.
+        start (datetime): The `from` query parameter, the start of the range, included.
+        end (datetime): The `to` query parameter, the end of the range, excluded.
+        step (str): The bucket size, "minute", "hour" or "day". Defaults to the finest bucket size whose
+            retention covers the start of the range.
+
+    Returns:
+        dict: A JSON object with the bucket size, the total count and the count per bucket, or an error message.
+    """
+    try:
+        counts, err = device_readings_service.get_counts(device_id, start, end, step)
+    except ValueError as e:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {"message": str(e)}
+    if err:
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return {"message": err}
+    return counts
+
+
+@app.get("/api/admin/stats")
+def get_store_stats():
+    """
+    Endpoint to retrieve the size and usage of the stores, for monitoring and sizing them in production.
+
+    When the Bloom filter tier is enabled this includes its fill ratio per generation and its estimated
+    false-positive rate. The hit rates of the response cache and the lanes of admission control are also reported.
+
+    Returns:
+        dict: A JSON object with the statistics of each store, of the response cache and of admission control,
+        which is null if disabled.
+    """
+    return {**device_readings_service.get_store_stats(), "response_cache": response_cache.stats(),
+            "admission": admission_controller.stats() if admission_controller is not None else None}
+
+
+@app.get("/api/admin/profiles")
+def list_profiles():
+    """
+    Endpoint to list the request profiles kept and the state of the stack sampler.
+
+    Requests are profiled when PROFILING_ENABLED is set and they are sent with the PROFILING_HEADER header, whose
+    value in the response is the id of their profile.
+
+    Returns:
+        dict: `profiles` with the id, method, path, start and duration of each profile, most recent first, and
+        `sampler` with the statistics of the stack sampler, or null if it is disabled.
+    """
+    return {"profiles": request_profiles.list(),
+            "sampler": stack_sampler.stats() if stack_sampler is not None else None}
+
+
+@app.get("/api/admin/profiles/sampled")
+def get_sampled_stacks(windows: Optional[int] = Query(None, ge=0)):
+    """
+    Endpoint to retrieve the stacks aggregated by the stack sampler, in collapsed format for flame graph tools.
+
+    Args:
+        windows (Optional[int]): The number of complete sampling windows included with the current one. Defaults
+            to every window kept.
+
+    Returns:
+        Response: One `stack count` line per distinct stack, or a 404 status if the sampler is disabled.
+    """
+    if stack_sampler is None:
+        return JSONResponse({"message": "The stack sampler is disabled"}, status_code=status.HTTP_404_NOT_FOUND)
+    return PlainTextResponse(stack_sampler.collapsed(windows))
+
+
+@app.get("/api/admin/profiles/{profile_id}")
+def get_profile(profile_id: int, format: Literal["pstats", "text"] = "pstats"):
+    """
+    Endpoint to retrieve the profile of a request.
+
+    Args:
+        profile_id (int): The id of the profile, returned in the profiling header of the response.
+        format (str): "pstats" for the statistics as written by `pstats.Stats.dump_stats`, to load with
+            `pstats.Stats` or snakeviz, or "text" for a report of the functions sorted by cumulative time.
+
+    Returns:
+        Response: The profile, or a 404 status if it is not kept.
+    """
+    data, err = request_profiles.get(profile_id)
+    if err:
+        return JSONResponse({"message": err}, status_code=status.HTTP_404_NOT_FOUND)
+    if format == "text":
+        return PlainTextResponse(format_pstats(data))
+    return Response(data, media_type="application/octet-stream",
+                    headers={"Content-Disposition": f'attachment; filename="request-{profile_id}.pstats"'})
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Endpoint exposing the metrics of the service in the Prometheus text format, for scraping.
+
+    This includes the latency of each route, the time spent in each phase of adding readings, the readings
+    accepted and rejected as duplicates per request, the size, evictions and rejections of the stores, and the
+    depth of the threadpool queue. The handler is async so it reads the threadpool from the event loop, and is
+    never itself queued behind a saturated threadpool.
+
+    Returns:
+        Response: The metrics, as `text/plain; version=0.0.4`.
+    """
+    return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,426 @@
+import time
+from bisect import bisect_left
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import anyio.to_thread
+
+# Upper bounds of the request latency buckets, in seconds.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Upper bounds of the buckets of the phases of adding readings, in seconds.
+PHASE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 1.0)
+# Upper bounds of the buckets of the number of readings of a request.
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000, 10000)
+
+
+def _escape(value: str) -> str:
+    """Escape a label value for the Prometheus text format."""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    """Format label pairs as `{name="value",...}`, or an empty string without labels."""
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    """Format a sample value, without a fraction for integers."""
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    """
+    Base of the metrics of a registry, with one child per combination of label values.
+
+    Children are created on first use and cached, so hot paths can bind them once with `labels`.
+
+    Attributes:
+        name (str): The name of the metric.
+        help (str): The description of the metric.
+        labelnames (Tuple[str, ...]): The names of the labels of the metric.
+    """
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        """
+        Initialize the metric.
+
+        Args:
+            name (str): The name of the metric.
+            help (str): The description of the metric.
+            labelnames (Sequence[str]): The names of the labels of the metric. Defaults to no labels.
+        """
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = Lock()
+
+    def labels(self, *values: str):
+        """
+        Return the child of the metric for the given label values, creating it on first use.
+
+        Args:
+            *values (str): One value per label name.
+
+        Returns:
+            The child, on which the metric is updated.
+
+        Raises:
+            ValueError: If the number of values does not match the label names.
+        """
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        """Return a new child of the metric."""
+        raise NotImplementedError
+
+    def samples(self) -> List[Tuple[str, Tuple[Tuple[str, str], ...], float]]:
+        """
+        Return the samples of the metric.
+
+        Returns:
+            List[Tuple[str, Tuple[Tuple[str, str], ...], float]]: The name, label pairs and value of each sample.
+        """
+        samples = []
+        for values, child in list(self._children.items()):
+            samples.extend(child.samples(self.name, tuple(zip(self.labelnames, values))))
+        return samples
+
+
+class _CounterChild:
+    """Value of a counter for one combination of label values."""
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = Lock()
+
+    def inc(self, amount: float = 1):
+        """
+        Increment the counter.
+
+        Args:
+            amount (float): The amount to add, which must not be negative. Defaults to 1.
+        """
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name: str, labels: Tuple[Tuple[str, str], ...]):
+        """Return the sample of the counter."""
+        return [(f"{name}_total", labels, self.value)]
+
+
+class Counter(_Metric):
+    """A monotonically increasing count, such as a number of requests."""
+    type = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        """Increment the counter of a metric without labels."""
+        self.labels().inc(amount)
+
+
+class _HistogramChild:
+    """Buckets, sum and count of a histogram for one combination of label values."""
+    __slots__ = ("buckets", "counts", "sum", "_lock")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last bucket counts the values above every bound
+        self.sum = 0.0
+        self._lock = Lock()
+
+    def observe(self, value: float):
+        """
+        Record a value.
+
+        Args:
+            value (float): The value, counted in the first bucket whose upper bound is at least the value.
+        """
+        index = bisect_left(self.buckets, value)
+        lock = self._lock
+        lock.acquire()  # Cheaper than a with statement, on the hot path
+        self.counts[index] += 1
+        self.sum += value
+        lock.release()
+
+    def samples(self, name: str, labels: Tuple[Tuple[str, str], ...]):
+        """Return the cumulative buckets, the sum and the count of the histogram."""
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            samples.append((f"{name}_bucket", labels + (("le", _format_value(float(bound))),), cumulative))
+        samples.append((f"{name}_sum", labels, total))
+        samples.append((f"{name}_count", labels, cumulative))
+        return samples
+
+
+class Histogram(_Metric):
+    """
+    Distribution of values, such as latencies, counted in buckets with fixed upper bounds.
+
+    Attributes:
+        buckets (Tuple[float, ...]): The upper bounds of the buckets, in increasing order.
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        """
+        Initialize the histogram.
+
+        Args:
+            name (str): The name of the metric.
+            help (str): The description of the metric.
+            labelnames (Sequence[str]): The names of the labels of the metric. Defaults to no labels.
+            buckets (Sequence[float]): The upper bounds of the buckets. Defaults to LATENCY_BUCKETS.
+        """
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        """Record a value of a metric without labels."""
+        self.labels().observe(value)
+
+
+class CallbackMetric(_Metric):
+    """
+    Gauge or counter whose value is read from a function when the metrics are collected, such as the size of a
+    store. The function returns None when the value is not available, and the metric is then left out.
+    """
+
+    def __init__(self, name: str, help: str, fn: Callable[[], Optional[float]], type: str = "gauge"):
+        """
+        Initialize the metric.
+
+        Args:
+            name (str): The name of the metric.
+            help (str): The description of the metric.
+            fn (Callable[[], Optional[float]]): Returns the current value, or None.
+            type (str): "gauge" or "counter". Defaults to "gauge".
+        """
+        super().__init__(name, help)
+        self.type = type
+        self.fn = fn
+
+    def samples(self):
+        value = self.fn()
+        if value is None:
+            return []
+        return [(f"{self.name}_total" if self.type == "counter" else self.name, (), value)]
+
+
+class Registry:
+    """Collection of the metrics of the application, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        """Initialize an empty Registry."""
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        """
+        Add a metric to the registry, or return the metric already registered under its name.
+
+        Args:
+            metric (_Metric): The metric.
+
+        Returns:
+            _Metric: The registered metric.
+        """
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        """Register and return a Counter."""
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        """Register and return a Histogram."""
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name: str, help: str, fn: Callable[[], Optional[float]], type: str = "gauge") -> CallbackMetric:
+        """Register and return a CallbackMetric."""
+        return self.register(CallbackMetric(name, help, fn, type))
+
+    def render(self) -> str:
+        """
+        Collect every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The samples of every metric, with their HELP and TYPE lines.
+        """
+        lines = []
+        for metric in list(self._metrics.values()):
+            samples = metric.samples()
+            if not samples:
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for name, labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware recording the duration of each HTTP request in a histogram labelled by method and route.
+
+    The route is the path template of the matched route (such as `/api/devices/{device_id}/cumulative_count`),
+    so the number of label values stays bounded, or "unmatched" if no route matched. The duration runs until
+    the response is complete, streamed bodies included.
+    """
+
+    def __init__(self, app, histogram: Histogram):
+        """
+        Initialize the middleware.
+
+        Args:
+            app: The ASGI application.
+            histogram (Histogram): The histogram, with the labels "method" and "route".
+        """
+        self.app = app
+        self.histogram = histogram
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            self.histogram.labels(scope["method"], path).observe(time.perf_counter() - start)
+
+
+def _total(values: Iterable[Optional[float]]) -> Optional[float]:
+    """Return the sum of the values that are not None, or None if they all are."""
+    values = [value for value in values if value is not None]
+    return sum(values) if values else None
+
+
+def _threadpool_statistic(name: str) -> Optional[int]:
+    """
+    Return a statistic of the limiter of the threadpool running the sync handlers.
+
+    Args:
+        name (str): The name of the statistic: "borrowed_tokens", "tasks_waiting" or "total_tokens".
+
+    Returns:
+        Optional[int]: The statistic, or None outside of an event loop.
+    """
+    try:
+        limiter = anyio.to_thread.current_default_thread_limiter()
+    except RuntimeError:
+        return None
+    if name == "total_tokens":
+        return limiter.total_tokens
+    return getattr(limiter.statistics(), name)
+
+
+def register_service_metrics(registry: Registry, services: Callable[[], Iterable], pipeline=None):
+    """
+    Register the gauges and counters read from the stores when the metrics are collected.
+
+    Values are summed over the services, such as the shards of the ingest pipeline. A value no store reports
+    (for example the evictions of a Redis timestamp store) is left out.
+
+    Args:
+        registry (Registry): The registry to add the metrics to.
+        services (Callable[[], Iterable[DeviceReadingsService]]): Returns the services whose stores are reported.
+        pipeline (ShardedIngestPipeline): The ingest pipeline whose pending writes are reported. Defaults to none.
+    """
+    def ts_stat(key):
+        return lambda: _total(service.ts_store.stats().get(key) for service in services())
+
+    def device_store_size():
+        return _total(len(service.device_store) if hasattr(service.device_store, "__len__") else None
+                      for service in services())
+
+    def device_store_stat(name):
+        # Read through the snapshot tier to the live store, which counts the rejections and evictions
+        return lambda: _total(getattr(getattr(service.device_store, "live", service.device_store), name, None)
+                              for service in services())
+
+    registry.callback("device_readings_timestamp_store_size", "Timestamps held by the timestamp store.",
+                      ts_stat("size"))
+    registry.callback("device_readings_timestamp_store_capacity", "Capacity of the timestamp store.",
+                      ts_stat("capacity"))
+    registry.callback("device_readings_timestamp_store_evictions", "Timestamps evicted to stay within capacity.",
+                      ts_stat("evictions"), type="counter")
+    registry.callback("device_readings_timestamp_store_expirations", "Timestamps expired after the retention.",
+                      ts_stat("expirations"), type="counter")
+    registry.callback("device_readings_device_store_size", "Devices held by the device store.", device_store_size)
+    registry.callback("device_readings_device_store_rejections", "New devices refused with \"Capacity exceeded\".",
+                      device_store_stat("rejections"), type="counter")
+    registry.callback("device_readings_device_store_evictions", "Devices evicted from memory to make room.",
+                      device_store_stat("evictions"), type="counter")
+    registry.callback("device_readings_device_store_spilled", "Devices held by the spill tier of the device store.",
+                      device_store_stat("spilled"))
+    registry.callback("device_readings_threadpool_busy", "Threads of the threadpool running sync handlers.",
+                      lambda: _threadpool_statistic("borrowed_tokens"))
+    registry.callback("device_readings_threadpool_waiting", "Calls queued for a thread of the threadpool.",
+                      lambda: _threadpool_statistic("tasks_waiting"))
+    registry.callback("device_readings_threadpool_size", "Threads of the threadpool.",
+                      lambda: _threadpool_statistic("total_tokens"))
+    if pipeline is not None:
+        registry.callback("device_readings_ingest_queue_pending", "Writes queued on the shards of the pipeline.",
+                          lambda: sum(shard.queue.qsize() if shard.queue else 0 for shard in pipeline.shards))
+
+
+def register_admission_metrics(registry: Registry, controller):
+    """
+    Register the gauges of the lanes of the admission controller.
+
+    Args:
+        registry (Registry): The registry to add the metrics to.
+        controller (AdmissionController): The admission controller whose lanes are reported.
+    """
+    for name, lane in controller.lanes.items():
+        registry.callback(f"device_readings_admission_{name}_in_flight",
+                          f"Requests of the {name} lane in flight.", lambda lane=lane: lane.in_flight)
+        registry.callback(f"device_readings_admission_{name}_queued",
+                          f"Requests of the {name} lane waiting for a slot.", lambda lane=lane: lane.queued)
+
+
+# Initialize the registry of the application and the metrics of the hot paths
+registry = Registry()
+request_duration_seconds = registry.histogram(
+    "device_readings_request_duration_seconds", "Duration of HTTP requests, by method and route.",
+    ["method", "route"])
+ingest_phase_seconds = registry.histogram(
+    "device_readings_ingest_phase_seconds",
+    "Time spent adding the readings of a request, by phase: converting timestamps (decode), checking them "
+    "against the timestamp store (dedupe), applying the accepted readings (update), both at once in a single "
+    "store operation (ingest), and writing the write-ahead log (wal).",
+    ["phase"], buckets=PHASE_BUCKETS)
+readings_per_request = registry.histogram(
+    "device_readings_readings_per_request",
+    "Readings of each device of a request, by result: accepted or rejected as duplicates.",
+    ["result"], buckets=COUNT_BUCKETS)
+admission_shed = registry.counter(
+    "device_readings_admission_shed", "Requests shed with a 429 by admission control, by lane and reason.",
+    ["lane", "reason"])
@@ -25,4 +25,26 @@ class DeviceReadings(BaseModel):
         readings (List[Reading]): A list of readings associated with the device.
     """
     id: uuid.UUID
-    readings: List[Reading]
\ No newline at end of file
+    readings: List[Reading]
+
+
+class DeviceIds(BaseModel):
+    """
+    Model representing a list of devices to read in a single request.
+
+    Attributes:
+        ids (List[uuid.UUID]): The unique identifiers of the devices.
+    """
+    ids: List[uuid.UUID]
+
+
+class DeviceReadingsBatch(BaseModel):
+    """
+    Model representing readings for many devices submitted in a single request.
+
+    A device may appear more than once; its readings are merged and processed together.
+
+    Attributes:
+        devices (List[DeviceReadings]): The readings for each device.
+    """
+    devices: List[DeviceReadings]
@@ -0,0 +1,503 @@
+import atexit
+import mmap
+import os
+import struct
+import time
+import uuid
+from threading import Event, Lock, Thread
+from typing import Iterator, List, Optional, Tuple
+
+from persistence.wal import WriteAheadLog, fsync_directory
+from stores.device_store import DeviceReadingIface, DeviceStoreIface
+from stores.epoch import from_epoch_us
+from stores.evicting_device_store import EvictingDeviceStore
+from stores.ts_store import TimeStampStoreIface
+
+# File header: magic bytes, the WAL sequence number the snapshot covers up to (exclusive), and the number of
+# device and key records.
+HEADER = struct.Struct("<8sqqq")
+MAGIC = b"DRSNAP01"
+
+# Device record: device UUID bytes, total count, latest epoch microseconds and its UTC offset (or NAIVE_OFFSET).
+# Sorted by UUID bytes.
+DEVICE_RECORD = struct.Struct("<16sqqi4x")
+
+# Dedupe key record: device UUID bytes, epoch microseconds and the WAL sequence number of the reading, which
+# decides which keys are kept by the next snapshot. Sorted by UUID bytes and then epoch.
+KEY_RECORD = struct.Struct("<16sqq")
+
+# A device record as read and written: (device UUID bytes, total_count, latest epoch_us, utc_offset).
+DeviceRecord = Tuple[bytes, int, int, int]
+
+
+def write_snapshot(path: str, wal_sequence: int, devices: List[DeviceRecord], keys: List[Tuple[bytes, int, int]]):
+    """
+    Write a snapshot file atomically: to a temporary file first, which then replaces `path`.
+
+    Args:
+        path (str): The path of the snapshot file.
+        wal_sequence (int): The WAL sequence number the snapshot covers up to (exclusive).
+        devices (List[DeviceRecord]): The device records.
+        keys (List[Tuple[bytes, int, int]]): The dedupe keys, as (device UUID bytes, epoch_us, WAL sequence).
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    devices = sorted(devices)
+    keys = sorted(keys)
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, wal_sequence, len(devices), len(keys)))
+        file.write(b"".join([DEVICE_RECORD.pack(*device) for device in devices]))
+        file.write(b"".join([KEY_RECORD.pack(*key) for key in keys]))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    fsync_directory(path)
+
+
+class SnapshotReader:
+    """
+    Read-only view of a snapshot file through a memory map.
+
+    Opening a snapshot only reads its header. Devices and dedupe keys are found by binary search over the sorted
+    fixed-size records, so lookups only touch the pages they need.
+
+    Attributes:
+        path (str): The path of the snapshot file.
+        wal_sequence (int): The WAL sequence number the snapshot covers up to (exclusive).
+        num_devices (int): The number of device records.
+        num_keys (int): The number of dedupe key records.
+    """
+
+    def __init__(self, path: str):
+        """
+        Open and map a snapshot file.
+
+        Args:
+            path (str): The path of the snapshot file.
+
+        Raises:
+            ValueError: If the file is not a snapshot.
+        """
+        self.path = path
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.wal_sequence, self.num_devices, self.num_keys = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError(f"Not a snapshot: {path}")
+        self._keys_offset = HEADER.size + self.num_devices * DEVICE_RECORD.size
+
+    def __repr__(self):
+        """
+        Return a string representation of the snapshot.
+
+        Returns:
+            str: A string representing the snapshot.
+        """
+        return (f"SnapshotReader(path={self.path!r}, wal_sequence={self.wal_sequence}, devices={self.num_devices}, "
+                f"keys={self.num_keys})")
+
+    def find_device(self, device_id: bytes) -> Optional[DeviceRecord]:
+        """
+        Find the record of a device.
+
+        Args:
+            device_id (bytes): The bytes of the device UUID.
+
+        Returns:
+            Optional[DeviceRecord]: The device record, or None if the device is not in the snapshot.
+        """
+        data = self._map
+        low, high = 0, self.num_devices
+        while low < high:
+            middle = (low + high) // 2
+            offset = HEADER.size + middle * DEVICE_RECORD.size
+            found = data[offset:offset + 16]
+            if found < device_id:
+                low = middle + 1
+            elif found > device_id:
+                high = middle
+            else:
+                return DEVICE_RECORD.unpack_from(data, offset)
+        return None
+
+    def contains_key(self, device_id: bytes, epoch_us: int) -> bool:
+        """
+        Check whether a reading is one of the dedupe keys of the snapshot.
+
+        Args:
+            device_id (bytes): The bytes of the device UUID.
+            epoch_us (int): The timestamp in integer Unix epoch microseconds.
+
+        Returns:
+            bool: True if the reading is in the snapshot.
+        """
+        data = self._map
+        target = (device_id, epoch_us)
+        low, high = 0, self.num_keys
+        while low < high:
+            middle = (low + high) // 2
+            offset = self._keys_offset + middle * KEY_RECORD.size
+            found = (data[offset:offset + 16], KEY_RECORD.unpack_from(data, offset)[1])
+            if found < target:
+                low = middle + 1
+            elif found > target:
+                high = middle
+            else:
+                return True
+        return False
+
+    def devices(self) -> Iterator[DeviceRecord]:
+        """Iterate over the device records, in UUID order."""
+        end = self._keys_offset
+        return DEVICE_RECORD.iter_unpack(self._map[HEADER.size:end])
+
+    def keys(self) -> Iterator[Tuple[bytes, int, int]]:
+        """Iterate over the dedupe keys, as (device UUID bytes, epoch_us, WAL sequence)."""
+        return KEY_RECORD.iter_unpack(self._map[self._keys_offset:self._keys_offset + self.num_keys * KEY_RECORD.size])
+
+    def close(self):
+        """Unmap the snapshot file."""
+        self._map.close()
+
+
+def open_snapshot(path: str) -> Optional[SnapshotReader]:
+    """
+    Open the snapshot at `path` if there is one.
+
+    Args:
+        path (str): The path of the snapshot file.
+
+    Returns:
+        Optional[SnapshotReader]: The snapshot, or None if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return None
+    return SnapshotReader(path)
+
+
+class Checkpointer:
+    """
+    Takes snapshots from the previous snapshot and the write-ahead log, without touching the live stores.
+
+    A checkpoint folds the log records written since the previous snapshot into its device counters and dedupe
+    keys, writes the new snapshot and then truncates the log at the position the snapshot covers. The live stores
+    are never read or locked, so ingestion carries on while a snapshot is taken; appends only wait while the few
+    records written during the checkpoint are copied by the truncation.
+
+    Only the `key_capacity` most recent dedupe keys are kept, like the ordered timestamp store.
+
+    Attributes:
+        wal (WriteAheadLog): The log the snapshot is built from.
+        path (str): The path of the snapshot file.
+        key_capacity (int): The maximum number of dedupe keys kept in the snapshot.
+        interval_s (float): The time between two periodic checkpoints, or 0 to disable them.
+        checkpoints (int): The number of checkpoints taken.
+        last_duration_s (float): The duration of the last checkpoint in seconds.
+    """
+
+    def __init__(self, wal: WriteAheadLog, path: str, key_capacity=10000, interval_s=0.0):
+        """
+        Initialize the Checkpointer.
+
+        Args:
+            wal (WriteAheadLog): The log the snapshot is built from.
+            path (str): The path of the snapshot file.
+            key_capacity (int): The maximum number of dedupe keys kept. Defaults to 10000.
+            interval_s (float): The time between two periodic checkpoints, or 0 to disable them. Defaults to 0.
+        """
+        self.wal = wal
+        self.path = path
+        self.key_capacity = key_capacity
+        self.interval_s = interval_s
+        self.checkpoints = 0
+        self.last_duration_s = 0.0
+        self._lock = Lock()  # Serialises checkpoints
+        self._stopped = Event()
+        self._thread = None
+
+    def checkpoint(self) -> int:
+        """
+        Take a snapshot covering every record appended to the log so far, and truncate the log.
+
+        Returns:
+            int: The WAL sequence number the new snapshot covers up to.
+        """
+        with self._lock:
+            start = time.perf_counter()
+            end_sequence = self.wal.next_sequence
+            devices = {}
+            keys = {}
+            start_sequence = None
+            previous = open_snapshot(self.path)
+            if previous is not None:
+                start_sequence = previous.wal_sequence
+                devices = {device[0]: list(device[1:]) for device in previous.devices()}
+                keys = {(device_id, epoch_us): sequence for device_id, epoch_us, sequence in previous.keys()}
+                previous.close()
+
+            sequence = max(start_sequence or 0, self.wal.base_sequence)
+            for device_id, epoch_us, count, utc_offset in self.wal.records(start_sequence, end_sequence):
+                device = devices.get(device_id)
+                if device is None:
+                    devices[device_id] = [count, epoch_us, utc_offset]
+                else:
+                    device[0] += count
+                    if epoch_us > device[1]:
+                        device[1] = epoch_us
+                        device[2] = utc_offset
+                keys[(device_id, epoch_us)] = sequence
+                sequence += 1
+
+            if len(keys) > self.key_capacity:
+                # Keep the most recent keys
+                keys = dict(sorted(keys.items(), key=lambda item: item[1])[-self.key_capacity:])
+            write_snapshot(self.path, end_sequence,
+                           [(device_id, *device) for device_id, device in devices.items()],
+                           [(device_id, epoch_us, sequence) for (device_id, epoch_us), sequence in keys.items()])
+            self.wal.truncate(end_sequence)
+            self.checkpoints += 1
+            self.last_duration_s = time.perf_counter() - start
+            return end_sequence
+
+    def start(self):
+        """Start taking checkpoints every `interval_s` seconds in a background thread."""
+        if self.interval_s > 0 and self._thread is None:
+            self._thread = Thread(target=self._run, name="checkpointer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        """Take a checkpoint every `interval_s` seconds until stopped, if records were appended since the last."""
+        while not self._stopped.wait(self.interval_s):
+            if len(self.wal):
+                self.checkpoint()
+
+    def stop(self):
+        """Stop the periodic checkpoints."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def stats(self) -> dict:
+        """
+        Report the checkpoints taken.
+
+        Returns:
+            dict: The snapshot path, the number of checkpoints and the duration of the last one.
+        """
+        return {"path": self.path, "checkpoints": self.checkpoints, "last_duration_s": self.last_duration_s}
+
+
+class SnapshotBackedDeviceStore(DeviceStoreIface):
+    """
+    Device store serving the devices of a snapshot lazily on top of a live store.
+
+    A device of the snapshot is copied into the live store the first time it is looked up, so the service can
+    answer as soon as the snapshot is mapped. Devices of the snapshot that are not loaded yet still count against
+    the capacity of the live store.
+
+    Attributes:
+        live (DeviceStoreIface): The store holding the loaded and new devices.
+        snapshot (SnapshotReader): The snapshot the devices are loaded from.
+    """
+
+    def __init__(self, live: DeviceStoreIface, snapshot: SnapshotReader):
+        """
+        Initialize the SnapshotBackedDeviceStore.
+
+        Args:
+            live (DeviceStoreIface): The store holding the loaded and new devices. It must have a `capacity`.
+            snapshot (SnapshotReader): The snapshot the devices are loaded from.
+        """
+        self.live = live
+        self.snapshot = snapshot
+        self.unloaded = snapshot.num_devices
+        self._lock = Lock()  # Serialises loading and creating devices while devices are unloaded
+
+    @property
+    def store_id(self) -> str:
+        """Identifies the contents of the live store."""
+        return self.live.store_id
+
+    def _load(self, device_id: uuid.UUID) -> Optional[DeviceReadingIface]:
+        """
+        Copy a device of the snapshot into the live store. Must be called with the lock held.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+
+        Returns:
+            Optional[DeviceReadingIface]: The loaded device reading, or None if the device is not in the snapshot.
+        """
+        record = self.snapshot.find_device(device_id.bytes)
+        if record is None:
+            return None
+        _, total_count, latest_epoch_us, utc_offset = record
+        device_reading = self.live.get_or_create_device_reading(device_id)
+        device_reading.increment_count(total_count)
+        device_reading.update_latest_timestamp(from_epoch_us(latest_epoch_us, utc_offset))
+        self.unloaded -= 1
+        return device_reading
+
+    def get_or_create_device_reading(self, device_id: uuid.UUID) -> DeviceReadingIface:
+        """
+        Retrieve the device reading for the specified device, loading or creating it if needed.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+
+        Returns:
+            DeviceReadingIface: The device reading for the specified device.
+
+        Raises:
+            ValueError: If the device is new and the store is full.
+        """
+        device_reading = self.live.get_device_reading(device_id)
+        if device_reading is not None or not self.unloaded:
+            return device_reading or self.live.get_or_create_device_reading(device_id)
+        with self._lock:
+            device_reading = self.live.get_device_reading(device_id) or self._load(device_id)
+            if device_reading is None:
+                full = len(self.live) + self.unloaded >= self.live.capacity
+                # An evicting live store makes room itself, evicting devices instead of rejecting new ones
+                if full and not isinstance(self.live, EvictingDeviceStore):
+                    raise ValueError("Capacity exceeded")
+                device_reading = self.live.get_or_create_device_reading(device_id)
+        return device_reading
+
+    def get_device_reading(self, device_id: uuid.UUID) -> DeviceReadingIface:
+        """
+        Retrieve the device reading for the specified device, loading it from the snapshot if needed.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+
+        Returns:
+            DeviceReadingIface: The device reading, or None if it does not exist.
+        """
+        device_reading = self.live.get_device_reading(device_id)
+        if device_reading is not None or not self.unloaded:
+            return device_reading
+        with self._lock:
+            return self.live.get_device_reading(device_id) or self._load(device_id)
+
+    def scan_devices(self, cursor: int, count: int) -> Tuple[int, List[uuid.UUID]]:
+        """
+        Return a page of the devices of the store, loading every device of the snapshot on the first call.
+
+        Args:
+            cursor (int): The cursor returned by the previous call, or 0 to start.
+            count (int): The maximum number of devices to return.
+
+        Returns:
+            Tuple[int, List[uuid.UUID]]: The cursor of the next page, or 0 once the scan is complete, and the
+            unique identifiers of the devices of the page.
+        """
+        if self.unloaded:
+            with self._lock:
+                for device_bytes, *_ in self.snapshot.devices():
+                    device_id = uuid.UUID(bytes=device_bytes)
+                    if self.live.get_device_reading(device_id) is None:
+                        self._load(device_id)
+        return self.live.scan_devices(cursor, count)
+
+    def clear(self):
+        """Clear the live store and forget the devices of the snapshot."""
+        with self._lock:
+            self.live.clear()
+            self.unloaded = 0
+            self.snapshot = _EMPTY_SNAPSHOT
+
+
+class SnapshotBackedTimestampStore(TimeStampStoreIface):
+    """
+    Timestamp store that also rejects the dedupe keys of a snapshot, in front of a live store.
+
+    The keys of the snapshot are looked up by binary search in the mapped file and are never evicted. They are
+    superseded by the keys of the next snapshot once the service restarts.
+
+    Attributes:
+        live (TimeStampStoreIface): The store for readings not in the snapshot.
+        snapshot (SnapshotReader): The snapshot holding the dedupe keys.
+    """
+
+    def __init__(self, live: TimeStampStoreIface, snapshot: SnapshotReader):
+        """
+        Initialize the SnapshotBackedTimestampStore.
+
+        Args:
+            live (TimeStampStoreIface): The store for readings not in the snapshot.
+            snapshot (SnapshotReader): The snapshot holding the dedupe keys.
+        """
+        self.live = live
+        self.snapshot = snapshot
+
+    def check_and_add_timestamp(self, device_id: uuid.UUID, timestamp: int) -> bool:
+        """
+        Check if a timestamp is present in the snapshot or the live store, and add it to the live store if not.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            timestamp (int): The timestamp in integer Unix epoch microseconds.
+
+        Returns:
+            bool: True if the timestamp was added, False if it was already present.
+        """
+        if self.snapshot.contains_key(device_id.bytes, timestamp):
+            return False
+        return self.live.check_and_add_timestamp(device_id, timestamp)
+
+    def stats(self) -> dict:
+        """
+        Report the statistics of the live store and the number of keys of the snapshot.
+
+        Returns:
+            dict: The statistics of the live store, with the number of snapshot keys.
+        """
+        return {**self.live.stats(), "snapshot_keys": self.snapshot.num_keys}
+
+    def clear(self):
+        """Clear the live store and forget the keys of the snapshot."""
+        self.live.clear()
+        self.snapshot = _EMPTY_SNAPSHOT
+
+
+class _EmptySnapshot:
+    """Stand-in for a snapshot without any device or key, used once a snapshot-backed store is cleared."""
+    num_devices = 0
+    num_keys = 0
+
+    @staticmethod
+    def find_device(device_id: bytes) -> None:
+        return None
+
+    @staticmethod
+    def contains_key(device_id: bytes, epoch_us: int) -> bool:
+        return False
+
+
+_EMPTY_SNAPSHOT = _EmptySnapshot()
+
+
+def create_checkpointer(settings, wal: Optional[WriteAheadLog]) -> Optional[Checkpointer]:
+    """
+    Create the checkpointer configured by the SNAPSHOT settings and start its periodic checkpoints.
+
+    Periodic checkpoints are stopped when the interpreter exits.
+
+    Args:
+        settings (Settings): The settings instance to read the snapshot options from.
+        wal (WriteAheadLog): The write-ahead log the snapshots are built from.
+
+    Returns:
+        Optional[Checkpointer]: The checkpointer, or None if there is no log or snapshots are disabled.
+    """
+    if wal is None or not settings.SNAPSHOT_ENABLED:
+        return None
+    checkpointer = Checkpointer(wal, settings.SNAPSHOT_PATH, key_capacity=settings.TIMESTAMP_STORE_CAPACITY,
+                                interval_s=settings.SNAPSHOT_INTERVAL_S)
+    checkpointer.start()
+    atexit.register(checkpointer.stop)
+    return checkpointer
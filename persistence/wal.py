@@ -0,0 +1,338 @@
+import atexit
+import os
+import struct
+import time
+import zlib
+from threading import Condition, Lock, Thread
+from typing import Iterator, List, Optional, Tuple
+
+# Fsync policies, selected with the WAL_FSYNC_POLICY setting.
+FSYNC_ALWAYS = "always"
+FSYNC_GROUP = "group"
+FSYNC_NONE = "none"
+
+# File header: magic bytes and the sequence number of the first record in the file.
+HEADER = struct.Struct("<8sq")
+MAGIC = b"DRWAL001"
+
+# Record of one accepted reading: device UUID bytes, epoch microseconds, count, UTC offset in seconds (or
+# NAIVE_OFFSET) and the CRC32 of the preceding fields. Records have a fixed size, so a torn tail can be cut off
+# by size alone and a corrupt record can be skipped without losing the records after it.
+RECORD = struct.Struct("<16sqqiI")
+_RECORD_BODY = struct.Struct("<16sqqi")
+
+# Range of the counts a record holds, a signed 64-bit integer.
+COUNT_MIN = -2 ** 63
+COUNT_MAX = 2 ** 63 - 1
+
+# An accepted reading, as written to and read from the log: (device UUID bytes, epoch_us, count, utc_offset).
+WalRecord = Tuple[bytes, int, int, int]
+
+
+def fsync_directory(path: str):
+    """
+    Fsync the directory of a file, so that a file created or renamed in it is durable.
+
+    Args:
+        path (str): The path of the file.
+    """
+    fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _pack(record: WalRecord) -> bytes:
+    """Pack a reading into a log record with its checksum."""
+    body = _RECORD_BODY.pack(*record)
+    return body + struct.pack("<I", zlib.crc32(body))
+
+
+class WriteAheadLog:
+    """
+    Append-only log of the readings accepted by the service, replayed on startup to rebuild the stores.
+
+    Records have a fixed binary layout (see RECORD) and are numbered by a sequence number. `append` writes
+    records to the file buffer and returns the sequence number following them, and `commit` makes them
+    durable according to `fsync_policy`:
+
+    - "always" flushes and fsyncs on every commit.
+    - "group" waits for a flusher thread that fsyncs at most once every `group_commit_ms` milliseconds, so
+      concurrent requests share one fsync.
+    - "none" flushes to the operating system without fsync, so records survive a crash of the process but
+      not of the machine.
+
+    Attributes:
+        path (str): The path of the log file.
+        fsync_policy (str): "always", "group" or "none".
+        group_commit_ms (float): The interval between fsyncs with the "group" policy.
+        base_sequence (int): The sequence number of the first record in the file.
+        next_sequence (int): The sequence number of the next record appended.
+        corrupt_records (int): The number of records skipped during replay because of a bad checksum.
+        fsyncs (int): The number of fsyncs done.
+    """
+
+    def __init__(self, path: str, fsync_policy=FSYNC_GROUP, group_commit_ms=5.0):
+        """
+        Open the log, creating it if needed and cutting off any partially written record at its end.
+
+        Args:
+            path (str): The path of the log file.
+            fsync_policy (str): "always", "group" or "none". Defaults to "group".
+            group_commit_ms (float): The interval between fsyncs with the "group" policy. Defaults to 5.
+
+        Raises:
+            ValueError: If the policy is unknown or the file is not a log.
+        """
+        if fsync_policy not in (FSYNC_ALWAYS, FSYNC_GROUP, FSYNC_NONE):
+            raise ValueError(f"Unknown fsync policy: {fsync_policy}")
+        self.path = path
+        self.fsync_policy = fsync_policy
+        self.group_commit_ms = group_commit_ms
+        self.corrupt_records = 0
+        self.fsyncs = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a+b")
+        self._file.seek(0, os.SEEK_END)
+        size = self._file.tell()
+        if size < HEADER.size:
+            self._file.truncate(0)
+            self._file.write(HEADER.pack(MAGIC, 0))
+            self._file.flush()
+            size = HEADER.size
+        self._file.seek(0)
+        magic, self.base_sequence = HEADER.unpack(self._file.read(HEADER.size))
+        if magic != MAGIC:
+            self._file.close()
+            raise ValueError(f"Not a write-ahead log: {path}")
+
+        num_records, torn = divmod(size - HEADER.size, RECORD.size)
+        if torn:
+            # The last record was only partially written before a crash
+            self._file.truncate(HEADER.size + num_records * RECORD.size)
+        self._file.seek(0, os.SEEK_END)
+        self.next_sequence = self.base_sequence + num_records
+
+        self._lock = Lock()  # Serialises writes to the file buffer
+        self._synced = Condition(Lock())
+        self._synced_sequence = self.next_sequence
+        self._requested_sequence = self.next_sequence
+        self._closed = False
+        self._flusher = None
+        if fsync_policy == FSYNC_GROUP:
+            self._flusher = Thread(target=self._run_flusher, name="wal-flusher", daemon=True)
+            self._flusher.start()
+
+    def __repr__(self):
+        """
+        Return a string representation of the log.
+
+        Returns:
+            str: A string representing the current state of the log.
+        """
+        return f"WriteAheadLog(path={self.path!r}, fsync_policy={self.fsync_policy}, records={len(self)})"
+
+    def __len__(self):
+        """Return the number of records in the file."""
+        return self.next_sequence - self.base_sequence
+
+    def append(self, records: List[WalRecord]) -> int:
+        """
+        Write records to the file buffer. They are not durable until `commit` returns.
+
+        Args:
+            records (List[WalRecord]): The accepted readings.
+
+        Returns:
+            int: The sequence number following the last record, to pass to `commit`.
+        """
+        data = b"".join([_pack(record) for record in records])
+        with self._lock:
+            self._file.write(data)
+            self.next_sequence += len(records)
+            return self.next_sequence
+
+    def commit(self, sequence: int):
+        """
+        Make the records before the given sequence number durable according to the fsync policy.
+
+        Args:
+            sequence (int): The sequence number returned by `append`.
+        """
+        if self.fsync_policy == FSYNC_GROUP:
+            with self._synced:
+                self._requested_sequence = max(self._requested_sequence, sequence)
+                self._synced.notify_all()
+                self._synced.wait_for(lambda: self._synced_sequence >= sequence or self._closed)
+        else:
+            self._sync(fsync=self.fsync_policy == FSYNC_ALWAYS)
+
+    def _sync(self, fsync: bool):
+        """Flush the file buffer and optionally fsync, then wake up the commits waiting for it."""
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.flush()
+            sequence = self.next_sequence
+            # A duplicate descriptor stays valid if the file is swapped by `truncate` during the fsync
+            fd = os.dup(self._file.fileno()) if fsync else None
+        if fsync:
+            # Records appended while the fsync runs wait for the next one
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        with self._synced:
+            self.fsyncs += fsync
+            self._synced_sequence = max(self._synced_sequence, sequence)
+            self._synced.notify_all()
+
+    def _run_flusher(self):
+        """
+        Fsync the log when commits are waiting, at most once every `group_commit_ms` milliseconds.
+
+        Commits arriving while the flusher waits or fsyncs are made durable together by the next fsync.
+        """
+        interval = self.group_commit_ms / 1000
+        last_sync = 0.0
+        while True:
+            with self._synced:
+                self._synced.wait_for(lambda: self._requested_sequence > self._synced_sequence or self._closed)
+                if self._closed:
+                    return
+            delay = last_sync + interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            last_sync = time.monotonic()
+            self._sync(fsync=True)
+
+    def records(self, start_sequence: Optional[int] = None, end_sequence: Optional[int] = None) -> Iterator[WalRecord]:
+        """
+        Read the records of the log in order, skipping records with a bad checksum.
+
+        Args:
+            start_sequence (int): The sequence number of the first record to read. Defaults to the first record
+                in the file.
+            end_sequence (int): The sequence number after the last record to read. Defaults to the end of the
+                file.
+
+        Returns:
+            Iterator[WalRecord]: The accepted readings, as appended.
+        """
+        with self._lock:
+            self._file.flush()
+            base_sequence = self.base_sequence
+            if end_sequence is None:
+                end_sequence = self.next_sequence
+            # Opened under the lock so that `truncate` cannot swap the file in between
+            file = open(self.path, "rb")
+        start_sequence = base_sequence if start_sequence is None else max(start_sequence, base_sequence)
+        remaining = max(0, end_sequence - start_sequence)
+        with file:
+            file.seek(HEADER.size + (start_sequence - base_sequence) * RECORD.size)
+            while remaining:
+                chunk = file.read(RECORD.size * min(remaining, 4096))
+                # Ignore a record still being written at the end of the file
+                chunk = chunk[:len(chunk) - len(chunk) % RECORD.size]
+                if not chunk:
+                    break
+                remaining -= len(chunk) // RECORD.size
+                view = memoryview(chunk)
+                for offset, (device_id, epoch_us, count, utc_offset, crc) in zip(
+                        range(0, len(chunk), RECORD.size), RECORD.iter_unpack(chunk)):
+                    if zlib.crc32(view[offset:offset + _RECORD_BODY.size]) != crc:
+                        self.corrupt_records += 1
+                        continue
+                    yield device_id, epoch_us, count, utc_offset
+
+    def truncate(self, sequence: int):
+        """
+        Drop the records before the given sequence number, once they are covered by a snapshot.
+
+        The records from `sequence` onwards are copied to a new file, which atomically replaces the log.
+        Appends wait while the copy runs.
+
+        Args:
+            sequence (int): The sequence number of the first record to keep.
+        """
+        with self._lock:
+            sequence = min(sequence, self.next_sequence)
+            if sequence <= self.base_sequence:
+                return
+            self._file.flush()
+            with open(self.path, "rb") as file:
+                file.seek(HEADER.size + (sequence - self.base_sequence) * RECORD.size)
+                tail = file.read((self.next_sequence - sequence) * RECORD.size)
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "wb") as file:
+                file.write(HEADER.pack(MAGIC, sequence))
+                file.write(tail)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.path)
+            fsync_directory(self.path)
+            self._file.close()
+            self._file = open(self.path, "a+b")
+            self.base_sequence = sequence
+
+    def stats(self) -> dict:
+        """
+        Report the size and durability settings of the log.
+
+        Returns:
+            dict: The fsync policy, the number of records and bytes, the fsyncs done and the corrupt records.
+        """
+        return {
+            "fsync_policy": self.fsync_policy,
+            "records": len(self),
+            "bytes": HEADER.size + len(self) * RECORD.size,
+            "next_sequence": self.next_sequence,
+            "fsyncs": self.fsyncs,
+            "corrupt_records": self.corrupt_records,
+        }
+
+    def close(self):
+        """Make all appended records durable and close the log."""
+        if self._closed:
+            return
+        self._sync(fsync=self.fsync_policy != FSYNC_NONE)
+        with self._synced:
+            self._closed = True
+            self._synced.notify_all()
+        if self._flusher is not None:
+            self._flusher.join()
+        with self._lock:
+            self._file.close()
+
+
+def create_wal(settings) -> Optional[WriteAheadLog]:
+    """
+    Open the write-ahead log configured by the WAL settings, if WAL_ENABLED is set.
+
+    The log is closed when the interpreter exits, so buffered records are not lost. It is written and replayed
+    by the service of the sync handlers only, so it is refused in async mode rather than silently leaving the
+    readings of the shards of the async pipeline unlogged.
+
+    Args:
+        settings (Settings): The settings instance to read the log options from.
+
+    Returns:
+        Optional[WriteAheadLog]: The log, or None if it is disabled.
+
+    Raises:
+        ValueError: If the log is enabled with INGEST_MODE=async.
+    """
+    if not settings.WAL_ENABLED:
+        return None
+    # The name of the async ingest mode, INGEST_MODE_ASYNC of ingest_pipeline, which imports this module
+    if settings.INGEST_MODE == "async":
+        raise ValueError("WAL_ENABLED is not supported with INGEST_MODE=async: the readings of the shards of the "
+                         "async pipeline are not written to the write-ahead log")
+    wal = WriteAheadLog(settings.WAL_PATH, fsync_policy=settings.WAL_FSYNC_POLICY,
+                        group_commit_ms=settings.WAL_GROUP_COMMIT_MS)
+    atexit.register(wal.close)
+    return wal
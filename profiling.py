@@ -0,0 +1,476 @@
+import asyncio
+import atexit
+import cProfile
+import io
+import itertools
+import marshal
+import os
+import pstats
+import sys
+import time
+from collections import Counter, OrderedDict, deque
+from contextvars import ContextVar
+from functools import wraps
+from threading import Event, Lock, Thread, get_ident
+from typing import Callable, Dict, List, Optional
+
+from fastapi.routing import APIRoute
+
+from config import settings
+
+# Profiling of the running process, gated by the PROFILING settings. A request sent with the PROFILING_HEADER
+# header runs under cProfile, on the event loop and in the threadpool, and its profile is kept in pstats format.
+# The stack sampler reads the stacks of every thread at a fixed interval and aggregates those running the code of
+# the application as collapsed stacks, the input of flame graph tools.
+
+# Directory of the application, whose frames are the ones the sampler reports, and the files of the
+# instrumentation wrapping every request, which are not reported as application frames.
+APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+INSTRUMENTATION_FILES = ("metrics.py", "profiling.py")
+
+# Profile of the request being handled, set by ProfilingMiddleware for the requests to profile.
+_current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("current_profile", default=None)
+
+
+class RequestProfile:
+    """
+    cProfile profiles of a single request, one per thread the request ran on.
+
+    cProfile only records the thread it is enabled on, so the event loop and each threadpool thread running part
+    of the request get a profile of their own, merged when the request is complete.
+
+    Attributes:
+        id (int): The identifier of the profile.
+        method (str): The HTTP method of the request.
+        path (str): The path of the request.
+        started (float): The Unix time the request started at.
+        duration_s (float): The duration of the request, once complete.
+    """
+
+    def __init__(self, id: int, method: str, path: str):
+        """
+        Initialize the RequestProfile.
+
+        Args:
+            id (int): The identifier of the profile.
+            method (str): The HTTP method of the request.
+            path (str): The path of the request.
+        """
+        self.id = id
+        self.method = method
+        self.path = path
+        self.started = time.time()
+        self.duration_s = 0.0
+        self.profiles: List[cProfile.Profile] = []
+        self._lock = Lock()
+
+    def thread_profile(self) -> cProfile.Profile:
+        """
+        Return a new profile for the calling thread, merged into the request profile once complete.
+
+        Returns:
+            cProfile.Profile: The profile, to enable and disable on the calling thread.
+        """
+        profile = cProfile.Profile()
+        with self._lock:
+            self.profiles.append(profile)
+        return profile
+
+    def dump(self) -> bytes:
+        """
+        Merge the profiles of every thread in the format of `pstats.Stats.dump_stats`.
+
+        Returns:
+            bytes: The merged statistics, readable with `pstats.Stats(path)` once written to a file.
+        """
+        with self._lock:
+            profiles = list(self.profiles)
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return marshal.dumps(stats.stats)
+
+    def summary(self) -> dict:
+        """Return the identifier, request and timing of the profile."""
+        return {"id": self.id, "method": self.method, "path": self.path, "started": self.started,
+                "duration_ms": round(self.duration_s * 1000, 3)}
+
+
+class ProfileStore:
+    """
+    The most recent request profiles, in pstats format.
+
+    Attributes:
+        capacity (int): The maximum number of profiles kept. The oldest profile is dropped first.
+    """
+
+    def __init__(self, capacity=20):
+        """
+        Initialize the ProfileStore.
+
+        Args:
+            capacity (int): The maximum number of profiles kept. Defaults to 20.
+        """
+        self.capacity = capacity
+        self._profiles: "OrderedDict[int, tuple]" = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = Lock()
+
+    def new_profile(self, method: str, path: str) -> RequestProfile:
+        """Return a RequestProfile with a new identifier."""
+        return RequestProfile(next(self._ids), method, path)
+
+    def add(self, profile: RequestProfile):
+        """
+        Keep the merged statistics of a complete request profile, dropping the oldest profile if needed.
+
+        Args:
+            profile (RequestProfile): The profile of a complete request.
+        """
+        entry = (profile.summary(), profile.dump())
+        with self._lock:
+            self._profiles[profile.id] = entry
+            while len(self._profiles) > self.capacity:
+                self._profiles.popitem(last=False)
+
+    def get(self, profile_id: int) -> (Optional[bytes], str):
+        """
+        Return the statistics of a profile in pstats format.
+
+        Args:
+            profile_id (int): The identifier of the profile.
+
+        Returns:
+            (Optional[bytes], str): The statistics, and an error message if the profile is not kept.
+        """
+        entry = self._profiles.get(profile_id)
+        if entry is None:
+            return None, f"Profile {profile_id} not found"
+        return entry[1], ""
+
+    def list(self) -> List[dict]:
+        """Return the summary of each profile kept, most recent first."""
+        with self._lock:
+            return [summary for summary, _ in reversed(self._profiles.values())]
+
+    def clear(self):
+        """Drop every profile."""
+        with self._lock:
+            self._profiles.clear()
+
+
+def format_pstats(data: bytes, sort="cumulative", limit=50) -> str:
+    """
+    Format statistics in pstats format as the text report of `pstats.Stats.print_stats`.
+
+    Args:
+        data (bytes): The statistics, as returned by `ProfileStore.get`.
+        sort (str): The pstats sort key. Defaults to "cumulative".
+        limit (int): The maximum number of functions listed. Defaults to 50.
+
+    Returns:
+        str: The report.
+    """
+    stream = io.StringIO()
+    stats = pstats.Stats(_MarshalledStats(data), stream=stream)
+    stats.sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
+
+
+class _MarshalledStats:
+    """Adapter loading statistics in pstats format into `pstats.Stats`, which accepts objects with create_stats."""
+
+    def __init__(self, data: bytes):
+        self.stats = marshal.loads(data)
+
+    def create_stats(self):
+        pass
+
+
+def profiled(fn: Callable) -> Callable:
+    """
+    Wrap a sync function so that, when called for a profiled request, it runs under a profile of its own thread.
+
+    Functions run in the threadpool are not recorded by the profile of the event loop, so the sync handlers and
+    the service calls handed to the threadpool are wrapped. Outside of a profiled request the wrapper only reads
+    a context variable.
+
+    Args:
+        fn (Callable): The function.
+
+    Returns:
+        Callable: The wrapped function, with the signature of `fn`.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        request_profile = _current_profile.get()
+        if request_profile is None or sys.getprofile() is not None:
+            # Not profiled, or already profiled on this thread
+            return fn(*args, **kwargs)
+        profile = request_profile.thread_profile()
+        profile.enable()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.disable()
+    return wrapper
+
+
+def _is_async(fn: Callable) -> bool:
+    """Return whether an endpoint is awaited on the event loop by FastAPI, instead of run in the threadpool."""
+    return asyncio.iscoroutinefunction(fn) or asyncio.iscoroutinefunction(getattr(fn, "__call__", None))
+
+
+class ProfiledRoute(APIRoute):
+    """Route whose sync endpoint is profiled in the threadpool for profiled requests, see `profiled`."""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        if not _is_async(endpoint):
+            endpoint = profiled(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware running the requests sent with the profiling header under cProfile.
+
+    The id of the profile is returned in the same header of the response, and the profile is kept in the store
+    once the response is complete. One request is profiled at a time: a request sent with the header while
+    another is profiled is served without a profile. The profile of the event loop also records the work of the
+    other requests it served while the profiled request was waiting.
+    """
+
+    def __init__(self, app, store: ProfileStore, header: str = "X-Profile"):
+        """
+        Initialize the middleware.
+
+        Args:
+            app: The ASGI application.
+            store (ProfileStore): The store the profiles are kept in.
+            header (str): The header requesting a profile. Defaults to "X-Profile".
+        """
+        self.app = app
+        self.store = store
+        self.header = header.lower().encode()
+        self._active = Lock()  # Held while a request is profiled
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not any(name == self.header for name, _ in scope["headers"]):
+            await self.app(scope, receive, send)
+            return
+        if not self._active.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            request_profile = self.store.new_profile(scope["method"], scope["path"])
+            profile_id = str(request_profile.id).encode()
+
+            async def send_with_id(message):
+                if message["type"] == "http.response.start":
+                    message["headers"] = list(message.get("headers", [])) + [(self.header, profile_id)]
+                await send(message)
+
+            token = _current_profile.set(request_profile)
+            profile = request_profile.thread_profile()
+            start = time.perf_counter()
+            profile.enable()
+            try:
+                await self.app(scope, receive, send_with_id)
+            finally:
+                profile.disable()
+                request_profile.duration_s = time.perf_counter() - start
+                _current_profile.reset(token)
+                self.store.add(request_profile)
+        finally:
+            self._active.release()
+
+
+class StackSampler:
+    """
+    Sampling profiler aggregating the stacks of the application as collapsed stacks.
+
+    A background thread reads the stacks of every thread every `interval_s` seconds with `sys._current_frames`.
+    Stacks without a frame of the application (idle threadpool threads, the event loop waiting for I/O) are
+    skipped, and the others are cut above the outermost frame of the application, so they start at the handler
+    in main.py and end in the store method or library call running. The metrics and profiling middlewares wrap
+    every request, so they are not counted as application frames. The sampler thread needs the GIL to take a
+    sample, so a thread running Python code is sampled at most once per switch interval (5 ms by default). Counts are aggregated over windows of
+    `window_s` seconds, the last `windows` of which are kept and, with a dump directory, written to it as
+    `stacks-<time>.folded` files.
+
+    Attributes:
+        interval_s (float): The time between two samples.
+        window_s (float): The duration of an aggregation window.
+        dump_dir (str): The directory the windows are written to, or an empty string.
+        samples (int): The number of samples taken.
+    """
+
+    def __init__(self, interval_s=0.01, window_s=60.0, windows=10, dump_dir="", root=APP_ROOT,
+                 exclude=INSTRUMENTATION_FILES):
+        """
+        Initialize the StackSampler.
+
+        Args:
+            interval_s (float): The time between two samples. Defaults to 0.01.
+            window_s (float): The duration of an aggregation window. Defaults to 60.
+            windows (int): The number of complete windows kept. Defaults to 10.
+            dump_dir (str): The directory the windows are written to. Defaults to none.
+            root (str): The directory of the code of the application. Defaults to APP_ROOT.
+            exclude (Tuple[str, ...]): The files of the directory that are not application code, relative to it.
+                Defaults to INSTRUMENTATION_FILES.
+        """
+        self.interval_s = interval_s
+        self.window_s = window_s
+        self.dump_dir = dump_dir
+        self.root = os.path.join(os.path.abspath(root), "")
+        self.exclude = frozenset(exclude)
+        self.samples = 0
+        self.windows = deque(maxlen=windows)
+        self._current = Counter()
+        self._window_start = time.time()
+        self._labels: Dict[object, tuple] = {}  # Label and application flag of each code object seen
+        self._lock = Lock()
+        self._stopped = Event()
+        self._thread = None
+
+    def _label(self, code) -> tuple:
+        """Return the label of a code object in the stacks, and whether it is code of the application."""
+        label = self._labels.get(code)
+        if label is None:
+            filename = code.co_filename
+            is_app = filename.startswith(self.root) and "site-packages" not in filename
+            name = filename[len(self.root):] if is_app else os.path.basename(filename)
+            is_app = is_app and name not in self.exclude
+            # co_qualname is only available from Python 3.11
+            qualname = getattr(code, "co_qualname", code.co_name)
+            label = self._labels[code] = (f"{name}:{qualname}", is_app)
+        return label
+
+    def collapse(self, frame) -> Optional[str]:
+        """
+        Return the stack of a frame as a collapsed stack, from the outermost frame of the application to the frame.
+
+        Args:
+            frame: The innermost frame of the stack.
+
+        Returns:
+            Optional[str]: The labels of the frames separated by semicolons, or None without a frame of the
+            application.
+        """
+        labels = []
+        outermost = -1
+        while frame is not None:
+            label, is_app = self._label(frame.f_code)
+            if is_app:
+                outermost = len(labels)
+            labels.append(label)
+            frame = frame.f_back
+        if outermost < 0:
+            return None
+        return ";".join(reversed(labels[:outermost + 1]))
+
+    def sample(self):
+        """Add the stacks of every other thread running code of the application to the current window."""
+        own = get_ident()
+        stacks = [self.collapse(frame) for thread_id, frame in sys._current_frames().items() if thread_id != own]
+        with self._lock:
+            self.samples += 1
+            for stack in stacks:
+                if stack is not None:
+                    self._current[stack] += 1
+
+    def rotate(self):
+        """Close the current window, keeping it with the last windows and writing it to the dump directory."""
+        with self._lock:
+            window = (self._window_start, time.time(), self._current)
+            self._current = Counter()
+            self._window_start = window[1]
+            self.windows.append(window)
+        if self.dump_dir:
+            os.makedirs(self.dump_dir, exist_ok=True)
+            name = time.strftime("stacks-%Y%m%dT%H%M%S.folded", time.gmtime(window[0]))
+            with open(os.path.join(self.dump_dir, name), "w") as f:
+                f.write(_format_collapsed(window[2]))
+
+    def collapsed(self, windows: Optional[int] = None) -> str:
+        """
+        Return the stacks sampled in the current window and the last complete windows, in collapsed format.
+
+        Args:
+            windows (Optional[int]): The number of complete windows included. Defaults to every window kept.
+
+        Returns:
+            str: One `stack count` line per distinct stack, most sampled first.
+        """
+        with self._lock:
+            kept = list(self.windows)
+            total = Counter(self._current)
+        if windows is not None:
+            kept = kept[len(kept) - windows:] if windows > 0 else []
+        for _, _, counts in kept:
+            total.update(counts)
+        return _format_collapsed(total)
+
+    def stats(self) -> dict:
+        """
+        Report the sampling.
+
+        Returns:
+            dict: The sample interval, the number of samples and the start and end of the windows kept.
+        """
+        return {"interval_ms": self.interval_s * 1000, "samples": self.samples,
+                "windows": [{"start": start, "end": end} for start, end, _ in self.windows]}
+
+    def start(self):
+        """Start sampling in a background thread."""
+        if self._thread is None:
+            self._thread = Thread(target=self._run, name="stack-sampler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        """Take a sample every `interval_s` seconds and close a window every `window_s` seconds, until stopped."""
+        next_rotation = time.monotonic() + self.window_s
+        while not self._stopped.wait(self.interval_s):
+            self.sample()
+            if time.monotonic() >= next_rotation:
+                self.rotate()
+                next_rotation += self.window_s
+
+    def stop(self):
+        """Stop sampling."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def _format_collapsed(counts: Counter) -> str:
+    """Format stack counts as collapsed stacks, most sampled first."""
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+def create_stack_sampler(settings) -> Optional[StackSampler]:
+    """
+    Create the stack sampler configured by the PROFILING settings and start it.
+
+    The sampler is stopped when the interpreter exits.
+
+    Args:
+        settings (Settings): The settings instance to read the profiling options from.
+
+    Returns:
+        Optional[StackSampler]: The sampler, or None if it is disabled.
+    """
+    if not settings.PROFILING_SAMPLER_ENABLED:
+        return None
+    sampler = StackSampler(interval_s=settings.PROFILING_SAMPLE_INTERVAL_MS / 1000,
+                           window_s=settings.PROFILING_WINDOW_S, windows=settings.PROFILING_WINDOWS,
+                           dump_dir=settings.PROFILING_DUMP_DIR)
+    sampler.start()
+    atexit.register(sampler.stop)
+    return sampler
+
+
+# Initialize the store of request profiles and the stack sampler, if enabled.
+request_profiles = ProfileStore(capacity=settings.PROFILING_MAX_PROFILES)
+stack_sampler = create_stack_sampler(settings)
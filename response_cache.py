@@ -0,0 +1,132 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Hashable, Optional
+
+from fastapi import Response, status
+
+from config import settings
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Check whether an If-None-Match header matches an entity tag, with the weak comparison of RFC 9110.
+
+    Args:
+        if_none_match (Optional[str]): The value of the header, a list of entity tags or "*".
+        etag (str): The entity tag of the current representation.
+
+    Returns:
+        bool: True if the client already holds the current representation.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+class ResponseCache:
+    """
+    Pre-serialized JSON bodies of device reads, so that polling an unchanged device costs no JSON encoding.
+
+    A body is cached with the version of the device it was rendered from, and is only served for that version:
+    an update of the device bumps its version, so the next read renders and caches a new body. Only the body of
+    the latest version is kept per device and endpoint, and the least recently used entries are evicted beyond
+    the capacity. The version is also sent as the ETag, so clients polling with If-None-Match get a
+    304 Not Modified without a body while the device is unchanged.
+
+    Attributes:
+        capacity (int): The maximum number of cached bodies. 0 disables the cache, but not the ETags.
+    """
+
+    def __init__(self, capacity=10000):
+        """
+        Initialize an empty ResponseCache.
+
+        Args:
+            capacity (int): The maximum number of cached bodies. Defaults to 10000.
+        """
+        self.capacity = capacity
+        self._lock = Lock()  # Guards the entries and the counters
+        self._init_cache()
+
+    def _init_cache(self):
+        """Initialize/Reset the entries and the counters."""
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def _get_body(self, key: Hashable, version: str, render: Callable[[], bytes]) -> bytes:
+        """Return the cached body of a key at a version, rendering and caching it on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        # Rendered outside the lock. The values read may be newer than the version, never older, since versions
+        # are bumped after the values are updated.
+        body = render()
+        if self.capacity:
+            with self._lock:
+                self._entries[key] = (version, body)
+                self._entries.move_to_end(key)
+                if len(self._entries) > self.capacity:
+                    self._entries.popitem(last=False)
+        return body
+
+    def respond(self, key: Hashable, version: str, if_none_match: Optional[str],
+                render: Callable[[], bytes]) -> Response:
+        """
+        Build the response of a read at a version, from the cache when possible.
+
+        Args:
+            key (Hashable): Identifies the endpoint and the device read.
+            version (str): The version of the device, as returned by `DeviceStoreIface.get_device_version`.
+            if_none_match (Optional[str]): The If-None-Match header of the request, if any.
+            render (Callable[[], bytes]): Reads the device and returns the JSON body, on a miss.
+
+        Returns:
+            Response: A 304 Not Modified response if the client holds the version, or a 200 response with the body,
+            both with the version as ETag.
+        """
+        etag = f'"{version}"'
+        if etag_matches(if_none_match, etag):
+            with self._lock:
+                self.not_modified += 1
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        return Response(content=self._get_body(key, version, render), media_type="application/json",
+                        headers={"ETag": etag})
+
+    def stats(self) -> dict:
+        """
+        Report the usage of the cache.
+
+        Returns:
+            dict: The number of cached bodies, the capacity, the hits, misses and 304 responses, the hit rate of
+            the cache and the share of reads answered with a 304.
+        """
+        with self._lock:
+            hits, misses, not_modified = self.hits, self.misses, self.not_modified
+            size = len(self._entries)
+        reads = hits + misses + not_modified
+        return {
+            "size": size,
+            "capacity": self.capacity,
+            "hits": hits,
+            "misses": misses,
+            "not_modified": not_modified,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "not_modified_rate": not_modified / reads if reads else 0.0,
+        }
+
+    def clear(self):
+        """Drop every cached body and reset the counters."""
+        with self._lock:
+            self._init_cache()
+
+
+# Initialize the response cache shared by the read handlers with the configured capacity.
+response_cache = ResponseCache(capacity=settings.RESPONSE_CACHE_CAPACITY)
@@ -0,0 +1,286 @@
+import math
+import uuid
+from collections import deque
+from hashlib import blake2b
+from threading import Lock
+from typing import List
+from .ts_store import TimeStampStoreIface
+
+# Policies for readings the filter reports as possibly seen.
+HIT_POLICY_REJECT = "reject"
+HIT_POLICY_EXACT = "exact"
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over byte string keys.
+
+    The filter is sized for `capacity` keys at a false-positive rate of `fpr`. Bit positions are derived from
+    a single 128-bit blake2b digest with double hashing.
+
+    Attributes:
+        num_bits (int): The number of bits in the filter.
+        num_hashes (int): The number of bit positions set per key.
+        count (int): The number of keys added.
+        set_bits (int): The number of bits currently set.
+    """
+
+    def __init__(self, capacity: int, fpr: float):
+        """
+        Initialize an empty BloomFilter.
+
+        Args:
+            capacity (int): The number of keys the filter is sized for.
+            fpr (float): The target false-positive rate once `capacity` keys have been added.
+        """
+        self.num_bits = max(8, math.ceil(-capacity * math.log(fpr) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+        self.set_bits = 0
+
+    def positions(self, key: bytes) -> List[int]:
+        """
+        Get the bit positions of a key.
+
+        Args:
+            key (bytes): The key.
+
+        Returns:
+            List[int]: The `num_hashes` bit positions of the key.
+        """
+        digest = blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        num_bits = self.num_bits
+        return [(h1 + i * h2) % num_bits for i in range(self.num_hashes)]
+
+    def contains(self, positions: List[int]) -> bool:
+        """
+        Check whether all the given bit positions are set.
+
+        Args:
+            positions (List[int]): The bit positions of a key.
+
+        Returns:
+            bool: False if the key was definitely never added, True if it possibly was.
+        """
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in positions)
+
+    def add(self, positions: List[int]):
+        """
+        Set the given bit positions.
+
+        Args:
+            positions (List[int]): The bit positions of a key.
+        """
+        bits = self.bits
+        for position in positions:
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                bits[position >> 3] |= mask
+                self.set_bits += 1
+        self.count += 1
+
+    def fill_ratio(self) -> float:
+        """Return the fraction of bits that are set."""
+        return self.set_bits / self.num_bits
+
+    def estimated_fpr(self) -> float:
+        """Return the false-positive rate estimated from the current fill ratio."""
+        return self.fill_ratio() ** self.num_hashes
+
+
+class RotatingBloomFilter:
+    """
+    Bloom filter made of generations, so that old keys age out.
+
+    Keys are added to the newest generation. Once it holds `capacity` keys, a new empty generation is started
+    and, when there are more than `generations`, the oldest one is dropped with all its keys. A key is
+    therefore remembered for between `capacity * (generations - 1)` and `capacity * generations` insertions.
+    Lookups check every generation, so each generation is sized for `fpr / generations` to keep the overall
+    false-positive rate within `fpr`.
+
+    Attributes:
+        capacity (int): The number of keys per generation.
+        fpr (float): The overall false-positive budget.
+        max_generations (int): The number of generations kept.
+        rotations (int): The number of times a new generation was started.
+    """
+
+    def __init__(self, capacity: int, fpr: float, generations: int):
+        """
+        Initialize the RotatingBloomFilter with a single empty generation.
+
+        Args:
+            capacity (int): The number of keys per generation.
+            fpr (float): The overall false-positive budget.
+            generations (int): The number of generations kept.
+        """
+        self.capacity = capacity
+        self.fpr = fpr
+        self.max_generations = generations
+        self._generation_fpr = 1 - (1 - fpr) ** (1 / generations)
+        self.generations = deque([self._new_generation()])
+        self.rotations = 0
+
+    def _new_generation(self) -> BloomFilter:
+        """Create an empty generation."""
+        return BloomFilter(self.capacity, self._generation_fpr)
+
+    def check_and_add(self, key: bytes) -> bool:
+        """
+        Check whether a key was possibly added before and add it to the newest generation if not.
+
+        Args:
+            key (bytes): The key.
+
+        Returns:
+            bool: True if the key was possibly added before, False if it was definitely new and has been added.
+        """
+        current = self.generations[-1]
+        # All generations have the same size, so they share the bit positions of a key
+        positions = current.positions(key)
+        if any(generation.contains(positions) for generation in self.generations):
+            return True
+
+        current.add(positions)
+        if current.count >= self.capacity:
+            self._rotate()
+        return False
+
+    def _rotate(self):
+        """Start a new generation and drop the oldest one if there are too many."""
+        self.generations.append(self._new_generation())
+        if len(self.generations) > self.max_generations:
+            self.generations.popleft()
+        self.rotations += 1
+
+    def fill_ratios(self) -> List[float]:
+        """Return the fill ratio of each generation, oldest first."""
+        return [generation.fill_ratio() for generation in self.generations]
+
+    def estimated_fpr(self) -> float:
+        """Return the overall false-positive rate estimated from the fill ratio of every generation."""
+        miss = 1.0
+        for generation in self.generations:
+            miss *= 1 - generation.estimated_fpr()
+        return 1 - miss
+
+
+class BloomTimestampStore(TimeStampStoreIface):
+    """
+    Timestamp store with a rotating Bloom filter tier in front of an exact store.
+
+    The filter remembers readings over a much longer horizon than an exact store could hold in the same memory.
+    A reading the filter has definitely not seen is new: it is added to the filter and accepted without a
+    lookup in the exact store. A reading the filter has possibly seen is handled by `hit_policy`:
+
+    - "reject" treats it as a duplicate. The exact store is never used, and new readings are wrongly rejected
+      at most at the configured false-positive rate.
+    - "exact" checks it against `exact_store`, so no new reading is ever rejected. Only filter hits reach the
+      exact store: a hit it does not hold is taken as a false positive, accepted and recorded there. This keeps
+      definite-new readings off the exact store, at the cost of exactness: the first resend of a reading is
+      accepted too, as its original was only recorded in the filter, and later resends are rejected while the
+      exact store still holds it.
+
+    Attributes:
+        exact_store (TimeStampStoreIface): The exact store behind the filter.
+        hit_policy (str): The policy for filter hits, "reject" or "exact".
+        bloom_filter (RotatingBloomFilter): The filter tier.
+        filter_hits (int): The number of readings the filter reported as possibly seen.
+    """
+
+    def __init__(self, exact_store: TimeStampStoreIface, capacity=1_000_000, fpr=0.001, generations=4,
+                 hit_policy=HIT_POLICY_REJECT):
+        """
+        Initialize the BloomTimestampStore.
+
+        Args:
+            exact_store (TimeStampStoreIface): The exact store behind the filter.
+            capacity (int): The number of readings per filter generation. Defaults to 1,000,000.
+            fpr (float): The overall false-positive budget of the filter. Defaults to 0.001.
+            generations (int): The number of filter generations kept. Defaults to 4.
+            hit_policy (str): "reject" or "exact". Defaults to "reject".
+
+        Raises:
+            ValueError: If the hit policy is unknown.
+        """
+        if hit_policy not in (HIT_POLICY_REJECT, HIT_POLICY_EXACT):
+            raise ValueError(f"Unknown hit policy: {hit_policy}")
+        self.exact_store = exact_store
+        self.capacity = capacity
+        self.fpr = fpr
+        self.num_generations = generations
+        self.hit_policy = hit_policy
+        self._lock = Lock()
+        self._init_store()
+
+    def _init_store(self):
+        """Initialize an empty filter tier."""
+        self.bloom_filter = RotatingBloomFilter(self.capacity, self.fpr, self.num_generations)
+        self.filter_hits = 0
+
+    def __repr__(self):
+        """
+        Return a string representation of the timestamp store.
+
+        Returns:
+            str: A string representing the current state of the store.
+        """
+        return f"BloomTimestampStore(exact_store={self.exact_store!r}, hit_policy={self.hit_policy})"
+
+    def check_and_add_timestamp(self, device_id: uuid.UUID, timestamp: int) -> bool:
+        """
+        Check if a timestamp is present for the device and add it if not.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            timestamp (int): The timestamp in integer Unix epoch microseconds.
+
+        Returns:
+            bool: True if the timestamp was added, False if it was already present or rejected by the filter.
+        """
+        key = device_id.bytes + timestamp.to_bytes(8, "little", signed=True)
+        with self._lock:
+            possibly_seen = self.bloom_filter.check_and_add(key)
+            if possibly_seen:
+                self.filter_hits += 1
+
+        if not possibly_seen:
+            return True
+        if self.hit_policy == HIT_POLICY_REJECT:
+            return False
+        # Recorded in the exact store only if it does not hold it yet
+        return self.exact_store.check_and_add_timestamp(device_id, timestamp)
+
+    def clear(self):
+        """Clear the filter and the exact store, resetting them to an empty state."""
+        with self._lock:
+            self._init_store()
+        self.exact_store.clear()
+
+    def stats(self) -> dict:
+        """
+        Report the filter sizing and usage, to help size it in production.
+
+        Returns:
+            dict: The filter configuration, fill ratio per generation, estimated false-positive rate and hits.
+        """
+        bloom_filter = self.bloom_filter
+        with self._lock:
+            return {
+                "backend": "bloom",
+                "hit_policy": self.hit_policy,
+                "capacity_per_generation": self.capacity,
+                "generations": len(bloom_filter.generations),
+                "max_generations": bloom_filter.max_generations,
+                "rotations": bloom_filter.rotations,
+                "bits_per_generation": bloom_filter.generations[-1].num_bits,
+                "fill_ratios": bloom_filter.fill_ratios(),
+                "target_fpr": self.fpr,
+                "estimated_fpr": bloom_filter.estimated_fpr(),
+                "filter_hits": self.filter_hits,
+                "exact_store": self.exact_store.stats(),
+            }
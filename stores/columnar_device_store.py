@@ -0,0 +1,223 @@
+import sys
+import uuid
+from array import array
+from threading import Lock
+from typing import List, Tuple
+
+from stores.device_store import DeviceReadingIface, DeviceStoreIface, ScanIndex, new_store_id
+from stores.epoch import NAIVE_OFFSET, from_epoch_us, to_epoch_us, utc_offset_seconds
+
+# Sentinel epoch value for devices without a reading yet.
+NO_TIMESTAMP = -2 ** 63
+
+
+class ColumnarDeviceReading(DeviceReadingIface):
+    """
+    Lightweight view over the slot of a device in a ColumnarDeviceStore.
+
+    The view holds no state of its own: counts and timestamps are read from and written to the columns of
+    the store.
+
+    Attributes:
+        device_id (uuid.UUID): The unique identifier of the device.
+    """
+    __slots__ = ("device_id", "_store", "_slot")
+
+    def __init__(self, store: "ColumnarDeviceStore", device_id: uuid.UUID, slot: int):
+        """
+        Initialize a view over a slot.
+
+        Args:
+            store (ColumnarDeviceStore): The store holding the columns.
+            device_id (uuid.UUID): The unique identifier of the device.
+            slot (int): The index of the device in the columns.
+        """
+        self.device_id = device_id
+        self._store = store
+        self._slot = slot
+
+    @property
+    def total_count(self) -> int:
+        """The cumulative count of readings for the device."""
+        return self._store._counts[self._slot]
+
+    @property
+    def latest_timestamp(self):
+        """The most recent timestamp when a reading was recorded, or None if there is no reading yet."""
+        epoch_us = self._store._latest[self._slot]
+        if epoch_us == NO_TIMESTAMP:
+            return None
+        return from_epoch_us(epoch_us, self._store._offsets[self._slot])
+
+    @property
+    def version(self) -> int:
+        """The number of updates of the count and latest timestamp."""
+        return self._store._versions[self._slot]
+
+    def increment_count(self, count):
+        """
+        Atomically increment the total count of readings by the given count.
+
+        Args:
+            count (int): The number of readings to add to the total count.
+        """
+        self._store._increment(self._slot, count)
+
+    def update_latest_timestamp(self, timestamp):
+        """
+        Atomically update the latest timestamp if the given timestamp is more recent.
+
+        Args:
+            timestamp (datetime.datetime): The new timestamp to set.
+        """
+        self._store._update_latest(self._slot, to_epoch_us(timestamp), utc_offset_seconds(timestamp))
+
+
+class ColumnarDeviceStore(DeviceStoreIface):
+    """
+    Device store holding device state in parallel typed columns instead of one object per device.
+
+    A dictionary maps each device UUID to a slot, and the state of the device lives at that slot in four
+    `array` columns: the total count and the latest timestamp as int64 epoch microseconds, the UTC offset
+    of that timestamp as int32 so it is returned as it was received, and the int64 version of the device.
+    Lookups return a small view object.
+    Updates are serialised by a lock striped by slot.
+
+    Attributes:
+        capacity (int): The maximum number of devices the store can hold.
+        stripes (int): The number of update locks.
+        rejections (int): The number of new devices refused because the store was full.
+    """
+
+    def __init__(self, capacity=100, stripes=16):
+        """
+        Initialize the ColumnarDeviceStore with a specified capacity.
+
+        Args:
+            capacity (int): The maximum number of devices to store.
+            stripes (int): The number of update locks. Defaults to 16.
+        """
+        self.capacity = capacity
+        self.stripes = stripes
+        self.rejections = 0
+        self._locks = [Lock() for _ in range(stripes)]
+        self._lock = Lock()  # Serialises the creation of new devices
+        self._init_store()
+
+    def _init_store(self):
+        """Initialize/Reset the index and the columns."""
+        self.store_id = new_store_id()
+        self.index = {}
+        self._scan_index = ScanIndex()
+        self._counts = array("q")
+        self._latest = array("q")
+        self._offsets = array("i")
+        self._versions = array("q")
+
+    def __len__(self):
+        """Return the number of devices in the store."""
+        return len(self.index)
+
+    def _increment(self, slot: int, count: int):
+        """Add to the total count of a slot."""
+        with self._locks[slot % self.stripes]:
+            self._counts[slot] += count
+            self._versions[slot] += 1
+
+    def _update_latest(self, slot: int, epoch_us: int, utc_offset: int):
+        """Set the latest timestamp of a slot if the given one is more recent."""
+        with self._locks[slot % self.stripes]:
+            if epoch_us > self._latest[slot]:
+                self._latest[slot] = epoch_us
+                self._offsets[slot] = utc_offset
+                self._versions[slot] += 1
+
+    def get_or_create_device_reading(self, device_id: uuid.UUID) -> DeviceReadingIface:
+        """
+        Retrieve a view over the slot of the specified device, creating the slot if it doesn't exist.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+
+        Returns:
+            DeviceReadingIface: The device reading view for the specified device.
+
+        Raises:
+            ValueError: If the device does not exist and the store is full.
+        """
+        slot = self.index.get(device_id)
+        if slot is None:
+            with self._lock:
+                # Another thread may have created the device while we were waiting for the lock
+                slot = self.index.get(device_id)
+                if slot is None:
+                    if len(self.index) >= self.capacity:
+                        self.rejections += 1  # Counted under the creation lock
+                        raise ValueError("Capacity exceeded")
+                    slot = len(self._counts)
+                    self._counts.append(0)
+                    self._latest.append(NO_TIMESTAMP)
+                    self._offsets.append(NAIVE_OFFSET)
+                    self._versions.append(0)
+                    # Publish the slot only once its columns exist
+                    self.index[device_id] = slot
+                    self._scan_index.add(device_id)
+        return ColumnarDeviceReading(self, device_id, slot)
+
+    def get_device_reading(self, device_id: uuid.UUID) -> DeviceReadingIface:
+        """
+        Retrieve a view over the slot of the specified device, if it exists.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+
+        Returns:
+            DeviceReadingIface: The device reading view, or None if it does not exist.
+        """
+        slot = self.index.get(device_id)
+        if slot is None:
+            return None
+        return ColumnarDeviceReading(self, device_id, slot)
+
+    def scan_devices(self, cursor: int, count: int) -> Tuple[int, List[uuid.UUID]]:
+        """
+        Return a page of the devices of the store, in insertion order.
+
+        Args:
+            cursor (int): The cursor returned by the previous call, or 0 to start.
+            count (int): The maximum number of devices to return.
+
+        Returns:
+            Tuple[int, List[uuid.UUID]]: The cursor of the next page, or 0 once the scan is complete, and the
+            unique identifiers of the devices of the page.
+        """
+        return self._scan_index.scan(cursor, count)
+
+    def memory_usage(self) -> int:
+        """
+        Estimate the memory held by the store, including the index and its UUID keys.
+
+        Returns:
+            int: The estimated size in bytes.
+        """
+        columns = sum(column.buffer_info()[1] * column.itemsize
+                      for column in (self._counts, self._latest, self._offsets, self._versions))
+        keys = sum(sys.getsizeof(device_id) + sys.getsizeof(device_id.int) for device_id in list(self.index))
+        slots = sum(sys.getsizeof(slot) for slot in list(self.index.values()))
+        return sys.getsizeof(self.index) + keys + slots + columns
+
+    def bytes_per_device(self) -> float:
+        """
+        Estimate the memory held by the store per device.
+
+        Returns:
+            float: The estimated size in bytes per device, or 0 if the store is empty.
+        """
+        if not self.index:
+            return 0.0
+        return self.memory_usage() / len(self.index)
+
+    def clear(self):
+        """Clear all devices from the store, resetting it to an empty state."""
+        with self._lock:
+            self._init_store()
@@ -1,6 +1,10 @@
+import secrets
 import uuid
 from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left
 from datetime import datetime
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
 
 
 class DeviceReadingIface(ABC):
@@ -10,9 +14,13 @@ class DeviceReadingIface(ABC):
     Attributes:
         total_count (int): The cumulative count of readings for a device.
         latest_timestamp (datetime): The latest timestamp when a reading was recorded.
+        version (int): Starts at 0 and is incremented after every update of the count or the latest timestamp,
+            so an unchanged version means unchanged values.
     """
+    __slots__ = ()  # Lets implementations use __slots__ to avoid a per-instance __dict__
     total_count: int
     latest_timestamp: datetime
+    version: int
 
     @abstractmethod
     def increment_count(self, device_id: uuid.UUID):
@@ -41,10 +49,150 @@ class DeviceReadingIface(ABC):
         raise NotImplementedError
 
 
+def new_store_id() -> str:
+    """Return a random identifier for the contents of a device store, drawn when it is created or cleared."""
+    return secrets.token_hex(8)
+
+
+class ScanIndex:
+    """
+    Keys of a store in insertion order, each with a sequence number, for `DeviceStoreIface.scan_devices`.
+
+    The cursor of a scan is the sequence number of the next key to return, found by bisection, so a full scan
+    takes O(n) whatever the page size. Removed keys are left as gaps until they are compacted, and compaction
+    keeps the sequence numbers of the remaining keys, so removing keys never shifts the keys after them: a key
+    present during the whole scan is returned exactly once. Keys added during a scan are returned if the scan
+    has not passed them.
+
+    Keys are added and removed under the lock of the store, and scans may run concurrently without it.
+
+    Attributes:
+        removals (bool): Whether keys can be removed, which keeps the position of every key.
+    """
+
+    def __init__(self, removals: bool = False):
+        """
+        Initialize an empty ScanIndex.
+
+        Args:
+            removals (bool): Whether keys can be removed. Defaults to False, for stores only removing keys by
+                clearing every key, which then use a new index.
+        """
+        self.removals = removals
+        self._next_seq = 1  # Cursor 0 starts a scan, so sequence numbers start at 1
+        self._entries = (array("q"), [])  # Sequence numbers, increasing, and keys, None once removed
+        self._positions = {}  # Position of each key in the entries, if keys can be removed
+        self._removed = 0
+
+    def __len__(self):
+        """Return the number of keys in the index."""
+        return len(self._entries[1]) - self._removed
+
+    def add(self, key):
+        """
+        Add a key after every key of the index. Must be called with the lock of the store held.
+
+        Args:
+            key: The key to add, which must not be in the index.
+        """
+        seqs, keys = self._entries
+        if self.removals:
+            self._positions[key] = len(keys)
+        # The sequence number is appended first, so a concurrent scan never sees a key without one
+        seqs.append(self._next_seq)
+        keys.append(key)
+        self._next_seq += 1
+
+    def remove(self, key):
+        """
+        Remove a key from the index, if it is in it. Must be called with the lock of the store held.
+
+        Args:
+            key: The key to remove.
+
+        Raises:
+            ValueError: If the index was created without removals.
+        """
+        if not self.removals:
+            raise ValueError("Keys cannot be removed from this index")
+        position = self._positions.pop(key, None)
+        if position is None:
+            return
+        self._entries[1][position] = None
+        self._removed += 1
+        if self._removed > len(self._positions):
+            self._compact()
+
+    def _compact(self):
+        """Drop the gaps of the removed keys, keeping the sequence numbers of the other keys."""
+        seqs, keys = self._entries
+        live = [position for position, key in enumerate(keys) if key is not None]
+        compacted = (array("q", [seqs[position] for position in live]), [keys[position] for position in live])
+        self._positions = {key: position for position, key in enumerate(compacted[1])}
+        self._removed = 0
+        # Replaced in one assignment, so a concurrent scan reads either the old entries or the new ones
+        self._entries = compacted
+
+    def scan(self, cursor: int, count: int) -> Tuple[int, List]:
+        """
+        Return a page of the keys of the index in insertion order.
+
+        Pages hold up to `count` keys, fewer where keys were removed.
+
+        Args:
+            cursor (int): The cursor returned by the previous call, or 0 to start.
+            count (int): The maximum number of keys to return.
+
+        Returns:
+            Tuple[int, List]: The cursor of the next page, or 0 once every key was returned, and the keys.
+        """
+        seqs, keys = self._entries
+        size = min(len(seqs), len(keys))
+        start = bisect_left(seqs, cursor, 0, size)
+        end = min(start + count, size)
+        page = [key for key in keys[start:end] if key is not None]
+        return (seqs[end] if end < size else 0), page
+
+
+def scan_partitioned(scans: Sequence[Callable[[int, int], Tuple[int, List]]], cursor: int, count: int
+                     ) -> Tuple[int, List]:
+    """
+    Return a page of the keys of several partitions scanned one after the other, for stores split into shards.
+
+    The cursor encodes the partition and the cursor within it as `partition_cursor * len(scans) + partition`.
+
+    Args:
+        scans (Sequence[Callable[[int, int], Tuple[int, List]]]): The scan function of each partition, taking a
+            cursor and a count and returning the next cursor (0 when done) and a page of keys.
+        cursor (int): The cursor returned by the previous call, or 0 to start.
+        count (int): The maximum number of keys to return.
+
+    Returns:
+        Tuple[int, List]: The cursor of the next page, or 0 once every partition was scanned, and the keys.
+    """
+    partitions = len(scans)
+    partition_cursor, index = divmod(cursor, partitions)
+    keys = []
+    while index < partitions:
+        partition_cursor, page = scans[index](partition_cursor, count - len(keys))
+        keys.extend(page)
+        if partition_cursor:
+            return partition_cursor * partitions + index, keys
+        index += 1
+        if len(keys) >= count:
+            return (index if index < partitions else 0), keys
+    return 0, keys
+
+
 class DeviceStoreIface(ABC):
     """
     Abstract interface for a device store, responsible for managing device readings.
+
+    Attributes:
+        store_id (str): Identifies the contents of the store. A new one is drawn when the store is created or
+            cleared, as the versions of the devices start again from 0.
     """
+    store_id: str
 
     @abstractmethod
     def get_or_create_device_reading(self, device_id: uuid.UUID) -> DeviceReadingIface:
@@ -78,6 +226,65 @@ class DeviceStoreIface(ABC):
         """
         raise NotImplementedError
 
+    def get_device_readings(self, device_ids: Iterable[uuid.UUID]
+                            ) -> Iterator[Tuple[uuid.UUID, Optional[DeviceReadingIface]]]:
+        """
+        Retrieve the device readings of many devices.
+
+        The default implementation delegates to `get_device_reading` for each device in order. Implementations
+        can override it to fetch many devices at once.
+
+        Args:
+            device_ids (Iterable[uuid.UUID]): The unique identifiers of the devices.
+
+        Returns:
+            Iterator[Tuple[uuid.UUID, Optional[DeviceReadingIface]]]: Each device ID, in order, with its device
+            reading or None if it does not exist.
+        """
+        for device_id in device_ids:
+            yield device_id, self.get_device_reading(device_id)
+
+    def get_device_version(self, device_id: uuid.UUID) -> Optional[str]:
+        """
+        Return a tag of the current values of a device, for conditional reads.
+
+        The tag is made of the store ID and the version of the device, so it changes whenever the count or the
+        latest timestamp of the device changes, and when the store is cleared or recreated.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+
+        Returns:
+            Optional[str]: The tag, or None if the device does not exist.
+        """
+        # The store ID is read first, so a tag never pairs the ID of a cleared store with a version after it
+        store_id = self.store_id
+        device_reading = self.get_device_reading(device_id)
+        if device_reading is None:
+            return None
+        return f"{store_id}-{device_reading.version}"
+
+    def scan_devices(self, cursor: int, count: int) -> Tuple[int, List[uuid.UUID]]:
+        """
+        Iterate over the devices of the store a page at a time, like the Redis SCAN command.
+
+        The scan starts with cursor 0 and each call returns the cursor of the next page, until it returns 0.
+        Every device present for the whole scan is returned, once by the in-memory stores (a Redis scan may
+        return a device twice). Devices created during the scan may or may not be returned.
+
+        Args:
+            cursor (int): The cursor returned by the previous call, or 0 to start.
+            count (int): The maximum number of devices to return.
+
+        Returns:
+            Tuple[int, List[uuid.UUID]]: The cursor of the next page, or 0 once the scan is complete, and the
+            unique identifiers of the devices of the page.
+
+        Raises:
+            NotImplementedError: If the store cannot be scanned.
+        """
+        raise NotImplementedError
+
     @abstractmethod
     def clear(self):
         """
@@ -0,0 +1,63 @@
+import datetime
+
+# Unix epoch as an aware datetime, used for exact conversion of aware datetimes.
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+# Sentinel UTC offset used to mark naive datetimes in integer columns.
+NAIVE_OFFSET = -2 ** 31
+
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def to_epoch_us(timestamp: datetime.datetime) -> int:
+    """
+    Convert a datetime to integer Unix epoch microseconds.
+
+    The conversion is exact, unlike `datetime.timestamp()` which returns a float. Naive datetimes are
+    interpreted in local time, as `datetime.timestamp()` does.
+
+    Args:
+        timestamp (datetime.datetime): The datetime to convert.
+
+    Returns:
+        int: The number of microseconds since the Unix epoch.
+    """
+    if timestamp.utcoffset() is None:
+        return int(timestamp.replace(microsecond=0).timestamp()) * 1_000_000 + timestamp.microsecond
+    return (timestamp - EPOCH) // _MICROSECOND
+
+
+def utc_offset_seconds(timestamp: datetime.datetime) -> int:
+    """
+    Get the UTC offset of a datetime in seconds, so it can be stored next to its epoch value.
+
+    Args:
+        timestamp (datetime.datetime): The datetime.
+
+    Returns:
+        int: The UTC offset in seconds, or NAIVE_OFFSET if the datetime is naive.
+    """
+    offset = timestamp.utcoffset()
+    if offset is None:
+        return NAIVE_OFFSET
+    return int(offset.total_seconds())
+
+
+def from_epoch_us(epoch_us: int, utc_offset: int = NAIVE_OFFSET) -> datetime.datetime:
+    """
+    Convert integer Unix epoch microseconds back to a datetime.
+
+    This is the inverse of `to_epoch_us` combined with `utc_offset_seconds`.
+
+    Args:
+        epoch_us (int): The number of microseconds since the Unix epoch.
+        utc_offset (int): The UTC offset in seconds, or NAIVE_OFFSET for a naive local datetime.
+
+    Returns:
+        datetime.datetime: The datetime for the given epoch value.
+    """
+    seconds, microseconds = divmod(epoch_us, 1_000_000)
+    if utc_offset == NAIVE_OFFSET:
+        return datetime.datetime.fromtimestamp(seconds).replace(microsecond=microseconds)
+    tz = datetime.timezone.utc if utc_offset == 0 else datetime.timezone(datetime.timedelta(seconds=utc_offset))
+    return datetime.datetime.fromtimestamp(seconds, tz).replace(microsecond=microseconds)
@@ -0,0 +1,231 @@
+import time
+import uuid
+from collections import OrderedDict
+from itertools import islice
+from typing import Callable, List, Optional, Tuple
+
+from .device_store import DeviceReadingIface, ScanIndex, new_store_id, scan_partitioned
+from .in_mem_device_store import DeviceReading, InMemoryDeviceStore
+from .spill_store import SqliteSpillStore
+
+# Names of the eviction policies, selected with the DEVICE_STORE_EVICTION setting.
+EVICTION_NONE = "none"
+EVICTION_LRU = "lru"
+EVICTION_IDLE = "idle"
+EVICTION_LFU = "lfu"
+
+
+class EvictingDeviceStore(InMemoryDeviceStore):
+    """
+    In-memory device store making room for new devices by evicting old ones, instead of rejecting new devices.
+
+    When the store holds `capacity` devices, a device is chosen by the policy:
+
+    - "lru": the least recently used device.
+    - "idle": the least recently used device, only if it was not used for `idle_ttl_s` seconds. New devices are
+      rejected with "Capacity exceeded" while every device is in use.
+    - "lfu": the least updated of the `sample` least recently used devices, so a device that was just created
+      is not evicted before its first updates.
+
+    Evicted devices are written to the spill tier, if any, and loaded back on their next access, so the number
+    of devices is limited by the disk instead of the memory. Without a spill tier, evicted devices are dropped,
+    and devices created afterwards start from a version above that of every dropped device, so a device dropped
+    and created again never reuses the versions, and so the ETags, it already had.
+    The eviction listeners are called with the id of each evicted device, so state kept per device elsewhere,
+    such as its rollups, is dropped with it, and the load listeners with the id of each device loaded back from
+    the spill tier.
+    The spill tier only holds devices evicted by this store, so it is emptied when the store is created: after
+    a restart, devices are rebuilt from the write-ahead log like those held in memory.
+
+    Devices are only evicted from the least recently used end, so with a capacity above the number of
+    concurrent requests a device in use by a request is never evicted. Devices evicted or loaded back during
+    `scan_devices` may be missed or returned twice, as with the Redis store, but evictions never make a scan
+    skip the other devices.
+
+    Attributes:
+        capacity (int): The maximum number of devices held in memory.
+        policy (str): The eviction policy, "lru", "idle" or "lfu".
+        idle_ttl_s (float): The time without use after which a device can be evicted by the "idle" policy.
+        sample (int): The number of least recently used devices the "lfu" policy chooses from.
+        spill (Optional[SqliteSpillStore]): The tier evicted devices are written to.
+        evictions (int): The number of devices evicted since the store was created.
+        eviction_listeners (List[Callable[[uuid.UUID], None]]): Called with the id of each evicted device, with
+            the lock held.
+        load_listeners (List[Callable[[uuid.UUID], None]]): Called with the id of each device loaded back from the
+            spill tier, with the lock held.
+        spilled (int): The number of devices in the spill tier.
+    """
+
+    def __init__(self, capacity=100, policy=EVICTION_LRU, idle_ttl_s=3600.0, sample=16,
+                 spill: Optional[SqliteSpillStore] = None, clock: Callable[[], float] = time.monotonic):
+        """
+        Initialize the EvictingDeviceStore.
+
+        Args:
+            capacity (int): The maximum number of devices held in memory. Defaults to 100.
+            policy (str): The eviction policy, "lru", "idle" or "lfu". Defaults to "lru".
+            idle_ttl_s (float): The idle time after which the "idle" policy evicts a device. Defaults to 3600.
+            sample (int): The number of devices the "lfu" policy chooses from. Defaults to 16.
+            spill (Optional[SqliteSpillStore]): The tier evicted devices are written to. Defaults to none.
+            clock (Callable[[], float]): Returns the current time in seconds. Defaults to `time.monotonic`.
+
+        Raises:
+            ValueError: If the policy is unknown.
+        """
+        if policy not in (EVICTION_LRU, EVICTION_IDLE, EVICTION_LFU):
+            raise ValueError(f"Unknown eviction policy: {policy}")
+        self.policy = policy
+        self.idle_ttl_s = idle_ttl_s
+        self.sample = sample
+        self.spill = spill
+        self.evictions = 0
+        self.spilled = 0
+        self.eviction_listeners: List[Callable[[uuid.UUID], None]] = []
+        self.load_listeners: List[Callable[[uuid.UUID], None]] = []
+        self._clock = clock
+        super().__init__(capacity=capacity)
+        if spill is not None:
+            spill.clear()
+
+    def _init_store(self):
+        """Initialize/Reset the devices, their scan order and their last use, least recent first."""
+        self.store_id = new_store_id()
+        self.store = {}
+        self._scan_index = ScanIndex(removals=True)
+        self._version_floor = 0  # Version of new devices, above the version of every dropped device
+        self._recency = OrderedDict()
+
+    def _touch(self, device_id: uuid.UUID):
+        """Mark a device held in memory as the most recently used. Must be called with the lock held."""
+        self._recency.move_to_end(device_id)
+        self._recency[device_id] = self._clock()
+
+    def _victim(self) -> Optional[uuid.UUID]:
+        """Return the device to evict according to the policy, or None if no device can be evicted."""
+        if not self._recency:
+            return None
+        if self.policy == EVICTION_LRU:
+            return next(iter(self._recency))
+        if self.policy == EVICTION_IDLE:
+            device_id, last_used = next(iter(self._recency.items()))
+            return device_id if self._clock() - last_used >= self.idle_ttl_s else None
+        # Least updated of the least recently used devices, the least recent first on ties
+        return min(islice(self._recency, self.sample), key=lambda device_id: self.store[device_id].version)
+
+    def _manage_capacity(self):
+        """
+        Make room for a new device if the store is full, by evicting a device. Must be called with the lock held.
+
+        Raises:
+            ValueError: If the store is full and the policy finds no device to evict.
+        """
+        if len(self.store) < self.capacity:
+            return
+        device_id = self._victim()
+        if device_id is None:
+            self.rejections += 1
+            raise ValueError("Capacity exceeded")
+        device_reading = self.store.pop(device_id)
+        del self._recency[device_id]
+        self._scan_index.remove(device_id)
+        if self.spill is not None:
+            self.spill.put(device_id, device_reading)
+            self.spilled += 1
+        else:
+            self._version_floor = max(self._version_floor, device_reading.version + 1)
+        self.evictions += 1
+        for listener in self.eviction_listeners:
+            listener(device_id)
+
+    def _insert(self, device_id: uuid.UUID, device_reading: DeviceReading):
+        """Add a device to the memory, evicting a device first if needed. Must be called with the lock held."""
+        self._manage_capacity()
+        self.store[device_id] = device_reading
+        self._scan_index.add(device_id)
+        self._recency[device_id] = self._clock()
+
+    def _unspill(self, device_id: uuid.UUID):
+        """Remove a device loaded back into memory from the spill tier. Must be called with the lock held."""
+        self.spill.delete(device_id)
+        self.spilled -= 1
+        for listener in self.load_listeners:
+            listener(device_id)
+
+    def get_or_create_device_reading(self, device_id: uuid.UUID) -> DeviceReadingIface:
+        """
+        Retrieve the device reading of a device, loading it back from the spill tier or creating it if needed.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+
+        Returns:
+            DeviceReadingIface: The device reading instance for the specified device.
+
+        Raises:
+            ValueError: If the device is not in memory, the store is full and no device can be evicted.
+        """
+        with self._lock:
+            device_reading = self.store.get(device_id)
+            if device_reading is not None:
+                self._touch(device_id)
+                return device_reading
+            spilled = self.spill.get(device_id) if self.spill is not None else None
+            self._insert(device_id, spilled or DeviceReading(device_id=device_id, version=self._version_floor))
+            if spilled is not None:
+                self._unspill(device_id)
+            return self.store[device_id]
+
+    def get_device_reading(self, device_id: uuid.UUID) -> DeviceReadingIface:
+        """
+        Retrieve the device reading of a device, loading it back from the spill tier if needed.
+
+        A spilled device that cannot be loaded back, because no device can be evicted, is returned from the spill
+        tier without being loaded.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+
+        Returns:
+            DeviceReadingIface: The device reading instance, or None if it does not exist.
+        """
+        with self._lock:
+            device_reading = self.store.get(device_id)
+            if device_reading is not None:
+                self._touch(device_id)
+                return device_reading
+            if self.spill is None:
+                return None
+            spilled = self.spill.get(device_id)
+            if spilled is None:
+                return None
+            try:
+                self._insert(device_id, spilled)
+            except ValueError:
+                return spilled
+            self._unspill(device_id)
+            return spilled
+
+    def scan_devices(self, cursor: int, count: int) -> Tuple[int, List[uuid.UUID]]:
+        """
+        Return a page of the devices of the store, those in memory in the order they were added to the memory
+        and then the spilled ones.
+
+        Args:
+            cursor (int): The cursor returned by the previous call, or 0 to start.
+            count (int): The maximum number of devices to return.
+
+        Returns:
+            Tuple[int, List[uuid.UUID]]: The cursor of the next page, or 0 once the scan is complete, and the
+            unique identifiers of the devices of the page.
+        """
+        if self.spill is None:
+            return self._scan_index.scan(cursor, count)
+        return scan_partitioned([lambda c, n: self._scan_index.scan(c, n), self.spill.scan], cursor, count)
+
+    def clear(self):
+        """Clear all device readings from memory and from the spill tier."""
+        with self._lock:
+            self._init_store()
+            if self.spill is not None:
+                self.spill.clear()
+                self.spilled = 0
@@ -0,0 +1,252 @@
+from typing import Optional
+
+from .bloom_ts_store import BloomTimestampStore
+from .columnar_device_store import ColumnarDeviceStore
+from .device_store import DeviceStoreIface
+from .evicting_device_store import EVICTION_NONE, EvictingDeviceStore
+from .in_mem_device_store import in_mem_device_store
+from .in_memory_ts_store import InMemoryTimestampStore, in_mem_ts_store
+from .partitioned_ts_store import PartitionedTimestampStore
+from .redis_store import RedisStore
+from .rollup_store import RollupStore
+from .shared_memory_store import SharedMemoryStore
+from .spill_store import SqliteSpillStore
+from .striped_device_store import StripedDeviceStore
+from .top_devices import TopDevices
+from .ttl_ts_store import TtlTimestampStore
+from .ts_store import TimeStampStoreIface
+from .watermark_ts_store import LATE_POLICY_EXACT, WatermarkTimestampStore
+
+# Names of the device store backends, selected with the DEVICE_STORE_BACKEND setting.
+DEVICE_BACKEND_MEMORY = "memory"
+DEVICE_BACKEND_STRIPED = "striped"
+DEVICE_BACKEND_COLUMNAR = "columnar"
+DEVICE_BACKEND_REDIS = "redis"
+DEVICE_BACKEND_SHARED = "shared"
+
+# Names of the timestamp store backends, selected with the TIMESTAMP_STORE_BACKEND setting.
+TS_BACKEND_ORDERED = "ordered"
+TS_BACKEND_PARTITIONED = "partitioned"
+TS_BACKEND_WATERMARK = "watermark"
+TS_BACKEND_REDIS = "redis"
+TS_BACKEND_SHARED = "shared"
+TS_BACKEND_TTL = "ttl"
+
+# Redis stores by server URL and key prefix, so the device store and the timestamp store share one instance.
+_redis_stores = {}
+
+# Shared memory stores by segment name, for the same reason.
+_shared_memory_stores = {}
+
+
+def create_device_store(settings) -> DeviceStoreIface:
+    """
+    Create the device store selected by the DEVICE_STORE_BACKEND setting.
+
+    Args:
+        settings (Settings): The settings instance to read the backend and its options from.
+
+    Returns:
+        DeviceStoreIface: The device store for the configured backend.
+
+    Raises:
+        ValueError: If the configured backend is unknown.
+    """
+    backend = settings.DEVICE_STORE_BACKEND
+    if backend == DEVICE_BACKEND_MEMORY:
+        if settings.DEVICE_STORE_EVICTION != EVICTION_NONE:
+            return create_evicting_device_store(settings)
+        return in_mem_device_store
+    if backend == DEVICE_BACKEND_STRIPED:
+        return StripedDeviceStore(capacity=settings.DEVICE_STORE_CAPACITY, stripes=settings.DEVICE_STORE_STRIPES)
+    if backend == DEVICE_BACKEND_COLUMNAR:
+        return ColumnarDeviceStore(capacity=settings.DEVICE_STORE_CAPACITY, stripes=settings.DEVICE_STORE_STRIPES)
+    if backend == DEVICE_BACKEND_REDIS:
+        return create_redis_store(settings)
+    if backend == DEVICE_BACKEND_SHARED:
+        return create_shared_memory_store(settings)
+    raise ValueError(f"Unknown device store backend: {backend}")
+
+
+def create_evicting_device_store(settings) -> EvictingDeviceStore:
+    """
+    Create the in-memory device store evicting devices with the DEVICE_STORE_EVICTION policy, spilling them to
+    DEVICE_STORE_SPILL_PATH if it is set.
+
+    Args:
+        settings (Settings): The settings instance to read the eviction options from.
+
+    Returns:
+        EvictingDeviceStore: The device store.
+
+    Raises:
+        ValueError: If the configured policy is unknown.
+    """
+    spill = SqliteSpillStore(settings.DEVICE_STORE_SPILL_PATH) if settings.DEVICE_STORE_SPILL_PATH else None
+    return EvictingDeviceStore(capacity=settings.DEVICE_STORE_CAPACITY, policy=settings.DEVICE_STORE_EVICTION,
+                               idle_ttl_s=settings.DEVICE_STORE_IDLE_TTL_S,
+                               sample=settings.DEVICE_STORE_EVICTION_SAMPLE, spill=spill)
+
+
+def create_ts_store(settings, shards=1) -> TimeStampStoreIface:
+    """
+    Create the timestamp store selected by the TIMESTAMP_STORE_BACKEND setting, behind a Bloom filter tier
+    if TIMESTAMP_BLOOM_ENABLED is set.
+
+    Args:
+        settings (Settings): The settings instance to read the backend and its options from.
+        shards (int): The number of independent stores created for the same settings. Global capacities are
+            split evenly between them. Defaults to 1.
+
+    Returns:
+        TimeStampStoreIface: The timestamp store for the configured backend.
+
+    Raises:
+        ValueError: If the configured backend is unknown.
+    """
+    ts_store = _create_backend_ts_store(settings, shards)
+    if settings.TIMESTAMP_BLOOM_ENABLED:
+        ts_store = BloomTimestampStore(
+            exact_store=ts_store,
+            capacity=max(1, settings.TIMESTAMP_BLOOM_CAPACITY // shards),
+            fpr=settings.TIMESTAMP_BLOOM_FPR,
+            generations=settings.TIMESTAMP_BLOOM_GENERATIONS,
+            hit_policy=settings.TIMESTAMP_BLOOM_HIT_POLICY,
+        )
+    return ts_store
+
+
+def _create_backend_ts_store(settings, shards=1) -> TimeStampStoreIface:
+    """
+    Create the timestamp store selected by the TIMESTAMP_STORE_BACKEND setting.
+
+    Args:
+        settings (Settings): The settings instance to read the backend and its options from.
+        shards (int): The number of independent stores the global capacities are split between.
+
+    Returns:
+        TimeStampStoreIface: The timestamp store for the configured backend.
+
+    Raises:
+        ValueError: If the configured backend is unknown.
+    """
+    backend = settings.TIMESTAMP_STORE_BACKEND
+    if backend == TS_BACKEND_ORDERED:
+        if shards > 1:
+            return InMemoryTimestampStore(capacity=max(1, settings.TIMESTAMP_STORE_CAPACITY // shards))
+        return in_mem_ts_store
+    if backend == TS_BACKEND_PARTITIONED:
+        return PartitionedTimestampStore(capacity_per_device=settings.TIMESTAMP_STORE_CAPACITY_PER_DEVICE)
+    if backend == TS_BACKEND_WATERMARK:
+        fallback_store = None
+        if settings.TIMESTAMP_WINDOW_LATE_POLICY == LATE_POLICY_EXACT:
+            fallback_store = InMemoryTimestampStore(capacity=max(1, settings.TIMESTAMP_STORE_CAPACITY // shards))
+        return WatermarkTimestampStore(
+            window_slots=settings.TIMESTAMP_WINDOW_SLOTS,
+            resolution_us=settings.TIMESTAMP_WINDOW_RESOLUTION_US,
+            late_policy=settings.TIMESTAMP_WINDOW_LATE_POLICY,
+            fallback_store=fallback_store,
+        )
+    if backend == TS_BACKEND_REDIS:
+        return create_redis_store(settings)
+    if backend == TS_BACKEND_SHARED:
+        return create_shared_memory_store(settings)
+    if backend == TS_BACKEND_TTL:
+        return TtlTimestampStore(retention_s=settings.TIMESTAMP_STORE_RETENTION_S,
+                                 bucket_s=settings.TIMESTAMP_STORE_BUCKET_S)
+    raise ValueError(f"Unknown timestamp store backend: {backend}")
+
+
+def create_redis_store(settings) -> RedisStore:
+    """
+    Get the Redis store for the REDIS settings, creating it with a pooled client on first use.
+
+    The same instance is returned for the device store and the timestamp store, so the service can ingest
+    a request with a single round trip.
+
+    Args:
+        settings (Settings): The settings instance to read the server and capacities from.
+
+    Returns:
+        RedisStore: The Redis store.
+    """
+    key = (settings.REDIS_URL, settings.REDIS_KEY_PREFIX)
+    store = _redis_stores.get(key)
+    if store is None:
+        store = _redis_stores[key] = RedisStore.from_url(
+            settings.REDIS_URL,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            device_capacity=settings.DEVICE_STORE_CAPACITY,
+            ts_capacity=settings.TIMESTAMP_STORE_CAPACITY,
+            prefix=settings.REDIS_KEY_PREFIX,
+        )
+    return store
+
+
+def create_shared_memory_store(settings) -> SharedMemoryStore:
+    """
+    Get the shared memory store for the SHARED_MEMORY_NAME setting, creating or attaching to its segment on
+    first use.
+
+    The same instance is returned for the device store and the timestamp store, so the service can ingest
+    a request under one lock per device.
+
+    Args:
+        settings (Settings): The settings instance to read the segment name and capacities from.
+
+    Returns:
+        SharedMemoryStore: The shared memory store.
+    """
+    store = _shared_memory_stores.get(settings.SHARED_MEMORY_NAME)
+    if store is None:
+        store = _shared_memory_stores[settings.SHARED_MEMORY_NAME] = SharedMemoryStore(
+            name=settings.SHARED_MEMORY_NAME,
+            device_capacity=settings.DEVICE_STORE_CAPACITY,
+            ts_capacity=settings.TIMESTAMP_STORE_CAPACITY,
+            stripes=settings.DEVICE_STORE_STRIPES,
+        )
+    return store
+
+
+def create_rollup_store(settings) -> Optional[RollupStore]:
+    """
+    Create the rollup store with the retention of each bucket size and the limit of future readings from the
+    ROLLUP settings, if ROLLUPS_ENABLED is set.
+
+    Rollups are held in process memory, so they cannot be enabled with the Redis and shared memory stores, whose
+    devices are updated by every worker process.
+
+    Args:
+        settings (Settings): The settings instance to read the backends and the rollup options from.
+
+    Returns:
+        Optional[RollupStore]: The rollup store, or None if rollups are disabled.
+
+    Raises:
+        ValueError: If rollups are enabled with the Redis or shared memory stores.
+    """
+    if not settings.ROLLUPS_ENABLED:
+        return None
+    if settings.DEVICE_STORE_BACKEND in (DEVICE_BACKEND_REDIS, DEVICE_BACKEND_SHARED) or \
+            settings.TIMESTAMP_STORE_BACKEND in (TS_BACKEND_REDIS, TS_BACKEND_SHARED):
+        raise ValueError("Rollups are not supported with the redis and shared stores, set ROLLUPS_ENABLED=false")
+    return RollupStore(retentions={
+        "minute": settings.ROLLUP_MINUTE_RETENTION,
+        "hour": settings.ROLLUP_HOUR_RETENTION,
+        "day": settings.ROLLUP_DAY_RETENTION,
+    }, max_future_s=settings.ROLLUP_MAX_FUTURE_S)
+
+
+def create_top_devices(settings) -> Optional[TopDevices]:
+    """
+    Create the index of the devices with the highest cumulative counts, unless TOP_DEVICES_CAPACITY is 0.
+
+    Args:
+        settings (Settings): The settings instance to read the capacity from.
+
+    Returns:
+        Optional[TopDevices]: The index, or None if it is disabled.
+    """
+    if settings.TOP_DEVICES_CAPACITY <= 0:
+        return None
+    return TopDevices(capacity=settings.TOP_DEVICES_CAPACITY)
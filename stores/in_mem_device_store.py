@@ -1,11 +1,12 @@
 import datetime
 import uuid
 from threading import Lock
+from typing import List, Tuple
 
 from pydantic import BaseModel
 from config import settings
 
-from stores.device_store import DeviceReadingIface, DeviceStoreIface
+from stores.device_store import DeviceReadingIface, DeviceStoreIface, ScanIndex, new_store_id
 
 
 class DeviceReading(BaseModel, DeviceReadingIface):
@@ -16,25 +17,29 @@ class DeviceReading(BaseModel, DeviceReadingIface):
         device_id (uuid.UUID): The unique identifier of the device.
         latest_timestamp (datetime.datetime): The most recent timestamp when a reading was recorded.
         total_count (int): The cumulative count of readings for the device.
+        version (int): The number of updates of the count and latest timestamp.
     """
     device_id: uuid.UUID
     latest_timestamp: datetime.datetime = None
     total_count: int = 0
+    version: int = 0
 
     def __init__(self, **data):
         super().__init__(**data)
-        self._lock = Lock()  # Thread-safe lock for updating timestamp
+        self._lock = Lock()  # Thread-safe lock for updating count and timestamp
 
     def increment_count(self, count):
         """
-        Increment the total count of readings by the given count.
+        Increment the total count of readings by the given count, ensuring thread safety with a lock.
 
-        This operation is thread-safe because GIL ensures atomicity of the operation.
+        `+=` on an attribute is a read followed by a write, so it is not atomic even with the GIL.
 
         Args:
             count (int): The number of readings to add to the total count.
         """
-        self.total_count += count
+        with self._lock:
+            self.total_count += count
+            self.version += 1
 
     def update_latest_timestamp(self, timestamp):
         """
@@ -47,6 +52,7 @@ class DeviceReading(BaseModel, DeviceReadingIface):
             # Only update if the new timestamp is more recent
             if not self.latest_timestamp or timestamp > self.latest_timestamp:
                 self.latest_timestamp = timestamp
+                self.version += 1
 
 
 class InMemoryDeviceStore(DeviceStoreIface):
@@ -55,6 +61,7 @@ class InMemoryDeviceStore(DeviceStoreIface):
 
     Attributes:
         capacity (int): The maximum number of device readings the store can hold.
+        rejections (int): The number of new devices refused because the store was full.
     """
 
     def __init__(self, capacity=100):
@@ -66,36 +73,57 @@ class InMemoryDeviceStore(DeviceStoreIface):
         """
         self._init_store()
         self.capacity = capacity
+        self.rejections = 0
+        self._lock = Lock()  # Serialises the creation of new devices
 
     def _init_store(self):
-        """Initialize/Reset the internal storage for device readings."""
+        """Initialize/Reset the internal storage for device readings and their scan order."""
+        self.store_id = new_store_id()
         self.store = {}
+        self._scan_index = ScanIndex()
+
+    def __len__(self):
+        """Return the number of devices in the store."""
+        return len(self.store)
 
     def _manage_capacity(self):
         """
-        Ensure the store does not exceed its capacity by removing the new entry if needed.
+        Ensure the store does not exceed its capacity, before a new entry is added.
 
         Raises:
-            ValueError: If the store exceeds the defined capacity.
+            ValueError: If the store is already at the defined capacity.
         """
-        if len(self.store) > self.capacity:
-            self.store.popitem()  # Remove the oldest entry
+        if len(self.store) >= self.capacity:
+            self.rejections += 1  # Counted under the creation lock
             raise ValueError("Capacity exceeded")
 
     def get_or_create_device_reading(self, device_id: uuid.UUID) -> DeviceReadingIface:
         """
         Retrieve an existing DeviceReading for the specified device ID, or create a new one if it doesn't exist.
 
-        Thread safety is guaranteed because the GIL ensures atomicity of the setdefault operation.
+        Existing devices are returned without taking a lock or building a DeviceReading. New devices are created
+        under a lock, and the capacity is checked before the device is inserted, so a full store never evicts
+        a device added by another thread.
 
         Args:
             device_id (uuid.UUID): The unique identifier of the device.
 
         Returns:
             DeviceReadingIface: The device reading instance for the specified device.
+
+        Raises:
+            ValueError: If the device does not exist and the store is full.
         """
-        device_reading = self.store.setdefault(device_id, DeviceReading(device_id=device_id))
-        self._manage_capacity()
+        device_reading = self.store.get(device_id)
+        if device_reading is None:
+            with self._lock:
+                # Another thread may have created the device while we were waiting for the lock
+                device_reading = self.store.get(device_id)
+                if device_reading is None:
+                    self._manage_capacity()
+                    device_reading = DeviceReading(device_id=device_id)
+                    self.store[device_id] = device_reading
+                    self._scan_index.add(device_id)
         return device_reading
 
     def get_device_reading(self, device_id: uuid.UUID) -> DeviceReadingIface:
@@ -110,6 +138,20 @@ class InMemoryDeviceStore(DeviceStoreIface):
         """
         return self.store.get(device_id)
 
+    def scan_devices(self, cursor: int, count: int) -> Tuple[int, List[uuid.UUID]]:
+        """
+        Return a page of the devices of the store, in insertion order.
+
+        Args:
+            cursor (int): The cursor returned by the previous call, or 0 to start.
+            count (int): The maximum number of devices to return.
+
+        Returns:
+            Tuple[int, List[uuid.UUID]]: The cursor of the next page, or 0 once the scan is complete, and the
+            unique identifiers of the devices of the page.
+        """
+        return self._scan_index.scan(cursor, count)
+
     def clear(self):
         """Clear all device readings from the store, resetting it to an empty state."""
         self._init_store()
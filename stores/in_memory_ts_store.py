@@ -1,5 +1,6 @@
 import uuid
 from collections import OrderedDict
+from typing import List
 from .ts_store import TimeStampStoreIface
 from config import settings
 
@@ -28,6 +29,7 @@ class InMemoryTimestampStore(TimeStampStoreIface):
 
     Attributes:
         capacity (int): The maximum number of timestamps to store.
+        evictions (int): The number of timestamps evicted to stay within the capacity since the store was created.
     """
 
     def __init__(self, capacity=1000):
@@ -38,6 +40,7 @@ class InMemoryTimestampStore(TimeStampStoreIface):
             capacity (int): The maximum number of timestamps to store. Defaults to 1000.
         """
         self.capacity = capacity
+        self.evictions = 0
         self._init_store()
 
     def _init_store(self):
@@ -78,10 +81,44 @@ class InMemoryTimestampStore(TimeStampStoreIface):
 
         return existing is some_unique_value
 
+    def check_and_add_timestamps(self, device_id: uuid.UUID, timestamps: List[int]) -> List[bool]:
+        """
+        Check and add several timestamps for a single device in one call.
+
+        Behaves exactly like calling `check_and_add_timestamp` for each timestamp in order, but
+        resolves the store attributes once for the whole list.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            timestamps (List[int]): The timestamps in Unix epoch format, in arrival order.
+
+        Returns:
+            List[bool]: One flag per timestamp, True if it was added, False if it was already present.
+        """
+        setdefault = self.store.setdefault
+        maintain_capacity = self._maintain_capacity
+        results = []
+        for timestamp in timestamps:
+            key = _key(device_id, timestamp)
+            some_unique_value = object()
+            results.append(setdefault(key, some_unique_value) is some_unique_value)
+            maintain_capacity(key)
+        return results
+
     def clear(self):
         """Clear all timestamps from the store, resetting it to an empty state."""
         self._init_store()
 
+    def stats(self) -> dict:
+        """
+        Report the size of the store.
+
+        Returns:
+            dict: The number of timestamps held, the capacity of the store and the number of evictions.
+        """
+        return {"backend": "ordered", "size": len(self.store), "capacity": self.capacity,
+                "evictions": self.evictions}
+
     def _maintain_capacity(self, key):
         """
         Maintain the capacity of the store by evicting the oldest timestamp if needed.
@@ -95,6 +132,7 @@ class InMemoryTimestampStore(TimeStampStoreIface):
         self.store.move_to_end(key)
         if len(self.store) > self.capacity:
             self.store.popitem(last=False)  # Remove the oldest entry
+            self.evictions += 1
 
 
 # Initialize an in-memory timestamp store with the configured capacity.
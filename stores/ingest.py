@@ -0,0 +1,36 @@
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, List, Tuple
+
+# A reading as passed to `ingest_readings`: (epoch_us, count, utc_offset).
+IngestReading = Tuple[int, int, int]
+
+
+class ReadingsIngestIface(ABC):
+    """
+    Abstract interface for a store that holds both device readings and timestamps, and can dedupe and apply
+    the readings of several devices in a single operation.
+
+    When the same store is used as device store and timestamp store, the service ingests through this interface
+    instead of calling the two stores reading by reading, which matters when each call is a network round trip.
+    """
+
+    @abstractmethod
+    def ingest_readings(self, readings_by_device: Dict[uuid.UUID, List[IngestReading]]
+                        ) -> Dict[uuid.UUID, Tuple[List[bool], str]]:
+        """
+        Dedupe the readings of each device, then add the counts of the new ones to the device and update its
+        latest timestamp, creating the device if needed.
+
+        Args:
+            readings_by_device (Dict[uuid.UUID, List[IngestReading]]): The readings of each device, as
+                (epoch_us, count, utc_offset) in arrival order.
+
+        Returns:
+            Dict[uuid.UUID, Tuple[List[bool], str]]: For each device, one flag per reading that is True if the
+            reading was new, and an error message if the device could not be created (with no flags).
+
+        Raises:
+            NotImplementedError: If the method is not implemented by a subclass.
+        """
+        raise NotImplementedError
@@ -0,0 +1,159 @@
+import uuid
+from array import array
+from threading import Lock
+from typing import List
+from .ts_store import TimeStampStoreIface
+
+
+class _Partition:
+    """
+    Bounded dedupe history for a single device.
+
+    Timestamps are kept both in a set, for membership checks, and in a ring buffer of raw 64-bit integers
+    that records insertion order, so the oldest timestamp can be evicted once the partition is full.
+    """
+    __slots__ = ("seen", "ring", "head", "lock")
+
+    def __init__(self):
+        self.seen = set()
+        self.ring = array("q")
+        self.head = 0  # Index of the oldest timestamp in the ring once it is full
+        self.lock = Lock()
+
+
+class PartitionedTimestampStore(TimeStampStoreIface):
+    """
+    In-memory timestamp store partitioned by device.
+
+    Each device gets its own bounded history of `capacity_per_device` timestamps, so a chatty device can only
+    evict its own history and the memory used per device is bounded. Devices are keyed by the integer value
+    of their UUID and timestamps are integer epoch microseconds, so checking a reading does not format or
+    allocate any strings.
+
+    Attributes:
+        capacity_per_device (int): The maximum number of timestamps remembered per device.
+    """
+
+    def __init__(self, capacity_per_device=1000):
+        """
+        Initialize the PartitionedTimestampStore with a per-device capacity.
+
+        Args:
+            capacity_per_device (int): The maximum number of timestamps remembered per device. Defaults to 1000.
+        """
+        self.capacity_per_device = capacity_per_device
+        self._init_store()
+
+    def _init_store(self):
+        """Initialize the mapping of device UUID integers to partitions."""
+        self.partitions = {}
+
+    def __repr__(self):
+        """
+        Return a string representation of the timestamp store.
+
+        Returns:
+            str: A string representing the current state of the store.
+        """
+        return f"PartitionedTimestampStore(devices={len(self.partitions)}, timestamps={len(self)})"
+
+    def __len__(self):
+        """Return the number of timestamps held across all devices."""
+        return sum(len(partition.seen) for partition in list(self.partitions.values()))
+
+    def _partition(self, device_id: uuid.UUID) -> _Partition:
+        """
+        Get the partition of a device, creating it if needed.
+
+        Creation is atomic because of the setdefault operation.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+
+        Returns:
+            _Partition: The partition holding the device's timestamps.
+        """
+        key = device_id.int
+        partition = self.partitions.get(key)
+        if partition is None:
+            partition = self.partitions.setdefault(key, _Partition())
+        return partition
+
+    def _check_and_add(self, partition: _Partition, timestamp: int) -> bool:
+        """
+        Check and add a timestamp to a partition. Must be called with the partition lock held.
+
+        Args:
+            partition (_Partition): The partition of the device.
+            timestamp (int): The timestamp in integer Unix epoch microseconds.
+
+        Returns:
+            bool: True if the timestamp was added, False if it was already present.
+        """
+        seen = partition.seen
+        if timestamp in seen:
+            return False
+
+        ring = partition.ring
+        if len(ring) < self.capacity_per_device:
+            ring.append(timestamp)
+        else:
+            # Overwrite the oldest timestamp and forget it
+            head = partition.head
+            seen.discard(ring[head])
+            ring[head] = timestamp
+            partition.head = (head + 1) % len(ring)
+        seen.add(timestamp)
+        return True
+
+    def check_and_add_timestamp(self, device_id: uuid.UUID, timestamp: int) -> bool:
+        """
+        Check if a timestamp is present for the device and add it if not.
+
+        If the device's history is full, its oldest timestamp is evicted. Histories of other devices are
+        not affected.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            timestamp (int): The timestamp in integer Unix epoch microseconds.
+
+        Returns:
+            bool: True if the timestamp was added, False if it was already present.
+        """
+        partition = self._partition(device_id)
+        with partition.lock:
+            return self._check_and_add(partition, timestamp)
+
+    def check_and_add_timestamps(self, device_id: uuid.UUID, timestamps: List[int]) -> List[bool]:
+        """
+        Check and add several timestamps for a single device, taking the device's lock once.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            timestamps (List[int]): The timestamps in integer Unix epoch microseconds, in arrival order.
+
+        Returns:
+            List[bool]: One flag per timestamp, True if it was added, False if it was already present.
+        """
+        partition = self._partition(device_id)
+        check_and_add = self._check_and_add
+        with partition.lock:
+            return [check_and_add(partition, timestamp) for timestamp in timestamps]
+
+    def stats(self) -> dict:
+        """
+        Report the size of the store.
+
+        Returns:
+            dict: The number of devices, the number of timestamps held and the capacity per device.
+        """
+        return {
+            "backend": "partitioned",
+            "devices": len(self.partitions),
+            "size": len(self),
+            "capacity_per_device": self.capacity_per_device,
+        }
+
+    def clear(self):
+        """Clear all timestamps from the store, resetting it to an empty state."""
+        self._init_store()
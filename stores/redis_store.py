@@ -0,0 +1,462 @@
+import uuid
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import redis
+
+from stores.device_store import DeviceReadingIface, DeviceStoreIface, new_store_id
+from stores.epoch import NAIVE_OFFSET, from_epoch_us, to_epoch_us, utc_offset_seconds
+from stores.ingest import IngestReading, ReadingsIngestIface
+from stores.ts_store import TimeStampStoreIface
+
+# Lua helpers shared by the scripts below. A device is a hash with its `count`, `latest` epoch microseconds, the
+# UTC `offset` of the latest timestamp and its `version`, incremented by every update. Dedupe keys live in a set,
+# with a list recording their insertion order so the oldest key can be evicted once the store is full, like the
+# ordered in-memory store.
+_LUA_HELPERS = """
+local function create_device(device_key, devices_key, capacity, device_id)
+    if redis.call('EXISTS', device_key) == 1 then
+        return true
+    end
+    if redis.call('SCARD', devices_key) >= capacity then
+        return false
+    end
+    redis.call('SADD', devices_key, device_id)
+    redis.call('HSET', device_key, 'count', 0, 'version', 0)
+    return true
+end
+
+local function check_and_add(ts_key, order_key, capacity, key)
+    if redis.call('SADD', ts_key, key) == 0 then
+        return 0
+    end
+    redis.call('RPUSH', order_key, key)
+    if redis.call('LLEN', order_key) > capacity then
+        redis.call('SREM', ts_key, redis.call('LPOP', order_key))
+    end
+    return 1
+end
+
+local function update_latest(device_key, epoch_us, offset)
+    local latest = redis.call('HGET', device_key, 'latest')
+    if not latest or tonumber(latest) < tonumber(epoch_us) then
+        redis.call('HSET', device_key, 'latest', epoch_us, 'offset', offset)
+        return true
+    end
+    return false
+end
+"""
+
+# KEYS: device hash, device set. ARGV: device capacity, device id.
+_CREATE_DEVICE_SCRIPT = _LUA_HELPERS + """
+if not create_device(KEYS[1], KEYS[2], tonumber(ARGV[1]), ARGV[2]) then
+    return redis.error_reply('Capacity exceeded')
+end
+return redis.call('HMGET', KEYS[1], 'count', 'latest', 'offset', 'version')
+"""
+
+# KEYS: dedupe key set, dedupe key order list. ARGV: key capacity, then the keys to check and add.
+_CHECK_AND_ADD_SCRIPT = _LUA_HELPERS + """
+local capacity = tonumber(ARGV[1])
+local added = {}
+for i = 2, #ARGV do
+    added[#added + 1] = check_and_add(KEYS[1], KEYS[2], capacity, ARGV[i])
+end
+return added
+"""
+
+# KEYS: device hash. ARGV: count.
+_INCREMENT_SCRIPT = """
+local count = redis.call('HINCRBY', KEYS[1], 'count', ARGV[1])
+redis.call('HINCRBY', KEYS[1], 'version', 1)
+return count
+"""
+
+# KEYS: device hash. ARGV: epoch microseconds, UTC offset.
+_UPDATE_LATEST_SCRIPT = _LUA_HELPERS + """
+if update_latest(KEYS[1], ARGV[1], ARGV[2]) then
+    redis.call('HINCRBY', KEYS[1], 'version', 1)
+end
+"""
+
+# KEYS: store ID key, device hash. ARGV: a new store ID, used if the store has none yet.
+_VERSION_SCRIPT = """
+local version = redis.call('HGET', KEYS[2], 'version')
+if not version then
+    return nil
+end
+local store_id = redis.call('GET', KEYS[1])
+if not store_id then
+    store_id = ARGV[1]
+    redis.call('SET', KEYS[1], store_id)
+end
+return store_id .. '-' .. version
+"""
+
+# KEYS: device hash, device set, dedupe key set, dedupe key order list.
+# ARGV: device capacity, key capacity, device id, then (epoch microseconds, count, UTC offset) per reading.
+_INGEST_SCRIPT = _LUA_HELPERS + """
+if not create_device(KEYS[1], KEYS[2], tonumber(ARGV[1]), ARGV[3]) then
+    return redis.error_reply('Capacity exceeded')
+end
+local capacity = tonumber(ARGV[2])
+local added = {}
+local total = 0
+local latest = nil
+local latest_offset = nil
+for i = 4, #ARGV, 3 do
+    local is_new = check_and_add(KEYS[3], KEYS[4], capacity, ARGV[3] .. '-' .. ARGV[i])
+    added[#added + 1] = is_new
+    if is_new == 1 then
+        total = total + tonumber(ARGV[i + 1])
+        if not latest or tonumber(ARGV[i]) > tonumber(latest) then
+            latest = ARGV[i]
+            latest_offset = ARGV[i + 2]
+        end
+    end
+end
+if latest then
+    redis.call('HINCRBY', KEYS[1], 'count', total)
+    redis.call('HINCRBY', KEYS[1], 'version', 1)
+    update_latest(KEYS[1], latest, latest_offset)
+end
+return added
+"""
+
+
+def _parse_latest(latest, offset):
+    """Convert the latest epoch and offset fields of a device hash to a datetime, or None if unset."""
+    if latest is None:
+        return None
+    return from_epoch_us(int(latest), int(offset) if offset is not None else NAIVE_OFFSET)
+
+
+class RedisDeviceReading(DeviceReadingIface):
+    """
+    Device reading stored in a Redis hash.
+
+    The count and latest timestamp are read when the reading is fetched. Updates are applied atomically on the
+    server and the local values are refreshed from the result.
+
+    Attributes:
+        device_id (uuid.UUID): The unique identifier of the device.
+        latest_timestamp (datetime.datetime): The most recent timestamp when a reading was recorded.
+        total_count (int): The cumulative count of readings for the device.
+        version (int): The number of updates of the device when it was fetched.
+    """
+    __slots__ = ("device_id", "latest_timestamp", "total_count", "version", "_store")
+
+    def __init__(self, store: "RedisStore", device_id: uuid.UUID, fields: list):
+        """
+        Initialize a RedisDeviceReading from the fields of its hash.
+
+        Args:
+            store (RedisStore): The store holding the device.
+            device_id (uuid.UUID): The unique identifier of the device.
+            fields (list): The `count`, `latest`, `offset` and `version` fields of the hash.
+        """
+        count, latest, offset, version = fields
+        self.device_id = device_id
+        self.total_count = int(count or 0)
+        self.latest_timestamp = _parse_latest(latest, offset)
+        self.version = int(version or 0)
+        self._store = store
+
+    def increment_count(self, count):
+        """
+        Atomically increment the total count of readings by the given count.
+
+        Args:
+            count (int): The number of readings to add to the total count.
+        """
+        self.total_count = self._store.increment(self.device_id, count)
+
+    def update_latest_timestamp(self, timestamp):
+        """
+        Atomically update the latest timestamp if the given timestamp is more recent.
+
+        Args:
+            timestamp (datetime.datetime): The new timestamp to set.
+        """
+        self._store.update_latest(self.device_id, to_epoch_us(timestamp), utc_offset_seconds(timestamp))
+        if not self.latest_timestamp or timestamp > self.latest_timestamp:
+            self.latest_timestamp = timestamp
+
+
+class RedisStore(DeviceStoreIface, TimeStampStoreIface, ReadingsIngestIface):
+    """
+    Device store and timestamp store kept in Redis, shared by every worker and host using the same server.
+
+    Every update runs in a server-side Lua script, so it is atomic without any client-side locking. When the
+    store is used as both device store and timestamp store, the service ingests a request through
+    `ingest_readings`: one script per device dedupes the readings, increments the count and updates the latest
+    timestamp, and the scripts of all devices of a request are sent in a single pipeline, so a request costs one
+    round trip. All keys share the `{prefix}` hash tag so they live in the same slot of a Redis Cluster.
+
+    Attributes:
+        client (redis.Redis): The client, backed by a connection pool.
+        device_capacity (int): The maximum number of devices.
+        ts_capacity (int): The maximum number of dedupe keys, the oldest being evicted first.
+        prefix (str): The prefix of every key.
+    """
+
+    def __init__(self, client: redis.Redis, device_capacity=100, ts_capacity=10000, prefix="device_readings"):
+        """
+        Initialize the RedisStore.
+
+        Args:
+            client (redis.Redis): The client, backed by a connection pool.
+            device_capacity (int): The maximum number of devices. Defaults to 100.
+            ts_capacity (int): The maximum number of dedupe keys. Defaults to 10000.
+            prefix (str): The prefix of every key. Defaults to "device_readings".
+        """
+        self.client = client
+        self.device_capacity = device_capacity
+        self.ts_capacity = ts_capacity
+        self.prefix = prefix
+        self._key_prefix = f"{{{prefix}}}:"
+        self._devices_key = self._key_prefix + "devices"
+        self._ts_key = self._key_prefix + "ts"
+        self._ts_order_key = self._key_prefix + "ts_order"
+        self._store_id_key = self._key_prefix + "store_id"
+        self._create_device = client.register_script(_CREATE_DEVICE_SCRIPT)
+        self._check_and_add = client.register_script(_CHECK_AND_ADD_SCRIPT)
+        self._increment = client.register_script(_INCREMENT_SCRIPT)
+        self._update_latest = client.register_script(_UPDATE_LATEST_SCRIPT)
+        self._get_version = client.register_script(_VERSION_SCRIPT)
+        self._ingest = client.register_script(_INGEST_SCRIPT)
+
+    @classmethod
+    def from_url(cls, url: str, max_connections=50, **kwargs) -> "RedisStore":
+        """
+        Create a RedisStore with a pooled client for the given server.
+
+        Args:
+            url (str): The URL of the Redis server, for example "redis://localhost:6379/0".
+            max_connections (int): The maximum number of pooled connections. Defaults to 50.
+            **kwargs: The other arguments of the store.
+
+        Returns:
+            RedisStore: The store.
+        """
+        pool = redis.ConnectionPool.from_url(url, max_connections=max_connections)
+        return cls(redis.Redis(connection_pool=pool), **kwargs)
+
+    def __repr__(self):
+        """
+        Return a string representation of the store.
+
+        Returns:
+            str: A string representing the store.
+        """
+        return f"RedisStore(prefix={self.prefix!r}, client={self.client!r})"
+
+    @property
+    def capacity(self) -> int:
+        """The maximum number of devices."""
+        return self.device_capacity
+
+    @property
+    def store_id(self) -> str:
+        """Identifies the contents of the store, for every client of the server. Drawn on first use after the
+        store is created or cleared."""
+        self.client.set(self._store_id_key, new_store_id(), nx=True)
+        return self.client.get(self._store_id_key).decode()
+
+    def device_key(self, device_id: uuid.UUID) -> str:
+        """Return the key of the hash of a device."""
+        return f"{self._key_prefix}device:{device_id}"
+
+    def get_or_create_device_reading(self, device_id: uuid.UUID) -> DeviceReadingIface:
+        """
+        Retrieve the device reading for the specified device, creating it if it doesn't exist.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+
+        Returns:
+            DeviceReadingIface: The device reading for the specified device.
+
+        Raises:
+            ValueError: If the device does not exist and the store is full.
+        """
+        try:
+            fields = self._create_device(keys=[self.device_key(device_id), self._devices_key],
+                                         args=[self.device_capacity, str(device_id)])
+        except redis.ResponseError as e:
+            raise ValueError(str(e)) from e
+        return RedisDeviceReading(self, device_id, fields)
+
+    def get_device_reading(self, device_id: uuid.UUID) -> DeviceReadingIface:
+        """
+        Retrieve the device reading for the specified device, if it exists.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+
+        Returns:
+            DeviceReadingIface: The device reading, or None if it does not exist.
+        """
+        fields = self.client.hmget(self.device_key(device_id), "count", "latest", "offset", "version")
+        if fields[0] is None:
+            return None
+        return RedisDeviceReading(self, device_id, fields)
+
+    def get_device_readings(self, device_ids: Iterable[uuid.UUID]
+                            ) -> Iterator[Tuple[uuid.UUID, Optional[DeviceReadingIface]]]:
+        """
+        Retrieve the device readings of many devices, with one round trip per thousand devices.
+
+        Args:
+            device_ids (Iterable[uuid.UUID]): The unique identifiers of the devices.
+
+        Returns:
+            Iterator[Tuple[uuid.UUID, Optional[DeviceReadingIface]]]: Each device ID, in order, with its device
+            reading or None if it does not exist.
+        """
+        device_ids = iter(device_ids)
+        while True:
+            page = list(islice(device_ids, 1000))
+            if not page:
+                return
+            pipeline = self.client.pipeline(transaction=False)
+            for device_id in page:
+                pipeline.hmget(self.device_key(device_id), "count", "latest", "offset", "version")
+            for device_id, fields in zip(page, pipeline.execute()):
+                yield device_id, (RedisDeviceReading(self, device_id, fields) if fields[0] is not None else None)
+
+    def get_device_version(self, device_id: uuid.UUID) -> Optional[str]:
+        """
+        Return a tag of the current values of a device in one round trip, without fetching them.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+
+        Returns:
+            Optional[str]: The store ID and the version of the device, or None if the device does not exist.
+        """
+        tag = self._get_version(keys=[self._store_id_key, self.device_key(device_id)], args=[new_store_id()])
+        return tag.decode() if tag is not None else None
+
+    def scan_devices(self, cursor: int, count: int) -> Tuple[int, List[uuid.UUID]]:
+        """
+        Return a page of the devices of the store with SSCAN, which may return a device more than once.
+
+        Args:
+            cursor (int): The cursor returned by the previous call, or 0 to start.
+            count (int): The number of devices to ask the server for. It may return more or fewer.
+
+        Returns:
+            Tuple[int, List[uuid.UUID]]: The cursor of the next page, or 0 once the scan is complete, and the
+            unique identifiers of the devices of the page.
+        """
+        cursor, members = self.client.sscan(self._devices_key, cursor=cursor, count=count)
+        return cursor, [uuid.UUID(member.decode()) for member in members]
+
+    def increment(self, device_id: uuid.UUID, count: int) -> int:
+        """
+        Add to the count of a device.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            count (int): The number of readings to add.
+
+        Returns:
+            int: The new count of the device.
+        """
+        return self._increment(keys=[self.device_key(device_id)], args=[count])
+
+    def update_latest(self, device_id: uuid.UUID, epoch_us: int, utc_offset: int):
+        """
+        Set the latest timestamp of a device if the given one is more recent.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            epoch_us (int): The timestamp in integer Unix epoch microseconds.
+            utc_offset (int): The UTC offset of the timestamp in seconds, or NAIVE_OFFSET.
+        """
+        self._update_latest(keys=[self.device_key(device_id)], args=[epoch_us, utc_offset])
+
+    def check_and_add_timestamp(self, device_id: uuid.UUID, timestamp: int) -> bool:
+        """
+        Check if a timestamp is present for the device and add it if not.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            timestamp (int): The timestamp in integer Unix epoch microseconds.
+
+        Returns:
+            bool: True if the timestamp was added, False if it was already present.
+        """
+        return self.check_and_add_timestamps(device_id, [timestamp])[0]
+
+    def check_and_add_timestamps(self, device_id: uuid.UUID, timestamps: List[int]) -> List[bool]:
+        """
+        Check and add several timestamps for a single device in one round trip.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            timestamps (List[int]): The timestamps in integer Unix epoch microseconds, in arrival order.
+
+        Returns:
+            List[bool]: One flag per timestamp, True if it was added, False if it was already present.
+        """
+        added = self._check_and_add(keys=[self._ts_key, self._ts_order_key],
+                                    args=[self.ts_capacity, *[f"{device_id}-{timestamp}" for timestamp in timestamps]])
+        return [bool(is_new) for is_new in added]
+
+    def ingest_readings(self, readings_by_device: Dict[uuid.UUID, List[IngestReading]]
+                        ) -> Dict[uuid.UUID, Tuple[List[bool], str]]:
+        """
+        Dedupe and apply the readings of each device with one script per device, all in a single round trip.
+
+        Args:
+            readings_by_device (Dict[uuid.UUID, List[IngestReading]]): The readings of each device, as
+                (epoch_us, count, utc_offset) in arrival order.
+
+        Returns:
+            Dict[uuid.UUID, Tuple[List[bool], str]]: For each device, one flag per reading that is True if the
+            reading was new, and an error message if the device could not be created (with no flags).
+        """
+        pipeline = self.client.pipeline(transaction=False)
+        for device_id, readings in readings_by_device.items():
+            args = [self.device_capacity, self.ts_capacity, str(device_id)]
+            for reading in readings:
+                args.extend(reading)
+            self._ingest(keys=[self.device_key(device_id), self._devices_key, self._ts_key, self._ts_order_key],
+                         args=args, client=pipeline)
+
+        results = {}
+        for device_id, added in zip(readings_by_device, pipeline.execute(raise_on_error=False)):
+            if isinstance(added, redis.ResponseError):
+                results[device_id] = ([], str(added))
+            elif isinstance(added, Exception):
+                raise added
+            else:
+                results[device_id] = ([bool(is_new) for is_new in added], "")
+        return results
+
+    def stats(self) -> dict:
+        """
+        Report the size of the store.
+
+        Returns:
+            dict: The number of devices and dedupe keys held, and the capacities.
+        """
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.scard(self._devices_key)
+        pipeline.scard(self._ts_key)
+        devices, size = pipeline.execute()
+        return {
+            "backend": "redis",
+            "devices": devices,
+            "device_capacity": self.device_capacity,
+            "size": size,
+            "capacity": self.ts_capacity,
+        }
+
+    def clear(self):
+        """Delete every key of the store, resetting it to an empty state."""
+        keys = list(self.client.scan_iter(match=self._key_prefix + "*", count=1000))
+        for start in range(0, len(keys), 1000):
+            self.client.delete(*keys[start:start + 1000])
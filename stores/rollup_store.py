@@ -0,0 +1,329 @@
+import sys
+import time
+import uuid
+from array import array
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Bucket sizes of the rollups in microseconds, by the name used in queries, from the finest to the coarsest.
+STEPS = {"minute": 60_000_000, "hour": 3_600_000_000, "day": 86_400_000_000}
+
+
+def _zeros(length: int) -> array:
+    """Return an int64 array of zeros."""
+    return array("q", bytes(8 * length))
+
+
+class BucketRing:
+    """
+    Counts of the most recent `retention` buckets of one size, in a ring indexed by bucket number modulo the
+    retention, with a Fenwick tree over the ring so that the sum of any range of buckets takes O(log n).
+
+    Buckets are numbered by `epoch_us // step_us`, so they are aligned on the Unix epoch in UTC. The ring moves
+    forward with the newest bucket seen; buckets falling out of it are cleared, and counts for buckets older
+    than the ring are dropped.
+
+    Attributes:
+        step_us (int): The size of a bucket in microseconds.
+        retention (int): The number of buckets kept.
+        newest (int): The number of the newest bucket, or None if nothing was added yet.
+    """
+    __slots__ = ("step_us", "retention", "newest", "_counts", "_tree")
+
+    def __init__(self, step_us: int, retention: int):
+        """
+        Initialize an empty ring.
+
+        Args:
+            step_us (int): The size of a bucket in microseconds.
+            retention (int): The number of buckets kept.
+        """
+        self.step_us = step_us
+        self.retention = retention
+        self.newest = None
+        self._counts = _zeros(retention)
+        self._tree = _zeros(retention + 1)
+
+    @property
+    def oldest(self) -> Optional[int]:
+        """The number of the oldest bucket kept, or None if nothing was added yet."""
+        if self.newest is None:
+            return None
+        return self.newest - self.retention + 1
+
+    def _update(self, position: int, delta: int):
+        """Add to the count of a ring position in the Fenwick tree."""
+        tree = self._tree
+        index = position + 1
+        while index <= self.retention:
+            tree[index] += delta
+            index += index & -index
+
+    def _prefix(self, position: int) -> int:
+        """Return the sum of the ring positions before the given one."""
+        tree = self._tree
+        total = 0
+        while position:
+            total += tree[position]
+            position -= position & -position
+        return total
+
+    def add(self, epoch_us: int, count: int):
+        """
+        Add a count to the bucket of a timestamp, moving the ring forward if it is newer than the newest bucket.
+
+        Args:
+            epoch_us (int): The timestamp in integer Unix epoch microseconds.
+            count (int): The count to add.
+        """
+        bucket = epoch_us // self.step_us
+        if self.newest is None or bucket - self.newest >= self.retention:
+            if self.newest is not None:
+                # Every bucket kept falls out of the ring
+                self._counts = _zeros(self.retention)
+                self._tree = _zeros(self.retention + 1)
+            self.newest = bucket
+        elif bucket > self.newest:
+            counts = self._counts
+            for cleared in range(self.newest + 1, bucket + 1):
+                position = cleared % self.retention
+                if counts[position]:
+                    self._update(position, -counts[position])
+                    counts[position] = 0
+            self.newest = bucket
+        elif bucket <= self.newest - self.retention:
+            return
+        position = bucket % self.retention
+        self._counts[position] += count
+        self._update(position, count)
+
+    def _clamp(self, first: int, last: int) -> Tuple[int, int]:
+        """Restrict a range of buckets to the buckets kept."""
+        if self.newest is None:
+            return 0, -1
+        return max(first, self.oldest), min(last, self.newest)
+
+    def sum(self, first: int, last: int) -> int:
+        """
+        Return the total count of a range of buckets, in O(log n).
+
+        Args:
+            first (int): The number of the first bucket.
+            last (int): The number of the last bucket, included.
+
+        Returns:
+            int: The total count of the buckets kept in the range.
+        """
+        first, last = self._clamp(first, last)
+        if first > last:
+            return 0
+        start, end = first % self.retention, last % self.retention
+        if start <= end:
+            return self._prefix(end + 1) - self._prefix(start)
+        # The range wraps around the end of the ring
+        return self._prefix(self.retention) - self._prefix(start) + self._prefix(end + 1)
+
+    def counts(self, first: int, last: int) -> List[Tuple[int, int]]:
+        """
+        Return the count of each bucket of a range.
+
+        Args:
+            first (int): The number of the first bucket.
+            last (int): The number of the last bucket, included.
+
+        Returns:
+            List[Tuple[int, int]]: The number and count of each bucket kept in the range, in order.
+        """
+        first, last = self._clamp(first, last)
+        counts = self._counts
+        return [(bucket, counts[bucket % self.retention]) for bucket in range(first, last + 1)]
+
+    def memory_usage(self) -> int:
+        """Return the size of the arrays of the ring in bytes."""
+        return sys.getsizeof(self._counts) + sys.getsizeof(self._tree)
+
+
+class RollupStore:
+    """
+    Per-device rollups of accepted counts in minute, hour and day buckets, for counts over time windows.
+
+    Each device gets a BucketRing per bucket size on its first reading, updated under a lock per device.
+    The retention of each bucket size is configurable, and a bucket size with no retention is disabled.
+
+    Rollups are kept for every device of the device store, and only dropped with their device, by `remove`
+    when the device store evicts it. A device loaded back from a spill tier starts new rollups with `restart`,
+    which records since when they cover the readings of the device, so its earlier buckets are not mistaken
+    for buckets without readings.
+
+    Readings more than `max_future_s` seconds ahead of the clock are left out of the rollups, so one reading
+    with a wrong clock cannot move the rings forward and clear every bucket of the device.
+
+    Attributes:
+        retentions (Dict[str, int]): The number of buckets kept for each enabled bucket size.
+        max_future_s (float): How far ahead of the clock a reading can be and still be added.
+        ignored (int): The number of readings left out because they were too far ahead of the clock.
+    """
+
+    def __init__(self, retentions: Dict[str, int], max_future_s: float = 3600.0,
+                 clock: Callable[[], float] = time.time):
+        """
+        Initialize an empty RollupStore.
+
+        Args:
+            retentions (Dict[str, int]): The number of buckets kept for each bucket size in STEPS. Bucket
+                sizes with a retention of 0 are disabled.
+            max_future_s (float): How far ahead of the clock a reading can be and still be added, in seconds.
+                Defaults to an hour.
+            clock (Callable[[], float]): Returns the current Unix time in seconds. Defaults to `time.time`.
+
+        Raises:
+            ValueError: If a bucket size is unknown or every bucket size is disabled.
+        """
+        unknown = set(retentions) - set(STEPS)
+        if unknown:
+            raise ValueError(f"Unknown rollup steps: {', '.join(sorted(unknown))}")
+        self.retentions = {step: retentions[step] for step in STEPS if retentions.get(step, 0) > 0}
+        if not self.retentions:
+            raise ValueError("At least one rollup step must have a retention")
+        self.max_future_s = max_future_s
+        self.ignored = 0
+        self._clock = clock
+        self._lock = Lock()  # Serialises the creation and removal of the rollups of devices
+        self._init_store()
+
+    def _init_store(self):
+        """Initialize/Reset the rollups of every device."""
+        self.devices = {}
+
+    def _new_entry(self, since_us: Optional[int] = None) -> tuple:
+        """Return the lock, the rings and the start of the coverage of the rollups of a device."""
+        return Lock(), [BucketRing(STEPS[step], retention) for step, retention in self.retentions.items()], since_us
+
+    def add(self, device_id: uuid.UUID, readings: Iterable[Tuple[int, int]]):
+        """
+        Add accepted readings to the rollups of a device.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            readings (Iterable[Tuple[int, int]]): The (epoch_us, count) of each reading.
+        """
+        entry = self.devices.get(device_id)
+        if entry is None:
+            with self._lock:
+                entry = self.devices.get(device_id)
+                if entry is None:
+                    entry = self.devices[device_id] = self._new_entry()
+        lock, rings, _ = entry
+        max_epoch_us = int((self._clock() + self.max_future_s) * 1_000_000)
+        ignored = 0
+        with lock:
+            for epoch_us, count in readings:
+                if epoch_us > max_epoch_us:
+                    ignored += 1
+                    continue
+                for ring in rings:
+                    ring.add(epoch_us, count)
+        if ignored:
+            with self._lock:
+                self.ignored += ignored
+
+    def remove(self, device_id: uuid.UUID):
+        """
+        Drop the rollups of a device, if any.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+        """
+        with self._lock:
+            self.devices.pop(device_id, None)
+
+    def restart(self, device_id: uuid.UUID):
+        """
+        Start new rollups for a device whose earlier rollups were dropped, covering its readings from now on.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+        """
+        with self._lock:
+            self.devices[device_id] = self._new_entry(since_us=int(self._clock() * 1_000_000))
+
+    def choose_step(self, device_id: uuid.UUID, start_us: int) -> str:
+        """
+        Return the finest bucket size whose retention covers a start time for the device, or the coarsest one.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            start_us (int): The start time in integer Unix epoch microseconds.
+
+        Returns:
+            str: The name of the bucket size.
+        """
+        entry = self.devices.get(device_id)
+        steps = list(self.retentions)
+        if entry is None:
+            return steps[0]
+        lock, rings, _ = entry
+        with lock:
+            for step, ring in zip(steps, rings):
+                if ring.newest is None or start_us // ring.step_us >= ring.oldest:
+                    return step
+        return steps[-1]
+
+    def get_counts(self, device_id: uuid.UUID, start_us: int, end_us: int, step: str
+                   ) -> Tuple[int, List[Tuple[int, int]], Optional[int]]:
+        """
+        Return the total count and the count per bucket of a device over a time range.
+
+        The range covers the buckets from the one containing `start_us` to the one containing the microsecond
+        before `end_us`. Buckets older than the retention of the bucket size, or newer than the newest reading,
+        are not returned. If the rollups of the device were restarted, buckets before the restart only hold the
+        readings received since, and the time of the restart is returned with the counts.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            start_us (int): The start of the range in integer Unix epoch microseconds, included.
+            end_us (int): The end of the range in integer Unix epoch microseconds, excluded.
+            step (str): The name of the bucket size.
+
+        Returns:
+            Tuple[int, List[Tuple[int, int]], Optional[int]]: The total count, the start in epoch microseconds
+            and the count of each bucket, and the time in epoch microseconds since when the rollups cover the
+            readings of the device, or None if they cover all of them.
+
+        Raises:
+            ValueError: If the bucket size is unknown or disabled.
+        """
+        if step not in self.retentions:
+            raise ValueError(f"Rollups by {step} are not enabled")
+        entry = self.devices.get(device_id)
+        if entry is None:
+            return 0, [], None
+        lock, rings, since_us = entry
+        ring = rings[list(self.retentions).index(step)]
+        first, last = start_us // ring.step_us, (end_us - 1) // ring.step_us
+        with lock:
+            total = ring.sum(first, last)
+            counts = ring.counts(first, last)
+        return total, [(bucket * ring.step_us, count) for bucket, count in counts], since_us
+
+    def stats(self) -> dict:
+        """
+        Report the size of the rollups.
+
+        Returns:
+            dict: The retention of each bucket size, the number of devices, the number of readings left out
+            because they were too far ahead of the clock and the memory held by the rings.
+        """
+        with self._lock:
+            rings = [ring for _, device_rings, _ in self.devices.values() for ring in device_rings]
+        return {
+            "retentions": self.retentions,
+            "devices": len(self.devices),
+            "ignored": self.ignored,
+            "bytes": sum(ring.memory_usage() for ring in rings),
+        }
+
+    def clear(self):
+        """Clear the rollups of every device."""
+        with self._lock:
+            self._init_store()
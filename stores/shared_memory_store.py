@@ -0,0 +1,518 @@
+import fcntl
+import os
+import secrets
+import struct
+import tempfile
+import uuid
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from threading import Lock
+from typing import Dict, List, Tuple
+
+from stores.device_store import DeviceReadingIface, DeviceStoreIface
+from stores.epoch import NAIVE_OFFSET, from_epoch_us, to_epoch_us, utc_offset_seconds
+from stores.ingest import IngestReading, ReadingsIngestIface
+from stores.ts_store import TimeStampStoreIface
+
+# Sentinel epoch value for devices without a reading yet.
+NO_TIMESTAMP = -2 ** 63
+
+# Segment header: magic bytes, device capacity, device table slots, dedupe keys per partition, key table slots
+# per partition, number of stripes and number of devices, followed by the store ID, a random number drawn when
+# the segment is created or cleared. It is padded to HEADER_SIZE bytes.
+HEADER = struct.Struct("<8sqqqqqq")
+HEADER_SIZE = 64
+MAGIC = b"DRSHM002"
+_DEVICE_COUNT = struct.Struct("<q")
+_DEVICE_COUNT_OFFSET = 48
+_STORE_ID = struct.Struct("<q")
+_STORE_ID_OFFSET = 56
+
+# Device table slot: device UUID bytes, count, latest epoch microseconds, version, UTC offset of the latest
+# timestamp and a used flag, set last so that a slot is only visible once it is initialised.
+DEVICE_SLOT = struct.Struct("<16sqqqii")
+_DEVICE_VALUES = struct.Struct("<qqqi")
+_DEVICE_VALUES_OFFSET = 16
+_USED = struct.Struct("<i")
+_USED_OFFSET = 44
+
+# Dedupe key partition: a header with the next ring position and the number of keys, a ring of the keys in
+# insertion order for eviction, then the key table slots (device UUID bytes, epoch microseconds, used flag).
+PARTITION_HEADER = struct.Struct("<qq")
+RING_ENTRY = struct.Struct("<16sq")
+KEY_SLOT = struct.Struct("<16sqq")
+_EMPTY_DEVICE = bytes(16)
+
+
+def _table_slots(entries: int) -> int:
+    """Return the number of slots of an open-addressing table holding the given entries at half load or less."""
+    slots = 8
+    while slots < 2 * entries:
+        slots *= 2
+    return slots
+
+
+class _ProcessLock:
+    """
+    Lock excluding both the other threads of the process and the other processes using the same lock file.
+
+    POSIX record locks are held per process, so a thread lock is taken first to exclude the other threads.
+    """
+    __slots__ = ("_thread_lock", "_fd", "_offset")
+
+    def __init__(self, fd: int, offset: int):
+        """
+        Initialize a lock over one byte of a lock file.
+
+        Args:
+            fd (int): The descriptor of the lock file.
+            offset (int): The byte of the file locked.
+        """
+        self._thread_lock = Lock()
+        self._fd = fd
+        self._offset = offset
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, self._offset)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+
+    def __exit__(self, *exc_info):
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, self._offset)
+        self._thread_lock.release()
+
+
+class SharedMemoryDeviceReading(DeviceReadingIface):
+    """
+    Lightweight view over the slot of a device in a SharedMemoryStore.
+
+    The view holds no state of its own: counts and timestamps are read from and written to shared memory under
+    the stripe lock of the device.
+
+    Attributes:
+        device_id (uuid.UUID): The unique identifier of the device.
+    """
+    __slots__ = ("device_id", "_store", "_offset", "_stripe")
+
+    def __init__(self, store: "SharedMemoryStore", device_id: uuid.UUID, offset: int):
+        """
+        Initialize a view over a slot.
+
+        Args:
+            store (SharedMemoryStore): The store holding the slot.
+            device_id (uuid.UUID): The unique identifier of the device.
+            offset (int): The offset of the slot in the segment.
+        """
+        self.device_id = device_id
+        self._store = store
+        self._offset = offset
+        self._stripe = device_id.int % store.stripes
+
+    @property
+    def total_count(self) -> int:
+        """The cumulative count of readings for the device."""
+        return self._store._read_device(self._offset, self._stripe)[0]
+
+    @property
+    def latest_timestamp(self):
+        """The most recent timestamp when a reading was recorded, or None if there is no reading yet."""
+        _, epoch_us, _, utc_offset = self._store._read_device(self._offset, self._stripe)
+        if epoch_us == NO_TIMESTAMP:
+            return None
+        return from_epoch_us(epoch_us, utc_offset)
+
+    @property
+    def version(self) -> int:
+        """The number of updates of the count and latest timestamp."""
+        return self._store._read_device(self._offset, self._stripe)[2]
+
+    def increment_count(self, count):
+        """
+        Atomically increment the total count of readings by the given count.
+
+        Args:
+            count (int): The number of readings to add to the total count.
+        """
+        self._store._update_device(self._offset, self._stripe, count, NO_TIMESTAMP, NAIVE_OFFSET)
+
+    def update_latest_timestamp(self, timestamp):
+        """
+        Atomically update the latest timestamp if the given timestamp is more recent.
+
+        Args:
+            timestamp (datetime.datetime): The new timestamp to set.
+        """
+        self._store._update_device(self._offset, self._stripe, 0, to_epoch_us(timestamp),
+                                   utc_offset_seconds(timestamp))
+
+
+class SharedMemoryStore(DeviceStoreIface, TimeStampStoreIface, ReadingsIngestIface):
+    """
+    Device store and timestamp store kept in a named shared memory segment, so that every worker process on
+    the host (for example with `uvicorn main:app --workers N`) sees the same devices and dedupe history.
+
+    The segment holds fixed-size open-addressing tables with linear probing: one table of device slots, and
+    one table of dedupe keys per stripe, with a ring of the keys in insertion order so that the oldest key of
+    the stripe is evicted once it is full. Devices are assigned to one of `stripes` stripes, and the slot and
+    dedupe keys of a device are only updated under the lock of its stripe. Locks are byte-range locks on a lock
+    file next to the segment, combined with thread locks. New devices are inserted under a global lock and
+    never move, so lookups take no lock.
+
+    The first process creates the segment and the others attach to it. The segment outlives the processes: it
+    is removed with `unlink`, and is otherwise reused, with its data, by the next process with the same name.
+
+    Attributes:
+        name (str): The name of the shared memory segment.
+        device_capacity (int): The maximum number of devices.
+        ts_capacity (int): The maximum number of dedupe keys, split evenly between the stripes.
+        stripes (int): The number of stripes.
+    """
+
+    def __init__(self, name="device_readings", device_capacity=100, ts_capacity=10000, stripes=16):
+        """
+        Create the shared memory segment, or attach to it if another process created it.
+
+        Args:
+            name (str): The name of the shared memory segment. Defaults to "device_readings".
+            device_capacity (int): The maximum number of devices. Defaults to 100.
+            ts_capacity (int): The maximum number of dedupe keys. Defaults to 10000.
+            stripes (int): The number of stripes. Defaults to 16.
+
+        Raises:
+            ValueError: If the existing segment was created with a different layout.
+        """
+        self.name = name
+        self.device_capacity = device_capacity
+        self.stripes = stripes
+        self.device_slots = _table_slots(device_capacity)
+        self.key_capacity = max(1, -(-ts_capacity // stripes))
+        self.key_slots = _table_slots(self.key_capacity)
+        self.ts_capacity = self.key_capacity * stripes
+        self._devices_offset = HEADER_SIZE
+        self._partitions_offset = HEADER_SIZE + self.device_slots * DEVICE_SLOT.size
+        self._partition_size = (PARTITION_HEADER.size + self.key_capacity * RING_ENTRY.size
+                                + self.key_slots * KEY_SLOT.size)
+        size = self._partitions_offset + stripes * self._partition_size
+
+        self._lock_path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+        self._lock_fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._lock = _ProcessLock(self._lock_fd, 0)  # Serialises the creation of devices and of the segment
+        self._locks = [_ProcessLock(self._lock_fd, stripe + 1) for stripe in range(stripes)]
+        layout = (MAGIC, device_capacity, self.device_slots, self.key_capacity, self.key_slots, stripes)
+        with self._lock:
+            try:
+                self._shm = SharedMemory(name=name, create=True, size=size)
+                HEADER.pack_into(self._shm.buf, 0, *layout, 0)
+                _STORE_ID.pack_into(self._shm.buf, _STORE_ID_OFFSET, secrets.randbits(63))
+            except FileExistsError:
+                self._shm = SharedMemory(name=name)
+            # The segment is shared by processes that may exit in any order, so it must not be removed when the
+            # process that opened it exits
+            resource_tracker.unregister(self._shm._name, "shared_memory")
+        self._buf = self._shm.buf
+        if HEADER.unpack_from(self._buf, 0)[:-1] != layout:
+            self.close()
+            raise ValueError(f"Shared memory segment {name} was created with a different layout")
+
+    def __repr__(self):
+        """
+        Return a string representation of the store.
+
+        Returns:
+            str: A string representing the store.
+        """
+        return f"SharedMemoryStore(name={self.name!r}, devices={len(self)})"
+
+    def __len__(self):
+        """Return the number of devices in the store."""
+        return _DEVICE_COUNT.unpack_from(self._buf, _DEVICE_COUNT_OFFSET)[0]
+
+    @property
+    def capacity(self) -> int:
+        """The maximum number of devices."""
+        return self.device_capacity
+
+    @property
+    def store_id(self) -> str:
+        """Identifies the contents of the segment, for every process attached to it."""
+        return f"{_STORE_ID.unpack_from(self._buf, _STORE_ID_OFFSET)[0]:016x}"
+
+    def _probe_device(self, device_id: uuid.UUID) -> Tuple[int, bool]:
+        """Return the offset of the slot of a device, or of the free slot it would take, and whether it exists."""
+        buf = self._buf
+        device_key = device_id.bytes
+        mask = self.device_slots - 1
+        index = hash(device_id.int) & mask
+        while True:
+            offset = self._devices_offset + index * DEVICE_SLOT.size
+            device, _, _, _, _, used = DEVICE_SLOT.unpack_from(buf, offset)
+            if not used:
+                return offset, False
+            if device == device_key:
+                return offset, True
+            index = (index + 1) & mask
+
+    def _find_or_create_device(self, device_id: uuid.UUID) -> int:
+        """Return the offset of the slot of a device, creating it if needed."""
+        offset, found = self._probe_device(device_id)
+        if found:
+            return offset
+        with self._lock:
+            # Another process may have created the device while we were waiting for the lock
+            offset, found = self._probe_device(device_id)
+            if not found:
+                devices = len(self)
+                if devices >= self.device_capacity:
+                    raise ValueError("Capacity exceeded")
+                DEVICE_SLOT.pack_into(self._buf, offset, device_id.bytes, 0, NO_TIMESTAMP, 0, NAIVE_OFFSET, 0)
+                _USED.pack_into(self._buf, offset + _USED_OFFSET, 1)
+                _DEVICE_COUNT.pack_into(self._buf, _DEVICE_COUNT_OFFSET, devices + 1)
+        return offset
+
+    def _read_device(self, offset: int, stripe: int) -> Tuple[int, int, int, int]:
+        """Read the count, latest epoch, version and UTC offset of a slot."""
+        with self._locks[stripe]:
+            return _DEVICE_VALUES.unpack_from(self._buf, offset + _DEVICE_VALUES_OFFSET)
+
+    def _update_device(self, offset: int, stripe: int, count: int, epoch_us: int, utc_offset: int):
+        """
+        Add to the count of a slot and set its latest timestamp if the given one is more recent, incrementing the
+        version if either changes.
+        """
+        with self._locks[stripe]:
+            total, latest, version, latest_offset = _DEVICE_VALUES.unpack_from(self._buf,
+                                                                               offset + _DEVICE_VALUES_OFFSET)
+            if count or epoch_us > latest:
+                version += 1
+            if epoch_us > latest:
+                latest, latest_offset = epoch_us, utc_offset
+            _DEVICE_VALUES.pack_into(self._buf, offset + _DEVICE_VALUES_OFFSET, total + count, latest, version,
+                                     latest_offset)
+
+    def get_or_create_device_reading(self, device_id: uuid.UUID) -> DeviceReadingIface:
+        """
+        Retrieve a view over the slot of the specified device, creating the slot if it doesn't exist.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+
+        Returns:
+            DeviceReadingIface: The device reading view for the specified device.
+
+        Raises:
+            ValueError: If the device does not exist and the store is full.
+        """
+        return SharedMemoryDeviceReading(self, device_id, self._find_or_create_device(device_id))
+
+    def get_device_reading(self, device_id: uuid.UUID) -> DeviceReadingIface:
+        """
+        Retrieve a view over the slot of the specified device, if it exists.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+
+        Returns:
+            DeviceReadingIface: The device reading view, or None if it does not exist.
+        """
+        offset, found = self._probe_device(device_id)
+        if not found:
+            return None
+        return SharedMemoryDeviceReading(self, device_id, offset)
+
+    def scan_devices(self, cursor: int, count: int) -> Tuple[int, List[uuid.UUID]]:
+        """
+        Return a page of the devices of the store, in the order of their slots in the device table.
+
+        The cursor is the index of the next slot to read. Devices never move, so it stays valid.
+
+        Args:
+            cursor (int): The cursor returned by the previous call, or 0 to start.
+            count (int): The maximum number of devices to return.
+
+        Returns:
+            Tuple[int, List[uuid.UUID]]: The cursor of the next page, or 0 once the scan is complete, and the
+            unique identifiers of the devices of the page.
+        """
+        buf = self._buf
+        device_ids = []
+        index = cursor
+        while index < self.device_slots and len(device_ids) < count:
+            device, _, _, _, _, used = DEVICE_SLOT.unpack_from(buf, self._devices_offset + index * DEVICE_SLOT.size)
+            if used:
+                device_ids.append(uuid.UUID(bytes=device))
+            index += 1
+        return (index if index < self.device_slots else 0), device_ids
+
+    def _key_home(self, device_key: bytes, epoch_us: int) -> int:
+        """Return the home slot of a dedupe key. Hashes of integers are the same in every process."""
+        return hash((int.from_bytes(device_key, "big"), epoch_us)) & (self.key_slots - 1)
+
+    def _probe_key(self, table: int, device_key: bytes, epoch_us: int) -> Tuple[int, bool]:
+        """Return the index of the slot of a dedupe key, or of the free slot it would take, and whether it exists."""
+        buf = self._buf
+        mask = self.key_slots - 1
+        index = self._key_home(device_key, epoch_us)
+        while True:
+            device, epoch, used = KEY_SLOT.unpack_from(buf, table + index * KEY_SLOT.size)
+            if not used:
+                return index, False
+            if epoch == epoch_us and device == device_key:
+                return index, True
+            index = (index + 1) & mask
+
+    def _remove_key(self, table: int, device_key: bytes, epoch_us: int):
+        """Remove a dedupe key, shifting back the keys after it so that no probe sequence is broken."""
+        buf = self._buf
+        mask = self.key_slots - 1
+        hole, found = self._probe_key(table, device_key, epoch_us)
+        if not found:
+            return
+        index = hole
+        while True:
+            index = (index + 1) & mask
+            device, epoch, used = KEY_SLOT.unpack_from(buf, table + index * KEY_SLOT.size)
+            if not used:
+                break
+            # A key can fill the hole if the hole lies between its home slot and its current slot
+            if (index - self._key_home(device, epoch)) & mask >= (index - hole) & mask:
+                KEY_SLOT.pack_into(buf, table + hole * KEY_SLOT.size, device, epoch, 1)
+                hole = index
+        KEY_SLOT.pack_into(buf, table + hole * KEY_SLOT.size, _EMPTY_DEVICE, 0, 0)
+
+    def _check_and_add(self, partition: int, device_key: bytes, epoch_us: int) -> bool:
+        """Check if a dedupe key is in a partition and add it if not, evicting the oldest key when it is full."""
+        buf = self._buf
+        ring = partition + PARTITION_HEADER.size
+        table = ring + self.key_capacity * RING_ENTRY.size
+        index, found = self._probe_key(table, device_key, epoch_us)
+        if found:
+            return False
+        head, size = PARTITION_HEADER.unpack_from(buf, partition)
+        if size == self.key_capacity:
+            self._remove_key(table, *RING_ENTRY.unpack_from(buf, ring + head * RING_ENTRY.size))
+            # Removing the oldest key may shift the keys of the probe sequence
+            index, _ = self._probe_key(table, device_key, epoch_us)
+        else:
+            size += 1
+        KEY_SLOT.pack_into(buf, table + index * KEY_SLOT.size, device_key, epoch_us, 1)
+        RING_ENTRY.pack_into(buf, ring + head * RING_ENTRY.size, device_key, epoch_us)
+        PARTITION_HEADER.pack_into(buf, partition, (head + 1) % self.key_capacity, size)
+        return True
+
+    def check_and_add_timestamp(self, device_id: uuid.UUID, timestamp: int) -> bool:
+        """
+        Check if a timestamp is present for the device and add it if not.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            timestamp (int): The timestamp in integer Unix epoch microseconds.
+
+        Returns:
+            bool: True if the timestamp was added, False if it was already present.
+        """
+        return self.check_and_add_timestamps(device_id, [timestamp])[0]
+
+    def check_and_add_timestamps(self, device_id: uuid.UUID, timestamps: List[int]) -> List[bool]:
+        """
+        Check and add several timestamps for a single device under one acquisition of its stripe lock.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            timestamps (List[int]): The timestamps in integer Unix epoch microseconds, in arrival order.
+
+        Returns:
+            List[bool]: One flag per timestamp, True if it was added, False if it was already present.
+        """
+        stripe = device_id.int % self.stripes
+        partition = self._partitions_offset + stripe * self._partition_size
+        device_key = device_id.bytes
+        with self._locks[stripe]:
+            return [self._check_and_add(partition, device_key, timestamp) for timestamp in timestamps]
+
+    def ingest_readings(self, readings_by_device: Dict[uuid.UUID, List[IngestReading]]
+                        ) -> Dict[uuid.UUID, Tuple[List[bool], str]]:
+        """
+        Dedupe and apply the readings of each device under one acquisition of its stripe lock.
+
+        Args:
+            readings_by_device (Dict[uuid.UUID, List[IngestReading]]): The readings of each device, as
+                (epoch_us, count, utc_offset) in arrival order.
+
+        Returns:
+            Dict[uuid.UUID, Tuple[List[bool], str]]: For each device, one flag per reading that is True if the
+            reading was new, and an error message if the device could not be created (with no flags).
+        """
+        buf = self._buf
+        results = {}
+        for device_id, readings in readings_by_device.items():
+            try:
+                offset = self._find_or_create_device(device_id) + _DEVICE_VALUES_OFFSET
+            except ValueError as e:
+                results[device_id] = ([], str(e))
+                continue
+            stripe = device_id.int % self.stripes
+            partition = self._partitions_offset + stripe * self._partition_size
+            device_key = device_id.bytes
+            added = []
+            with self._locks[stripe]:
+                total, latest, version, latest_offset = _DEVICE_VALUES.unpack_from(buf, offset)
+                for epoch_us, count, utc_offset in readings:
+                    is_new = self._check_and_add(partition, device_key, epoch_us)
+                    added.append(is_new)
+                    if is_new:
+                        total += count
+                        if epoch_us > latest:
+                            latest, latest_offset = epoch_us, utc_offset
+                if any(added):
+                    _DEVICE_VALUES.pack_into(buf, offset, total, latest, version + 1, latest_offset)
+            results[device_id] = (added, "")
+        return results
+
+    def stats(self) -> dict:
+        """
+        Report the size of the store.
+
+        Returns:
+            dict: The number of devices and dedupe keys held, the capacities and the size of the segment.
+        """
+        size = sum(PARTITION_HEADER.unpack_from(self._buf, self._partitions_offset + stripe * self._partition_size)[1]
+                   for stripe in range(self.stripes))
+        return {
+            "backend": "shared",
+            "devices": len(self),
+            "device_capacity": self.device_capacity,
+            "size": size,
+            "capacity": self.ts_capacity,
+            "stripes": self.stripes,
+            "segment_bytes": self._shm.size,
+        }
+
+    def clear(self):
+        """Clear all devices and dedupe keys from the store, for every process attached to it."""
+        with self._lock:
+            for lock in self._locks:
+                lock.__enter__()
+            try:
+                self._buf[HEADER_SIZE:] = bytes(len(self._buf) - HEADER_SIZE)
+                _DEVICE_COUNT.pack_into(self._buf, _DEVICE_COUNT_OFFSET, 0)
+                _STORE_ID.pack_into(self._buf, _STORE_ID_OFFSET, secrets.randbits(63))
+            finally:
+                for lock in reversed(self._locks):
+                    lock.__exit__(None, None, None)
+
+    def close(self):
+        """Detach from the segment, leaving it to the other processes."""
+        self._buf = None
+        self._shm.close()
+        os.close(self._lock_fd)
+
+    def unlink(self):
+        """Remove the segment and its lock file, once every process is done with them. The store must be closed
+        afterwards."""
+        # Registered again only for `unlink` to unregister it
+        resource_tracker.register(self._shm._name, "shared_memory")
+        self._shm.unlink()
+        os.unlink(self._lock_path)
@@ -0,0 +1,179 @@
+import uuid
+from typing import List, Tuple
+
+from stores.device_store import DeviceReadingIface, DeviceStoreIface, ScanIndex, new_store_id
+
+
+class CapacityBudget:
+    """
+    Device capacity shared by several single-writer stores.
+
+    Stores drawing from the same budget must all be written from the same thread, for example by tasks on
+    one event loop, so the budget needs no lock.
+
+    Attributes:
+        capacity (int): The maximum number of devices across all the stores.
+        used (int): The number of devices admitted so far.
+    """
+    __slots__ = ("capacity", "used")
+
+    def __init__(self, capacity: int):
+        """
+        Initialize an unused CapacityBudget.
+
+        Args:
+            capacity (int): The maximum number of devices across all the stores.
+        """
+        self.capacity = capacity
+        self.used = 0
+
+    def reserve(self):
+        """
+        Reserve room for one device.
+
+        Raises:
+            ValueError: If the budget is exhausted.
+        """
+        if self.used >= self.capacity:
+            raise ValueError("Capacity exceeded")
+        self.used += 1
+
+    def release(self, count: int):
+        """
+        Give back room for the given number of devices.
+
+        Args:
+            count (int): The number of devices removed.
+        """
+        self.used -= count
+
+
+class SingleWriterDeviceReading(DeviceReadingIface):
+    """
+    Device reading without any locking, owned by a single writer.
+
+    Attributes:
+        device_id (uuid.UUID): The unique identifier of the device.
+        latest_timestamp (datetime.datetime): The most recent timestamp when a reading was recorded.
+        total_count (int): The cumulative count of readings for the device.
+        version (int): The number of updates of the count and latest timestamp.
+    """
+    __slots__ = ("device_id", "latest_timestamp", "total_count", "version")
+
+    def __init__(self, device_id: uuid.UUID):
+        """
+        Initialize an empty SingleWriterDeviceReading.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+        """
+        self.device_id = device_id
+        self.latest_timestamp = None
+        self.total_count = 0
+        self.version = 0
+
+    def increment_count(self, count):
+        """
+        Increment the total count of readings by the given count.
+
+        Args:
+            count (int): The number of readings to add to the total count.
+        """
+        self.total_count += count
+        self.version += 1
+
+    def update_latest_timestamp(self, timestamp):
+        """
+        Update the latest timestamp if the given timestamp is more recent.
+
+        Args:
+            timestamp (datetime.datetime): The new timestamp to set.
+        """
+        if not self.latest_timestamp or timestamp > self.latest_timestamp:
+            self.latest_timestamp = timestamp
+            self.version += 1
+
+
+class SingleWriterDeviceStore(DeviceStoreIface):
+    """
+    Device store without any locking, for a shard owned by a single writer task.
+
+    The store must only be written from one thread at a time. Several stores can share a CapacityBudget so that
+    the capacity applies across all shards.
+
+    Attributes:
+        budget (CapacityBudget): The device capacity the store draws from.
+    """
+
+    def __init__(self, capacity=100, budget: CapacityBudget = None):
+        """
+        Initialize the SingleWriterDeviceStore.
+
+        Args:
+            capacity (int): The maximum number of devices, used when no budget is given.
+            budget (CapacityBudget): The device capacity shared with other stores. Defaults to a budget of
+                `capacity` devices owned by this store.
+        """
+        self.budget = budget if budget is not None else CapacityBudget(capacity)
+        self._init_store()
+
+    def _init_store(self):
+        """Initialize/Reset the dictionary of device readings and their scan order."""
+        self.store_id = new_store_id()
+        self.store = {}
+        self._scan_index = ScanIndex()
+
+    def __len__(self):
+        """Return the number of devices in the store."""
+        return len(self.store)
+
+    def get_or_create_device_reading(self, device_id: uuid.UUID) -> DeviceReadingIface:
+        """
+        Retrieve the device reading for the specified device, creating it if it doesn't exist.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+
+        Returns:
+            DeviceReadingIface: The device reading for the specified device.
+
+        Raises:
+            ValueError: If the device does not exist and the capacity is exhausted.
+        """
+        device_reading = self.store.get(device_id)
+        if device_reading is None:
+            self.budget.reserve()
+            device_reading = self.store[device_id] = SingleWriterDeviceReading(device_id)
+            self._scan_index.add(device_id)
+        return device_reading
+
+    def get_device_reading(self, device_id: uuid.UUID) -> DeviceReadingIface:
+        """
+        Retrieve the device reading for the specified device, if it exists.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+
+        Returns:
+            DeviceReadingIface: The device reading, or None if it does not exist.
+        """
+        return self.store.get(device_id)
+
+    def scan_devices(self, cursor: int, count: int) -> Tuple[int, List[uuid.UUID]]:
+        """
+        Return a page of the devices of the store, in insertion order.
+
+        Args:
+            cursor (int): The cursor returned by the previous call, or 0 to start.
+            count (int): The maximum number of devices to return.
+
+        Returns:
+            Tuple[int, List[uuid.UUID]]: The cursor of the next page, or 0 once the scan is complete, and the
+            unique identifiers of the devices of the page.
+        """
+        return self._scan_index.scan(cursor, count)
+
+    def clear(self):
+        """Clear all devices from the store and give their room back to the budget."""
+        self.budget.release(len(self.store))
+        self._init_store()
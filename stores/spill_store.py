@@ -0,0 +1,120 @@
+import os
+import sqlite3
+import uuid
+from threading import Lock
+from typing import List, Optional, Tuple
+
+from .epoch import from_epoch_us, to_epoch_us, utc_offset_seconds
+from .in_mem_device_store import DeviceReading
+
+
+class SqliteSpillStore:
+    """
+    On-disk tier of a device store, holding the devices evicted from memory in a local SQLite database.
+
+    Each device is held by one tier at a time: it is written here when it is evicted and removed when it is
+    loaded back. The latest timestamp is kept as epoch microseconds and a UTC offset, so it is restored with its
+    original offset, and the version is kept so ETags stay valid across an eviction.
+
+    Attributes:
+        path (str): The path of the database file.
+    """
+
+    def __init__(self, path: str):
+        """
+        Open the SQLite database at the given path, creating it if needed.
+
+        Args:
+            path (str): The path of the database file, or ":memory:" for a database that is not persisted.
+        """
+        self.path = path
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # The spill tier is a cache of evicted state, so a crash may lose the last writes but must not corrupt it
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS devices (id BLOB PRIMARY KEY, total_count INTEGER NOT NULL, "
+                         "latest_epoch_us INTEGER, utc_offset INTEGER, version INTEGER NOT NULL)")
+        self._lock = Lock()  # Serialises the use of the connection
+
+    def __len__(self):
+        """Return the number of devices in the spill tier."""
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM devices").fetchone()[0]
+
+    def put(self, device_id: uuid.UUID, device_reading: DeviceReading):
+        """
+        Write the state of an evicted device.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            device_reading (DeviceReading): The device reading evicted from memory.
+        """
+        timestamp = device_reading.latest_timestamp
+        latest_epoch_us = to_epoch_us(timestamp) if timestamp is not None else None
+        utc_offset = utc_offset_seconds(timestamp) if timestamp is not None else None
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO devices VALUES (?, ?, ?, ?, ?)",
+                             (device_id.bytes, device_reading.total_count, latest_epoch_us, utc_offset,
+                              device_reading.version))
+
+    def get(self, device_id: uuid.UUID) -> Optional[DeviceReading]:
+        """
+        Read the state of a spilled device, without removing it.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+
+        Returns:
+            Optional[DeviceReading]: A device reading with the spilled state, or None if the device is not spilled.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT total_count, latest_epoch_us, utc_offset, version FROM devices "
+                                   "WHERE id = ?", (device_id.bytes,)).fetchone()
+        if row is None:
+            return None
+        total_count, latest_epoch_us, utc_offset, version = row
+        device_reading = DeviceReading(device_id=device_id, total_count=total_count, version=version)
+        if latest_epoch_us is not None:
+            device_reading.latest_timestamp = from_epoch_us(latest_epoch_us, utc_offset)
+        return device_reading
+
+    def delete(self, device_id: uuid.UUID):
+        """
+        Remove a device loaded back into memory.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM devices WHERE id = ?", (device_id.bytes,))
+
+    def scan(self, cursor: int, count: int) -> Tuple[int, List[uuid.UUID]]:
+        """
+        Return a page of the spilled devices, in the order they were written.
+
+        Args:
+            cursor (int): The cursor returned by the previous call, or 0 to start.
+            count (int): The maximum number of devices to return.
+
+        Returns:
+            Tuple[int, List[uuid.UUID]]: The cursor of the next page, or 0 once every device was returned, and the
+            unique identifiers of the devices of the page.
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT rowid, id FROM devices WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                                    (cursor, count)).fetchall()
+        if len(rows) < count:
+            return 0, [uuid.UUID(bytes=device_id) for _, device_id in rows]
+        return rows[-1][0], [uuid.UUID(bytes=device_id) for _, device_id in rows]
+
+    def clear(self):
+        """Remove every spilled device."""
+        with self._lock:
+            self._db.execute("DELETE FROM devices")
+
+    def close(self):
+        """Close the database."""
+        with self._lock:
+            self._db.close()
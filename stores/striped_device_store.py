@@ -0,0 +1,170 @@
+import uuid
+from threading import Lock
+from typing import List, Tuple
+
+from stores.device_store import DeviceReadingIface, DeviceStoreIface, ScanIndex, new_store_id, scan_partitioned
+
+
+class StripedDeviceReading(DeviceReadingIface):
+    """
+    Device reading whose updates are serialised by the lock of the stripe it belongs to.
+
+    Attributes:
+        device_id (uuid.UUID): The unique identifier of the device.
+        latest_timestamp (datetime.datetime): The most recent timestamp when a reading was recorded.
+        total_count (int): The cumulative count of readings for the device.
+        version (int): The number of updates of the count and latest timestamp.
+    """
+    __slots__ = ("device_id", "latest_timestamp", "total_count", "version", "_lock")
+
+    def __init__(self, device_id: uuid.UUID, lock: Lock):
+        """
+        Initialize an empty StripedDeviceReading.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            lock (Lock): The lock of the stripe holding the device.
+        """
+        self.device_id = device_id
+        self.latest_timestamp = None
+        self.total_count = 0
+        self.version = 0
+        self._lock = lock
+
+    def increment_count(self, count):
+        """
+        Atomically increment the total count of readings by the given count.
+
+        Args:
+            count (int): The number of readings to add to the total count.
+        """
+        with self._lock:
+            self.total_count += count
+            self.version += 1
+
+    def update_latest_timestamp(self, timestamp):
+        """
+        Atomically update the latest timestamp if the given timestamp is more recent.
+
+        Args:
+            timestamp (datetime.datetime): The new timestamp to set.
+        """
+        with self._lock:
+            if not self.latest_timestamp or timestamp > self.latest_timestamp:
+                self.latest_timestamp = timestamp
+                self.version += 1
+
+
+class StripedDeviceStore(DeviceStoreIface):
+    """
+    Device store split into lock-striped shards, for handlers running in a threadpool.
+
+    Devices are spread over `stripes` shards by their UUID. Looking up an existing device takes no lock and
+    allocates nothing. Creating a device takes the lock of its shard only, and a slot is reserved against the
+    capacity before the device is inserted, so a full store rejects the new device without touching devices
+    inserted by other threads. Updates to a device are serialised by the lock of its shard.
+
+    Attributes:
+        capacity (int): The maximum number of device readings the store can hold.
+        stripes (int): The number of shards and locks.
+        rejections (int): The number of new devices refused because the store was full.
+    """
+
+    def __init__(self, capacity=100, stripes=16):
+        """
+        Initialize the StripedDeviceStore with a specified capacity and number of stripes.
+
+        Args:
+            capacity (int): The maximum number of device readings to store.
+            stripes (int): The number of shards and locks. Defaults to 16.
+        """
+        self.capacity = capacity
+        self.stripes = stripes
+        self.rejections = 0
+        self._locks = [Lock() for _ in range(stripes)]
+        self._admission_lock = Lock()
+        self._init_store()
+
+    def _init_store(self):
+        """Initialize/Reset the shards, their scan order and the number of admitted devices."""
+        self.store_id = new_store_id()
+        self.shards = [{} for _ in range(self.stripes)]
+        self._scan_indexes = [ScanIndex() for _ in range(self.stripes)]
+        self._size = 0
+
+    def __len__(self):
+        """Return the number of devices in the store."""
+        return self._size
+
+    def _admit(self):
+        """
+        Reserve a slot for a new device.
+
+        Raises:
+            ValueError: If the store is full.
+        """
+        with self._admission_lock:
+            if self._size >= self.capacity:
+                self.rejections += 1  # Counted under the admission lock
+                raise ValueError("Capacity exceeded")
+            self._size += 1
+
+    def get_or_create_device_reading(self, device_id: uuid.UUID) -> DeviceReadingIface:
+        """
+        Retrieve an existing device reading for the specified device ID, or create a new one if it doesn't exist.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+
+        Returns:
+            DeviceReadingIface: The device reading instance for the specified device.
+
+        Raises:
+            ValueError: If the device does not exist and the store is full.
+        """
+        index = device_id.int % self.stripes
+        shard = self.shards[index]
+        device_reading = shard.get(device_id)
+        if device_reading is not None:
+            return device_reading
+
+        lock = self._locks[index]
+        with lock:
+            # Another thread may have created the device while we were waiting for the lock
+            device_reading = shard.get(device_id)
+            if device_reading is None:
+                self._admit()
+                device_reading = StripedDeviceReading(device_id, lock)
+                shard[device_id] = device_reading
+                self._scan_indexes[index].add(device_id)
+        return device_reading
+
+    def get_device_reading(self, device_id: uuid.UUID) -> DeviceReadingIface:
+        """
+        Retrieve the device reading for the specified device ID, if it exists.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+
+        Returns:
+            DeviceReadingIface: The device reading instance, or None if it does not exist.
+        """
+        return self.shards[device_id.int % self.stripes].get(device_id)
+
+    def scan_devices(self, cursor: int, count: int) -> Tuple[int, List[uuid.UUID]]:
+        """
+        Return a page of the devices of the store, shard by shard in insertion order.
+
+        Args:
+            cursor (int): The cursor returned by the previous call, or 0 to start.
+            count (int): The maximum number of devices to return.
+
+        Returns:
+            Tuple[int, List[uuid.UUID]]: The cursor of the next page, or 0 once the scan is complete, and the
+            unique identifiers of the devices of the page.
+        """
+        return scan_partitioned([scan_index.scan for scan_index in self._scan_indexes], cursor, count)
+
+    def clear(self):
+        """Clear all device readings from the store, resetting it to an empty state."""
+        self._init_store()
@@ -0,0 +1,163 @@
+import sys
+import uuid
+from threading import Lock
+from typing import List, Tuple
+
+
+class TopDevices:
+    """
+    Index of the `capacity` devices with the highest cumulative counts, updated as readings are accepted.
+
+    The devices are kept in a min-heap ordered by count, with the position of each device in a dict so that
+    the count of a device already in the heap is updated in place in O(log capacity). Cumulative counts only
+    grow, so a device outside the index can only enter it through one of its own updates, and the lowest count
+    of a full index never decreases.
+
+    Updates of devices whose count does not exceed the lowest count of a full index, which are most updates once
+    the index is full, return without taking the lock. This is safe because `floor` is only ever raised: a stale
+    value is lower than the current one, so it can make an update take the lock needlessly but never skip one
+    that should enter the index. Updates taking the lock keep the highest count seen for a device, so updates
+    of the same device applied out of order do not lower its count.
+
+    Attributes:
+        capacity (int): The maximum number of devices in the index.
+        floor (int): The lowest count of the index once it is full, or -1 while it is not.
+        updates (int): The number of updates that changed the index, since it was created.
+    """
+
+    def __init__(self, capacity=100):
+        """
+        Initialize an empty TopDevices index.
+
+        Args:
+            capacity (int): The maximum number of devices in the index. Defaults to 100.
+
+        Raises:
+            ValueError: If the capacity is not positive.
+        """
+        if capacity < 1:
+            raise ValueError("The capacity of the top devices must be positive")
+        self.capacity = capacity
+        self.updates = 0
+        self._lock = Lock()  # Serialises changes to the heap
+        self._init_store()
+
+    def _init_store(self):
+        """
+        Initialize/Reset the heap of (count, device_id) entries and the position of each device in it, keyed by
+        the integer value of the UUID, which hashes faster than the UUID itself.
+        """
+        self._heap = []
+        self._positions = {}
+        self.floor = -1
+
+    def __len__(self):
+        """Return the number of devices in the index."""
+        return len(self._heap)
+
+    def _sift_down(self, position: int):
+        """Move an entry down the heap until both of its children have a higher count."""
+        heap = self._heap
+        positions = self._positions
+        size = len(heap)
+        entry = heap[position]
+        while True:
+            child = 2 * position + 1
+            if child >= size:
+                break
+            if child + 1 < size and heap[child + 1][0] < heap[child][0]:
+                child += 1
+            if heap[child][0] >= entry[0]:
+                break
+            # Move the child up into the hole left by the entry
+            heap[position] = heap[child]
+            positions[heap[position][1].int] = position
+            position = child
+        heap[position] = entry
+        positions[entry[1].int] = position
+
+    def _sift_up(self, position: int):
+        """Move an entry up the heap until its parent has a lower count."""
+        heap = self._heap
+        positions = self._positions
+        entry = heap[position]
+        while position:
+            parent = (position - 1) // 2
+            if heap[parent][0] <= entry[0]:
+                break
+            heap[position] = heap[parent]
+            positions[heap[position][1].int] = position
+            position = parent
+        heap[position] = entry
+        positions[entry[1].int] = position
+
+    def update(self, device_id: uuid.UUID, count: int):
+        """
+        Record the current cumulative count of a device.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            count (int): The cumulative count of the device, read after its last update.
+        """
+        key = device_id.int
+        if count <= self.floor and key not in self._positions:
+            return
+        with self._lock:
+            heap = self._heap
+            position = self._positions.get(key)
+            if position is not None:
+                if count <= heap[position][0]:
+                    return
+                heap[position] = (count, device_id)
+                # A higher count moves the device away from the root of the min-heap
+                self._sift_down(position)
+            elif len(heap) < self.capacity:
+                heap.append((count, device_id))
+                self._sift_up(len(heap) - 1)
+            elif count > heap[0][0]:
+                del self._positions[heap[0][1].int]
+                heap[0] = (count, device_id)
+                self._sift_down(0)
+            else:
+                return
+            if len(heap) == self.capacity:
+                self.floor = heap[0][0]
+            self.updates += 1
+
+    def top(self, k: int) -> List[Tuple[uuid.UUID, int]]:
+        """
+        Return the devices with the highest cumulative counts, highest first.
+
+        The cost depends on the capacity of the index only, not on the number of devices.
+
+        Args:
+            k (int): The number of devices to return, at most the capacity.
+
+        Returns:
+            List[Tuple[uuid.UUID, int]]: The unique identifier and cumulative count of up to `k` devices.
+        """
+        with self._lock:
+            entries = list(self._heap)
+        entries.sort(key=lambda entry: entry[0], reverse=True)
+        return [(device_id, count) for count, device_id in entries[:k]]
+
+    def stats(self) -> dict:
+        """
+        Report the size of the index.
+
+        Returns:
+            dict: The capacity, the number of devices, the lowest count of a full index and the number of updates
+            that changed the index.
+        """
+        return {
+            "capacity": self.capacity,
+            "devices": len(self._heap),
+            "floor": self.floor,
+            "updates": self.updates,
+            "bytes": sys.getsizeof(self._heap) + sys.getsizeof(self._positions),
+        }
+
+    def clear(self):
+        """Clear every device from the index."""
+        with self._lock:
+            self._init_store()
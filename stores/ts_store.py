@@ -1,5 +1,6 @@
 import uuid
 from abc import ABC, abstractmethod
+from typing import List
 
 
 class TimeStampStoreIface(ABC):
@@ -20,7 +21,7 @@ class TimeStampStoreIface(ABC):
 
         Args:
             device_id (uuid.UUID): The unique identifier of the device.
-            timestamp (int): The timestamp to check, in Unix epoch format.
+            timestamp (int): The timestamp to check, in integer Unix epoch microseconds.
 
         Returns:
             bool: True if the timestamp was added (i.e., it was not already present), False otherwise.
@@ -30,6 +31,32 @@ class TimeStampStoreIface(ABC):
         """
         raise NotImplementedError
 
+    def check_and_add_timestamps(self, device_id: uuid.UUID, timestamps: List[int]) -> List[bool]:
+        """
+        Check and add several timestamps for a single device in one call.
+
+        The default implementation delegates to `check_and_add_timestamp` for each timestamp in order.
+        Implementations can override it to amortise per-call overhead (locking, key lookups, round trips)
+        across the whole list.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            timestamps (List[int]): The timestamps to check, in integer Unix epoch microseconds, in arrival order.
+
+        Returns:
+            List[bool]: One flag per timestamp, True if it was added (i.e., it was not already present).
+        """
+        return [self.check_and_add_timestamp(device_id, timestamp) for timestamp in timestamps]
+
+    def stats(self) -> dict:
+        """
+        Report the size and usage of the store, for monitoring and sizing.
+
+        Returns:
+            dict: Store specific statistics. The default implementation reports nothing.
+        """
+        return {}
+
     @abstractmethod
     def clear(self):
         """
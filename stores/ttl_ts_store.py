@@ -0,0 +1,202 @@
+import math
+import sys
+import time
+import uuid
+from collections import deque
+from threading import Lock
+from typing import Callable, List
+
+from .ts_store import TimeStampStoreIface
+
+# Maximum number of keys of expired buckets removed per timestamp checked, so a bucket is removed a little at a
+# time by the following calls instead of all at once by one request. Each timestamp adds at most one key, so the
+# expired keys are removed faster than new keys are added.
+EXPIRE_BATCH = 64
+
+
+class TtlTimestampStore(TimeStampStoreIface):
+    """
+    In-memory timestamp store remembering each timestamp for a retention time, whatever the traffic volume.
+
+    Keys are grouped by the bucket of `bucket_s` seconds in which they were last seen, in a queue of buckets
+    ordered by time, as in a timing wheel. A bucket is expired as a whole once it is older than the retention,
+    by removing its keys a batch at a time, so expiry costs O(1) amortized per key and no request pays for a
+    whole bucket. A key is remembered for at least `retention_s` seconds after it was last seen, and at most
+    one bucket and the time to remove its bucket longer. Seeing a key again moves it to the current bucket,
+    as the ordered store moves it to the end.
+
+    Keys are aged by the time they were seen, not by the timestamp of the reading, so the readings replayed
+    from the write-ahead log on restart are remembered for a whole retention from the restart.
+
+    Attributes:
+        retention_s (float): The time a timestamp is remembered after it was last seen.
+        bucket_s (float): The size of the time buckets keys are expired by.
+        expirations (int): The number of timestamps expired since the store was created.
+    """
+
+    def __init__(self, retention_s=86400.0, bucket_s=60.0, clock: Callable[[], float] = time.monotonic):
+        """
+        Initialize the TtlTimestampStore.
+
+        Args:
+            retention_s (float): The time a timestamp is remembered after it was last seen. Defaults to 24 hours.
+            bucket_s (float): The size of the time buckets keys are expired by. Defaults to 60 seconds.
+            clock (Callable[[], float]): Returns the current time in seconds. Defaults to `time.monotonic`.
+
+        Raises:
+            ValueError: If the retention or the bucket size is not positive.
+        """
+        if retention_s <= 0 or bucket_s <= 0:
+            raise ValueError("The retention and the bucket size must be positive")
+        self.retention_s = retention_s
+        self.bucket_s = bucket_s
+        self.expirations = 0
+        # A bucket is expired once it is more than this number of buckets older than the current one
+        self._span = math.ceil(retention_s / bucket_s)
+        self._clock = clock
+        self._lock = Lock()  # Serialises changes to the keys and the buckets
+        self._init_store()
+
+    def _init_store(self):
+        """
+        Initialize/Reset the bucket number of each key, keyed by the integer value of the device UUID and the
+        timestamp, and the queue of (bucket number, keys) buckets, the oldest first.
+        """
+        self.store = {}
+        self._buckets = deque()
+
+    def __repr__(self):
+        """
+        Return a string representation of the timestamp store.
+
+        Returns:
+            str: A string representing the current state of the store.
+        """
+        return f"TtlTimestampStore(timestamps={len(self.store)}, buckets={len(self._buckets)})"
+
+    def __len__(self):
+        """Return the number of timestamps held."""
+        return len(self.store)
+
+    def _current_bucket(self, timestamps=1) -> tuple:
+        """
+        Expire the keys of the buckets older than the retention, a batch at a time, and return the current bucket.
+        Must be called with the lock held.
+
+        Args:
+            timestamps (int): The number of timestamps about to be checked, which sets the number of keys expired.
+
+        Returns:
+            tuple: The (bucket number, keys) bucket of the current time.
+        """
+        number = int(self._clock() // self.bucket_s)
+        buckets = self._buckets
+        store = self.store
+        horizon = number - self._span - 1
+        budget = EXPIRE_BATCH * timestamps
+        while buckets and buckets[0][0] <= horizon and budget:
+            expired_number, keys = buckets[0]
+            while keys and budget:
+                key = keys.pop()
+                # Keys seen again since are held by a newer bucket
+                if store.get(key) is expired_number:
+                    del store[key]
+                    self.expirations += 1
+                budget -= 1
+            if not keys:
+                buckets.popleft()
+        if not buckets or buckets[-1][0] != number:
+            # Every key of the bucket refers to the same number object, which is compared by identity
+            buckets.append((number, []))
+        return buckets[-1]
+
+    def _check_and_add(self, key: tuple, bucket: tuple) -> bool:
+        """
+        Check and add a key to the current bucket. Must be called with the lock held.
+
+        Args:
+            key (tuple): The integer value of the device UUID and the timestamp.
+            bucket (tuple): The (bucket number, keys) bucket of the current time.
+
+        Returns:
+            bool: True if the key was added, False if it was already present.
+        """
+        number, keys = bucket
+        seen = self.store.get(key)
+        if seen is not number:
+            self.store[key] = number
+            keys.append(key)
+        return seen is None
+
+    def check_and_add_timestamp(self, device_id: uuid.UUID, timestamp: int) -> bool:
+        """
+        Check if a timestamp was seen within the retention and add it if not.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            timestamp (int): The timestamp in integer Unix epoch microseconds.
+
+        Returns:
+            bool: True if the timestamp was added, False if it was already present.
+        """
+        with self._lock:
+            return self._check_and_add((device_id.int, timestamp), self._current_bucket())
+
+    def check_and_add_timestamps(self, device_id: uuid.UUID, timestamps: List[int]) -> List[bool]:
+        """
+        Check and add several timestamps for a single device, taking the lock and reading the clock once.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            timestamps (List[int]): The timestamps in integer Unix epoch microseconds, in arrival order.
+
+        Returns:
+            List[bool]: One flag per timestamp, True if it was added, False if it was already present.
+        """
+        device_key = device_id.int
+        check_and_add = self._check_and_add
+        with self._lock:
+            bucket = self._current_bucket(len(timestamps))
+            return [check_and_add((device_key, timestamp), bucket) for timestamp in timestamps]
+
+    def stats(self) -> dict:
+        """
+        Report the size of the store and its memory against the retention.
+
+        The memory is estimated from the size of the containers and of one key. Until the store has been used for
+        a whole retention, `window_fill` is below 1 and `window_bytes` projects the memory of a whole retention
+        at the same rate.
+
+        Returns:
+            dict: The number of timestamps held, the retention and bucket size, the number of buckets, the age of
+            the oldest bucket, the share of the retention it covers, the number of expirations and the estimated
+            memory now and for a whole retention.
+        """
+        with self._lock:
+            now = self._clock()
+            buckets = list(self._buckets)
+            size = len(self.store)
+            key = next(iter(self.store), None)
+            size_bytes = sys.getsizeof(self.store) + sys.getsizeof(self._buckets)
+            size_bytes += sum(sys.getsizeof(keys) for _, keys in buckets)
+        if key is not None:
+            size_bytes += size * (sys.getsizeof(key) + sum(sys.getsizeof(part) for part in key))
+        oldest_age_s = now - buckets[0][0] * self.bucket_s if buckets else 0.0
+        window_fill = min(1.0, oldest_age_s / self.retention_s)
+        return {
+            "backend": "ttl",
+            "size": size,
+            "retention_s": self.retention_s,
+            "bucket_s": self.bucket_s,
+            "buckets": len(buckets),
+            "oldest_age_s": oldest_age_s,
+            "window_fill": window_fill,
+            "expirations": self.expirations,
+            "bytes": size_bytes,
+            "window_bytes": int(size_bytes / window_fill) if window_fill else 0,
+        }
+
+    def clear(self):
+        """Clear all timestamps from the store, resetting it to an empty state."""
+        with self._lock:
+            self._init_store()
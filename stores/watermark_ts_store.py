@@ -0,0 +1,241 @@
+import uuid
+from threading import Lock
+from typing import List, Optional
+from .ts_store import TimeStampStoreIface
+
+# Policies for readings older than the window below the watermark.
+LATE_POLICY_REJECT = "reject"
+LATE_POLICY_EXACT = "exact"
+
+
+class _Window:
+    """
+    Dedupe state of a single device: the highest slot seen and a bitmap of the slots below it.
+
+    Bit `i` of `bits` is set when slot `watermark - i` has been seen.
+    """
+    __slots__ = ("watermark", "bits", "lock")
+
+    def __init__(self):
+        self.watermark = None
+        self.bits = 0
+        self.lock = Lock()
+
+
+class WatermarkTimestampStore(TimeStampStoreIface):
+    """
+    Timestamp store that keeps a high-watermark and a bitmap window of recent timestamps per device.
+
+    Timestamps are bucketed into slots of `resolution_us` microseconds. Each device keeps the highest slot it
+    has seen (the watermark) and a bitmap of the `window_slots` slots up to it. A reading newer than the
+    watermark is accepted in O(1) by shifting the bitmap, without storing an entry per reading, and a reading
+    inside the window is checked against its bit. Memory is fixed at `window_slots` bits per device.
+
+    Readings that fall in the same slot are treated as duplicates, so `resolution_us` must not be coarser than
+    the interval between two readings of a device. The default of 1 dedupes on exact microseconds, so distinct
+    readings are never merged; coarser slots widen the window for devices sending at a known interval. Readings older
+    than the window are handled by `late_policy`: "reject" drops them as duplicates, "exact" checks them
+    against `fallback_store`. With the "exact" policy the slots seen are moved to `fallback_store` as they
+    fall off the window, so a reading resent after the window slid past it is still caught as a duplicate,
+    while readings inside the window stay O(1). Slots are recorded in the fallback store by their start, so
+    late readings are deduped by slot as in the window.
+
+    Attributes:
+        window_slots (int): The number of slots remembered below the watermark of each device.
+        resolution_us (int): The width of a slot in microseconds.
+        late_policy (str): The policy for readings older than the window, "reject" or "exact".
+        late_rejections (int): The number of readings rejected because they were older than the window.
+    """
+
+    def __init__(self, window_slots=3600, resolution_us=1, late_policy=LATE_POLICY_REJECT,
+                 fallback_store: Optional[TimeStampStoreIface] = None):
+        """
+        Initialize the WatermarkTimestampStore.
+
+        Args:
+            window_slots (int): The number of slots remembered below the watermark. Defaults to 3600.
+            resolution_us (int): The width of a slot in microseconds. Defaults to 1, exact microseconds.
+            late_policy (str): "reject" or "exact". Defaults to "reject".
+            fallback_store (TimeStampStoreIface): The exact store used for late readings with the "exact" policy.
+
+        Raises:
+            ValueError: If the policy is unknown or the "exact" policy is used without a fallback store.
+        """
+        if late_policy not in (LATE_POLICY_REJECT, LATE_POLICY_EXACT):
+            raise ValueError(f"Unknown late policy: {late_policy}")
+        if late_policy == LATE_POLICY_EXACT and fallback_store is None:
+            raise ValueError("The exact late policy requires a fallback store")
+        self.window_slots = window_slots
+        self.resolution_us = resolution_us
+        self.late_policy = late_policy
+        self.fallback_store = fallback_store
+        self._mask = (1 << window_slots) - 1
+        self._init_store()
+
+    def _init_store(self):
+        """Initialize the mapping of device UUID integers to windows."""
+        self.windows = {}
+        self.late_rejections = 0
+
+    def __repr__(self):
+        """
+        Return a string representation of the timestamp store.
+
+        Returns:
+            str: A string representing the current state of the store.
+        """
+        return (f"WatermarkTimestampStore(devices={len(self.windows)}, window_slots={self.window_slots}, "
+                f"resolution_us={self.resolution_us})")
+
+    def _window(self, device_id: uuid.UUID) -> _Window:
+        """
+        Get the window of a device, creating it if needed.
+
+        Creation is atomic because of the setdefault operation.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+
+        Returns:
+            _Window: The dedupe window of the device.
+        """
+        key = device_id.int
+        window = self.windows.get(key)
+        if window is None:
+            window = self.windows.setdefault(key, _Window())
+        return window
+
+    def _spill(self, device_id: uuid.UUID, window: _Window, shift: int):
+        """
+        Record the slots seen that fall off a window in the fallback store, before the window advances by
+        `shift` slots. Must be called with the window lock held, so a resent reading always finds its slot in
+        either the window or the fallback store.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            window (_Window): The window of the device.
+            shift (int): The number of slots the watermark moves forward.
+        """
+        first_age = max(self.window_slots - shift, 0)
+        dropped = window.bits >> first_age
+        slots = []
+        # Only the set bits are visited, so each slot seen is moved once over its life
+        while dropped:
+            lowest = dropped & -dropped
+            slots.append((window.watermark - first_age - lowest.bit_length() + 1) * self.resolution_us)
+            dropped ^= lowest
+        if slots:
+            self.fallback_store.check_and_add_timestamps(device_id, slots)
+
+    def _check_and_add(self, device_id: uuid.UUID, window: _Window, slot: int) -> Optional[bool]:
+        """
+        Check and add a slot to a window. Must be called with the window lock held.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            window (_Window): The window of the device.
+            slot (int): The slot of the timestamp.
+
+        Returns:
+            Optional[bool]: True if the slot was added, False if it was already present, or None if the slot is
+            older than the window.
+        """
+        watermark = window.watermark
+        if watermark is None or slot > watermark:
+            shift = self.window_slots if watermark is None else slot - watermark
+            if watermark is not None and self.late_policy == LATE_POLICY_EXACT:
+                self._spill(device_id, window, shift)
+            # Advance the watermark: the bitmap slides by the distance and the new slot is bit 0
+            window.bits = 1 if shift >= self.window_slots else ((window.bits << shift) | 1) & self._mask
+            window.watermark = slot
+            return True
+
+        age = watermark - slot
+        if age >= self.window_slots:
+            return None
+        bit = 1 << age
+        if window.bits & bit:
+            return False
+        window.bits |= bit
+        return True
+
+    def _check_late(self, device_id: uuid.UUID, timestamp: int) -> bool:
+        """
+        Apply the late policy to a reading older than the window.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            timestamp (int): The timestamp in integer Unix epoch microseconds.
+
+        Returns:
+            bool: True if the slot of the timestamp was added to the fallback store, False otherwise.
+        """
+        if self.late_policy == LATE_POLICY_EXACT:
+            slot_us = timestamp // self.resolution_us * self.resolution_us
+            return self.fallback_store.check_and_add_timestamp(device_id, slot_us)
+        self.late_rejections += 1
+        return False
+
+    def check_and_add_timestamp(self, device_id: uuid.UUID, timestamp: int) -> bool:
+        """
+        Check if a timestamp is present for the device and add it if not.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            timestamp (int): The timestamp in integer Unix epoch microseconds.
+
+        Returns:
+            bool: True if the timestamp was added, False if it was already present or rejected as too old.
+        """
+        window = self._window(device_id)
+        with window.lock:
+            added = self._check_and_add(device_id, window, timestamp // self.resolution_us)
+        if added is None:
+            return self._check_late(device_id, timestamp)
+        return added
+
+    def check_and_add_timestamps(self, device_id: uuid.UUID, timestamps: List[int]) -> List[bool]:
+        """
+        Check and add several timestamps for a single device, taking the device's lock once.
+
+        Args:
+            device_id (uuid.UUID): The unique identifier of the device.
+            timestamps (List[int]): The timestamps in integer Unix epoch microseconds, in arrival order.
+
+        Returns:
+            List[bool]: One flag per timestamp, True if it was added, False otherwise.
+        """
+        window = self._window(device_id)
+        resolution_us = self.resolution_us
+        with window.lock:
+            results = [self._check_and_add(device_id, window, timestamp // resolution_us)
+                       for timestamp in timestamps]
+        for i, added in enumerate(results):
+            if added is None:
+                results[i] = self._check_late(device_id, timestamps[i])
+        return results
+
+    def stats(self) -> dict:
+        """
+        Report the size of the store and how many late readings it rejected.
+
+        Returns:
+            dict: The number of devices, the window configuration and the number of late rejections.
+        """
+        stats = {
+            "backend": "watermark",
+            "devices": len(self.windows),
+            "window_slots": self.window_slots,
+            "resolution_us": self.resolution_us,
+            "late_policy": self.late_policy,
+            "late_rejections": self.late_rejections,
+        }
+        if self.fallback_store is not None:
+            stats["fallback_store"] = self.fallback_store.stats()
+        return stats
+
+    def clear(self):
+        """Clear all windows from the store, resetting it to an empty state."""
+        self._init_store()
+        if self.fallback_store is not None:
+            self.fallback_store.clear()
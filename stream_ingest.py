@@ -0,0 +1,407 @@
+import codecs
+import json
+import uuid
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+from starlette.responses import StreamingResponse
+
+from device_readings_service import encode_readings
+from fast_ingest import decode_device_readings
+from models import DeviceReadings
+from stores.ingest import IngestReading
+from streaming import encode_json
+
+# Media types of the uploads: one DeviceReadings object per line, or a JSON array of DeviceReadings objects.
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/jsonl", "application/ndjson")
+JSON_MEDIA_TYPE = "application/json"
+
+# A document of an upload: its line (or position in the array), the document, and an error message if it
+# cannot be read.
+Document = Tuple[int, object, str]
+
+# What the array reader expects next: the opening bracket, the first element or the closing bracket, a comma or
+# the closing bracket, or an element after a comma.
+_OPEN, _FIRST, _SEPARATOR, _ELEMENT = range(4)
+_WHITESPACE = " \t\r\n"
+
+
+def _error_message(e: ValueError) -> str:
+    """Return a one-line message for a validation error, naming the fields at fault."""
+    if isinstance(e, ValidationError):
+        return "; ".join(f"{'.'.join(map(str, error['loc'])) or 'body'}: {error['msg']}" for error in e.errors())
+    return str(e)
+
+
+class NdjsonReader:
+    """
+    Splits an upload into lines as its chunks arrive, holding at most one line in memory.
+
+    Blank lines are skipped. A line longer than `max_line_bytes` is reported as an error and skipped without
+    being buffered.
+
+    Attributes:
+        max_line_bytes (int): The maximum length of a line.
+        error (str): An error that stopped the reading, always empty as every line is read independently.
+    """
+
+    def __init__(self, max_line_bytes: int):
+        """
+        Initialize the NdjsonReader.
+
+        Args:
+            max_line_bytes (int): The maximum length of a line.
+        """
+        self.max_line_bytes = max_line_bytes
+        self.error = ""
+        self._buffer = bytearray()
+        self._line = 0
+        self._skipping = False  # Set while skipping the rest of a line that is too long
+
+    def feed(self, chunk: bytes) -> Iterator[Document]:
+        """
+        Add a chunk of the upload and return the lines it completes.
+
+        Args:
+            chunk (bytes): The next chunk of the upload.
+
+        Returns:
+            Iterator[Document]: The line number and the bytes of each complete line.
+        """
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end < 0:
+                break
+            self._line += 1
+            if self._skipping:
+                self._skipping = False
+            elif self._buffer:
+                self._buffer += chunk[start:end]
+                line = bytes(self._buffer)
+                self._buffer.clear()
+                yield from self._complete_line(line)
+            else:
+                yield from self._complete_line(chunk[start:end])
+            start = end + 1
+
+        if not self._skipping:
+            self._buffer += chunk[start:]
+            if len(self._buffer) > self.max_line_bytes:
+                self._buffer.clear()
+                self._skipping = True
+                yield self._line + 1, None, f"Line exceeds {self.max_line_bytes} bytes"
+
+    def finish(self) -> Iterator[Document]:
+        """Return the last line of the upload if it does not end with a newline."""
+        if not self._skipping and self._buffer:
+            self._line += 1
+            line = bytes(self._buffer)
+            self._buffer.clear()
+            yield from self._complete_line(line)
+
+    def _complete_line(self, line: bytes) -> Iterator[Document]:
+        """Return a complete line unless it is blank."""
+        if len(line) > self.max_line_bytes:
+            yield self._line, None, f"Line exceeds {self.max_line_bytes} bytes"
+        elif line.strip():
+            yield self._line, line, ""
+
+    @staticmethod
+    def decode(document: bytes) -> Tuple[uuid.UUID, List[IngestReading]]:
+        """
+        Decode a line into the readings of a device, with the fast decode path if the line is canonical.
+
+        Args:
+            document (bytes): The line.
+
+        Returns:
+            Tuple[uuid.UUID, List[IngestReading]]: The device ID and its readings.
+
+        Raises:
+            ValueError: If the line is not a valid DeviceReadings object.
+        """
+        decoded = decode_device_readings(document)
+        if decoded is not None:
+            return decoded
+        device_readings = DeviceReadings.model_validate_json(document)
+        return device_readings.id, encode_readings(device_readings.readings)
+
+
+class JsonArrayReader:
+    """
+    Parses the elements of an upload holding a JSON array as its chunks arrive, holding at most one element in
+    memory.
+
+    An element that is not valid JSON breaks the array, so it stops the reading with an error, as does an
+    element longer than `max_element_bytes` characters.
+
+    Attributes:
+        max_element_bytes (int): The maximum length of an element.
+        error (str): The error that stopped the reading, or an empty string.
+    """
+
+    def __init__(self, max_element_bytes: int):
+        """
+        Initialize the JsonArrayReader.
+
+        Args:
+            max_element_bytes (int): The maximum length of an element.
+        """
+        self.max_element_bytes = max_element_bytes
+        self.error = ""
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._text = ""
+        self._element = 0
+        self._expect = _OPEN
+        self._done = False  # Set once the closing bracket was read
+
+    def feed(self, chunk: bytes) -> Iterator[Document]:
+        """
+        Add a chunk of the upload and return the elements it completes.
+
+        Args:
+            chunk (bytes): The next chunk of the upload.
+
+        Returns:
+            Iterator[Document]: The position and the parsed value of each complete element.
+        """
+        if self.error or self._done:
+            return
+        try:
+            self._text += self._decoder.decode(chunk)
+        except UnicodeDecodeError as e:
+            self.error = f"Invalid UTF-8: {e.reason}"
+            return
+        yield from self._parse(final=False)
+
+    def finish(self) -> Iterator[Document]:
+        """Return the last elements of the upload, and report an error if the array is not closed."""
+        if self.error or self._done:
+            return
+        yield from self._parse(final=True)
+        if not self.error and not self._done:
+            self.error = f"Unterminated array after element {self._element}"
+
+    def _parse(self, final: bool) -> Iterator[Document]:
+        """
+        Parse the complete elements of the buffered text.
+
+        Args:
+            final (bool): Whether the upload is complete, so an element ending the text cannot continue.
+        """
+        text = self._text
+        position = 0
+        while True:
+            while position < len(text) and text[position] in _WHITESPACE:
+                position += 1
+            if position == len(text):
+                break
+            char = text[position]
+            if self._expect == _OPEN:
+                if char != "[":
+                    self.error = "Expected a JSON array"
+                    return
+                position += 1
+                self._expect = _FIRST
+            elif char == "]" and self._expect != _ELEMENT:
+                self._done = True
+                break
+            elif self._expect == _SEPARATOR:
+                if char != ",":
+                    self.error = f"Expected ',' or ']' after element {self._element}"
+                    return
+                position += 1
+                self._expect = _ELEMENT
+            else:
+                try:
+                    value, end = self._json.raw_decode(text, position)
+                except json.JSONDecodeError as e:
+                    if final:
+                        self.error = f"Element {self._element + 1}: {e.msg}"
+                        return
+                    if len(text) - position > self.max_element_bytes:
+                        self.error = f"Element {self._element + 1} exceeds {self.max_element_bytes} characters"
+                        return
+                    break  # Incomplete, wait for the next chunk
+                if end == len(text) and not final:
+                    break  # A number may continue in the next chunk
+                self._element += 1
+                self._expect = _SEPARATOR
+                position = end
+                yield self._element, value, ""
+        self._text = text[position:]
+
+    @staticmethod
+    def decode(document: object) -> Tuple[uuid.UUID, List[IngestReading]]:
+        """
+        Validate an element as the readings of a device.
+
+        Args:
+            document (object): The parsed element.
+
+        Returns:
+            Tuple[uuid.UUID, List[IngestReading]]: The device ID and its readings.
+
+        Raises:
+            ValueError: If the element is not a valid DeviceReadings object.
+        """
+        device_readings = DeviceReadings.model_validate(document)
+        return device_readings.id, encode_readings(device_readings.readings)
+
+
+def create_upload_reader(content_type: Optional[str], max_document_bytes: int):
+    """
+    Return the reader of an upload with the given content type.
+
+    Args:
+        content_type (Optional[str]): The Content-Type header of the upload. NDJSON is assumed if it is missing.
+        max_document_bytes (int): The maximum length of a line or an array element.
+
+    Returns:
+        The NdjsonReader or JsonArrayReader of the upload, or None if the content type is not supported.
+    """
+    media_type = (content_type or NDJSON_MEDIA_TYPES[0]).split(";", 1)[0].strip().lower()
+    if media_type in NDJSON_MEDIA_TYPES:
+        return NdjsonReader(max_document_bytes)
+    if media_type == JSON_MEDIA_TYPE:
+        return JsonArrayReader(max_document_bytes)
+    return None
+
+
+class UploadIngest:
+    """
+    Adds the readings of an upload to the stores as it is read, in micro-batches.
+
+    Documents are decoded as they are read and their readings are grouped by device until the batch holds
+    `batch_size` readings, then the batch is added at once. Only the current chunk, the current document and
+    the current batch are held in memory.
+
+    Progress is reported as a stream of NDJSON events: a `progress` event after each batch, an `error` event for
+    each of the first `max_errors` documents that cannot be added (its line, or position in an array, and the
+    reason), and a final `done` event. Every event holds the number of documents read (`lines`), the number of
+    readings added (`readings`, duplicates included) and the number of errors (`errors`), which are documents that
+    could not be added and an error that stopped the reading. `done` also holds `complete`, which is false if
+    the upload could not be read to its end.
+
+    Attributes:
+        lines (int): The number of documents read.
+        readings (int): The number of readings added.
+        errors (int): The number of errors.
+    """
+
+    def __init__(self, reader, add_batch: Callable[[Dict[uuid.UUID, List[IngestReading]]],
+                                                   Awaitable[Dict[uuid.UUID, str]]],
+                 batch_size: int, max_errors: int):
+        """
+        Initialize the UploadIngest.
+
+        Args:
+            reader: The NdjsonReader or JsonArrayReader of the upload.
+            add_batch (Callable): Adds the readings of many devices, returning an error message per device.
+            batch_size (int): The number of readings added at a time.
+            max_errors (int): The maximum number of error events.
+        """
+        self.reader = reader
+        self.add_batch = add_batch
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.lines = 0
+        self.readings = 0
+        self.errors = 0
+        self._batch: Dict[uuid.UUID, List[IngestReading]] = {}
+        self._batch_lines: Dict[uuid.UUID, List[Tuple[int, int]]] = {}  # Line and number of readings
+        self._batch_readings = 0
+        self._events: List[dict] = []
+
+    async def run(self, chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+        """
+        Read an upload and add its readings.
+
+        Args:
+            chunks (AsyncIterable[bytes]): The chunks of the upload, as they arrive.
+
+        Returns:
+            AsyncIterator[bytes]: The events, encoded as NDJSON, as the upload is read.
+        """
+        async for chunk in chunks:
+            for document in self.reader.feed(chunk):
+                self._add(*document)
+                if self._batch_readings >= self.batch_size:
+                    await self._flush()
+            if self._events:
+                yield self._encode_events()
+
+        for document in self.reader.finish():
+            self._add(*document)
+        await self._flush()
+        if self.reader.error:
+            self._error(None, self.reader.error)
+        self._events.append(dict(self._counts(), event="done", complete=not self.reader.error))
+        yield self._encode_events()
+
+    def _add(self, line: int, document: object, err: str):
+        """Decode a document and add its readings to the current batch."""
+        self.lines += 1
+        if err:
+            self._error(line, err)
+            return
+        try:
+            device_id, readings = self.reader.decode(document)
+        except ValueError as e:
+            self._error(line, _error_message(e))
+            return
+        self._batch.setdefault(device_id, []).extend(readings)
+        self._batch_lines.setdefault(device_id, []).append((line, len(readings)))
+        self._batch_readings += len(readings)
+
+    async def _flush(self):
+        """Add the readings of the current batch, and report the documents of the devices that failed."""
+        if not self._batch_lines:
+            return
+        batch, batch_lines = self._batch, self._batch_lines
+        self._batch, self._batch_lines, self._batch_readings = {}, {}, 0
+        results = await self.add_batch(batch)
+        for device_id, lines in batch_lines.items():
+            err = results[device_id]
+            for line, readings in lines:
+                if err:
+                    self._error(line, err)
+                else:
+                    self.readings += readings
+        self._events.append(dict(self._counts(), event="progress"))
+
+    def _error(self, line: Optional[int], message: str):
+        """Count a document that cannot be added, and report it unless too many errors were reported."""
+        self.errors += 1
+        if self.errors <= self.max_errors:
+            event = {"event": "error", "message": message}
+            if line is not None:
+                event["line"] = line
+            self._events.append(event)
+
+    def _counts(self) -> dict:
+        """Return the counts reported by every progress event."""
+        return {"lines": self.lines, "readings": self.readings, "errors": self.errors}
+
+    def _encode_events(self) -> bytes:
+        """Encode and clear the pending events."""
+        chunk = b"".join(encode_json(event) + b"\n" for event in self._events)
+        self._events.clear()
+        return chunk
+
+
+class UploadResponse(StreamingResponse):
+    """
+    Streaming response whose body is produced while the request body is being read.
+
+    The body reads the request stream itself, so the response does not listen for the client disconnecting as
+    StreamingResponse does, which would consume the messages of the request body. A client disconnecting is
+    noticed by the request stream instead.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
@@ -0,0 +1,47 @@
+import json
+import uuid
+from datetime import datetime
+from typing import Callable, Iterable, Iterator, List
+
+# Same separators as the JSON responses of FastAPI, so streamed and pre-serialized responses look the same.
+_encoder = json.JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(",", ":"),
+                            default=lambda value: value.isoformat() if isinstance(value, datetime) else str(value))
+
+
+def encode_json(value) -> bytes:
+    """
+    Encode a JSON response body, with datetimes as ISO 8601 strings and UUIDs as strings.
+
+    Args:
+        value: The value to encode.
+
+    Returns:
+        bytes: The encoded body.
+    """
+    return _encoder.encode(value).encode()
+
+
+def stream_json_list(key: str, pages: Iterable[List[dict]], tail: Callable[[], dict] = dict) -> Iterator[bytes]:
+    """
+    Encode a JSON object holding a list of items as a stream of chunks, one per page of items, so that a large
+    response is never held in memory.
+
+    The object is `{key: [items...], **tail()}`. The tail is computed once every page was encoded, so it can
+    report where the pages stopped. Datetimes are encoded as ISO 8601 strings and UUIDs as strings.
+
+    Args:
+        key (str): The name of the list.
+        pages (Iterable[List[dict]]): The items, a page at a time.
+        tail (Callable[[], dict]): Returns the other fields of the object. Defaults to no other field.
+
+    Returns:
+        Iterator[bytes]: The chunks of the encoded object.
+    """
+    separator = ""
+    yield f"{{{_encoder.encode(key)}:[".encode()
+    for page in pages:
+        if page:
+            yield (separator + ",".join(map(_encoder.encode, page))).encode()
+            separator = ","
+    fields = "".join(f",{_encoder.encode(name)}:{_encoder.encode(value)}" for name, value in tail().items())
+    yield f"]{fields}}}".encode()
@@ -0,0 +1,144 @@
+import asyncio
+import unittest
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from admission import AdmissionControlMiddleware, AdmissionController, AdmissionLane, create_admission_controller
+from config.base import Settings
+from metrics import Registry
+
+
+class TestAdmissionLane(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.lane = AdmissionLane("ingest", max_in_flight=2, queue_size=1, queue_timeout_s=0.05)
+
+    def test_invalid_limits(self):
+        # Test that a lane without slots, with a negative queue or without a queue timeout is rejected
+        with self.assertRaises(ValueError):
+            AdmissionLane("ingest", max_in_flight=0, queue_size=1, queue_timeout_s=1)
+        with self.assertRaises(ValueError):
+            AdmissionLane("ingest", max_in_flight=1, queue_size=-1, queue_timeout_s=1)
+        with self.assertRaises(ValueError):
+            AdmissionLane("ingest", max_in_flight=1, queue_size=1, queue_timeout_s=0)
+
+    async def test_admitted_within_limit(self):
+        # Test that requests are admitted at once up to the limit and that releasing frees their slots
+        self.assertIsNone(await self.lane.acquire())
+        self.assertIsNone(await self.lane.acquire())
+        self.assertEqual(self.lane.in_flight, 2)
+        self.lane.release()
+        self.lane.release()
+        self.assertEqual((self.lane.in_flight, self.lane.admitted), (0, 2))
+
+    async def test_shed_when_queue_full(self):
+        # Test that a request is shed at once when the lane and its queue are full
+        await self.lane.acquire()
+        await self.lane.acquire()
+        queued = asyncio.create_task(self.lane.acquire())
+        await asyncio.sleep(0)
+        self.assertEqual(self.lane.queued, 1)
+        self.assertEqual(await self.lane.acquire(), "queue_full")
+        self.lane.release()
+        self.assertIsNone(await queued)
+        self.assertEqual(self.lane.in_flight, 2)
+        self.assertEqual(self.lane.shed, {"queue_full": 1, "timeout": 0})
+
+    async def test_shed_after_timeout(self):
+        # Test that a queued request is shed once it waited the queue timeout, and leaves the queue
+        await self.lane.acquire()
+        await self.lane.acquire()
+        self.assertEqual(await self.lane.acquire(), "timeout")
+        self.assertEqual((self.lane.queued, self.lane.in_flight), (0, 2))
+        self.assertEqual(self.lane.shed["timeout"], 1)
+
+    async def test_slots_handed_in_order(self):
+        # Test that released slots are handed to the queued requests first in first out
+        lane = AdmissionLane("ingest", max_in_flight=1, queue_size=10, queue_timeout_s=1)
+        await lane.acquire()
+        order = []
+
+        async def request(index):
+            await lane.acquire()
+            order.append(index)
+
+        tasks = [asyncio.create_task(request(index)) for index in range(3)]
+        await asyncio.sleep(0)
+        for _ in range(3):
+            lane.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        self.assertEqual(order, [0, 1, 2])
+        self.assertEqual(lane.in_flight, 1)
+
+    async def test_cancelled_waiter(self):
+        # Test that a queued request cancelled while waiting leaves the queue and is not handed a slot
+        lane = AdmissionLane("ingest", max_in_flight=1, queue_size=10, queue_timeout_s=1)
+        await lane.acquire()
+        cancelled = asyncio.create_task(lane.acquire())
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await cancelled
+        self.assertEqual(lane.queued, 0)
+        lane.release()
+        self.assertEqual(lane.in_flight, 0)
+
+
+class TestAdmissionControlMiddleware(unittest.TestCase):
+
+    def setUp(self):
+        self.controller = AdmissionController(ingest_max_in_flight=1, ingest_queue_size=0, read_max_in_flight=1,
+                                              read_queue_size=0, retry_after_s=3)
+        self.shed = Registry().counter("shed", "Shed requests.", ["lane", "reason"])
+        app = FastAPI()
+        app.add_middleware(AdmissionControlMiddleware, controller=self.controller, shed_counter=self.shed)
+
+        @app.post("/api/devices/readings")
+        def update_readings():
+            return {"message": "Readings updated successfully"}
+
+        @app.get("/api/devices/{device_id}/cumulative_count")
+        def get_cumulative_count(device_id: str):
+            return {"cumulative_count": 0}
+
+        self.client = TestClient(app)
+
+    def test_lanes(self):
+        # Test that only the ingest requests and the reads of a device are subject to admission control
+        self.assertEqual(self.controller.lane("POST", "/api/devices/readings/batch").name, "ingest")
+        self.assertEqual(self.controller.lane("GET", "/api/devices/1/latest_timestamp").name, "read")
+        self.assertIsNone(self.controller.lane("GET", "/api/devices/top"))
+        self.assertIsNone(self.controller.lane("GET", "/api/devices/readings"))
+
+    def test_admitted(self):
+        # Test that requests within the limits are served and release their slots
+        for _ in range(3):
+            self.assertEqual(self.client.post("/api/devices/readings").status_code, 200)
+            self.assertEqual(self.client.get("/api/devices/1/cumulative_count").status_code, 200)
+        stats = self.controller.stats()
+        self.assertEqual((stats["ingest"]["admitted"], stats["ingest"]["in_flight"]), (3, 0))
+        self.assertEqual(stats["read"]["admitted"], 3)
+
+    def test_shed_ingest_keeps_reads(self):
+        # Test that ingest is shed with a 429 and a Retry-After while the ingest lane is full, and reads are not
+        self.controller.lanes["ingest"].in_flight = 1
+        response = self.client.post("/api/devices/readings")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["Retry-After"], "3")
+        self.assertEqual(response.json(), {"message": "Too many ingest requests, retry later"})
+        self.assertEqual(self.client.get("/api/devices/1/cumulative_count").status_code, 200)
+        self.assertEqual(self.shed.samples(), [("shed_total", (("lane", "ingest"), ("reason", "queue_full")), 1)])
+
+    def test_create_admission_controller(self):
+        # Test that the controller is created from the settings, and not at all when disabled
+        self.assertIsNone(create_admission_controller(Settings(ADMISSION_ENABLED=False)))
+        controller = create_admission_controller(Settings(ADMISSION_ENABLED=True, ADMISSION_READ_MAX_IN_FLIGHT=8,
+                                                          ADMISSION_RETRY_AFTER_S=5))
+        self.assertEqual((controller.lanes["read"].max_in_flight, controller.retry_after_s), (8, 5))
+        self.assertEqual(controller.threads, 24 + 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
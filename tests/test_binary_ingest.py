@@ -0,0 +1,117 @@
+import unittest
+import uuid
+
+from fastapi.testclient import TestClient
+
+from binary_ingest import (MAX_EPOCH_US, PACKED_HEADER, PACKED_MEDIA_TYPE, decode_msgpack, decode_packed,
+                           encode_packed, msgpack)
+from device_readings_service import device_readings_service
+from main import app
+
+DEVICE_ID = uuid.UUID("3fa85f64-5717-4562-b3fc-2c963f66afa6")
+# 2024-10-11T02:11:43.862Z
+EPOCH_US = 1728612703862000
+
+
+class TestDecodePacked(unittest.TestCase):
+
+    def test_round_trip(self):
+        # Test that packed readings decode to the device and readings they were encoded from
+        readings = [(EPOCH_US, 3, 0), (EPOCH_US + 1, -4, 3600), (-EPOCH_US, 2 ** 31 - 1, -86399)]
+        body = encode_packed(DEVICE_ID, readings)
+        self.assertEqual(len(body), PACKED_HEADER.size + 16 * len(readings))
+        self.assertEqual(decode_packed(body), ((DEVICE_ID, readings), ""))
+        self.assertEqual(decode_packed(encode_packed(DEVICE_ID, [])), ((DEVICE_ID, []), ""))
+
+    def test_invalid_body(self):
+        # Test that truncated bodies, other formats and values that are not datetimes are rejected
+        body = encode_packed(DEVICE_ID, [(EPOCH_US, 3, 0)])
+        for invalid in [body[:10], body[:-1], body + b"\0", b"XXXX" + body[4:],
+                        encode_packed(DEVICE_ID, [(MAX_EPOCH_US + 1, 3, 0)]),
+                        encode_packed(DEVICE_ID, [(EPOCH_US, 3, 86400)])]:
+            decoded, err = decode_packed(invalid)
+            self.assertIsNone(decoded)
+            self.assertNotEqual(err, "")
+
+
+@unittest.skipIf(msgpack is None, "msgpack is not installed")
+class TestDecodeMsgpack(unittest.TestCase):
+
+    def test_decode(self):
+        # Test that readings without an offset are in UTC and the device id is read as bytes or as a string
+        readings = [[EPOCH_US, 3], [EPOCH_US + 1, 4, 3600]]
+        expected = ((DEVICE_ID, [(EPOCH_US, 3, 0), (EPOCH_US + 1, 4, 3600)]), "")
+        self.assertEqual(decode_msgpack(msgpack.packb({"id": DEVICE_ID.bytes, "readings": readings})), expected)
+        self.assertEqual(decode_msgpack(msgpack.packb({"id": str(DEVICE_ID), "readings": readings})), expected)
+
+    def test_invalid_body(self):
+        # Test that bodies that are not MessagePack or do not follow the schema are rejected
+        for invalid in [b"\xc1", msgpack.packb([1, 2]), msgpack.packb({"id": "device", "readings": []}),
+                        msgpack.packb({"id": DEVICE_ID.bytes, "readings": [[EPOCH_US]]}),
+                        msgpack.packb({"id": DEVICE_ID.bytes, "readings": [[float(EPOCH_US), 3]]}),
+                        msgpack.packb({"id": DEVICE_ID.bytes, "readings": [[EPOCH_US, True]]}),
+                        msgpack.packb({"id": DEVICE_ID.bytes, "readings": [[MAX_EPOCH_US + 1, 3]]})]:
+            decoded, err = decode_msgpack(invalid)
+            self.assertIsNone(decoded)
+            self.assertNotEqual(err, "")
+
+
+class TestBinaryDecodeRoute(unittest.TestCase):
+
+    def setUp(self):
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        device_readings_service.device_store.clear()
+        device_readings_service.ts_store.clear()
+        if device_readings_service.rollups is not None:
+            device_readings_service.rollups.clear()
+        if device_readings_service.top_devices is not None:
+            device_readings_service.top_devices.clear()
+
+    def post(self, body: bytes, content_type: str):
+        return self.client.post("/api/devices/readings", content=body, headers={"content-type": content_type})
+
+    def test_packed_readings_added(self):
+        # Test that packed readings update the device like the same readings sent as JSON, duplicates included
+        body = encode_packed(DEVICE_ID, [(EPOCH_US, 3, 3600), (EPOCH_US + 500000, 4, 3600), (EPOCH_US, 5, 3600)])
+        response = self.post(body, PACKED_MEDIA_TYPE)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"message": "Readings updated successfully"})
+        self.assertEqual(self.client.get(f"/api/devices/{DEVICE_ID}/cumulative_count").json(),
+                         {"cumulative_count": 7})
+        self.assertEqual(self.client.get(f"/api/devices/{DEVICE_ID}/latest_timestamp").json(),
+                         {"latest_timestamp": "2024-10-11T03:11:44.362000+01:00"})
+        # The same reading sent as JSON is a duplicate
+        self.client.post("/api/devices/readings", json={
+            "id": str(DEVICE_ID), "readings": [{"timestamp": "2024-10-11T02:11:43.862Z", "count": 9}]})
+        self.assertEqual(self.client.get(f"/api/devices/{DEVICE_ID}/cumulative_count").json(),
+                         {"cumulative_count": 7})
+
+    def test_invalid_packed_body(self):
+        # Test that an invalid packed body is rejected with a 400 status without adding readings
+        response = self.post(encode_packed(DEVICE_ID, [(EPOCH_US, 3, 0)])[:-1], PACKED_MEDIA_TYPE + "; v=1")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"message": "Body size does not match the number of readings"})
+        self.assertEqual(self.client.get(f"/api/devices/{DEVICE_ID}/cumulative_count").status_code, 404)
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def test_msgpack_readings_added(self):
+        # Test that MessagePack readings update the device
+        body = msgpack.packb({"id": DEVICE_ID.bytes, "readings": [[EPOCH_US, 3], [EPOCH_US + 1, 4]]})
+        self.assertEqual(self.post(body, "application/msgpack").status_code, 200)
+        self.assertEqual(self.client.get(f"/api/devices/{DEVICE_ID}/cumulative_count").json(),
+                         {"cumulative_count": 7})
+
+    @unittest.skipIf(msgpack is not None, "msgpack is installed")
+    def test_msgpack_unsupported(self):
+        # Test that MessagePack bodies are refused with a 415 status without msgpack
+        self.assertEqual(self.post(b"\x80", "application/msgpack").status_code, 415)
+
+    def test_json_unchanged(self):
+        # Test that JSON bodies still go through the regular handler and its validation
+        self.assertEqual(self.client.post("/api/devices/readings", json={"id": "not-a-uuid"}).status_code, 422)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+import unittest
+import uuid
+from .utils import run_multiples_threads
+from stores.bloom_ts_store import BloomFilter, BloomTimestampStore, RotatingBloomFilter
+from stores.in_memory_ts_store import InMemoryTimestampStore
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_sizing(self):
+        # Test that the filter is sized from the capacity and the false-positive rate
+        bloom_filter = BloomFilter(capacity=1000, fpr=0.01)
+        self.assertEqual(bloom_filter.num_bits, 9586)
+        self.assertEqual(bloom_filter.num_hashes, 7)
+        self.assertEqual(len(bloom_filter.bits), 1199)
+
+    def test_no_false_negatives(self):
+        # Test that every added key is reported as possibly present
+        bloom_filter = BloomFilter(capacity=1000, fpr=0.01)
+        keys = [i.to_bytes(8, "little") for i in range(1000)]
+        for key in keys:
+            bloom_filter.add(bloom_filter.positions(key))
+        self.assertTrue(all(bloom_filter.contains(bloom_filter.positions(key)) for key in keys))
+        self.assertEqual(bloom_filter.count, 1000)
+
+    def test_false_positive_rate_within_budget(self):
+        # Test that the observed and estimated false-positive rates are close to the target at capacity
+        bloom_filter = BloomFilter(capacity=2000, fpr=0.01)
+        for i in range(2000):
+            bloom_filter.add(bloom_filter.positions(i.to_bytes(8, "little")))
+        false_positives = sum(bloom_filter.contains(bloom_filter.positions(i.to_bytes(8, "little")))
+                              for i in range(2000, 22000))
+        self.assertLess(false_positives / 20000, 0.02)
+        self.assertAlmostEqual(bloom_filter.fill_ratio(), 0.5, delta=0.05)
+        self.assertLess(bloom_filter.estimated_fpr(), 0.02)
+
+
+class TestRotatingBloomFilter(unittest.TestCase):
+
+    def test_old_keys_age_out(self):
+        # Test that keys are forgotten once their generation is dropped
+        bloom_filter = RotatingBloomFilter(capacity=10, fpr=0.001, generations=2)
+        self.assertFalse(bloom_filter.check_and_add(b"first"))
+        self.assertTrue(bloom_filter.check_and_add(b"first"))
+
+        for i in range(30):
+            bloom_filter.check_and_add(i.to_bytes(8, "little") + b"filler")
+
+        self.assertEqual(len(bloom_filter.generations), 2)
+        self.assertEqual(bloom_filter.rotations, 3)
+        self.assertFalse(bloom_filter.check_and_add(b"first"))
+
+    def test_estimated_fpr_combines_generations(self):
+        # Test that the estimated false-positive rate accounts for every generation
+        bloom_filter = RotatingBloomFilter(capacity=100, fpr=0.01, generations=3)
+        for i in range(250):
+            bloom_filter.check_and_add(i.to_bytes(8, "little"))
+        self.assertEqual(len(bloom_filter.fill_ratios()), 3)
+        self.assertLess(bloom_filter.estimated_fpr(), 0.02)
+        self.assertGreater(bloom_filter.estimated_fpr(), 0)
+
+
+class TestBloomTimestampStore(unittest.TestCase):
+
+    def setUp(self):
+        self.exact_store = InMemoryTimestampStore(capacity=3)
+        self.store = BloomTimestampStore(self.exact_store, capacity=100, fpr=0.001, generations=2)
+        self.device_id = uuid.uuid4()
+        self.timestamp = 1622540800000000
+
+    def test_definite_new_skips_exact_store(self):
+        # Test that new readings are accepted from the filter alone with the reject policy
+        self.assertTrue(self.store.check_and_add_timestamp(self.device_id, self.timestamp))
+        self.assertFalse(self.store.check_and_add_timestamp(self.device_id, self.timestamp))
+        self.assertEqual(len(self.exact_store.store), 0)
+        self.assertEqual(self.store.filter_hits, 1)
+
+    def test_remembers_beyond_exact_capacity(self):
+        # Test that duplicates are remembered for longer than the exact store capacity
+        for i in range(10):
+            self.store.check_and_add_timestamp(self.device_id, self.timestamp + i)
+        self.assertFalse(self.store.check_and_add_timestamp(self.device_id, self.timestamp))
+
+    def test_exact_policy(self):
+        # Test that only hits are checked against and recorded in the exact store with the exact policy
+        store = BloomTimestampStore(self.exact_store, capacity=100, fpr=0.001, generations=2, hit_policy="exact")
+        self.assertTrue(store.check_and_add_timestamp(self.device_id, self.timestamp))
+        self.assertEqual(len(self.exact_store.store), 0)
+        # The first resend is not in the exact store yet, so it is taken as a false positive
+        self.assertTrue(store.check_and_add_timestamp(self.device_id, self.timestamp))
+        self.assertEqual(len(self.exact_store.store), 1)
+        self.assertFalse(store.check_and_add_timestamp(self.device_id, self.timestamp))
+        self.assertEqual(store.filter_hits, 2)
+
+    def test_batch_and_devices(self):
+        # Test that the batch call and different devices are handled independently
+        other_device_id = uuid.uuid4()
+        self.assertEqual(self.store.check_and_add_timestamps(self.device_id, [self.timestamp, self.timestamp]),
+                         [True, False])
+        self.assertTrue(self.store.check_and_add_timestamp(other_device_id, self.timestamp))
+
+    def test_stats(self):
+        # Test that the filter fill ratio and estimated false-positive rate are reported
+        self.store.check_and_add_timestamp(self.device_id, self.timestamp)
+        stats = self.store.stats()
+        self.assertEqual(stats["backend"], "bloom")
+        self.assertEqual(len(stats["fill_ratios"]), 1)
+        self.assertGreater(stats["fill_ratios"][0], 0)
+        self.assertGreaterEqual(stats["estimated_fpr"], 0)
+        self.assertEqual(stats["exact_store"]["backend"], "ordered")
+
+    def test_clear(self):
+        # Test that clearing the store forgets all readings
+        self.store.check_and_add_timestamp(self.device_id, self.timestamp)
+        self.store.clear()
+        self.assertTrue(self.store.check_and_add_timestamp(self.device_id, self.timestamp))
+
+    def test_invalid_policy(self):
+        # Test that unknown hit policies are rejected
+        with self.assertRaises(ValueError):
+            BloomTimestampStore(self.exact_store, hit_policy="unknown")
+
+    def test_concurrent_addition_of_same_timestamp(self):
+        # Test that concurrent addition of the same timestamp is handled correctly
+        args = [(self.device_id, self.timestamp)] * 10
+        result = run_multiples_threads(self.store.check_and_add_timestamp, args)
+        self.assertEqual(result.count(True), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
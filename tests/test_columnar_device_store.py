@@ -0,0 +1,157 @@
+import datetime
+import random
+import unittest
+import uuid
+from stores.columnar_device_store import ColumnarDeviceStore
+from stores.device_store import DeviceReadingIface
+from tests.utils import run_multiples_threads
+
+
+class TestColumnarDeviceReading(unittest.TestCase):
+
+    def setUp(self):
+        self.store = ColumnarDeviceStore(capacity=10, stripes=4)
+        self.device_id = uuid.uuid4()
+        self.device_reading = self.store.get_or_create_device_reading(self.device_id)
+
+    def test_initialization(self):
+        # Check that a new device reading starts empty and holds no state of its own
+        self.assertEqual(self.device_reading.device_id, self.device_id)
+        self.assertEqual(self.device_reading.total_count, 0)
+        self.assertIsNone(self.device_reading.latest_timestamp)
+        self.assertFalse(hasattr(self.device_reading, "__dict__"))
+
+    def test_views_share_state(self):
+        # Check that two views over the same device see each other's updates
+        self.device_reading.increment_count(3)
+        self.assertEqual(self.store.get_device_reading(self.device_id).total_count, 3)
+
+    def test_increment_count_concurrent(self):
+        # Verify that increment_count correctly increases the total count with concurrent calls
+        args = [[5]] * 100
+        run_multiples_threads(self.device_reading.increment_count, args)
+        self.assertEqual(self.device_reading.total_count, 500)
+
+    def test_update_timestamp_concurrent(self):
+        # Verify that update_latest_timestamp keeps the most recent timestamp with concurrent calls
+        old_timestamp = datetime.datetime.now()
+        args = [[old_timestamp + datetime.timedelta(seconds=10) * i] for i in range(10)]
+        highest_timestamp = args[-1][0]
+        random.shuffle(args)
+        run_multiples_threads(self.device_reading.update_latest_timestamp, args)
+        self.assertEqual(self.device_reading.latest_timestamp, highest_timestamp)
+
+    def test_timestamp_keeps_offset(self):
+        # Check that an aware timestamp is returned with the offset it was received with
+        tz = datetime.timezone(datetime.timedelta(hours=5, minutes=30))
+        timestamp = datetime.datetime(2024, 9, 29, 12, 0, 0, 123456, tzinfo=tz)
+        self.device_reading.update_latest_timestamp(timestamp)
+        latest_timestamp = self.device_reading.latest_timestamp
+        self.assertEqual(latest_timestamp, timestamp)
+        self.assertEqual(latest_timestamp.utcoffset(), timestamp.utcoffset())
+
+    def test_older_timestamp_ignored(self):
+        # Check that an older timestamp in another offset does not override the latest one
+        timestamp = datetime.datetime(2024, 9, 29, 12, 0, 0, tzinfo=datetime.timezone.utc)
+        self.device_reading.update_latest_timestamp(timestamp)
+        self.device_reading.update_latest_timestamp(
+            datetime.datetime(2024, 9, 29, 13, 0, 0, tzinfo=datetime.timezone(datetime.timedelta(hours=2))))
+        self.assertEqual(self.device_reading.latest_timestamp, timestamp)
+
+
+class TestColumnarDeviceStore(unittest.TestCase):
+
+    def setUp(self):
+        self.device_store = ColumnarDeviceStore(capacity=2, stripes=4)
+        self.device_id_1 = uuid.uuid4()
+        self.device_id_2 = uuid.uuid4()
+        self.device_id_3 = uuid.uuid4()
+
+    def test_get_or_create_device_reading(self):
+        # Test that get_or_create_device_reading creates a device once and then returns views over the same slot
+        reading = self.device_store.get_or_create_device_reading(self.device_id_1)
+        self.assertIsInstance(reading, DeviceReadingIface)
+        self.assertEqual(self.device_store.get_or_create_device_reading(self.device_id_1).device_id, self.device_id_1)
+        self.assertEqual(len(self.device_store), 1)
+
+    def test_capacity_exceeded(self):
+        # Test that a new device is rejected when the store is full, without evicting existing devices
+        self.device_store.get_or_create_device_reading(self.device_id_1)
+        self.device_store.get_or_create_device_reading(self.device_id_2)
+        with self.assertRaises(ValueError) as exc_info:
+            self.device_store.get_or_create_device_reading(self.device_id_3)
+        self.assertEqual(str(exc_info.exception), "Capacity exceeded")
+        self.assertEqual(len(self.device_store), 2)
+        self.assertEqual(self.device_store.rejections, 1)
+        self.assertIsNotNone(self.device_store.get_device_reading(self.device_id_1))
+        self.assertIsNone(self.device_store.get_device_reading(self.device_id_3))
+
+    def test_concurrent_creation_respects_capacity(self):
+        # Test that concurrent creation of many devices admits exactly `capacity` devices
+        device_store = ColumnarDeviceStore(capacity=10, stripes=4)
+
+        def create(device_id):
+            try:
+                return device_store.get_or_create_device_reading(device_id)
+            except ValueError:
+                return None
+
+        result = run_multiples_threads(create, [[uuid.uuid4()] for _ in range(50)])
+        self.assertEqual(len(device_store), 10)
+        self.assertEqual(sum(reading is not None for reading in result), 10)
+
+    def test_concurrent_creation_of_same_device(self):
+        # Test that concurrent creation of the same device uses a single slot
+        run_multiples_threads(self.device_store.get_or_create_device_reading, [[self.device_id_1]] * 20)
+        self.assertEqual(len(self.device_store), 1)
+        self.assertEqual(len(self.device_store._counts), 1)
+
+    def test_get_device_reading_non_existent(self):
+        # Test that get_device_reading returns None if the device_id does not exist in the store
+        self.assertIsNone(self.device_store.get_device_reading(self.device_id_1))
+
+    def test_bytes_per_device(self):
+        # Test that the memory report is empty for an empty store and grows with the devices
+        self.assertEqual(self.device_store.bytes_per_device(), 0)
+        self.device_store.get_or_create_device_reading(self.device_id_1)
+        memory_usage = self.device_store.memory_usage()
+        self.assertGreater(self.device_store.bytes_per_device(), 0)
+        self.device_store.get_or_create_device_reading(self.device_id_2)
+        self.assertGreater(self.device_store.memory_usage(), memory_usage)
+
+    def test_clear(self):
+        # Test that clearing the store removes all devices and frees the capacity
+        self.device_store.get_or_create_device_reading(self.device_id_1)
+        self.device_store.get_or_create_device_reading(self.device_id_2)
+        self.device_store.clear()
+        self.assertEqual(len(self.device_store), 0)
+        self.assertEqual(self.device_store.get_or_create_device_reading(self.device_id_3).total_count, 0)
+
+    def test_scan_devices(self):
+        # Test that a single scan returns every device
+        self.device_store.get_or_create_device_reading(self.device_id_1)
+        self.device_store.get_or_create_device_reading(self.device_id_2)
+        cursor, device_ids = self.device_store.scan_devices(0, 10)
+        self.assertEqual(cursor, 0)
+        self.assertEqual(set(device_ids), {self.device_id_1, self.device_id_2})
+
+    def test_get_device_version(self):
+        # Test that the version changes with the count and the latest timestamp, and with the store ID on clear
+        self.assertIsNone(self.device_store.get_device_version(self.device_id_1))
+        reading = self.device_store.get_or_create_device_reading(self.device_id_1)
+        created = self.device_store.get_device_version(self.device_id_1)
+        reading.increment_count(1)
+        counted = self.device_store.get_device_version(self.device_id_1)
+        reading.update_latest_timestamp(datetime.datetime(2024, 9, 29, 12, 0))
+        updated = self.device_store.get_device_version(self.device_id_1)
+        reading.update_latest_timestamp(datetime.datetime(2024, 9, 29, 11, 0))
+        self.assertEqual(len({created, counted, updated}), 3)
+        self.assertEqual(self.device_store.get_device_version(self.device_id_1), updated)
+
+        self.device_store.clear()
+        self.device_store.get_or_create_device_reading(self.device_id_1)
+        self.assertNotEqual(self.device_store.get_device_version(self.device_id_1), created)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,17 @@
 import unittest
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from unittest.mock import Mock
 from stores.device_store import DeviceStoreIface
+from stores.epoch import to_epoch_us
 from stores.ts_store import TimeStampStoreIface
 from models import DeviceReadings, Reading
-from device_readings_service import DeviceReadingsService
+from config.base import Settings
+from device_readings_service import DeviceReadingsService, DeviceSummaryScan, _create_service
 from stores.in_mem_device_store import InMemoryDeviceStore
 from stores.in_memory_ts_store import InMemoryTimestampStore
+from stores.rollup_store import RollupStore
+from stores.top_devices import TopDevices
 
 
 class TestDeviceReadingsService(unittest.TestCase):
@@ -81,6 +85,85 @@ class TestDeviceReadingsService(unittest.TestCase):
         result = self.service.add_device_readings(self.device_readings)
         self.assertEqual(result, "Device store error")
 
+    def test_add_device_readings_batch_success(self):
+        # Verifies that add_device_readings_batch looks up each device once, deduplicates with a single call per
+        # device and applies the summed count and the most recent timestamp once.
+
+        mock_device_reading = Mock()
+        self.mock_device_store.get_or_create_device_reading.return_value = mock_device_reading
+        self.mock_ts_store.check_and_add_timestamps.return_value = [True, True]
+
+        result = self.service.add_device_readings_batch([self.device_readings])
+
+        self.assertEqual(result, {self.device_id: ""})
+        self.mock_device_store.get_or_create_device_reading.assert_called_once_with(self.device_id)
+        self.mock_ts_store.check_and_add_timestamps.assert_called_once_with(
+            self.device_id, [to_epoch_us(self.timestamp_1), to_epoch_us(self.timestamp_2)])
+        mock_device_reading.increment_count.assert_called_once_with(5)
+        mock_device_reading.update_latest_timestamp.assert_called_once_with(self.timestamp_2)
+
+    def test_add_device_readings_batch_merges_same_device(self):
+        # Ensures that readings for a device appearing more than once in the batch are processed together.
+
+        mock_device_reading = Mock()
+        self.mock_device_store.get_or_create_device_reading.return_value = mock_device_reading
+        self.mock_ts_store.check_and_add_timestamps.return_value = [True, False, True]
+        timestamp_3 = self.timestamp_1 + timedelta(seconds=5)
+        extra = DeviceReadings(id=self.device_id, readings=[Reading(timestamp=timestamp_3, count=7)])
+
+        result = self.service.add_device_readings_batch([self.device_readings, extra])
+
+        self.assertEqual(result, {self.device_id: ""})
+        self.mock_device_store.get_or_create_device_reading.assert_called_once_with(self.device_id)
+        mock_device_reading.increment_count.assert_called_once_with(10)
+        mock_device_reading.update_latest_timestamp.assert_called_once_with(timestamp_3)
+
+    def test_add_device_readings_batch_dedupes_within_batch(self):
+        # Ensures that repeated timestamps are sent to the timestamp store once, and only count once if new.
+
+        mock_device_reading = Mock()
+        self.mock_device_store.get_or_create_device_reading.return_value = mock_device_reading
+        self.mock_ts_store.check_and_add_timestamps.return_value = [True, False]
+        extra = DeviceReadings(id=self.device_id, readings=[Reading(timestamp=self.timestamp_1, count=7),
+                                                           Reading(timestamp=self.timestamp_2, count=4)])
+
+        result = self.service.add_device_readings_batch([self.device_readings, extra])
+
+        self.assertEqual(result, {self.device_id: ""})
+        self.mock_ts_store.check_and_add_timestamps.assert_called_once_with(
+            self.device_id, [to_epoch_us(self.timestamp_1), to_epoch_us(self.timestamp_2)])
+        mock_device_reading.increment_count.assert_called_once_with(3)
+        mock_device_reading.update_latest_timestamp.assert_called_once_with(self.timestamp_1)
+
+    def test_add_device_readings_batch_all_duplicates(self):
+        # Ensures that the device reading is left untouched when every reading is a duplicate.
+
+        mock_device_reading = Mock()
+        self.mock_device_store.get_or_create_device_reading.return_value = mock_device_reading
+        self.mock_ts_store.check_and_add_timestamps.return_value = [False, False]
+
+        result = self.service.add_device_readings_batch([self.device_readings])
+
+        self.assertEqual(result, {self.device_id: ""})
+        mock_device_reading.increment_count.assert_not_called()
+        mock_device_reading.update_latest_timestamp.assert_not_called()
+
+    def test_add_device_readings_batch_per_device_error(self):
+        # Checks that a device store error is reported for that device only.
+
+        other_device_id = uuid.uuid4()
+        mock_device_reading = Mock()
+        self.mock_device_store.get_or_create_device_reading.side_effect = [
+            mock_device_reading, ValueError("Capacity exceeded")]
+        self.mock_ts_store.check_and_add_timestamps.return_value = [True, True]
+        other = DeviceReadings(id=other_device_id, readings=[Reading(timestamp=self.timestamp_1, count=1)])
+
+        result = self.service.add_device_readings_batch([self.device_readings, other])
+
+        self.assertEqual(result, {self.device_id: "", other_device_id: "Capacity exceeded"})
+        self.mock_ts_store.check_and_add_timestamps.assert_called_once()
+        mock_device_reading.increment_count.assert_called_once_with(5)
+
     def test_get_cumulative_count_success(self):
         # Validates that get_cumulative_count correctly retrieves the total count for an existing device reading.
 
@@ -125,6 +208,13 @@ class TestDeviceReadingsService(unittest.TestCase):
         self.assertIsNone(latest_timestamp)
         self.assertEqual(error, f"Device with id {self.device_id} not found")
 
+    def test_get_store_stats(self):
+        # Ensures that get_store_stats reports the statistics of the timestamp store.
+
+        self.mock_ts_store.stats.return_value = {"backend": "ordered", "size": 1}
+
+        self.assertEqual(self.service.get_store_stats(), {"timestamp_store": {"backend": "ordered", "size": 1}})
+
 
 class TestDeviceReadingsServiceFunctional(unittest.TestCase):
     # This test case performs functional tests using the real in-memory stores,
@@ -196,6 +286,66 @@ class TestDeviceReadingsServiceFunctional(unittest.TestCase):
         self.assertEqual(latest_timestamp, self.timestamp_2)
         self.assertIsNone(error)
 
+    def test_add_device_readings_batch_functional(self):
+        # Tests that a batch for several devices gives the same results as adding the readings one device at a time.
+
+        other_device_id = uuid.uuid4()
+        batch = [
+            DeviceReadings(id=self.device_id, readings=[
+                Reading(timestamp=self.timestamp_1, count=3),
+                Reading(timestamp=self.timestamp_1, count=3),
+            ]),
+            DeviceReadings(id=other_device_id, readings=[Reading(timestamp=self.timestamp_2, count=4)]),
+            DeviceReadings(id=self.device_id, readings=[Reading(timestamp=self.timestamp_2, count=2)]),
+        ]
+
+        result = self.service.add_device_readings_batch(batch)
+        self.assertEqual(result, {self.device_id: "", other_device_id: ""})
+
+        self.assertEqual(self.service.get_cumulative_count(self.device_id), (5, None))
+        self.assertEqual(self.service.get_latest_timestamp(self.device_id), (self.timestamp_2, None))
+        self.assertEqual(self.service.get_cumulative_count(other_device_id), (4, None))
+
+        # Re-sending the batch does not change the counts
+        self.service.add_device_readings_batch(batch)
+        self.assertEqual(self.service.get_cumulative_count(self.device_id), (5, None))
+
+    def test_add_device_readings_batched_functional(self):
+        # Tests that many readings of a device, processed as a batch, give the same results as reading by reading.
+
+        readings = [Reading(timestamp=self.timestamp_1 + timedelta(seconds=i % 7, hours=-(i % 3)), count=i)
+                    for i in range(40)]
+        scalar = DeviceReadingsService(device_store=InMemoryDeviceStore(), ts_store=InMemoryTimestampStore(),
+                                       rollups=RollupStore(retentions={"minute": 600, "hour": 24}))
+        batched = DeviceReadingsService(device_store=InMemoryDeviceStore(), ts_store=InMemoryTimestampStore(),
+                                        rollups=RollupStore(retentions={"minute": 600, "hour": 24}))
+        for chunk in range(0, 40, 4):
+            scalar.add_device_readings(DeviceReadings(id=self.device_id, readings=readings[chunk:chunk + 4]))
+        self.assertEqual(batched.add_device_readings(DeviceReadings(id=self.device_id, readings=readings)), "")
+
+        start, end = self.timestamp_1 - timedelta(hours=3), self.timestamp_1 + timedelta(hours=1)
+        self.assertEqual(batched.get_cumulative_count(self.device_id), scalar.get_cumulative_count(self.device_id))
+        self.assertEqual(batched.get_latest_timestamp(self.device_id), scalar.get_latest_timestamp(self.device_id))
+        self.assertEqual(batched.get_counts(self.device_id, start, end), scalar.get_counts(self.device_id, start, end))
+        self.assertEqual(batched.get_cumulative_count(self.device_id), (sum(range(21)), None))
+
+    def test_add_encoded_readings_functional(self):
+        # Tests that encoded readings give the same results as the readings they were decoded from.
+
+        tz = timezone(timedelta(hours=2))
+        timestamp_1 = datetime(2024, 10, 11, 2, 11, 43, tzinfo=tz)
+        timestamp_2 = timestamp_1 + timedelta(seconds=10)
+        readings = [(to_epoch_us(timestamp_2), 2, 7200), (to_epoch_us(timestamp_1), 3, 7200),
+                    (to_epoch_us(timestamp_1), 3, 7200)]
+
+        self.assertEqual(self.service.add_encoded_readings(self.device_id, readings), "")
+        self.assertEqual(self.service.get_cumulative_count(self.device_id), (5, None))
+        self.assertEqual(self.service.get_latest_timestamp(self.device_id), (timestamp_2, None))
+
+        # Re-sending the readings does not change the count
+        self.assertEqual(self.service.add_encoded_readings(self.device_id, readings), "")
+        self.assertEqual(self.service.get_cumulative_count(self.device_id), (5, None))
+
     def test_device_not_found_functional(self):
         # Ensures that attempts to retrieve data for a non-existent device return appropriate error messages.
 
@@ -207,6 +357,115 @@ class TestDeviceReadingsServiceFunctional(unittest.TestCase):
         self.assertIsNone(latest_timestamp)
         self.assertIsNotNone(ts_error)
 
+    def test_rollups_dropped_with_evicted_devices(self):
+        # Ensures that the rollups of a device evicted from the device store are dropped with it.
+
+        service = _create_service(Settings(ROLLUPS_ENABLED=True, DEVICE_STORE_EVICTION="lru", DEVICE_STORE_CAPACITY=1,
+                                           TIMESTAMP_STORE_BACKEND="partitioned", WAL_ENABLED=False))
+        timestamp = datetime(2024, 9, 29, 12, 0, tzinfo=timezone.utc)
+        first, second = uuid.uuid4(), uuid.uuid4()
+        for device_id in (first, second):
+            service.add_device_readings(DeviceReadings(id=device_id, readings=[Reading(timestamp=timestamp, count=3)]))
+        self.assertEqual(service.rollups.stats()["devices"], 1)
+        self.assertEqual(service.rollups.get_counts(first, 0, to_epoch_us(timestamp) + 1, "day"), (0, [], None))
+        self.assertEqual(service.rollups.get_counts(second, 0, to_epoch_us(timestamp) + 1, "day")[0], 3)
+
+    def test_rollups_restarted_for_spilled_devices(self):
+        # Ensures that the counts of a device loaded back from the spill tier report since when they cover it.
+
+        service = _create_service(Settings(ROLLUPS_ENABLED=True, DEVICE_STORE_EVICTION="lru", DEVICE_STORE_CAPACITY=1,
+                                           DEVICE_STORE_SPILL_PATH=":memory:", TIMESTAMP_STORE_BACKEND="partitioned",
+                                           WAL_ENABLED=False))
+        timestamp = datetime(2024, 9, 29, 12, 0, tzinfo=timezone.utc)
+        first = uuid.uuid4()
+        for device_id in (first, uuid.uuid4()):
+            service.add_device_readings(DeviceReadings(id=device_id, readings=[Reading(timestamp=timestamp, count=3)]))
+        counts, err = service.get_counts(first, timestamp, timestamp + timedelta(days=1), "day")
+        self.assertIsNone(err)
+        self.assertEqual(counts["total"], 0)
+        self.assertGreater(counts["since"], timestamp)
+
+    def test_get_counts_functional(self):
+        # Ensures that accepted readings are rolled up per time bucket, through the single and batch paths.
+
+        service = DeviceReadingsService(device_store=self.in_mem_device_store, ts_store=self.in_mem_ts_store,
+                                        rollups=RollupStore(retentions={"minute": 60, "hour": 24}))
+        start = datetime(2024, 9, 29, 12, 0, tzinfo=timezone.utc)
+        service.add_device_readings(DeviceReadings(id=self.device_id, readings=[
+            Reading(timestamp=start, count=3), Reading(timestamp=start, count=3)]))
+        service.add_device_readings_batch([DeviceReadings(id=self.device_id, readings=[
+            Reading(timestamp=start + timedelta(minutes=2), count=2)])])
+
+        counts, err = service.get_counts(self.device_id, start, start + timedelta(minutes=5))
+        self.assertIsNone(err)
+        self.assertEqual(counts["step"], "minute")
+        self.assertEqual(counts["total"], 5)
+        self.assertEqual([bucket["count"] for bucket in counts["counts"]], [3, 0, 2])
+        self.assertEqual(counts["counts"][2]["start"], start + timedelta(minutes=2))
+
+        counts, _ = service.get_counts(self.device_id, start, start + timedelta(hours=1), "hour")
+        self.assertEqual(counts["counts"], [{"start": start, "count": 5}])
+        self.assertEqual(service.get_counts(uuid.uuid4(), start, start + timedelta(hours=1))[0], None)
+        with self.assertRaises(ValueError):
+            service.get_counts(self.device_id, start, start)
+        with self.assertRaises(ValueError):
+            self.service.get_counts(self.device_id, start, start + timedelta(hours=1))
+
+    def test_get_top_devices_functional(self):
+        # Ensures that the top devices index follows the counts updated by the single, batch and encoded paths.
+
+        service = DeviceReadingsService(device_store=self.in_mem_device_store, ts_store=self.in_mem_ts_store,
+                                        top_devices=TopDevices(capacity=2))
+        device_ids = [uuid.uuid4() for _ in range(3)]
+        service.add_device_readings(DeviceReadings(id=device_ids[0], readings=[
+            Reading(timestamp=self.timestamp_1, count=3)]))
+        service.add_device_readings_batch([DeviceReadings(id=device_ids[1], readings=[
+            Reading(timestamp=self.timestamp_1, count=5)])])
+        service.add_encoded_readings(device_ids[2], [(to_epoch_us(self.timestamp_1), 1, 0)])
+        self.assertEqual(service.get_top_devices(2), [{"id": device_ids[1], "cumulative_count": 5},
+                                                      {"id": device_ids[0], "cumulative_count": 3}])
+
+        # Duplicates do not change the index, and a device overtaking another replaces it
+        service.add_device_readings(DeviceReadings(id=device_ids[0], readings=[
+            Reading(timestamp=self.timestamp_1, count=3)]))
+        service.add_encoded_readings(device_ids[2], [(to_epoch_us(self.timestamp_2), 9, 0)])
+        self.assertEqual(service.get_top_devices(1), [{"id": device_ids[2], "cumulative_count": 10}])
+        self.assertEqual(service.get_store_stats()["top_devices"]["devices"], 2)
+        with self.assertRaises(ValueError):
+            service.get_top_devices(3)
+        with self.assertRaises(ValueError):
+            self.service.get_top_devices(1)
+
+    def test_get_device_summaries_functional(self):
+        # Ensures that the summaries of many devices are returned in order, with unknown devices reported.
+
+        self.service.add_device_readings(DeviceReadings(id=self.device_id, readings=[
+            Reading(timestamp=self.timestamp_1, count=3)]))
+        unknown_device_id = uuid.uuid4()
+        pages = list(self.service.get_device_summaries([self.device_id, unknown_device_id]))
+        self.assertEqual(pages, [[
+            {"id": self.device_id, "cumulative_count": 3, "latest_timestamp": self.timestamp_1},
+            {"id": unknown_device_id, "message": f"Device with id {unknown_device_id} not found"},
+        ]])
+
+    def test_scan_device_summaries_functional(self):
+        # Ensures that a scan with a limit stops with a cursor that resumes it, until every device is read.
+
+        device_ids = [uuid.uuid4() for _ in range(5)]
+        for device_id in device_ids:
+            self.service.add_device_readings(DeviceReadings(id=device_id, readings=[
+                Reading(timestamp=self.timestamp_1, count=1)]))
+        scan = self.service.scan_device_summaries(limit=3)
+        first = [summary["id"] for page in scan for summary in page]
+        self.assertEqual(len(first), 3)
+        self.assertNotEqual(scan.cursor, 0)
+
+        scan = DeviceSummaryScan(self.in_mem_device_store.scan_devices, self.service._summaries,
+                                 cursor=scan.cursor, page_size=1)
+        rest = [summary["id"] for page in scan for summary in page]
+        self.assertEqual(scan.cursor, 0)
+        self.assertEqual(sorted(first + rest), sorted(device_ids))
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
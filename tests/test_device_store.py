@@ -0,0 +1,76 @@
+import unittest
+
+from stores.device_store import ScanIndex, scan_partitioned
+
+
+def scan_all(scan, count):
+    """Scan every key page by page, returning the keys in order."""
+    keys, cursor = [], 0
+    while True:
+        cursor, page = scan(cursor, count)
+        keys.extend(page)
+        if cursor == 0:
+            return keys
+
+
+class TestScanIndex(unittest.TestCase):
+
+    def test_scan_in_insertion_order(self):
+        # Test that pages return every key once in insertion order, and that an empty index ends at once
+        index = ScanIndex()
+        self.assertEqual(index.scan(0, 10), (0, []))
+        for key in range(10):
+            index.add(key)
+        self.assertEqual(scan_all(index.scan, 3), list(range(10)))
+        self.assertEqual(index.scan(0, 10), (0, list(range(10))))
+        self.assertEqual(len(index), 10)
+
+    def test_removal_does_not_shift_cursor(self):
+        # Test that removing keys already returned does not make the scan skip the next keys
+        index = ScanIndex(removals=True)
+        for key in range(10):
+            index.add(key)
+        cursor, page = index.scan(0, 4)
+        self.assertEqual(page, [0, 1, 2, 3])
+        for key in page:
+            index.remove(key)
+        index.add(10)
+        keys = list(page)
+        while cursor:
+            cursor, page = index.scan(cursor, 4)
+            keys += page
+        self.assertEqual(keys, list(range(11)))
+
+    def test_compaction_keeps_cursor(self):
+        # Test that compacting the removed keys keeps the cursors of a scan in progress valid
+        index = ScanIndex(removals=True)
+        for key in range(10):
+            index.add(key)
+        cursor, page = index.scan(0, 6)
+        # Removing more than half of the keys compacts the index
+        for key in [0, 1, 2, 3, 4, 5, 7]:
+            index.remove(key)
+        # Removing a key twice is a no-op
+        index.remove(7)
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.scan(cursor, 10), (0, [6, 8, 9]))
+        self.assertEqual(scan_all(index.scan, 1), [6, 8, 9])
+
+    def test_removals_disabled(self):
+        # Test that keys cannot be removed from an index created without removals
+        index = ScanIndex()
+        index.add(1)
+        with self.assertRaises(ValueError):
+            index.remove(1)
+
+    def test_scan_partitioned(self):
+        # Test that partitions are scanned one after the other, with the cursor of each encoded in the cursor
+        indexes = [ScanIndex(), ScanIndex(), ScanIndex()]
+        for key in range(10):
+            indexes[key % 3].add(key)
+        keys = scan_all(lambda c, n: scan_partitioned([index.scan for index in indexes], c, n), 2)
+        self.assertEqual(keys, [0, 3, 6, 9, 1, 4, 7, 2, 5, 8])
+
+
+if __name__ == '__main__':
+    unittest.main()
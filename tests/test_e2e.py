@@ -1,4 +1,5 @@
 import datetime
+import json
 import unittest
 import uuid
 import random
@@ -46,6 +47,10 @@ class E2ETests(unittest.TestCase):
         # Clear the stores after each test to ensure clean state
         device_readings_service.device_store.clear()
         device_readings_service.ts_store.clear()
+        if device_readings_service.rollups is not None:
+            device_readings_service.rollups.clear()
+        if device_readings_service.top_devices is not None:
+            device_readings_service.top_devices.clear()
 
     def test_update_readings_and_fetch_responses(self):
         # Test that readings can be added and then fetched for cumulative count and latest timestamp
@@ -111,6 +116,30 @@ class E2ETests(unittest.TestCase):
         self.assertEqual(response.status_code, 500)
         self.assertEqual(response.json(), {"message": "Capacity exceeded"})
 
+    def test_batch_update_reports_capacity_per_device(self):
+        # Test that a batch reports capacity exceeded only for the devices that do not fit in the store
+
+        device_ids = [str(uuid.uuid4()) for _ in range(settings.DEVICE_STORE_CAPACITY + 1)]
+        batch = {
+            "devices": [
+                {"id": device_id, "readings": [{"timestamp": self.timestamp, "count": 15}]}
+                for device_id in device_ids
+            ]
+        }
+        response = self.client.post("/api/devices/readings/batch", json=batch)
+        self.assertEqual(response.status_code, 200)
+
+        results = response.json()["results"]
+        self.assertEqual([result["id"] for result in results], device_ids)
+        self.assertTrue(all(result["success"] for result in results[:-1]))
+        self.assertEqual(results[-1], {"id": device_ids[-1], "success": False, "message": "Capacity exceeded"})
+
+        # Accepted devices have their counts, the rejected one is unknown
+        response = self.client.get(f"/api/devices/{device_ids[0]}/cumulative_count")
+        self.assertEqual(response.json(), {"cumulative_count": 15})
+        response = self.client.get(f"/api/devices/{device_ids[-1]}/cumulative_count")
+        self.assertEqual(response.status_code, 404)
+
     def test_duplicate_timestamps_in_same_request(self):
         # Test that duplicate timestamps in the same request are only counted once
 
@@ -227,4 +256,123 @@ class E2ETests(unittest.TestCase):
             # Verify latest timestamp
             response = self.client.get(f"/api/devices/{device_id}/latest_timestamp")
             self.assertEqual(response.status_code, 200)
-            self.assertEqual(response.json(), {"latest_timestamp": data["readings"][0]["timestamp"]})
\ No newline at end of file
+            self.assertEqual(response.json(), {"latest_timestamp": data["readings"][0]["timestamp"]})
+
+    def test_counts_over_time_range(self):
+        # Test that the counts of a device over a time range are returned per bucket, and that invalid ranges are
+        # rejected
+        if device_readings_service.rollups is None:
+            self.skipTest("Rollups are disabled")
+        self.client.post("/api/devices/readings", json=self.data)
+        params = {"from": "2024-10-11T02:00:00+00:00", "to": "2024-10-11T03:00:00+00:00", "step": "hour"}
+        response = self.client.get(f"/api/devices/{self.device_id}/counts", params=params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"step": "hour", "total": 15,
+                                           "counts": [{"start": "2024-10-11T02:00:00+00:00", "count": 15}]})
+
+        response = self.client.get(f"/api/devices/{self.unknown_device_id}/counts", params=params)
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(f"/api/devices/{self.device_id}/counts", params={**params, "to": params["from"]})
+        self.assertEqual(response.status_code, 400)
+
+    def test_device_summaries(self):
+        # Test that the summaries of a list of devices, and of every device by cursor, are streamed in one response
+        self.client.post("/api/devices/readings", json=self.data)
+        response = self.client.post("/api/devices/summaries", json={"ids": [self.device_id, self.unknown_device_id]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"devices": [
+            {"id": self.device_id, "cumulative_count": 15, "latest_timestamp": self.timestamp},
+            {"id": self.unknown_device_id, "message": f"Device with id {self.unknown_device_id} not found"},
+        ]})
+
+        response = self.client.get("/api/devices/summaries")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"next_cursor": 0, "devices": [
+            {"id": self.device_id, "cumulative_count": 15, "latest_timestamp": self.timestamp}]})
+
+    def test_conditional_reads(self):
+        # Test that polling an unchanged device with its ETag gets 304 Not Modified, until a reading is accepted
+        self.client.post("/api/devices/readings", json=self.data)
+        url = f"/api/devices/{self.device_id}/cumulative_count"
+        response = self.client.get(url)
+        etag = response.headers["ETag"]
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+        # A duplicate reading is not accepted, so the device is unchanged
+        self.client.post("/api/devices/readings", json=self.data)
+        self.assertEqual(self.client.get(url, headers={"If-None-Match": etag}).status_code, 304)
+
+        self.data["readings"][0]["timestamp"] = "2024-10-11T03:11:43.862000+00:00"
+        self.client.post("/api/devices/readings", json=self.data)
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"cumulative_count": 30})
+        self.assertNotEqual(response.headers["ETag"], etag)
+        response = self.client.get(f"/api/devices/{self.device_id}/latest_timestamp",
+                                   headers={"If-None-Match": response.headers["ETag"]})
+        self.assertEqual(response.status_code, 304)
+
+    def test_stream_readings(self):
+        # Test that an NDJSON upload sent in chunks is added line by line, with a report of the invalid lines
+        lines = [{"id": self.device_id, "readings": [{"timestamp": f"2024-10-11T02:{minute:02d}:00Z", "count": 2}]}
+                 for minute in range(10)]
+        body = "\n".join(json.dumps(line) for line in lines[:5]) + "\nnot json\n" + "\n".join(
+            json.dumps(line) for line in lines) + "\n"
+        chunks = [body.encode()[i:i + 100] for i in range(0, len(body), 100)]
+        response = self.client.post("/api/devices/readings/stream", content=iter(chunks),
+                                    headers={"content-type": "application/x-ndjson"})
+        self.assertEqual(response.status_code, 200)
+        events = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual(events[0]["event"], "error")
+        self.assertEqual(events[0]["line"], 6)
+        self.assertEqual(events[-1], {"event": "done", "lines": 16, "readings": 15, "errors": 1, "complete": True})
+
+        # Re-sent readings are counted once
+        response = self.client.get(f"/api/devices/{self.device_id}/cumulative_count")
+        self.assertEqual(response.json(), {"cumulative_count": 20})
+
+        response = self.client.post("/api/devices/readings/stream", content=b"a,b",
+                                    headers={"content-type": "text/csv"})
+        self.assertEqual(response.status_code, 415)
+
+    def test_top_devices(self):
+        # Test that the devices with the highest counts are returned highest first, and that k is validated
+        if settings.TOP_DEVICES_CAPACITY == 0:
+            self.skipTest("Top devices are disabled")
+        other_device_id = str(uuid.uuid4())
+        self.client.post("/api/devices/readings", json=self.data)
+        self.client.post("/api/devices/readings", json={**self.data, "id": other_device_id,
+                                                        "readings": [{"timestamp": self.timestamp, "count": 20}]})
+        response = self.client.get("/api/devices/top", params={"k": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"devices": [{"id": other_device_id, "cumulative_count": 20},
+                                                       {"id": self.device_id, "cumulative_count": 15}]})
+        response = self.client.get("/api/devices/top", params={"k": settings.TOP_DEVICES_CAPACITY + 1})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get("/api/devices/top", params={"k": 0}).status_code, 422)
+
+    def test_metrics(self):
+        # Test that the metrics report the route latency, the readings per request and the size of the stores
+        self.client.post("/api/devices/readings", json=self.data)
+        self.client.post("/api/devices/readings", json=self.data)
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain; version=0.0.4"))
+        samples = dict(line.rsplit(" ", 1) for line in response.text.splitlines() if not line.startswith("#"))
+        self.assertGreaterEqual(float(samples['device_readings_request_duration_seconds_count'
+                                              '{method="POST",route="/api/devices/readings"}']), 2)
+        self.assertIn('device_readings_readings_per_request_bucket{result="duplicate",le="1"}', samples)
+        self.assertIn("device_readings_threadpool_waiting", samples)
+        if settings.INGEST_MODE == "sync":
+            self.assertEqual(samples["device_readings_device_store_size"], "1")
+
+    def test_profiles(self):
+        # Test that the profiles can be listed, and that unknown profiles and the disabled sampler are reported
+        response = self.client.get("/api/admin/profiles")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("profiles", response.json())
+        self.assertEqual(self.client.get("/api/admin/profiles/123456").status_code, 404)
+        if not settings.PROFILING_SAMPLER_ENABLED:
+            self.assertEqual(self.client.get("/api/admin/profiles/sampled").status_code, 404)
+
@@ -0,0 +1,36 @@
+import datetime
+import unittest
+from stores.epoch import NAIVE_OFFSET, from_epoch_us, to_epoch_us, utc_offset_seconds
+
+
+class TestEpoch(unittest.TestCase):
+
+    def test_aware_round_trip(self):
+        # Test that an aware datetime converts to exact microseconds and back with its offset
+        timestamp = datetime.datetime(2024, 10, 11, 2, 11, 43, 862001,
+                                      tzinfo=datetime.timezone(datetime.timedelta(hours=1)))
+        epoch_us = to_epoch_us(timestamp)
+        self.assertEqual(epoch_us, 1728609103862001)
+        restored = from_epoch_us(epoch_us, utc_offset_seconds(timestamp))
+        self.assertEqual(restored, timestamp)
+        self.assertEqual(restored.isoformat(), timestamp.isoformat())
+
+    def test_naive_round_trip(self):
+        # Test that a naive datetime is interpreted in local time and restored as a naive datetime
+        timestamp = datetime.datetime(2024, 10, 11, 2, 11, 43, 862001)
+        self.assertEqual(utc_offset_seconds(timestamp), NAIVE_OFFSET)
+        self.assertEqual(to_epoch_us(timestamp) // 1_000_000, int(timestamp.timestamp()))
+        restored = from_epoch_us(to_epoch_us(timestamp))
+        self.assertEqual(restored, timestamp)
+        self.assertIsNone(restored.tzinfo)
+
+    def test_float_and_int_epochs_agree(self):
+        # Test that equal instants always map to the same integer, whatever their timezone
+        utc = datetime.datetime(2024, 10, 11, 1, 11, 43, 862000, tzinfo=datetime.timezone.utc)
+        plus_one = utc.astimezone(datetime.timezone(datetime.timedelta(hours=1)))
+        self.assertEqual(to_epoch_us(utc), to_epoch_us(plus_one))
+        self.assertIsInstance(to_epoch_us(utc), int)
+
+
+if __name__ == '__main__':
+    unittest.main()
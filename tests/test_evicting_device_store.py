@@ -0,0 +1,217 @@
+import datetime
+import unittest
+import uuid
+from stores.evicting_device_store import EvictingDeviceStore
+from stores.spill_store import SqliteSpillStore
+from tests.utils import run_multiples_threads
+
+
+class FakeClock:
+    """Clock returning a time advanced by the tests."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestSqliteSpillStore(unittest.TestCase):
+
+    def setUp(self):
+        self.spill = SqliteSpillStore(":memory:")
+        self.addCleanup(self.spill.close)
+
+    def test_put_get_delete(self):
+        # Test that a spilled device keeps its count, its timestamp with its offset and its version
+        store = EvictingDeviceStore(capacity=1)
+        device_id = uuid.uuid4()
+        device_reading = store.get_or_create_device_reading(device_id)
+        offset = datetime.timezone(datetime.timedelta(hours=5))
+        timestamp = datetime.datetime(2024, 1, 1, 12, 30, 15, 123456, tzinfo=offset)
+        device_reading.increment_count(7)
+        device_reading.update_latest_timestamp(timestamp)
+        self.spill.put(device_id, device_reading)
+        spilled = self.spill.get(device_id)
+        self.assertEqual(spilled.total_count, 7)
+        self.assertEqual(spilled.latest_timestamp, timestamp)
+        self.assertEqual(spilled.latest_timestamp.utcoffset(), datetime.timedelta(hours=5))
+        self.assertEqual(spilled.version, device_reading.version)
+        self.assertEqual(len(self.spill), 1)
+        self.spill.delete(device_id)
+        self.assertIsNone(self.spill.get(device_id))
+        self.assertEqual(len(self.spill), 0)
+
+    def test_scan(self):
+        # Test that scan pages through every spilled device in the order they were written
+        store = EvictingDeviceStore(capacity=1)
+        device_ids = [uuid.uuid4() for _ in range(5)]
+        for device_id in device_ids:
+            self.spill.put(device_id, store.get_or_create_device_reading(device_id))
+        cursor, page = self.spill.scan(0, 3)
+        self.assertEqual(page, device_ids[:3])
+        cursor, page = self.spill.scan(cursor, 3)
+        self.assertEqual((cursor, page), (0, device_ids[3:]))
+
+
+class TestEvictingDeviceStore(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.spill = SqliteSpillStore(":memory:")
+        self.addCleanup(self.spill.close)
+
+    def create_store(self, policy="lru", capacity=2, spill=True):
+        return EvictingDeviceStore(capacity=capacity, policy=policy, idle_ttl_s=60, sample=2,
+                                   spill=self.spill if spill else None, clock=self.clock)
+
+    def test_unknown_policy(self):
+        # Test that an unknown policy is rejected
+        with self.assertRaises(ValueError):
+            EvictingDeviceStore(policy="random")
+
+    def test_lru_evicts_and_reloads(self):
+        # Test that the least recently used device is spilled to make room and loaded back with its state
+        store = self.create_store()
+        first, second, third = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+        timestamp = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        device_reading = store.get_or_create_device_reading(first)
+        device_reading.increment_count(3)
+        device_reading.update_latest_timestamp(timestamp)
+        version = device_reading.version
+        store.get_or_create_device_reading(second)
+        store.get_or_create_device_reading(third)
+        self.assertEqual(len(store), 2)
+        self.assertEqual((store.evictions, store.spilled, store.rejections), (1, 1, 0))
+        reloaded = store.get_device_reading(first)
+        self.assertEqual(reloaded.total_count, 3)
+        self.assertEqual(reloaded.latest_timestamp, timestamp)
+        self.assertEqual(reloaded.version, version)
+        # Loading the first device back evicted the second one, the least recently used
+        self.assertEqual((store.evictions, store.spilled), (2, 1))
+        self.assertIsNotNone(self.spill.get(second))
+        self.assertIsNone(self.spill.get(first))
+
+    def test_touch_protects_recent_device(self):
+        # Test that a device used recently is not evicted before devices used earlier
+        store = self.create_store()
+        first, second, third = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+        store.get_or_create_device_reading(first)
+        store.get_or_create_device_reading(second)
+        store.get_device_reading(first)
+        store.get_or_create_device_reading(third)
+        self.assertIsNotNone(self.spill.get(second))
+        self.assertIsNone(self.spill.get(first))
+
+    def test_idle_policy(self):
+        # Test that the idle policy rejects new devices while every device is in use and evicts idle ones
+        store = self.create_store(policy="idle")
+        store.get_or_create_device_reading(uuid.uuid4())
+        store.get_or_create_device_reading(uuid.uuid4())
+        with self.assertRaises(ValueError):
+            store.get_or_create_device_reading(uuid.uuid4())
+        self.assertEqual(store.rejections, 1)
+        self.clock.now = 60
+        store.get_or_create_device_reading(uuid.uuid4())
+        self.assertEqual((store.evictions, store.spilled), (1, 1))
+
+    def test_idle_read_of_spilled_device_when_full(self):
+        # Test that a spilled device is still readable when it cannot be loaded back
+        store = self.create_store(policy="idle")
+        first = uuid.uuid4()
+        store.get_or_create_device_reading(first).increment_count(4)
+        store.get_or_create_device_reading(uuid.uuid4())
+        self.clock.now = 60
+        store.get_or_create_device_reading(uuid.uuid4())
+        self.assertEqual(store.get_device_reading(first).total_count, 4)
+        self.assertEqual(store.spilled, 1)
+
+    def test_lfu_policy(self):
+        # Test that the lfu policy evicts the least updated of the least recently used devices
+        store = self.create_store(policy="lfu")
+        first, second = uuid.uuid4(), uuid.uuid4()
+        store.get_or_create_device_reading(first).increment_count(1)
+        store.get_or_create_device_reading(second)
+        store.get_or_create_device_reading(uuid.uuid4())
+        self.assertIsNotNone(self.spill.get(second))
+        self.assertIsNone(self.spill.get(first))
+
+    def test_without_spill(self):
+        # Test that evicted devices are dropped without a spill tier
+        store = self.create_store(spill=False)
+        first = uuid.uuid4()
+        store.get_or_create_device_reading(first).increment_count(2)
+        store.get_or_create_device_reading(uuid.uuid4())
+        store.get_or_create_device_reading(uuid.uuid4())
+        self.assertIsNone(store.get_device_reading(first))
+        recreated = store.get_or_create_device_reading(first)
+        self.assertEqual(recreated.total_count, 0)
+        # The version starts above that of the dropped device, so its versions are not reused
+        self.assertGreater(recreated.version, 1)
+
+    def test_eviction_listeners(self):
+        # Test that the listeners are called with the id of each evicted device
+        store = self.create_store()
+        evicted = []
+        store.eviction_listeners.append(evicted.append)
+        device_ids = [uuid.uuid4() for _ in range(4)]
+        for device_id in device_ids:
+            store.get_or_create_device_reading(device_id)
+        self.assertEqual(evicted, device_ids[:2])
+
+    def test_scan_devices(self):
+        # Test that a scan returns the devices in memory and the spilled ones
+        store = self.create_store()
+        device_ids = [uuid.uuid4() for _ in range(5)]
+        for device_id in device_ids:
+            store.get_or_create_device_reading(device_id)
+        scanned, cursor = [], 0
+        while True:
+            cursor, page = store.scan_devices(cursor, 2)
+            scanned.extend(page)
+            if cursor == 0:
+                break
+        self.assertCountEqual(scanned, device_ids)
+
+    def test_scan_while_evicting(self):
+        # Test that devices evicted during a scan do not make it skip the devices left in memory
+        for spill in (False, True):
+            store = self.create_store(capacity=4, spill=spill)
+            device_ids = [uuid.uuid4() for _ in range(6)]
+            for device_id in device_ids[:4]:
+                store.get_or_create_device_reading(device_id)
+            cursor, scanned = store.scan_devices(0, 2)
+            # Evicts the first two devices, already scanned
+            for device_id in device_ids[4:]:
+                store.get_or_create_device_reading(device_id)
+            while cursor:
+                cursor, page = store.scan_devices(cursor, 2)
+                scanned.extend(page)
+            # Spilled devices are returned again from the spill tier
+            self.assertEqual(scanned, device_ids + device_ids[:2] if spill else device_ids)
+            store.clear()
+
+    def test_spill_emptied_on_creation_and_clear(self):
+        # Test that the spill tier is emptied when the store is created and cleared
+        store = self.create_store()
+        for _ in range(3):
+            store.get_or_create_device_reading(uuid.uuid4())
+        self.assertEqual(len(self.spill), 1)
+        store.clear()
+        self.assertEqual((len(store), len(self.spill), store.spilled), (0, 0, 0))
+        store.get_or_create_device_reading(uuid.uuid4())
+        store.get_or_create_device_reading(uuid.uuid4())
+        store.get_or_create_device_reading(uuid.uuid4())
+        self.create_store()
+        self.assertEqual(len(self.spill), 0)
+
+    def test_concurrent_creation(self):
+        # Test that concurrent creations keep the store within its capacity and every device in one tier
+        store = self.create_store(capacity=10)
+        device_ids = [uuid.uuid4() for _ in range(100)]
+        run_multiples_threads(lambda device_id: store.get_or_create_device_reading(device_id).increment_count(1),
+                              [[device_id] for device_id in device_ids])
+        self.assertEqual(len(store), 10)
+        self.assertEqual(len(self.spill), 90)
+        self.assertEqual(store.spilled, 90)
+        self.assertEqual(sum(store.get_device_reading(device_id).total_count for device_id in device_ids), 100)
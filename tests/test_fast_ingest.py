@@ -0,0 +1,118 @@
+import unittest
+import uuid
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from device_readings_service import device_readings_service
+from fast_ingest import TimestampDecoder, decode_device_readings, router
+from main import app
+from models import DeviceReadings
+from stores.epoch import NAIVE_OFFSET, to_epoch_us, utc_offset_seconds
+
+DEVICE_ID = "3fa85f64-5717-4562-b3fc-2c963f66afa6"
+
+
+class TestTimestampDecoder(unittest.TestCase):
+
+    def test_decode_like_pydantic(self):
+        # Test that timestamps decode to the epoch and offset of the datetimes pydantic builds
+        decoder = TimestampDecoder()
+        timestamps = ["2024-10-11T02:11:43Z", "2024-10-11T02:11:43.862Z", "2024-10-11T02:11:44.000001Z",
+                      "2024-10-11T02:11:43.862000+00:00", "2024-10-11T02:11:43+05:30", "2024-10-11T02:11:43-08:00",
+                      "2024-12-31T23:59:59.999999-23:59", "1969-12-31T23:59:59.5Z", "2024-10-11T02:11:43.25"]
+        for timestamp in timestamps:
+            reading = DeviceReadings.model_validate(
+                {"id": DEVICE_ID, "readings": [{"timestamp": timestamp, "count": 1}]}).readings[0]
+            expected = (to_epoch_us(reading.timestamp), utc_offset_seconds(reading.timestamp))
+            self.assertEqual(decoder.decode(timestamp), expected, timestamp)
+        self.assertEqual(decoder.decode("2024-10-11T02:11:43.25")[1], NAIVE_OFFSET)
+
+    def test_decode_non_canonical(self):
+        # Test that timestamps in other forms, or with invalid fields, are left to pydantic
+        decoder = TimestampDecoder()
+        for timestamp in ["2024-10-11 02:11:43Z", "2024-10-11T02:11Z", "2024-10-11T02:11:43.1234567Z",
+                          "2024-10-11T02:11:60Z", "2024-02-30T02:11:43Z", "2024-10-11T24:00:00Z",
+                          "2024-10-11T02:11:43+24:00", "1728612703", ""]:
+            self.assertIsNone(decoder.decode(timestamp), timestamp)
+
+
+class TestDecodeDeviceReadings(unittest.TestCase):
+
+    def test_decode(self):
+        # Test that the device ID and the readings are decoded in order, duplicates included
+        body = ('{"id": "%s", "readings": [{"timestamp": "2024-10-11T02:11:43Z", "count": 3},'
+                '{"count": 4, "timestamp": "2024-10-11T02:11:43Z"}]}' % DEVICE_ID.upper()).encode()
+        device_id, readings = decode_device_readings(body)
+        self.assertEqual(device_id, uuid.UUID(DEVICE_ID))
+        self.assertEqual(readings, [(1728612703000000, 3, 0), (1728612703000000, 4, 0)])
+        self.assertEqual(decode_device_readings(b'{"id": "%s", "readings": []}' % DEVICE_ID.encode()),
+                         (uuid.UUID(DEVICE_ID), []))
+
+    def test_decode_fallback(self):
+        # Test that bodies pydantic may coerce or reject are not decoded
+        reading = '{"timestamp": "2024-10-11T02:11:43Z", "count": 3}'
+        for body in ['{"id": "%s", "readings": [%s' % (DEVICE_ID, reading),
+                     '[{"id": "%s", "readings": [%s]}]' % (DEVICE_ID, reading),
+                     '{"readings": [%s]}' % reading,
+                     '{"id": "%s", "readings": [%s]}' % (DEVICE_ID.replace("-", ""), reading),
+                     '{"id": "%s", "readings": {}}' % DEVICE_ID,
+                     '{"id": "%s", "readings": [%s, 1]}' % (DEVICE_ID, reading),
+                     '{"id": "%s", "readings": [{"timestamp": "2024-10-11T02:11:43Z", "count": "3"}]}' % DEVICE_ID,
+                     '{"id": "%s", "readings": [{"timestamp": "2024-10-11T02:11:43Z", "count": true}]}' % DEVICE_ID,
+                     '{"id": "%s", "readings": [{"timestamp": "2024-10-11T02:11:43Z", "count": 3.0}]}' % DEVICE_ID,
+                     '{"id": "%s", "readings": [{"timestamp": 1728612703, "count": 3}]}' % DEVICE_ID,
+                     '{"id": "%s", "readings": [{"count": 3}]}' % DEVICE_ID]:
+            self.assertIsNone(decode_device_readings(body.encode()), body)
+
+
+class TestFastDecodeRoute(unittest.TestCase):
+
+    def setUp(self):
+        # Compare an app using the fast decode path with the regular app
+        fast_app = FastAPI()
+        fast_app.include_router(router)
+        self.fast_client = TestClient(fast_app)
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        device_readings_service.device_store.clear()
+        device_readings_service.ts_store.clear()
+        if device_readings_service.rollups is not None:
+            device_readings_service.rollups.clear()
+        if device_readings_service.top_devices is not None:
+            device_readings_service.top_devices.clear()
+
+    def test_readings_added(self):
+        # Test that readings decoded by the fast path update the device like the regular handler does
+        readings = [{"timestamp": "2024-10-11T02:11:43+01:00", "count": 3},
+                    {"timestamp": "2024-10-11T02:11:44.5+01:00", "count": 4},
+                    {"timestamp": "2024-10-11T02:11:43+01:00", "count": 5}]
+        response = self.fast_client.post("/api/devices/readings", json={"id": DEVICE_ID, "readings": readings})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"message": "Readings updated successfully"})
+        self.assertEqual(self.client.get(f"/api/devices/{DEVICE_ID}/cumulative_count").json(),
+                         {"cumulative_count": 7})
+        self.assertEqual(self.client.get(f"/api/devices/{DEVICE_ID}/latest_timestamp").json(),
+                         {"latest_timestamp": "2024-10-11T02:11:44.500000+01:00"})
+
+    def test_validation_errors_unchanged(self):
+        # Test that invalid payloads get the same response from both apps
+        for body in ['{"id": "not-a-uuid", "readings": []}',
+                     '{"id": "%s", "readings": [{"timestamp": "yesterday", "count": 3}]}' % DEVICE_ID,
+                     '{"id": "%s", "readings": [{"timestamp": "2024-10-11T02:11:43Z"}]}' % DEVICE_ID,
+                     '{"id": "%s", "readings": [' % DEVICE_ID]:
+            expected = self.client.post("/api/devices/readings", content=body,
+                                        headers={"content-type": "application/json"})
+            response = self.fast_client.post("/api/devices/readings", content=body,
+                                             headers={"content-type": "application/json"})
+            self.assertEqual(response.status_code, 422)
+            self.assertEqual(response.json(), expected.json())
+
+    def test_coerced_payload_falls_back(self):
+        # Test that a payload pydantic coerces is still accepted through the regular handler
+        body = {"id": DEVICE_ID, "readings": [{"timestamp": "2024-10-11 02:11:43Z", "count": "3"}]}
+        response = self.fast_client.post("/api/devices/readings", json=body)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(f"/api/devices/{DEVICE_ID}/cumulative_count").json(),
+                         {"cumulative_count": 3})
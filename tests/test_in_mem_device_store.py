@@ -84,6 +84,7 @@ class TestDeviceStore(unittest.TestCase):
             self.device_store.get_or_create_device_reading(self.device_id_3)
         self.assertEqual(str(exc_info.exception), "Capacity exceeded")
         self.assertEqual(len(self.device_store.store), 2)
+        self.assertEqual(self.device_store.rejections, 1)
 
     def test_store_maintains_capacity(self):
         # Add more readings than capacity and verify store size is maintained at capacity limit
@@ -96,6 +97,23 @@ class TestDeviceStore(unittest.TestCase):
 
         self.assertEqual(len(self.device_store.store), 2)
 
+    def test_concurrent_creation_respects_capacity(self):
+        # Test that concurrent creation of many devices admits exactly `capacity` devices and evicts none of them
+        device_store = InMemoryDeviceStore(capacity=10)
+
+        def create(device_id):
+            try:
+                return device_store.get_or_create_device_reading(device_id)
+            except ValueError:
+                return None
+
+        result = run_multiples_threads(create, [[uuid.uuid4()] for _ in range(50)])
+        admitted = [reading for reading in result if reading is not None]
+        self.assertEqual(len(admitted), 10)
+        self.assertEqual(len(device_store.store), 10)
+        for reading in admitted:
+            self.assertIs(device_store.get_device_reading(reading.device_id), reading)
+
     def test_get_device_reading(self):
         # Test that get_device_reading returns a DeviceReading object if it exists in the store
         self.device_store.get_or_create_device_reading(self.device_id_1)
@@ -108,6 +126,33 @@ class TestDeviceStore(unittest.TestCase):
         reading = self.device_store.get_device_reading(self.device_id_2)
         self.assertIsNone(reading)
 
+    def test_scan_devices(self):
+        # Test that scanning in pages returns every device once and ends with cursor 0
+        self.device_store.get_or_create_device_reading(self.device_id_1)
+        self.device_store.get_or_create_device_reading(self.device_id_2)
+        cursor, first = self.device_store.scan_devices(0, 1)
+        self.assertEqual(len(first), 1)
+        cursor, second = self.device_store.scan_devices(cursor, 1)
+        self.assertEqual(cursor, 0)
+        self.assertEqual(set(first + second), {self.device_id_1, self.device_id_2})
+
+    def test_get_device_version(self):
+        # Test that the version changes with the count and the latest timestamp, and with the store ID on clear
+        self.assertIsNone(self.device_store.get_device_version(self.device_id_1))
+        reading = self.device_store.get_or_create_device_reading(self.device_id_1)
+        created = self.device_store.get_device_version(self.device_id_1)
+        reading.increment_count(1)
+        counted = self.device_store.get_device_version(self.device_id_1)
+        reading.update_latest_timestamp(datetime.datetime(2024, 9, 29, 12, 0))
+        updated = self.device_store.get_device_version(self.device_id_1)
+        reading.update_latest_timestamp(datetime.datetime(2024, 9, 29, 11, 0))
+        self.assertEqual(len({created, counted, updated}), 3)
+        self.assertEqual(self.device_store.get_device_version(self.device_id_1), updated)
+
+        self.device_store.clear()
+        self.device_store.get_or_create_device_reading(self.device_id_1)
+        self.assertNotEqual(self.device_store.get_device_version(self.device_id_1), created)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -35,6 +35,7 @@ class TestInMemoryTimestampStore(unittest.TestCase):
         oldest_key = _key(self.device_id, timestamps[0])
         self.assertNotIn(oldest_key, self.store.store)
         self.assertEqual(len(self.store.store), self.capacity)
+        self.assertEqual(self.store.stats()["evictions"], 1)
 
     def test_capacity_with_different_device_ids(self):
         # Test that the store handles capacity with multiple device ids
@@ -60,6 +61,19 @@ class TestInMemoryTimestampStore(unittest.TestCase):
         self.assertEqual(count, 1)
         self.assertIn(_key(self.device_id, timestamp), self.store.store)
 
+    def test_check_and_add_timestamps(self):
+        # Test that the batch call reports new and duplicate timestamps in order, including duplicates in the batch
+        self.store.check_and_add_timestamp(self.device_id, 1622540800)
+        result = self.store.check_and_add_timestamps(self.device_id, [1622540800, 1622540900, 1622540900])
+        self.assertEqual(result, [False, True, False])
+        self.assertIn(_key(self.device_id, 1622540900), self.store.store)
+
+    def test_check_and_add_timestamps_capacity(self):
+        # Test that the batch call maintains the capacity of the store
+        self.store.check_and_add_timestamps(self.device_id, [1622540800, 1622540900, 1622541000, 1622541100])
+        self.assertEqual(len(self.store.store), self.capacity)
+        self.assertNotIn(_key(self.device_id, 1622540800), self.store.store)
+
 
 if __name__ == '__main__':
     unittest.main()
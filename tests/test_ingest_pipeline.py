@@ -0,0 +1,190 @@
+import asyncio
+import datetime
+import unittest
+import uuid
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import ingest_pipeline as ingest_pipeline_module
+from config.base import Settings
+from ingest_pipeline import ShardedIngestPipeline, create_ingest_pipeline
+from models import DeviceReadings, Reading
+from stores.epoch import to_epoch_us
+from stores.in_memory_ts_store import InMemoryTimestampStore
+
+# The pipeline is only created in async ingest mode, so the async handlers are tested over one created here otherwise
+if ingest_pipeline_module.ingest_pipeline is None:
+    ingest_pipeline_module.ingest_pipeline = create_ingest_pipeline(Settings(INGEST_MODE="async"))
+ingest_pipeline = ingest_pipeline_module.ingest_pipeline
+from async_routes import router  # noqa: E402, imported once the pipeline it serves exists
+
+
+def _readings(device_id, *timestamps, count=1):
+    """Build the readings of a device, one per timestamp."""
+    return DeviceReadings(id=device_id, readings=[Reading(timestamp=timestamp, count=count)
+                                                  for timestamp in timestamps])
+
+
+class TestShardedIngestPipeline(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.pipeline = ShardedIngestPipeline(shards=4, queue_size=2, device_capacity=3,
+                                              ts_store_factory=lambda: InMemoryTimestampStore(capacity=100))
+        self.timestamp = datetime.datetime(2024, 9, 29, 12, 0, 0, tzinfo=datetime.timezone.utc)
+
+    async def test_add_device_readings(self):
+        # Test that readings are applied by the writer of the shard and deduplicated
+        device_id = uuid.uuid4()
+        later = self.timestamp + datetime.timedelta(seconds=1)
+        err = await self.pipeline.add_device_readings(_readings(device_id, self.timestamp, later, later, count=2))
+        self.assertEqual(err, "")
+        self.assertEqual(self.pipeline.get_cumulative_count(device_id), (4, None))
+        self.assertEqual(self.pipeline.get_latest_timestamp(device_id), (later, None))
+
+    async def test_concurrent_writes_with_backpressure(self):
+        # Test that many concurrent writes through small queues are all applied exactly once
+        device_ids = [uuid.uuid4() for _ in range(3)]
+        await asyncio.gather(*[
+            self.pipeline.add_device_readings(
+                _readings(device_ids[i % 3], self.timestamp + datetime.timedelta(seconds=i)))
+            for i in range(60)
+        ])
+        self.assertEqual(sum(self.pipeline.get_cumulative_count(device_id)[0] for device_id in device_ids), 60)
+        self.assertTrue(all(shard.writer.done() for shard in self.pipeline.shards if shard.writer))
+
+    async def test_capacity_shared_between_shards(self):
+        # Test that the device capacity applies across all shards
+        results = [await self.pipeline.add_device_readings(_readings(uuid.uuid4(), self.timestamp))
+                   for _ in range(5)]
+        self.assertEqual(results, ["", "", "", "Capacity exceeded", "Capacity exceeded"])
+
+    async def test_add_device_readings_batch(self):
+        # Test that a batch is split by shard and the results keep the order of first appearance
+        device_ids = [uuid.uuid4() for _ in range(5)]
+        batch = [_readings(device_id, self.timestamp) for device_id in device_ids]
+        batch.append(_readings(device_ids[0], self.timestamp + datetime.timedelta(seconds=1)))
+        results = await self.pipeline.add_device_readings_batch(batch)
+        self.assertEqual(list(results), device_ids)
+        self.assertEqual(list(results.values()).count("Capacity exceeded"), 2)
+        self.assertEqual(self.pipeline.get_cumulative_count(device_ids[0]), (2, None))
+
+    async def test_add_encoded_readings_batch(self):
+        # Test that encoded readings are split by shard, deduped per device and reported per device
+        device_ids = [uuid.uuid4() for _ in range(4)]
+        epoch_us = to_epoch_us(self.timestamp)
+        batch = {device_id: [(epoch_us, 2, 0), (epoch_us, 2, 0)] for device_id in device_ids}
+        results = await self.pipeline.add_encoded_readings_batch(batch)
+        self.assertEqual(list(results), device_ids)
+        self.assertEqual(list(results.values()).count("Capacity exceeded"), 1)
+        self.assertEqual(self.pipeline.get_cumulative_count(device_ids[0]), (2, None))
+
+    async def test_top_devices(self):
+        # Test that the top devices of every shard are merged, highest count first
+        device_ids = [uuid.uuid4() for _ in range(3)]
+        for count, device_id in enumerate(device_ids, start=1):
+            await self.pipeline.add_device_readings(_readings(device_id, self.timestamp, count=count))
+        self.assertEqual(self.pipeline.get_top_devices(2), [{"id": device_ids[2], "cumulative_count": 3},
+                                                            {"id": device_ids[1], "cumulative_count": 2}])
+        self.pipeline.clear()
+        self.assertEqual(self.pipeline.get_top_devices(2), [])
+
+    async def test_unknown_device(self):
+        # Test that reads for an unknown device report an error
+        device_id = uuid.uuid4()
+        self.assertEqual(self.pipeline.get_cumulative_count(device_id),
+                         (0, f"Device with id {device_id} not found"))
+
+
+class TestCreateIngestPipeline(unittest.TestCase):
+
+    def test_create_ingest_pipeline(self):
+        # Test that the pipeline is only created in async ingest mode, with the configured shards
+        self.assertIsNone(create_ingest_pipeline(Settings(INGEST_MODE="sync")))
+        pipeline = create_ingest_pipeline(Settings(INGEST_MODE="async", INGEST_SHARDS=2))
+        self.assertIsInstance(pipeline, ShardedIngestPipeline)
+        self.assertEqual(len(pipeline.shards), 2)
+
+
+class TestAsyncRoutes(unittest.TestCase):
+    """
+    End-to-end tests of the async handlers, which are registered on the app when INGEST_MODE is "async".
+    """
+
+    def setUp(self):
+        app = FastAPI()
+        app.include_router(router)
+        self.client = TestClient(app)
+        self.device_id = "3fa85f64-5717-4562-b3fc-2c963f66afa6"
+        self.timestamp = "2024-10-11T02:11:43.862000+00:00"
+
+    def tearDown(self):
+        # Clear the shard stores after each test to ensure clean state
+        ingest_pipeline.clear()
+
+    def test_update_readings_and_fetch_responses(self):
+        # Test that readings can be added and then fetched, with each request on its own event loop
+        data = {"id": self.device_id, "readings": [{"timestamp": self.timestamp, "count": 15}]}
+        response = self.client.post("/api/devices/readings", json=data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"message": "Readings updated successfully"})
+
+        response = self.client.post("/api/devices/readings", json=data)
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(f"/api/devices/{self.device_id}/cumulative_count")
+        self.assertEqual(response.json(), {"cumulative_count": 15})
+        response = self.client.get(f"/api/devices/{self.device_id}/latest_timestamp")
+        self.assertEqual(response.json(), {"latest_timestamp": self.timestamp})
+
+    def test_update_readings_batch(self):
+        # Test that the batch endpoint reports one result per device
+        data = {"devices": [{"id": self.device_id, "readings": [{"timestamp": self.timestamp, "count": 5}]}]}
+        response = self.client.post("/api/devices/readings/batch", json=data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"results": [
+            {"id": self.device_id, "success": True, "message": "Readings updated successfully"}]})
+
+    def test_unknown_device(self):
+        # Test that fetching an unknown device returns a 404 error
+        response = self.client.get(f"/api/devices/{uuid.uuid4()}/cumulative_count")
+        self.assertEqual(response.status_code, 404)
+
+    def test_get_counts(self):
+        # Test that the counts over a time range are served from the rollups of the shard of the device
+        if ingest_pipeline.shards[0].service.rollups is None:
+            self.skipTest("Rollups are disabled")
+        data = {"id": self.device_id, "readings": [{"timestamp": self.timestamp, "count": 15}]}
+        self.client.post("/api/devices/readings", json=data)
+        response = self.client.get(f"/api/devices/{self.device_id}/counts",
+                                   params={"from": "2024-10-11T02:11:00+00:00", "to": "2024-10-11T02:12:00+00:00"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"step": "minute", "total": 15,
+                                           "counts": [{"start": "2024-10-11T02:11:00+00:00", "count": 15}]})
+
+    def test_device_summaries(self):
+        # Test that summaries are read from the shard of each device, by list and by scanning every shard
+        data = {"id": self.device_id, "readings": [{"timestamp": self.timestamp, "count": 15}]}
+        self.client.post("/api/devices/readings", json=data)
+        summary = {"id": self.device_id, "cumulative_count": 15, "latest_timestamp": self.timestamp}
+        response = self.client.post("/api/devices/summaries", json={"ids": [self.device_id]})
+        self.assertEqual(response.json(), {"devices": [summary]})
+        response = self.client.get("/api/devices/summaries")
+        self.assertEqual(response.json(), {"devices": [summary], "next_cursor": 0})
+
+    def test_conditional_reads(self):
+        # Test that the version of the device in its shard is sent as ETag and answers 304 while it is unchanged
+        data = {"id": self.device_id, "readings": [{"timestamp": self.timestamp, "count": 15}]}
+        self.client.post("/api/devices/readings", json=data)
+        url = f"/api/devices/{self.device_id}/latest_timestamp"
+        etag = self.client.get(url).headers["ETag"]
+        self.assertEqual(self.client.get(url, headers={"If-None-Match": etag}).status_code, 304)
+
+    def test_get_store_stats(self):
+        # Test that the stats endpoint reports the pipeline and every shard
+        response = self.client.get("/api/admin/stats")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["ingest"]["mode"], "async")
+        self.assertEqual(len(response.json()["shards"]), len(ingest_pipeline.shards))
+
+
+if __name__ == '__main__':
+    unittest.main()
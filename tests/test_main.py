@@ -1,7 +1,12 @@
 import unittest
+import uuid
 from unittest.mock import patch
 from fastapi.testclient import TestClient
+from device_readings_service import DeviceReadingsService
 from main import app
+from response_cache import response_cache
+from stores.evicting_device_store import EvictingDeviceStore
+from stores.in_memory_ts_store import InMemoryTimestampStore
 from dateutil.parser import parse as parse_date
 
 
@@ -13,6 +18,7 @@ class TestMain(unittest.TestCase):
     Input validations tests are included in this class.
     """
     def setUp(self):
+        response_cache.clear()
         self.client = TestClient(app)
         self.device_id = "3fa85f64-5717-4562-b3fc-2c963f66afa6"
         self.data = {
@@ -36,20 +42,40 @@ class TestMain(unittest.TestCase):
     @patch('main.device_readings_service')
     def test_get_cumulative_count(self, mock_service):
         # Test that the GET /api/devices/{device_id}/cumulative_count endpoint returns the correct count.
+        mock_service.get_device_version.return_value = "store-1"
         mock_service.get_cumulative_count.return_value = (10, None)
         response = self.client.get(f"/api/devices/{self.device_id}/cumulative_count")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json(), {"cumulative_count": 10})
+        self.assertEqual(response.headers["ETag"], '"store-1"')
 
     @patch('main.device_readings_service')
     def test_get_latest_timestamp(self, mock_service):
         # Test that the GET /api/devices/{device_id}/latest_timestamp endpoint returns the correct timestamp.
         dt_string = "2021-09-29T16:08:15+01:00"
+        mock_service.get_device_version.return_value = "store-1"
         mock_service.get_latest_timestamp.return_value = (parse_date(dt_string), None)
         response = self.client.get(f"/api/devices/{self.device_id}/latest_timestamp")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json(), {"latest_timestamp": dt_string})
 
+    @patch('main.device_readings_service')
+    def test_get_cumulative_count_not_modified(self, mock_service):
+        # Test that the GET /api/devices/{device_id}/cumulative_count endpoint returns 304 without a body when the
+        # client holds the current version, and renders the body once per version otherwise.
+        mock_service.get_device_version.return_value = "store-2"
+        mock_service.get_cumulative_count.return_value = (7, None)
+        url = f"/api/devices/{self.device_id}/cumulative_count"
+        response = self.client.get(url, headers={"If-None-Match": '"store-2"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response.headers["ETag"], '"store-2"')
+
+        for _ in range(3):
+            response = self.client.get(url, headers={"If-None-Match": '"store-1"'})
+            self.assertEqual(response.json(), {"cumulative_count": 7})
+        self.assertEqual(mock_service.get_cumulative_count.call_count, 1)
+
     @patch('main.device_readings_service')
     def test_update_readings_error(self, mock_service):
         # Test that the POST /api/devices/readings endpoint returns an error message when an error occurs.
@@ -58,10 +84,36 @@ class TestMain(unittest.TestCase):
         self.assertEqual(response.status_code, 500)
         self.assertEqual(response.json(), {"message": "Error message"})
 
+    @patch('main.device_readings_service')
+    def test_update_readings_batch(self, mock_service):
+        # Test that the POST /api/devices/readings/batch endpoint reports a result for each device.
+        other_device_id = "36d5658a-6908-479e-887e-a949ec199272"
+        mock_service.add_device_readings_batch.return_value = {
+            uuid.UUID(self.device_id): "",
+            uuid.UUID(other_device_id): "Capacity exceeded",
+        }
+        response = self.client.post("/api/devices/readings/batch", json={
+            "devices": [self.data, {**self.data, "id": other_device_id}]
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"results": [
+            {"id": self.device_id, "success": True, "message": "Readings updated successfully"},
+            {"id": other_device_id, "success": False, "message": "Capacity exceeded"},
+        ]})
+
+    def test_update_readings_batch_invalid_device(self):
+        # Test that the POST /api/devices/readings/batch endpoint validates every device in the batch.
+        response = self.client.post("/api/devices/readings/batch", json={
+            "devices": [self.data, {"id": "invalid-uuid", "readings": []}]
+        })
+        self.assertEqual(response.status_code, 422)
+        self.assertIn("Input should be a valid UUID, invalid character", response.text)
+
     @patch('main.device_readings_service')
     def test_get_cumulative_count_error(self, mock_service):
         # Test that the GET /api/devices/{device_id}/cumulative_count endpoint returns an error message for a missing
         # device.
+        mock_service.get_device_version.return_value = None
         mock_service.get_cumulative_count.return_value = (None, "Error message")
         response = self.client.get(f"/api/devices/{self.device_id}/cumulative_count")
         self.assertEqual(response.status_code, 404)
@@ -71,11 +123,22 @@ class TestMain(unittest.TestCase):
     def test_get_latest_timestamp_error(self, mock_service):
         # Test that the GET /api/devices/{device_id}/latest_timestamp endpoint returns an error message for a missing
         # device.
+        mock_service.get_device_version.return_value = None
         mock_service.get_latest_timestamp.return_value = (None, "Error message")
         response = self.client.get(f"/api/devices/{self.device_id}/latest_timestamp")
         self.assertEqual(response.status_code, 404)
         self.assertEqual(response.json(), {"message": "Error message"})
 
+    @patch('main.device_readings_service')
+    def test_get_store_stats(self, mock_service):
+        # Test that the GET /api/admin/stats endpoint returns the statistics of the stores.
+        stats = {"timestamp_store": {"backend": "bloom", "estimated_fpr": 0.001, "fill_ratios": [0.5]}}
+        mock_service.get_store_stats.return_value = stats
+        response = self.client.get("/api/admin/stats")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["timestamp_store"], stats["timestamp_store"])
+        self.assertIn("hit_rate", response.json()["response_cache"])
+
     def test_invalid_uuid(self):
         # Test that the POST /api/devices/readings endpoint returns a validation error for an invalid UUID.
         response = self.client.post("/api/devices/readings", json={
@@ -150,6 +213,64 @@ class TestMain(unittest.TestCase):
         })
         self.assertEqual(response.status_code, 200)
 
+    @patch('main.device_readings_service')
+    def test_get_counts(self, mock_service):
+        # Test that the GET /api/devices/{device_id}/counts endpoint passes the range and returns the counts.
+        mock_service.get_counts.return_value = ({"step": "day", "total": 3, "counts": []}, None)
+        response = self.client.get(f"/api/devices/{self.device_id}/counts",
+                                   params={"from": "2024-10-01T00:00:00Z", "to": "2024-10-02T00:00:00Z", "step": "day"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"step": "day", "total": 3, "counts": []})
+        _, start, end, step = mock_service.get_counts.call_args.args
+        self.assertEqual((start, end, step), (parse_date("2024-10-01T00:00:00Z"), parse_date("2024-10-02T00:00:00Z"),
+                                              "day"))
+
+    @patch('main.device_readings_service')
+    def test_get_device_summaries(self, mock_service):
+        # Test that the POST /api/devices/summaries endpoint streams the pages of summaries as one JSON object.
+        mock_service.get_device_summaries.return_value = iter([[{"id": self.device_id, "cumulative_count": 1}],
+                                                               [{"id": self.device_id, "cumulative_count": 2}]])
+        response = self.client.post("/api/devices/summaries", json={"ids": [self.device_id]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"devices": [{"id": self.device_id, "cumulative_count": 1},
+                                                       {"id": self.device_id, "cumulative_count": 2}]})
+
+    def test_dropped_device_gets_new_etag(self):
+        # Test that a device evicted without a spill tier and created again gets a new ETag, and not the body
+        # cached for its previous life
+        service = DeviceReadingsService(device_store=EvictingDeviceStore(capacity=1),
+                                        ts_store=InMemoryTimestampStore(capacity=100))
+        other_id = "36d5658a-6908-479e-887e-a949ec199272"
+        url = f"/api/devices/{self.device_id}/cumulative_count"
+        with patch('main.device_readings_service', service):
+            self.client.post("/api/devices/readings", json={**self.data, "readings": [
+                {"timestamp": "2024-10-11T02:11:43.862Z", "count": 30}]})
+            first = self.client.get(url)
+            self.assertEqual(first.json(), {"cumulative_count": 30})
+            self.client.post("/api/devices/readings", json={**self.data, "id": other_id})
+            self.client.post("/api/devices/readings", json={**self.data, "readings": [
+                {"timestamp": "2024-10-11T02:11:44.862Z", "count": 5}]})
+            second = self.client.get(url)
+            self.assertEqual(second.json(), {"cumulative_count": 5})
+            self.assertNotEqual(second.headers["ETag"], first.headers["ETag"])
+            response = self.client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+            self.assertEqual(response.status_code, 200)
+
+    def test_scan_device_summaries_invalid_cursor(self):
+        # Test that the GET /api/devices/summaries endpoint returns a validation error for a negative cursor or a
+        # zero limit.
+        self.assertEqual(self.client.get("/api/devices/summaries", params={"cursor": -1}).status_code, 422)
+        self.assertEqual(self.client.get("/api/devices/summaries", params={"limit": 0}).status_code, 422)
+
+    def test_get_counts_invalid_step(self):
+        # Test that the GET /api/devices/{device_id}/counts endpoint returns a validation error for an unknown step
+        # or a missing range.
+        response = self.client.get(f"/api/devices/{self.device_id}/counts",
+                                   params={"from": "2024-10-01T00:00:00Z", "to": "2024-10-02T00:00:00Z", "step": "week"})
+        self.assertEqual(response.status_code, 422)
+        response = self.client.get(f"/api/devices/{self.device_id}/counts")
+        self.assertEqual(response.status_code, 422)
+
     def test_invalid_device_id_in_cumulative_count(self):
         # Test that the GET /api/devices/{device_id}/cumulative_count endpoint returns a validation error for an
         # invalid UUID.
@@ -0,0 +1,101 @@
+import types
+import unittest
+import uuid
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from metrics import Histogram, Registry, RequestMetricsMiddleware, register_service_metrics
+from stores.columnar_device_store import ColumnarDeviceStore
+from stores.in_memory_ts_store import InMemoryTimestampStore
+from stores.striped_device_store import StripedDeviceStore
+
+
+def _samples(registry: Registry) -> dict:
+    """Return the samples rendered by a registry, by name and labels."""
+    return dict(line.rsplit(" ", 1) for line in registry.render().splitlines() if not line.startswith("#"))
+
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        # Test that a counter is rendered with the _total suffix, per label value
+        counter = self.registry.counter("requests", "Requests.", ["code"])
+        counter.labels("200").inc()
+        counter.labels("200").inc(2)
+        counter.labels("500").inc()
+        self.assertEqual(_samples(self.registry),
+                         {'requests_total{code="200"}': "3", 'requests_total{code="500"}': "1"})
+        self.assertIn("# TYPE requests counter", self.registry.render())
+
+    def test_histogram(self):
+        # Test that the buckets of a histogram are cumulative, with a +Inf bucket, a sum and a count
+        histogram = self.registry.histogram("latency", "Latency.", buckets=[0.5, 0.1])
+        for value in [0.05, 0.1, 0.3, 2.0]:
+            histogram.observe(value)
+        self.assertEqual(_samples(self.registry), {'latency_bucket{le="0.1"}': "2", 'latency_bucket{le="0.5"}': "3",
+                                                   'latency_bucket{le="+Inf"}': "4", "latency_sum": "2.45",
+                                                   "latency_count": "4"})
+
+    def test_labels(self):
+        # Test that children are cached, label values are escaped and the number of values is checked
+        histogram = self.registry.histogram("latency", "Latency.", ["route"], buckets=[1])
+        self.assertIs(histogram.labels("/a"), histogram.labels("/a"))
+        histogram.labels('a"b\\').observe(1)
+        self.assertIn('latency_count{route="a\\"b\\\\"} 1', self.registry.render())
+        with self.assertRaises(ValueError):
+            histogram.labels("/a", "GET")
+
+    def test_callbacks(self):
+        # Test that callbacks are read when rendering, and left out when they return None
+        size = [3]
+        self.registry.callback("size", "Size.", lambda: size[0])
+        self.registry.callback("evictions", "Evictions.", lambda: 7, type="counter")
+        self.registry.callback("missing", "Missing.", lambda: None)
+        size[0] = 4
+        self.assertEqual(_samples(self.registry), {"size": "4", "evictions_total": "7"})
+        self.assertNotIn("missing", self.registry.render())
+
+    def test_device_store_rejections(self):
+        # Test that the rejections of the striped and columnar stores are reported, also behind the snapshot tier
+        striped_store, columnar_store = StripedDeviceStore(capacity=0), ColumnarDeviceStore(capacity=0)
+        for store in (striped_store, columnar_store):
+            with self.assertRaises(ValueError):
+                store.get_or_create_device_reading(uuid.uuid4())
+        services = [types.SimpleNamespace(device_store=striped_store, ts_store=InMemoryTimestampStore()),
+                    types.SimpleNamespace(device_store=types.SimpleNamespace(live=columnar_store),
+                                          ts_store=InMemoryTimestampStore())]
+        register_service_metrics(self.registry, lambda: services)
+        self.assertEqual(_samples(self.registry)["device_readings_device_store_rejections_total"], "2")
+
+    def test_register_twice(self):
+        # Test that registering a name again returns the metric already registered
+        counter = self.registry.counter("requests", "Requests.")
+        self.assertIs(self.registry.counter("requests", "Requests."), counter)
+
+
+class TestRequestMetricsMiddleware(unittest.TestCase):
+
+    def test_route_template(self):
+        # Test that requests are labelled with the route template, and unknown paths as unmatched
+        histogram = Histogram("duration", "Duration.", ["method", "route"])
+        app = FastAPI()
+        app.add_middleware(RequestMetricsMiddleware, histogram=histogram)
+
+        @app.get("/items/{item_id}")
+        def get_item(item_id: int):
+            return {"id": item_id}
+
+        client = TestClient(app)
+        client.get("/items/1")
+        client.get("/items/2")
+        client.get("/nothing")
+        self.assertEqual(histogram.labels("GET", "/items/{item_id}").samples("d", ())[-1][2], 2)
+        self.assertEqual(histogram.labels("GET", "unmatched").samples("d", ())[-1][2], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
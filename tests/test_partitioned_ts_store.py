@@ -0,0 +1,77 @@
+import unittest
+import uuid
+from .utils import run_multiples_threads
+from stores.partitioned_ts_store import PartitionedTimestampStore
+
+
+class TestPartitionedTimestampStore(unittest.TestCase):
+
+    def setUp(self):
+        self.capacity = 3
+        self.store = PartitionedTimestampStore(capacity_per_device=self.capacity)
+        self.device_id = uuid.uuid4()
+        self.timestamp = 1622540800000000
+
+    def test_add_timestamp(self):
+        # Test that a new timestamp returns True (indicating it was added)
+        result = self.store.check_and_add_timestamp(self.device_id, self.timestamp)
+        self.assertTrue(result)
+        self.assertIn(self.timestamp, self.store.partitions[self.device_id.int].seen)
+
+    def test_add_existing_timestamp(self):
+        # Test that an existing timestamp returns False
+        self.store.check_and_add_timestamp(self.device_id, self.timestamp)
+        result = self.store.check_and_add_timestamp(self.device_id, self.timestamp)
+        self.assertFalse(result)
+
+    def test_same_timestamp_different_devices(self):
+        # Test that the same timestamp is new for each device
+        self.assertTrue(self.store.check_and_add_timestamp(self.device_id, self.timestamp))
+        self.assertTrue(self.store.check_and_add_timestamp(uuid.uuid4(), self.timestamp))
+
+    def test_capacity_per_device(self):
+        # Test that a device evicts its own oldest timestamp when its history is full
+        timestamps = [self.timestamp + i for i in range(5)]
+        for ts in timestamps:
+            self.store.check_and_add_timestamp(self.device_id, ts)
+
+        partition = self.store.partitions[self.device_id.int]
+        self.assertEqual(partition.seen, set(timestamps[2:]))
+        self.assertEqual(len(partition.ring), self.capacity)
+        # The evicted timestamp is accepted again, the retained ones are still duplicates
+        self.assertTrue(self.store.check_and_add_timestamp(self.device_id, timestamps[0]))
+        self.assertFalse(self.store.check_and_add_timestamp(self.device_id, timestamps[4]))
+
+    def test_chatty_device_does_not_evict_other_devices(self):
+        # Test that a device filling its history does not affect the history of other devices
+        quiet_device_id = uuid.uuid4()
+        self.store.check_and_add_timestamp(quiet_device_id, self.timestamp)
+        for i in range(10 * self.capacity):
+            self.store.check_and_add_timestamp(self.device_id, self.timestamp + i)
+
+        self.assertFalse(self.store.check_and_add_timestamp(quiet_device_id, self.timestamp))
+        self.assertEqual(len(self.store), self.capacity + 1)
+
+    def test_check_and_add_timestamps(self):
+        # Test that the batch call reports new and duplicate timestamps in order, including duplicates in the batch
+        self.store.check_and_add_timestamp(self.device_id, self.timestamp)
+        result = self.store.check_and_add_timestamps(
+            self.device_id, [self.timestamp, self.timestamp + 1, self.timestamp + 1])
+        self.assertEqual(result, [False, True, False])
+
+    def test_clear(self):
+        # Test that clearing the store forgets all timestamps
+        self.store.check_and_add_timestamp(self.device_id, self.timestamp)
+        self.store.clear()
+        self.assertEqual(len(self.store), 0)
+        self.assertTrue(self.store.check_and_add_timestamp(self.device_id, self.timestamp))
+
+    def test_concurrent_addition_of_same_timestamp(self):
+        # Test that concurrent addition of the same timestamp is handled correctly
+        args = [(self.device_id, self.timestamp)] * 10
+        result = run_multiples_threads(self.store.check_and_add_timestamp, args)
+        self.assertEqual(result.count(True), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
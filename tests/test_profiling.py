@@ -0,0 +1,113 @@
+import marshal
+import os
+import tempfile
+import threading
+import unittest
+from collections import namedtuple
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from profiling import ProfiledRoute, ProfileStore, ProfilingMiddleware, StackSampler, format_pstats
+
+
+def _wait_in_app(started: threading.Event, stop: threading.Event):
+    """Block in a function of the application until stopped."""
+    started.set()
+    stop.wait()
+
+
+class TestStackSampler(unittest.TestCase):
+
+    def setUp(self):
+        self.started = threading.Event()
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=_wait_in_app, args=(self.started, self.stop))
+        self.thread.start()
+        self.started.wait()
+
+    def tearDown(self):
+        self.stop.set()
+        self.thread.join()
+
+    def test_sample(self):
+        # Test that stacks are cut at the outermost frame of the application, and other stacks are skipped
+        sampler = StackSampler()
+        sampler.sample()
+        sampler.sample()
+        lines = sampler.collapsed().splitlines()
+        self.assertEqual(len(lines), 1)
+        stack, count = lines[0].rsplit(" ", 1)
+        self.assertTrue(stack.startswith(f"tests{os.sep}test_profiling.py:_wait_in_app;threading.py:Event.wait"))
+        self.assertEqual(count, "2")
+        self.assertEqual(sampler.samples, 2)
+
+    def test_windows(self):
+        # Test that closed windows are kept up to the limit, written to the dump directory and selectable
+        with tempfile.TemporaryDirectory() as dump_dir:
+            sampler = StackSampler(windows=2, dump_dir=dump_dir)
+            for _ in range(3):
+                sampler.sample()
+                sampler.rotate()
+            sampler.sample()
+            self.assertEqual(len(sampler.windows), 2)
+            self.assertTrue(sampler.collapsed().endswith(" 3\n"))
+            self.assertTrue(sampler.collapsed(windows=0).endswith(" 1\n"))
+            self.assertTrue(os.listdir(dump_dir))
+
+    def test_label_without_qualname(self):
+        # Test that code objects without a qualified name, before Python 3.11, are labelled with their name
+        code = namedtuple("Code", "co_filename co_name")(os.path.abspath(__file__), "_wait_in_app")
+        label, is_app = StackSampler()._label(code)
+        self.assertEqual(label, f"tests{os.sep}test_profiling.py:_wait_in_app")
+        self.assertTrue(is_app)
+
+
+class TestProfileStore(unittest.TestCase):
+
+    def test_capacity(self):
+        # Test that the oldest profile is dropped beyond the capacity, and a dropped profile is reported missing
+        store = ProfileStore(capacity=2)
+        for _ in range(3):
+            profile = store.new_profile("GET", "/")
+            profile.thread_profile().runcall(sum, [1, 2])
+            store.add(profile)
+        self.assertEqual([summary["id"] for summary in store.list()], [3, 2])
+        self.assertEqual(store.get(1), (None, "Profile 1 not found"))
+        data, err = store.get(3)
+        self.assertEqual(err, "")
+        self.assertIn(("~", 0, "<built-in method builtins.sum>"), marshal.loads(data))
+
+
+class TestProfilingMiddleware(unittest.TestCase):
+
+    def setUp(self):
+        self.store = ProfileStore()
+        app = FastAPI()
+        app.router.route_class = ProfiledRoute
+        app.add_middleware(ProfilingMiddleware, store=self.store, header="X-Profile")
+
+        @app.get("/work")
+        def work():
+            return {"total": sorted(range(100))[-1]}
+
+        self.client = TestClient(app)
+
+    def test_profiled_request(self):
+        # Test that a request sent with the header is profiled, including the sync handler run in the threadpool
+        response = self.client.get("/work", headers={"X-Profile": "1"})
+        self.assertEqual(response.json(), {"total": 99})
+        profile_id = int(response.headers["X-Profile"])
+        data, err = self.store.get(profile_id)
+        self.assertEqual(err, "")
+        self.assertIn("(work)", format_pstats(data, limit=1000))
+
+    def test_unprofiled_request(self):
+        # Test that requests without the header are not profiled
+        response = self.client.get("/work")
+        self.assertNotIn("X-Profile", response.headers)
+        self.assertEqual(self.store.list(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
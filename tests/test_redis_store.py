@@ -0,0 +1,152 @@
+import datetime
+import unittest
+import uuid
+import redis
+from config import settings
+from device_readings_service import DeviceReadingsService
+from models import DeviceReadings, Reading
+from stores.device_store import DeviceReadingIface
+from stores.epoch import to_epoch_us
+from stores.redis_store import RedisStore
+from tests.utils import run_multiples_threads
+
+
+class RedisTestCase(unittest.TestCase):
+    """
+    Base class for the tests of the Redis store, run against the server at REDIS_URL.
+
+    The tests are skipped if the server is not reachable. Each test uses its own key prefix and deletes its keys.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            redis.Redis.from_url(settings.REDIS_URL, socket_connect_timeout=1).ping()
+        except redis.ConnectionError:
+            raise unittest.SkipTest(f"Redis server not reachable at {settings.REDIS_URL}")
+
+    def setUp(self):
+        self.store = RedisStore.from_url(settings.REDIS_URL, device_capacity=2, ts_capacity=3,
+                                         prefix=f"device_readings_test_{uuid.uuid4().hex}")
+        self.device_id_1 = uuid.uuid4()
+        self.device_id_2 = uuid.uuid4()
+        self.device_id_3 = uuid.uuid4()
+        self.timestamp = datetime.datetime(2024, 9, 29, 12, 0, 0, tzinfo=datetime.timezone.utc)
+
+    def tearDown(self):
+        self.store.clear()
+
+
+class TestRedisDeviceStore(RedisTestCase):
+
+    def test_get_or_create_device_reading(self):
+        # Test that a device is created empty and then found with its updates
+        reading = self.store.get_or_create_device_reading(self.device_id_1)
+        self.assertIsInstance(reading, DeviceReadingIface)
+        self.assertEqual(reading.total_count, 0)
+        self.assertIsNone(reading.latest_timestamp)
+
+        reading.increment_count(5)
+        reading.update_latest_timestamp(self.timestamp)
+        reading.update_latest_timestamp(self.timestamp - datetime.timedelta(seconds=1))
+        reading = self.store.get_device_reading(self.device_id_1)
+        self.assertEqual(reading.total_count, 5)
+        self.assertEqual(reading.latest_timestamp, self.timestamp)
+
+    def test_capacity_exceeded(self):
+        # Test that a new device is rejected when the store is full
+        self.store.get_or_create_device_reading(self.device_id_1)
+        self.store.get_or_create_device_reading(self.device_id_2)
+        with self.assertRaises(ValueError) as exc_info:
+            self.store.get_or_create_device_reading(self.device_id_3)
+        self.assertEqual(str(exc_info.exception), "Capacity exceeded")
+        self.assertIsNone(self.store.get_device_reading(self.device_id_3))
+
+    def test_increment_count_concurrent(self):
+        # Verify that increments from many threads are all applied
+        reading = self.store.get_or_create_device_reading(self.device_id_1)
+        run_multiples_threads(reading.increment_count, [[5]] * 50)
+        self.assertEqual(self.store.get_device_reading(self.device_id_1).total_count, 250)
+
+
+    def test_scan_devices(self):
+        # Test that scanning the devices until cursor 0 returns every device, and that they are read in one batch
+        self.store.get_or_create_device_reading(self.device_id_1).increment_count(3)
+        self.store.get_or_create_device_reading(self.device_id_2)
+        scanned, cursor = set(), 0
+        while True:
+            cursor, page = self.store.scan_devices(cursor, 1)
+            scanned.update(page)
+            if cursor == 0:
+                break
+        self.assertEqual(scanned, {self.device_id_1, self.device_id_2})
+        readings = dict(self.store.get_device_readings([self.device_id_1, uuid.uuid4()]))
+        self.assertEqual(readings[self.device_id_1].total_count, 3)
+        self.assertEqual(list(readings.values())[1], None)
+
+
+    def test_get_device_version(self):
+        # Test that every update of a device changes its version, through each update path
+        self.assertIsNone(self.store.get_device_version(self.device_id_1))
+        reading = self.store.get_or_create_device_reading(self.device_id_1)
+        versions = [self.store.get_device_version(self.device_id_1)]
+        reading.increment_count(1)
+        versions.append(self.store.get_device_version(self.device_id_1))
+        reading.update_latest_timestamp(datetime.datetime(2024, 9, 29, 12, 0))
+        versions.append(self.store.get_device_version(self.device_id_1))
+        self.store.ingest_readings({self.device_id_1: [(1, 1, 0)]})
+        versions.append(self.store.get_device_version(self.device_id_1))
+        self.assertEqual(len(set(versions)), 4)
+        self.assertEqual(self.store.get_device_reading(self.device_id_1).version, 3)
+        self.assertTrue(versions[0].startswith(self.store.store_id))
+
+
+class TestRedisTimestampStore(RedisTestCase):
+
+    def test_check_and_add_timestamp(self):
+        # Test that a timestamp is added once per device
+        self.assertTrue(self.store.check_and_add_timestamp(self.device_id_1, 1))
+        self.assertFalse(self.store.check_and_add_timestamp(self.device_id_1, 1))
+        self.assertTrue(self.store.check_and_add_timestamp(self.device_id_2, 1))
+
+    def test_capacity_evicts_oldest(self):
+        # Test that the oldest timestamp is evicted once the store is full
+        self.assertEqual(self.store.check_and_add_timestamps(self.device_id_1, [1, 2, 3, 4, 2]),
+                         [True, True, True, True, False])
+        self.assertTrue(self.store.check_and_add_timestamp(self.device_id_1, 1))
+        self.assertEqual(self.store.stats()["size"], 3)
+
+
+class TestRedisIngest(RedisTestCase):
+
+    def test_ingest_readings(self):
+        # Test that one call dedupes and applies the readings of several devices
+        later = to_epoch_us(self.timestamp) + 1_000_000
+        results = self.store.ingest_readings({
+            self.device_id_1: [(to_epoch_us(self.timestamp), 5, 0), (later, 3, 3600), (later, 3, 3600)],
+            self.device_id_2: [(to_epoch_us(self.timestamp), 1, 0)],
+            self.device_id_3: [(to_epoch_us(self.timestamp), 1, 0)],
+        })
+        self.assertEqual(results, {
+            self.device_id_1: ([True, True, False], ""),
+            self.device_id_2: ([True], ""),
+            self.device_id_3: ([], "Capacity exceeded"),
+        })
+        reading = self.store.get_device_reading(self.device_id_1)
+        self.assertEqual(reading.total_count, 8)
+        self.assertEqual(reading.latest_timestamp, self.timestamp + datetime.timedelta(seconds=1))
+        self.assertEqual(reading.latest_timestamp.utcoffset(), datetime.timedelta(hours=1))
+
+    def test_service_uses_ingest(self):
+        # Test that the service ingests through the store when it is both the device and the timestamp store
+        service = DeviceReadingsService(device_store=self.store, ts_store=self.store)
+        self.assertIs(service.ingest_store, self.store)
+        readings = DeviceReadings(id=self.device_id_1, readings=[Reading(timestamp=self.timestamp, count=4)])
+        self.assertEqual(service.add_device_readings(readings), "")
+        self.assertEqual(service.add_device_readings(readings), "")
+        self.assertEqual(service.get_cumulative_count(self.device_id_1), (4, None))
+        self.assertEqual(service.get_latest_timestamp(self.device_id_1), (self.timestamp, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+from response_cache import ResponseCache, etag_matches
+
+
+class TestEtagMatches(unittest.TestCase):
+
+    def test_etag_matches(self):
+        # Test that a list of tags, weak tags and the wildcard match, and that a missing header does not
+        self.assertTrue(etag_matches('"a-1"', '"a-1"'))
+        self.assertTrue(etag_matches('"a-0", W/"a-1"', '"a-1"'))
+        self.assertTrue(etag_matches("*", '"a-1"'))
+        self.assertFalse(etag_matches('"a-0"', '"a-1"'))
+        self.assertFalse(etag_matches(None, '"a-1"'))
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ResponseCache(capacity=2)
+        self.renders = []
+
+    def _render(self, body):
+        """Return a render function recording its calls."""
+        def render():
+            self.renders.append(body)
+            return body
+        return render
+
+    def test_body_cached_per_version(self):
+        # Test that a body is rendered once per version and served from the cache until the version changes
+        for _ in range(3):
+            response = self.cache.respond("device", "s-1", None, self._render(b'{"count":1}'))
+            self.assertEqual(response.body, b'{"count":1}')
+            self.assertEqual(response.headers["ETag"], '"s-1"')
+        response = self.cache.respond("device", "s-2", None, self._render(b'{"count":2}'))
+        self.assertEqual(response.body, b'{"count":2}')
+        self.assertEqual(self.renders, [b'{"count":1}', b'{"count":2}'])
+        self.assertEqual(self.cache.stats()["size"], 1)
+
+    def test_not_modified(self):
+        # Test that a client holding the current version gets a 304 without a body and without rendering it
+        response = self.cache.respond("device", "s-1", '"s-1"', self._render(b"{}"))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.body, b"")
+        self.assertEqual(self.renders, [])
+
+    def test_eviction(self):
+        # Test that the least recently used body is evicted beyond the capacity
+        self.cache.respond("a", "s-1", None, self._render(b"a"))
+        self.cache.respond("b", "s-1", None, self._render(b"b"))
+        self.cache.respond("a", "s-1", None, self._render(b"a"))
+        self.cache.respond("c", "s-1", None, self._render(b"c"))
+        self.cache.respond("a", "s-1", None, self._render(b"a"))
+        self.cache.respond("b", "s-1", None, self._render(b"b"))
+        self.assertEqual(self.renders, [b"a", b"b", b"c", b"b"])
+
+    def test_stats(self):
+        # Test that hits, misses and 304 responses are counted and their rates reported
+        self.cache.respond("device", "s-1", None, self._render(b"{}"))
+        self.cache.respond("device", "s-1", None, self._render(b"{}"))
+        self.cache.respond("device", "s-1", '"s-1"', self._render(b"{}"))
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["not_modified"]), (1, 1, 1))
+        self.assertEqual(stats["hit_rate"], 0.5)
+        self.assertAlmostEqual(stats["not_modified_rate"], 1 / 3)
+        self.cache.clear()
+        self.assertEqual(self.cache.stats()["hits"], 0)
+
+    def test_disabled(self):
+        # Test that a cache without capacity renders every time but still answers with 304
+        cache = ResponseCache(capacity=0)
+        cache.respond("device", "s-1", None, self._render(b"{}"))
+        cache.respond("device", "s-1", None, self._render(b"{}"))
+        self.assertEqual(len(self.renders), 2)
+        self.assertEqual(cache.respond("device", "s-1", '"s-1"', self._render(b"{}")).status_code, 304)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import random
+import unittest
+import uuid
+from stores.rollup_store import STEPS, BucketRing, RollupStore
+
+MINUTE_US = STEPS["minute"]
+
+
+class TestBucketRing(unittest.TestCase):
+
+    def setUp(self):
+        self.ring = BucketRing(step_us=MINUTE_US, retention=10)
+
+    def test_sum_and_counts(self):
+        # Test that counts are added to the bucket of their timestamp and summed over ranges
+        self.ring.add(0, 1)
+        self.ring.add(MINUTE_US - 1, 2)
+        self.ring.add(3 * MINUTE_US, 4)
+        self.assertEqual(self.ring.sum(0, 0), 3)
+        self.assertEqual(self.ring.sum(0, 3), 7)
+        self.assertEqual(self.ring.sum(1, 2), 0)
+        self.assertEqual(self.ring.counts(0, 3), [(0, 3), (1, 0), (2, 0), (3, 4)])
+
+    def test_retention(self):
+        # Test that old buckets fall out of the ring as newer buckets arrive, and late counts are dropped
+        self.ring.add(0, 1)
+        self.ring.add(5 * MINUTE_US, 2)
+        self.ring.add(12 * MINUTE_US, 4)
+        self.assertEqual(self.ring.oldest, 3)
+        self.assertEqual(self.ring.sum(0, 20), 6)
+        self.ring.add(2 * MINUTE_US, 8)
+        self.assertEqual(self.ring.sum(0, 20), 6)
+        self.ring.add(100 * MINUTE_US, 1)
+        self.assertEqual(self.ring.sum(0, 100), 1)
+
+    def test_matches_brute_force(self):
+        # Test that range sums, including ranges wrapping around the ring, match a sum over all counts kept
+        rng = random.Random(7)
+        added = {}
+        for _ in range(2000):
+            bucket = rng.randrange(0, 40) + len(added) // 50
+            self.ring.add(bucket * MINUTE_US + rng.randrange(MINUTE_US), 1)
+            if bucket > self.ring.newest - 10:
+                added[bucket] = added.get(bucket, 0) + 1
+            first = rng.randrange(0, 60)
+            last = first + rng.randrange(0, 15)
+            expected = sum(count for bucket, count in added.items()
+                           if max(first, self.ring.oldest) <= bucket <= min(last, self.ring.newest))
+            self.assertEqual(self.ring.sum(first, last), expected)
+
+
+class TestRollupStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = RollupStore(retentions={"minute": 60, "hour": 24, "day": 0})
+        self.device_id = uuid.uuid4()
+
+    def test_invalid_retentions(self):
+        # Test that unknown bucket sizes and rollups without any bucket size are rejected
+        with self.assertRaises(ValueError):
+            RollupStore(retentions={"week": 10})
+        with self.assertRaises(ValueError):
+            RollupStore(retentions={"minute": 0})
+
+    def test_get_counts(self):
+        # Test that counts are returned per bucket and in total, for the bucket size asked for
+        hour_us = STEPS["hour"]
+        self.store.add(self.device_id, [(0, 1), (MINUTE_US, 2), (hour_us, 4)])
+        self.assertEqual(self.store.get_counts(self.device_id, 0, 2 * hour_us, "hour"),
+                         (7, [(0, 3), (hour_us, 4)], None))
+        # The first minute fell out of the 60 minutes kept once the reading of the next hour arrived
+        self.assertEqual(self.store.get_counts(self.device_id, 0, 2 * MINUTE_US, "minute"), (2, [(MINUTE_US, 2)], None))
+        self.assertEqual(self.store.get_counts(uuid.uuid4(), 0, hour_us, "hour"), (0, [], None))
+        with self.assertRaises(ValueError):
+            self.store.get_counts(self.device_id, 0, hour_us, "day")
+
+    def test_choose_step(self):
+        # Test that the finest bucket size covering the start of the range is chosen
+        self.store.add(self.device_id, [(100 * MINUTE_US, 1)])
+        self.assertEqual(self.store.choose_step(self.device_id, 50 * MINUTE_US), "minute")
+        self.assertEqual(self.store.choose_step(self.device_id, 0), "hour")
+        self.assertEqual(self.store.choose_step(uuid.uuid4(), 0), "minute")
+
+    def test_future_readings_ignored(self):
+        # Test that a reading far ahead of the clock is left out instead of clearing the buckets of the device
+        store = RollupStore(retentions={"minute": 60, "hour": 24}, max_future_s=60, clock=lambda: 3600.0)
+        store.add(self.device_id, [(0, 1), (3600 * 1_000_000, 2), (10 ** 15, 4)])
+        self.assertEqual(store.get_counts(self.device_id, 0, 2 * STEPS["hour"], "hour")[0], 3)
+        store.add(self.device_id, [(3660 * 1_000_000, 8)])
+        self.assertEqual(store.get_counts(self.device_id, 0, 2 * STEPS["hour"], "hour")[0], 11)
+        self.assertEqual(store.stats()["ignored"], 1)
+
+    def test_restart(self):
+        # Test that restarted rollups drop the previous counts and report since when they cover the readings
+        store = RollupStore(retentions={"minute": 60}, clock=lambda: 120.0)
+        store.add(self.device_id, [(0, 1)])
+        store.restart(self.device_id)
+        store.add(self.device_id, [(2 * MINUTE_US, 2)])
+        self.assertEqual(store.get_counts(self.device_id, 0, 3 * MINUTE_US, "minute"),
+                         (2, [(0, 0), (MINUTE_US, 0), (2 * MINUTE_US, 2)], 2 * MINUTE_US))
+
+    def test_remove(self):
+        # Test that removing a device drops its rollups, and that removing an unknown device is a no-op
+        self.store.add(self.device_id, [(0, 1)])
+        self.store.remove(self.device_id)
+        self.store.remove(uuid.uuid4())
+        self.assertEqual(self.store.get_counts(self.device_id, 0, MINUTE_US, "minute"), (0, [], None))
+        self.assertEqual(self.store.stats()["devices"], 0)
+
+    def test_stats_and_clear(self):
+        # Test that the stats report the devices and that clearing removes them
+        self.store.add(self.device_id, [(0, 1)])
+        self.assertEqual(self.store.stats()["devices"], 1)
+        self.assertGreater(self.store.stats()["bytes"], 84 * 16)
+        self.store.clear()
+        self.assertEqual(self.store.stats()["devices"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,212 @@
+import datetime
+import multiprocessing
+import random
+import unittest
+import uuid
+from collections import OrderedDict
+from device_readings_service import DeviceReadingsService
+from models import DeviceReadings, Reading
+from stores.device_store import DeviceReadingIface
+from stores.epoch import to_epoch_us
+from stores.shared_memory_store import SharedMemoryStore
+from tests.utils import run_multiples_threads
+
+
+def _ingest_in_process(name, device_ids, start, readings):
+    """Ingest readings of the given devices through the store attached in another process."""
+    store = SharedMemoryStore(name=name, device_capacity=4, ts_capacity=100000, stripes=4)
+    service = DeviceReadingsService(device_store=store, ts_store=store)
+    timestamp = datetime.datetime(2024, 9, 29, 12, 0, 0, tzinfo=datetime.timezone.utc)
+    for i in range(start, start + readings):
+        for device_id in device_ids:
+            # Every reading is sent twice, and the overlapping ranges of the processes are only counted once
+            reading = Reading(timestamp=timestamp + datetime.timedelta(seconds=i), count=1)
+            service.add_device_readings(DeviceReadings(id=device_id, readings=[reading, reading]))
+    store.close()
+
+
+class SharedMemoryTestCase(unittest.TestCase):
+    """Base class for the tests of the shared memory store, each with its own segment removed afterwards."""
+
+    def setUp(self):
+        self.name = f"device_readings_test_{uuid.uuid4().hex[:12]}"
+        self.store = SharedMemoryStore(name=self.name, device_capacity=2, ts_capacity=3, stripes=1)
+        self.device_id_1 = uuid.uuid4()
+        self.device_id_2 = uuid.uuid4()
+        self.device_id_3 = uuid.uuid4()
+        self.timestamp = datetime.datetime(2024, 9, 29, 12, 0, 0, tzinfo=datetime.timezone.utc)
+
+    def tearDown(self):
+        self.store.unlink()
+        self.store.close()
+
+
+class TestSharedMemoryDeviceStore(SharedMemoryTestCase):
+
+    def test_get_or_create_device_reading(self):
+        # Test that a device is created empty and then found with its updates
+        reading = self.store.get_or_create_device_reading(self.device_id_1)
+        self.assertIsInstance(reading, DeviceReadingIface)
+        self.assertEqual(reading.total_count, 0)
+        self.assertIsNone(reading.latest_timestamp)
+
+        reading.increment_count(5)
+        reading.update_latest_timestamp(self.timestamp)
+        reading.update_latest_timestamp(self.timestamp - datetime.timedelta(seconds=1))
+        reading = self.store.get_device_reading(self.device_id_1)
+        self.assertEqual(reading.total_count, 5)
+        self.assertEqual(reading.latest_timestamp, self.timestamp)
+        self.assertIsNone(self.store.get_device_reading(self.device_id_2))
+
+    def test_capacity_exceeded(self):
+        # Test that a new device is rejected when the store is full, but existing devices are still returned
+        self.store.get_or_create_device_reading(self.device_id_1)
+        self.store.get_or_create_device_reading(self.device_id_2)
+        with self.assertRaises(ValueError) as exc_info:
+            self.store.get_or_create_device_reading(self.device_id_3)
+        self.assertEqual(str(exc_info.exception), "Capacity exceeded")
+        self.assertIsNotNone(self.store.get_or_create_device_reading(self.device_id_1))
+        self.assertEqual(len(self.store), 2)
+
+    def test_shared_between_instances(self):
+        # Test that a second instance attached to the segment sees and updates the same devices
+        self.store.get_or_create_device_reading(self.device_id_1).increment_count(3)
+        other = SharedMemoryStore(name=self.name, device_capacity=2, ts_capacity=3, stripes=1)
+        try:
+            other.get_device_reading(self.device_id_1).increment_count(2)
+            self.assertTrue(other.check_and_add_timestamp(self.device_id_1, 1))
+        finally:
+            other.close()
+        self.assertEqual(self.store.get_device_reading(self.device_id_1).total_count, 5)
+        self.assertFalse(self.store.check_and_add_timestamp(self.device_id_1, 1))
+
+    def test_different_layout(self):
+        # Test that attaching with different capacities is rejected
+        with self.assertRaises(ValueError):
+            SharedMemoryStore(name=self.name, device_capacity=10, ts_capacity=3, stripes=1)
+
+    def test_scan_devices(self):
+        # Test that scanning by slot returns every device once and ends with cursor 0
+        self.store.get_or_create_device_reading(self.device_id_1)
+        self.store.get_or_create_device_reading(self.device_id_2)
+        cursor, first = self.store.scan_devices(0, 1)
+        _, second = self.store.scan_devices(cursor, 1) if cursor else (0, [])
+        self.assertEqual(set(first + second), {self.device_id_1, self.device_id_2})
+        self.assertEqual(self.store.scan_devices(0, 10), (0, first + second))
+
+    def test_get_device_version(self):
+        # Test that updates from any instance change the version, and that clearing changes the store ID
+        reading = self.store.get_or_create_device_reading(self.device_id_1)
+        created = self.store.get_device_version(self.device_id_1)
+        other = SharedMemoryStore(name=self.name, device_capacity=2, ts_capacity=3, stripes=1)
+        try:
+            self.assertEqual(other.get_device_version(self.device_id_1), created)
+            other.get_device_reading(self.device_id_1).increment_count(1)
+        finally:
+            other.close()
+        counted = self.store.get_device_version(self.device_id_1)
+        self.store.ingest_readings({self.device_id_1: [(to_epoch_us(self.timestamp), 1, 0)]})
+        self.assertEqual(len({created, counted, self.store.get_device_version(self.device_id_1)}), 3)
+        self.assertEqual(reading.version, 2)
+
+        store_id = self.store.store_id
+        self.store.clear()
+        self.assertNotEqual(self.store.store_id, store_id)
+
+    def test_concurrent_updates(self):
+        # Test that concurrent increments from many threads are all counted
+        reading = self.store.get_or_create_device_reading(self.device_id_1)
+        run_multiples_threads(lambda: [reading.increment_count(1) for _ in range(1000)], [()] * 8)
+        self.assertEqual(reading.total_count, 8000)
+
+
+class TestSharedMemoryTimestampStore(SharedMemoryTestCase):
+
+    def test_check_and_add_timestamps(self):
+        # Test that duplicates are rejected, within a list and across calls
+        self.assertEqual(self.store.check_and_add_timestamps(self.device_id_1, [1, 2, 1]), [True, True, False])
+        self.assertFalse(self.store.check_and_add_timestamp(self.device_id_1, 2))
+        self.assertTrue(self.store.check_and_add_timestamp(self.device_id_2, 2))
+
+    def test_eviction(self):
+        # Test that the oldest timestamp is evicted once the store is full
+        self.store.check_and_add_timestamps(self.device_id_1, [1, 2, 3, 4])
+        self.assertEqual(self.store.stats()["size"], 3)
+        self.assertTrue(self.store.check_and_add_timestamp(self.device_id_1, 1))
+        self.assertFalse(self.store.check_and_add_timestamp(self.device_id_1, 4))
+
+    def test_matches_ordered_store(self):
+        # Test that random inserts and evictions give the same answers as a FIFO dictionary
+        store = SharedMemoryStore(name=self.name + "_fifo", device_capacity=2, ts_capacity=50, stripes=1)
+        try:
+            expected = OrderedDict()
+            rng = random.Random(42)
+            for _ in range(5000):
+                device_id = rng.choice([self.device_id_1, self.device_id_2])
+                timestamp = rng.randrange(200)
+                is_new = (device_id, timestamp) not in expected
+                if is_new:
+                    expected[(device_id, timestamp)] = None
+                    if len(expected) > 50:
+                        expected.popitem(last=False)
+                self.assertEqual(store.check_and_add_timestamp(device_id, timestamp), is_new)
+        finally:
+            store.unlink()
+            store.close()
+
+    def test_clear(self):
+        # Test that clearing removes the devices and timestamps
+        self.store.get_or_create_device_reading(self.device_id_1)
+        self.store.check_and_add_timestamp(self.device_id_1, 1)
+        self.store.clear()
+        self.assertIsNone(self.store.get_device_reading(self.device_id_1))
+        self.assertTrue(self.store.check_and_add_timestamp(self.device_id_1, 1))
+        self.assertEqual(self.store.stats()["devices"], 0)
+
+
+class TestSharedMemoryIngest(SharedMemoryTestCase):
+
+    def test_ingest_readings(self):
+        # Test that readings are deduped and applied per device, with capacity errors per device
+        epoch_us = to_epoch_us(self.timestamp)
+        results = self.store.ingest_readings({
+            self.device_id_1: [(epoch_us, 2, 0), (epoch_us, 2, 0), (epoch_us + 1, 3, 3600)],
+            self.device_id_2: [(epoch_us, 1, 0)],
+            self.device_id_3: [(epoch_us, 1, 0)],
+        })
+        self.assertEqual(results[self.device_id_1], ([True, False, True], ""))
+        self.assertEqual(results[self.device_id_3], ([], "Capacity exceeded"))
+        reading = self.store.get_device_reading(self.device_id_1)
+        self.assertEqual(reading.total_count, 5)
+        self.assertEqual(reading.latest_timestamp.utcoffset(), datetime.timedelta(hours=1))
+
+    def test_service_ingests_through_store(self):
+        # Test that the service uses the single-lock ingest path when the store backs both interfaces
+        service = DeviceReadingsService(device_store=self.store, ts_store=self.store)
+        self.assertIs(service.ingest_store, self.store)
+        reading = Reading(timestamp=self.timestamp, count=4)
+        self.assertEqual(service.add_device_readings(DeviceReadings(id=self.device_id_1, readings=[reading])), "")
+        self.assertEqual(service.get_cumulative_count(self.device_id_1), (4, None))
+
+    def test_multiple_processes(self):
+        # Test that processes attached to the same segment share one consistent view of the devices
+        store = SharedMemoryStore(name=self.name + "_mp", device_capacity=4, ts_capacity=100000, stripes=4)
+        try:
+            device_ids = [uuid.uuid4() for _ in range(4)]
+            context = multiprocessing.get_context("spawn")
+            processes = [context.Process(target=_ingest_in_process, args=(store.name, device_ids, start, 100))
+                         for start in (0, 50, 100)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+                self.assertEqual(process.exitcode, 0)
+            for device_id in device_ids:
+                self.assertEqual(store.get_device_reading(device_id).total_count, 200)
+        finally:
+            store.unlink()
+            store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import datetime
+import unittest
+import uuid
+from stores.device_store import DeviceReadingIface
+from stores.single_writer_device_store import CapacityBudget, SingleWriterDeviceStore
+
+
+class TestSingleWriterDeviceStore(unittest.TestCase):
+
+    def setUp(self):
+        self.device_store = SingleWriterDeviceStore(capacity=2)
+        self.device_id_1 = uuid.uuid4()
+        self.device_id_2 = uuid.uuid4()
+        self.device_id_3 = uuid.uuid4()
+
+    def test_get_or_create_device_reading(self):
+        # Test that get_or_create_device_reading creates a device reading once and then returns the same one
+        reading = self.device_store.get_or_create_device_reading(self.device_id_1)
+        self.assertIsInstance(reading, DeviceReadingIface)
+        self.assertIs(self.device_store.get_or_create_device_reading(self.device_id_1), reading)
+        self.assertFalse(hasattr(reading, "__dict__"))
+        self.assertEqual(len(self.device_store), 1)
+
+    def test_update_reading(self):
+        # Test that counts add up and only a more recent timestamp replaces the latest one
+        reading = self.device_store.get_or_create_device_reading(self.device_id_1)
+        timestamp = datetime.datetime.now()
+        reading.increment_count(3)
+        reading.increment_count(4)
+        reading.update_latest_timestamp(timestamp)
+        reading.update_latest_timestamp(timestamp - datetime.timedelta(seconds=1))
+        self.assertEqual(reading.total_count, 7)
+        self.assertEqual(reading.latest_timestamp, timestamp)
+
+    def test_capacity_exceeded(self):
+        # Test that a new device is rejected when the store is full
+        self.device_store.get_or_create_device_reading(self.device_id_1)
+        self.device_store.get_or_create_device_reading(self.device_id_2)
+        with self.assertRaises(ValueError) as exc_info:
+            self.device_store.get_or_create_device_reading(self.device_id_3)
+        self.assertEqual(str(exc_info.exception), "Capacity exceeded")
+        self.assertIsNone(self.device_store.get_device_reading(self.device_id_3))
+
+    def test_shared_budget(self):
+        # Test that stores sharing a budget are bounded together, and that clearing one gives its room back
+        budget = CapacityBudget(2)
+        store_1 = SingleWriterDeviceStore(budget=budget)
+        store_2 = SingleWriterDeviceStore(budget=budget)
+        store_1.get_or_create_device_reading(self.device_id_1)
+        store_2.get_or_create_device_reading(self.device_id_2)
+        with self.assertRaises(ValueError):
+            store_1.get_or_create_device_reading(self.device_id_3)
+        store_2.clear()
+        store_1.get_or_create_device_reading(self.device_id_3)
+        self.assertEqual(budget.used, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
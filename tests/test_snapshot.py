@@ -0,0 +1,184 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from device_readings_service import DeviceReadingsService
+from models import DeviceReadings, Reading
+from persistence.snapshot import (Checkpointer, SnapshotBackedDeviceStore, SnapshotBackedTimestampStore,
+                                  SnapshotReader, open_snapshot, write_snapshot)
+from persistence.wal import WriteAheadLog
+from stores.epoch import to_epoch_us
+from stores.in_mem_device_store import InMemoryDeviceStore
+from stores.in_memory_ts_store import InMemoryTimestampStore
+
+
+class TestSnapshotFile(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "readings.snapshot")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_and_lookup(self):
+        # Test that devices and keys written in any order are found by binary search
+        device_ids = [uuid.uuid4().bytes for _ in range(50)]
+        write_snapshot(self.path, 42, [(device_id, i, i * 10, 0) for i, device_id in enumerate(device_ids)],
+                       [(device_id, epoch_us, 0) for device_id in device_ids for epoch_us in (5, 1, 3)])
+        snapshot = SnapshotReader(self.path)
+        self.assertEqual((snapshot.wal_sequence, snapshot.num_devices, snapshot.num_keys), (42, 50, 150))
+        for i, device_id in enumerate(device_ids):
+            self.assertEqual(snapshot.find_device(device_id), (device_id, i, i * 10, 0))
+            self.assertTrue(snapshot.contains_key(device_id, 3))
+            self.assertFalse(snapshot.contains_key(device_id, 2))
+        self.assertIsNone(snapshot.find_device(uuid.uuid4().bytes))
+        self.assertEqual(len(list(snapshot.devices())), 50)
+        snapshot.close()
+
+    def test_missing_and_invalid_file(self):
+        # Test that a missing snapshot is reported as None and a file which is not a snapshot is rejected
+        self.assertIsNone(open_snapshot(self.path))
+        with open(self.path, "wb") as file:
+            file.write(b"\x00" * 64)
+        with self.assertRaises(ValueError):
+            SnapshotReader(self.path)
+
+
+class TestCheckpointAndRestart(unittest.TestCase):
+    """
+    Functional tests of snapshots taken from the write-ahead log and of restarting from them.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.wal_path = os.path.join(self.directory, "readings.wal")
+        self.snapshot_path = os.path.join(self.directory, "readings.snapshot")
+        self.timestamp = datetime.datetime(2024, 9, 29, 12, 0, 0, tzinfo=datetime.timezone.utc)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _start(self, device_capacity=10):
+        """Start a service as on startup: snapshot-backed stores, then the log written after the snapshot."""
+        wal = WriteAheadLog(self.wal_path, fsync_policy="none")
+        device_store = InMemoryDeviceStore(capacity=device_capacity)
+        ts_store = InMemoryTimestampStore(capacity=100)
+        snapshot = open_snapshot(self.snapshot_path)
+        if snapshot is not None:
+            device_store = SnapshotBackedDeviceStore(device_store, snapshot)
+            ts_store = SnapshotBackedTimestampStore(ts_store, snapshot)
+        service = DeviceReadingsService(device_store=device_store, ts_store=ts_store, wal=wal)
+        service.replay(wal.records(start_sequence=snapshot.wal_sequence if snapshot else None))
+        return service
+
+    def _add(self, service, device_id, seconds, count=1):
+        """Add one reading to a device."""
+        return service.add_device_readings(DeviceReadings(id=device_id, readings=[
+            Reading(timestamp=self.timestamp + datetime.timedelta(seconds=seconds), count=count)]))
+
+    def test_restart_from_snapshot_and_log_tail(self):
+        # Test that state is restored from the snapshot plus the records written after it
+        device_1, device_2 = uuid.uuid4(), uuid.uuid4()
+        service = self._start()
+        self._add(service, device_1, 0, count=5)
+        self._add(service, device_2, 0, count=2)
+        checkpointer = Checkpointer(service.wal, self.snapshot_path)
+        self.assertEqual(checkpointer.checkpoint(), 2)
+        # The log only keeps the records after the snapshot
+        self.assertEqual(len(service.wal), 0)
+        self._add(service, device_1, 10, count=3)
+        service.wal.close()
+
+        service = self._start()
+        # Devices of the snapshot are loaded on first use
+        self.assertEqual(len(service.device_store.live), 1)
+        self.assertEqual(service.get_cumulative_count(device_1), (8, None))
+        self.assertEqual(service.get_cumulative_count(device_2), (2, None))
+        self.assertEqual(service.get_latest_timestamp(device_1),
+                         (self.timestamp + datetime.timedelta(seconds=10), None))
+
+        # Readings in the snapshot and in the log tail are still duplicates
+        self._add(service, device_1, 0, count=5)
+        self._add(service, device_1, 10, count=3)
+        self.assertEqual(service.get_cumulative_count(device_1), (8, None))
+        service.wal.close()
+
+    def test_successive_snapshots(self):
+        # Test that a snapshot folds the previous one into the new log records
+        device_id = uuid.uuid4()
+        service = self._start()
+        checkpointer = Checkpointer(service.wal, self.snapshot_path)
+        for i in range(3):
+            self._add(service, device_id, i, count=2)
+            checkpointer.checkpoint()
+        service.wal.close()
+
+        snapshot = SnapshotReader(self.snapshot_path)
+        self.assertEqual(snapshot.wal_sequence, 3)
+        self.assertEqual(snapshot.find_device(device_id.bytes)[1], 6)
+        self.assertEqual(snapshot.num_keys, 3)
+        snapshot.close()
+
+    def test_key_capacity(self):
+        # Test that only the most recent keys are kept
+        device_id = uuid.uuid4()
+        service = self._start()
+        for i in range(5):
+            self._add(service, device_id, i)
+        Checkpointer(service.wal, self.snapshot_path, key_capacity=2).checkpoint()
+        service.wal.close()
+
+        snapshot = SnapshotReader(self.snapshot_path)
+        self.assertEqual([epoch_us for _, epoch_us, _ in snapshot.keys()],
+                         [to_epoch_us(self.timestamp + datetime.timedelta(seconds=i)) for i in (3, 4)])
+        snapshot.close()
+
+    def test_scan_loads_snapshot_devices(self):
+        # Test that scanning the devices includes the devices of the snapshot that were never used
+        device_1, device_2 = uuid.uuid4(), uuid.uuid4()
+        service = self._start()
+        self._add(service, device_1, 0)
+        Checkpointer(service.wal, self.snapshot_path).checkpoint()
+        self._add(service, device_2, 0)
+        service.wal.close()
+
+        service = self._start()
+        self.assertEqual(sorted(service.device_store.scan_devices(0, 10)[1]), sorted([device_1, device_2]))
+        service.wal.close()
+
+    def test_unloaded_devices_count_against_capacity(self):
+        # Test that devices of the snapshot keep their room in the store before they are loaded
+        service = self._start(device_capacity=2)
+        self._add(service, uuid.uuid4(), 0)
+        self._add(service, uuid.uuid4(), 0)
+        Checkpointer(service.wal, self.snapshot_path).checkpoint()
+        service.wal.close()
+
+        service = self._start(device_capacity=2)
+        self.assertEqual(self._add(service, uuid.uuid4(), 0), "Capacity exceeded")
+        service.wal.close()
+
+    def test_checkpoint_during_ingestion(self):
+        # Test that readings added while snapshots are taken are all restored
+        device_ids = [uuid.uuid4() for _ in range(5)]
+        service = self._start()
+        checkpointer = Checkpointer(service.wal, self.snapshot_path)
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [pool.submit(self._add, service, device_ids[i % 5], i) for i in range(200)]
+            for _ in range(5):
+                checkpointer.checkpoint()
+            for future in futures:
+                future.result()
+        service.wal.close()
+
+        service = self._start()
+        self.assertEqual(sum(service.get_cumulative_count(device_id)[0] for device_id in device_ids), 200)
+        service.wal.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
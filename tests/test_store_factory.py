@@ -0,0 +1,154 @@
+import unittest
+import uuid
+from config.base import Settings
+from stores.bloom_ts_store import BloomTimestampStore
+from stores.columnar_device_store import ColumnarDeviceStore
+from stores.evicting_device_store import EvictingDeviceStore
+from stores.factory import (_shared_memory_stores, create_device_store, create_rollup_store, create_top_devices,
+                            create_ts_store)
+from stores.in_mem_device_store import in_mem_device_store
+from stores.in_memory_ts_store import InMemoryTimestampStore, in_mem_ts_store
+from stores.partitioned_ts_store import PartitionedTimestampStore
+from stores.redis_store import RedisStore
+from stores.rollup_store import RollupStore
+from stores.shared_memory_store import SharedMemoryStore
+from stores.striped_device_store import StripedDeviceStore
+from stores.top_devices import TopDevices
+from stores.ttl_ts_store import TtlTimestampStore
+from stores.watermark_ts_store import WatermarkTimestampStore
+
+
+class TestStoreFactory(unittest.TestCase):
+
+    def test_memory_device_store(self):
+        # Test that the default backend is the shared in-memory device store
+        self.assertIs(create_device_store(Settings()), in_mem_device_store)
+
+    def test_striped_device_store(self):
+        # Test that the striped backend uses the capacity and number of stripes
+        store = create_device_store(Settings(DEVICE_STORE_BACKEND="striped", DEVICE_STORE_CAPACITY=5,
+                                             DEVICE_STORE_STRIPES=4))
+        self.assertIsInstance(store, StripedDeviceStore)
+        self.assertEqual(store.capacity, 5)
+        self.assertEqual(store.stripes, 4)
+
+    def test_evicting_device_store(self):
+        # Test that an eviction policy on the memory backend creates an evicting store with a spill tier if set
+        store = create_device_store(Settings(DEVICE_STORE_EVICTION="idle", DEVICE_STORE_CAPACITY=5,
+                                             DEVICE_STORE_IDLE_TTL_S=30, DEVICE_STORE_SPILL_PATH=":memory:"))
+        self.assertIsInstance(store, EvictingDeviceStore)
+        self.assertEqual((store.capacity, store.policy, store.idle_ttl_s), (5, "idle", 30))
+        self.assertIsNotNone(store.spill)
+        store.spill.close()
+        store = create_device_store(Settings(DEVICE_STORE_EVICTION="lru"))
+        self.assertIsNone(store.spill)
+
+    def test_columnar_device_store(self):
+        # Test that the columnar backend uses the capacity and number of stripes
+        store = create_device_store(Settings(DEVICE_STORE_BACKEND="columnar", DEVICE_STORE_CAPACITY=5,
+                                             DEVICE_STORE_STRIPES=4))
+        self.assertIsInstance(store, ColumnarDeviceStore)
+        self.assertEqual(store.capacity, 5)
+        self.assertEqual(store.stripes, 4)
+
+    def test_redis_store(self):
+        # Test that the redis backend returns one shared store for devices and timestamps, without connecting
+        settings = Settings(DEVICE_STORE_BACKEND="redis", TIMESTAMP_STORE_BACKEND="redis", DEVICE_STORE_CAPACITY=5,
+                            TIMESTAMP_STORE_CAPACITY=50, REDIS_KEY_PREFIX="factory_test")
+        store = create_device_store(settings)
+        self.assertIsInstance(store, RedisStore)
+        self.assertIs(create_ts_store(settings), store)
+        self.assertEqual(store.capacity, 5)
+
+    def test_shared_memory_store(self):
+        # Test that the shared backend returns one shared store for devices and timestamps
+        settings = Settings(DEVICE_STORE_BACKEND="shared", TIMESTAMP_STORE_BACKEND="shared", DEVICE_STORE_CAPACITY=5,
+                            TIMESTAMP_STORE_CAPACITY=50, DEVICE_STORE_STRIPES=4,
+                            SHARED_MEMORY_NAME=f"device_readings_test_{uuid.uuid4().hex[:12]}")
+        store = create_device_store(settings)
+        try:
+            self.assertIsInstance(store, SharedMemoryStore)
+            self.assertIs(create_ts_store(settings), store)
+            self.assertEqual(store.capacity, 5)
+            self.assertEqual(store.stripes, 4)
+        finally:
+            _shared_memory_stores.pop(settings.SHARED_MEMORY_NAME)
+            store.unlink()
+            store.close()
+
+    def test_unknown_device_store(self):
+        # Test that an unknown backend is rejected
+        with self.assertRaises(ValueError):
+            create_device_store(Settings(DEVICE_STORE_BACKEND="unknown"))
+
+    def test_ordered_ts_store(self):
+        # Test that the default backend is the shared ordered in-memory store
+        self.assertIs(create_ts_store(Settings()), in_mem_ts_store)
+
+    def test_sharded_ts_store(self):
+        # Test that sharded stores get their own store with the global capacities split between them
+        store = create_ts_store(Settings(TIMESTAMP_STORE_CAPACITY=100, TIMESTAMP_BLOOM_ENABLED=True,
+                                         TIMESTAMP_BLOOM_CAPACITY=1000), shards=4)
+        self.assertEqual(store.capacity, 250)
+        self.assertIsNot(store.exact_store, in_mem_ts_store)
+        self.assertEqual(store.exact_store.capacity, 25)
+
+    def test_partitioned_ts_store(self):
+        # Test that the partitioned backend uses the per-device capacity
+        store = create_ts_store(Settings(TIMESTAMP_STORE_BACKEND="partitioned", TIMESTAMP_STORE_CAPACITY_PER_DEVICE=7))
+        self.assertIsInstance(store, PartitionedTimestampStore)
+        self.assertEqual(store.capacity_per_device, 7)
+
+    def test_watermark_ts_store(self):
+        # Test that the watermark backend uses the window settings and an exact fallback when configured
+        store = create_ts_store(Settings(TIMESTAMP_STORE_BACKEND="watermark", TIMESTAMP_WINDOW_SLOTS=10,
+                                         TIMESTAMP_WINDOW_LATE_POLICY="exact"))
+        self.assertIsInstance(store, WatermarkTimestampStore)
+        self.assertEqual(store.window_slots, 10)
+        self.assertIsInstance(store.fallback_store, InMemoryTimestampStore)
+
+        store = create_ts_store(Settings(TIMESTAMP_STORE_BACKEND="watermark"))
+        self.assertIsNone(store.fallback_store)
+
+    def test_ttl_ts_store(self):
+        # Test that the ttl backend uses the retention and bucket size
+        store = create_ts_store(Settings(TIMESTAMP_STORE_BACKEND="ttl", TIMESTAMP_STORE_RETENTION_S=3600,
+                                         TIMESTAMP_STORE_BUCKET_S=10))
+        self.assertIsInstance(store, TtlTimestampStore)
+        self.assertEqual((store.retention_s, store.bucket_s), (3600, 10))
+
+    def test_bloom_tier(self):
+        # Test that the Bloom filter tier wraps the configured backend when enabled
+        store = create_ts_store(Settings(TIMESTAMP_STORE_BACKEND="partitioned", TIMESTAMP_BLOOM_ENABLED=True,
+                                         TIMESTAMP_BLOOM_CAPACITY=100, TIMESTAMP_BLOOM_HIT_POLICY="exact"))
+        self.assertIsInstance(store, BloomTimestampStore)
+        self.assertIsInstance(store.exact_store, PartitionedTimestampStore)
+        self.assertEqual(store.capacity, 100)
+        self.assertEqual(store.hit_policy, "exact")
+
+    def test_unknown_ts_store(self):
+        # Test that an unknown backend is rejected
+        with self.assertRaises(ValueError):
+            create_ts_store(Settings(TIMESTAMP_STORE_BACKEND="unknown"))
+
+    def test_top_devices(self):
+        # Test that the top devices index uses the configured capacity, and is disabled by a capacity of 0
+        self.assertEqual(create_top_devices(Settings(TOP_DEVICES_CAPACITY=5)).capacity, 5)
+        self.assertIsInstance(create_top_devices(Settings()), TopDevices)
+        self.assertIsNone(create_top_devices(Settings(TOP_DEVICES_CAPACITY=0)))
+
+    def test_rollup_store(self):
+        # Test that rollups are created with the configured retentions, disabled by the setting and refused with
+        # the Redis and shared memory stores
+        self.assertIsNone(create_rollup_store(Settings(ROLLUPS_ENABLED=False)))
+        store = create_rollup_store(Settings(ROLLUPS_ENABLED=True, ROLLUP_DAY_RETENTION=0, ROLLUP_MAX_FUTURE_S=5))
+        self.assertIsInstance(store, RollupStore)
+        self.assertEqual((list(store.retentions), store.max_future_s), (["minute", "hour"], 5))
+        with self.assertRaises(ValueError):
+            create_rollup_store(Settings(ROLLUPS_ENABLED=True, DEVICE_STORE_BACKEND="redis"))
+        with self.assertRaises(ValueError):
+            create_rollup_store(Settings(ROLLUPS_ENABLED=True, TIMESTAMP_STORE_BACKEND="shared"))
+
+
+if __name__ == '__main__':
+    unittest.main()
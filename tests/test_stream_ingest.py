@@ -0,0 +1,140 @@
+import asyncio
+import json
+import unittest
+import uuid
+
+from stream_ingest import JsonArrayReader, NdjsonReader, UploadIngest, create_upload_reader
+
+DEVICE_ID = uuid.UUID("3fa85f64-5717-4562-b3fc-2c963f66afa6")
+OTHER_DEVICE_ID = uuid.UUID("3fa85f64-5717-4562-b3fc-2c963f66afa7")
+
+
+def _line(device_id, second, count=1) -> bytes:
+    """Return a DeviceReadings document with one reading."""
+    return json.dumps({"id": str(device_id), "readings": [
+        {"timestamp": f"2024-10-11T02:11:{second:02d}Z", "count": count}]}).encode()
+
+
+def _read(reader, chunks):
+    """Feed chunks to a reader and return every document it returns."""
+    documents = []
+    for chunk in chunks:
+        documents.extend(reader.feed(chunk))
+    documents.extend(reader.finish())
+    return documents
+
+
+def _split(data: bytes, size: int):
+    """Split data into chunks of the given size."""
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestNdjsonReader(unittest.TestCase):
+
+    def test_lines_split_across_chunks(self):
+        # Test that lines are returned whole whatever the chunk boundaries, with their line numbers
+        data = b"\n".join([_line(DEVICE_ID, 1), b"", _line(DEVICE_ID, 2), b"  ", _line(DEVICE_ID, 3)])
+        for size in [1, 7, len(data)]:
+            documents = _read(NdjsonReader(max_line_bytes=1000), _split(data, size))
+            self.assertEqual(documents, [(1, _line(DEVICE_ID, 1), ""), (3, _line(DEVICE_ID, 2), ""),
+                                         (5, _line(DEVICE_ID, 3), "")])
+
+    def test_long_line_skipped(self):
+        # Test that a line over the limit is reported once and skipped without stopping the reading
+        data = b"x" * 200 + b"\n" + _line(DEVICE_ID, 1) + b"\n"
+        for size in [10, len(data)]:
+            documents = _read(NdjsonReader(max_line_bytes=len(_line(DEVICE_ID, 1))), _split(data, size))
+            self.assertEqual(documents[0][0::2], (1, f"Line exceeds {len(_line(DEVICE_ID, 1))} bytes"))
+            self.assertEqual(documents[1:], [(2, _line(DEVICE_ID, 1), "")])
+
+
+class TestJsonArrayReader(unittest.TestCase):
+
+    def test_elements_split_across_chunks(self):
+        # Test that elements are returned whole whatever the chunk boundaries, with their positions
+        elements = [json.loads(_line(DEVICE_ID, second)) for second in range(3)]
+        data = json.dumps(elements, indent=1).encode() + b"\n"
+        for size in [1, 5, len(data)]:
+            reader = JsonArrayReader(max_element_bytes=1000)
+            self.assertEqual(_read(reader, _split(data, size)),
+                             [(1, elements[0], ""), (2, elements[1], ""), (3, elements[2], "")])
+            self.assertEqual(reader.error, "")
+
+    def test_numbers_and_empty_array(self):
+        # Test that a number split across chunks is read whole, and that an empty array holds no element
+        self.assertEqual(_read(JsonArrayReader(1000), [b"[12", b"34, 5", b"]"]), [(1, 1234, ""), (2, 5, "")])
+        reader = JsonArrayReader(1000)
+        self.assertEqual(_read(reader, [b" [ ] "]), [])
+        self.assertEqual(reader.error, "")
+
+    def test_errors_stop_reading(self):
+        # Test that a broken array stops the reading with an error, after the elements before the error
+        cases = [([b'{"id": 1}'], [], "Expected a JSON array"),
+                 ([b"[1, 2", b" 3]"], [(1, 1, ""), (2, 2, "")], "Expected ',' or ']' after element 2"),
+                 ([b"[1, {"], [(1, 1, "")], "Element 2: Expecting property name enclosed in double quotes"),
+                 ([b"[1, 2"], [(1, 1, ""), (2, 2, "")], "Unterminated array after element 2"),
+                 ([b'[1, "' + b"x" * 20], [(1, 1, "")], "Element 2 exceeds 10 characters")]
+        for chunks, documents, error in cases:
+            reader = JsonArrayReader(max_element_bytes=10)
+            self.assertEqual(_read(reader, chunks), documents)
+            self.assertEqual(reader.error, error)
+
+
+class TestCreateUploadReader(unittest.TestCase):
+
+    def test_media_types(self):
+        # Test that NDJSON is the default, JSON is read as an array, and other media types are rejected
+        self.assertIsInstance(create_upload_reader(None, 10), NdjsonReader)
+        self.assertIsInstance(create_upload_reader("application/x-ndjson; charset=utf-8", 10), NdjsonReader)
+        self.assertIsInstance(create_upload_reader("Application/JSON", 10), JsonArrayReader)
+        self.assertIsNone(create_upload_reader("text/csv", 10))
+
+
+class TestUploadIngest(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+
+    async def _add_batch(self, batch):
+        # Record the batches, and fail the other device as if the store was full
+        self.batches.append(batch)
+        return {device_id: "Capacity exceeded" if device_id == OTHER_DEVICE_ID else "" for device_id in batch}
+
+    def _run(self, upload, chunks):
+        """Run an upload and return its events."""
+        async def run():
+            async def stream():
+                for chunk in chunks:
+                    yield chunk
+            return b"".join([chunk async for chunk in upload.run(stream())])
+        return [json.loads(line) for line in asyncio.run(run()).splitlines()]
+
+    def test_micro_batches(self):
+        # Test that readings are added in batches of the batch size, with a progress event per batch
+        data = b"\n".join(_line(DEVICE_ID, second, count=2) for second in range(5))
+        upload = UploadIngest(NdjsonReader(1000), self._add_batch, batch_size=2, max_errors=10)
+        events = self._run(upload, _split(data, 16))
+        self.assertEqual([len(batch[DEVICE_ID]) for batch in self.batches], [2, 2, 1])
+        self.assertEqual(self.batches[0][DEVICE_ID][0], (1728612660000000, 2, 0))
+        self.assertEqual([event["event"] for event in events], ["progress"] * 3 + ["done"])
+        self.assertEqual(events[-1], {"event": "done", "lines": 5, "readings": 5, "errors": 0, "complete": True})
+
+    def test_errors_reported_per_line(self):
+        # Test that invalid lines and lines of failed devices are reported with their line numbers
+        data = b"\n".join([_line(DEVICE_ID, 1), b'{"id": "nope", "readings": []}', _line(OTHER_DEVICE_ID, 1),
+                           b"{", _line(DEVICE_ID, 2)])
+        upload = UploadIngest(NdjsonReader(1000), self._add_batch, batch_size=100, max_errors=2)
+        events = self._run(upload, [data])
+        errors = [event for event in events if event["event"] == "error"]
+        self.assertEqual([error["line"] for error in errors], [2, 4])
+        self.assertTrue(errors[0]["message"].startswith("id: Input should be a valid UUID"))
+        self.assertEqual(events[-1], {"event": "done", "lines": 5, "readings": 2, "errors": 3, "complete": True})
+
+    def test_broken_array(self):
+        # Test that the elements before an error that stops the reading are added
+        data = b"[" + _line(DEVICE_ID, 1) + b", " + _line(DEVICE_ID, 2)
+        upload = UploadIngest(JsonArrayReader(1000), self._add_batch, batch_size=100, max_errors=10)
+        events = self._run(upload, [data])
+        self.assertEqual(events[-3]["event"], "progress")
+        self.assertEqual(events[-2], {"event": "error", "message": "Unterminated array after element 2"})
+        self.assertEqual(events[-1], {"event": "done", "lines": 2, "readings": 2, "errors": 1, "complete": False})
@@ -0,0 +1,40 @@
+import datetime
+import json
+import unittest
+import uuid
+from streaming import stream_json_list
+
+
+class TestStreamJsonList(unittest.TestCase):
+
+    def test_pages_and_tail(self):
+        # Test that the pages are joined into one list, empty pages are skipped and the tail is added at the end
+        device_id = uuid.uuid4()
+        timestamp = datetime.datetime(2024, 9, 29, 12, 0, tzinfo=datetime.timezone.utc)
+        pages = [[{"id": device_id, "at": timestamp}], [], [{"id": device_id, "at": None}]]
+        chunks = list(stream_json_list("devices", pages, tail=lambda: {"next_cursor": 7}))
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(json.loads(b"".join(chunks)), {
+            "devices": [{"id": str(device_id), "at": "2024-09-29T12:00:00+00:00"}, {"id": str(device_id), "at": None}],
+            "next_cursor": 7,
+        })
+
+    def test_tail_read_after_pages(self):
+        # Test that the tail is computed only once every page was read
+        state = {"pages": 0}
+
+        def pages():
+            for _ in range(3):
+                state["pages"] += 1
+                yield [{}]
+
+        chunks = b"".join(stream_json_list("items", pages(), tail=lambda: dict(state)))
+        self.assertEqual(json.loads(chunks), {"items": [{}, {}, {}], "pages": 3})
+
+    def test_empty(self):
+        # Test that no pages give an empty list
+        self.assertEqual(json.loads(b"".join(stream_json_list("items", []))), {"items": []})
+
+
+if __name__ == '__main__':
+    unittest.main()
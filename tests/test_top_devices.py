@@ -0,0 +1,81 @@
+import random
+import unittest
+import uuid
+from stores.top_devices import TopDevices
+from tests.utils import run_multiples_threads
+
+
+class TestTopDevices(unittest.TestCase):
+
+    def setUp(self):
+        self.top_devices = TopDevices(capacity=3)
+
+    def test_invalid_capacity(self):
+        # Test that an index without capacity is rejected
+        with self.assertRaises(ValueError):
+            TopDevices(capacity=0)
+
+    def test_top_ordered(self):
+        # Test that the devices are returned highest count first, limited to k
+        device_ids = [uuid.uuid4() for _ in range(3)]
+        for device_id, count in zip(device_ids, [5, 9, 1]):
+            self.top_devices.update(device_id, count)
+        self.assertEqual(self.top_devices.top(3), [(device_ids[1], 9), (device_ids[0], 5), (device_ids[2], 1)])
+        self.assertEqual(self.top_devices.top(1), [(device_ids[1], 9)])
+        self.assertEqual(self.top_devices.floor, 1)
+
+    def test_lowest_device_replaced(self):
+        # Test that a device entering a full index replaces the device with the lowest count
+        device_ids = [uuid.uuid4() for _ in range(4)]
+        for device_id, count in zip(device_ids, [5, 9, 1, 3]):
+            self.top_devices.update(device_id, count)
+        self.assertEqual([device_id for device_id, _ in self.top_devices.top(3)], device_ids[1::-1] + [device_ids[3]])
+        self.assertEqual(self.top_devices.floor, 3)
+        # A device below the floor does not enter the index
+        self.top_devices.update(device_ids[2], 2)
+        self.assertNotIn(device_ids[2], [device_id for device_id, _ in self.top_devices.top(3)])
+
+    def test_update_in_place(self):
+        # Test that a device already in the index is updated in place and never lowered
+        device_ids = [uuid.uuid4() for _ in range(3)]
+        for device_id, count in zip(device_ids, [5, 9, 1]):
+            self.top_devices.update(device_id, count)
+        self.top_devices.update(device_ids[2], 10)
+        self.top_devices.update(device_ids[1], 4)
+        self.assertEqual(self.top_devices.top(3), [(device_ids[2], 10), (device_ids[1], 9), (device_ids[0], 5)])
+        self.assertEqual(len(self.top_devices), 3)
+        self.assertEqual(self.top_devices.floor, 5)
+
+    def test_matches_sorted_counts(self):
+        # Test that random increments of many devices give the same top devices as sorting every count
+        top_devices = TopDevices(capacity=10)
+        device_ids = [uuid.uuid4() for _ in range(200)]
+        counts = dict.fromkeys(device_ids, 0)
+        rng = random.Random(7)
+        for _ in range(5000):
+            device_id = rng.choice(device_ids)
+            counts[device_id] += rng.randint(1, 5)
+            top_devices.update(device_id, counts[device_id])
+        expected = sorted(counts.values(), reverse=True)[:10]
+        top = top_devices.top(10)
+        self.assertEqual([count for _, count in top], expected)
+        self.assertTrue(all(counts[device_id] == count for device_id, count in top))
+
+    def test_concurrent_updates(self):
+        # Test that concurrent updates of increasing counts keep the highest count of each device
+        top_devices = TopDevices(capacity=5)
+        device_ids = [uuid.uuid4() for _ in range(20)]
+        args = [[device_id, count] for count in range(1, 51) for device_id in device_ids]
+        random.shuffle(args)
+        run_multiples_threads(top_devices.update, args)
+        self.assertEqual([count for _, count in top_devices.top(5)], [50] * 5)
+        self.assertEqual(len(top_devices), 5)
+
+    def test_stats_and_clear(self):
+        # Test that the statistics report the size of the index and that clear empties it
+        self.top_devices.update(uuid.uuid4(), 4)
+        stats = self.top_devices.stats()
+        self.assertEqual((stats["capacity"], stats["devices"], stats["floor"], stats["updates"]), (3, 1, -1, 1))
+        self.top_devices.clear()
+        self.assertEqual(self.top_devices.top(3), [])
+        self.assertEqual(self.top_devices.floor, -1)
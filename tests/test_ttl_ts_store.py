@@ -0,0 +1,105 @@
+import unittest
+import uuid
+from stores.ttl_ts_store import EXPIRE_BATCH, TtlTimestampStore
+from tests.utils import run_multiples_threads
+
+
+class FakeClock:
+    """Clock returning a time advanced by the tests."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTtlTimestampStore(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.store = TtlTimestampStore(retention_s=10, bucket_s=1, clock=self.clock)
+        self.device_id = uuid.uuid4()
+
+    def test_invalid_retention(self):
+        # Test that a retention or a bucket size that is not positive is rejected
+        with self.assertRaises(ValueError):
+            TtlTimestampStore(retention_s=0)
+        with self.assertRaises(ValueError):
+            TtlTimestampStore(bucket_s=0)
+
+    def test_duplicates_within_retention(self):
+        # Test that a timestamp is rejected as a duplicate for the whole retention, whatever the traffic
+        self.assertTrue(self.store.check_and_add_timestamp(self.device_id, 1))
+        for i in range(1000):
+            self.store.check_and_add_timestamp(self.device_id, 100 + i)
+        self.clock.now = 10.99
+        self.assertFalse(self.store.check_and_add_timestamp(self.device_id, 1))
+        self.assertTrue(self.store.check_and_add_timestamp(uuid.uuid4(), 1))
+
+    def test_expiry_after_retention(self):
+        # Test that a timestamp is forgotten once its bucket is older than the retention
+        self.store.check_and_add_timestamp(self.device_id, 1)
+        self.clock.now = 11
+        self.assertTrue(self.store.check_and_add_timestamp(self.device_id, 1))
+        self.assertEqual(self.store.expirations, 1)
+        self.assertEqual(len(self.store), 1)
+
+    def test_seen_again_refreshes_retention(self):
+        # Test that seeing a timestamp again keeps it for a whole retention from then
+        self.store.check_and_add_timestamp(self.device_id, 1)
+        self.clock.now = 5
+        self.assertFalse(self.store.check_and_add_timestamp(self.device_id, 1))
+        self.clock.now = 15
+        self.assertFalse(self.store.check_and_add_timestamp(self.device_id, 1))
+        self.assertEqual(self.store.expirations, 0)
+        self.clock.now = 30
+        self.assertTrue(self.store.check_and_add_timestamp(self.device_id, 1))
+
+    def test_expiry_in_batches(self):
+        # Test that an expired bucket is removed a batch of keys at a time by the following calls
+        self.store.check_and_add_timestamps(self.device_id, list(range(3 * EXPIRE_BATCH)))
+        self.clock.now = 20
+        other_device_id = uuid.uuid4()
+        self.store.check_and_add_timestamp(other_device_id, 1)
+        self.assertEqual(self.store.expirations, EXPIRE_BATCH)
+        self.store.check_and_add_timestamp(other_device_id, 2)
+        self.store.check_and_add_timestamp(other_device_id, 3)
+        self.assertEqual(self.store.expirations, 3 * EXPIRE_BATCH)
+        self.assertEqual(len(self.store), 3)
+        self.assertEqual(self.store.stats()["buckets"], 1)
+
+    def test_check_and_add_timestamps(self):
+        # Test that a list of timestamps is deduped against the store and within the list
+        self.store.check_and_add_timestamp(self.device_id, 1)
+        self.assertEqual(self.store.check_and_add_timestamps(self.device_id, [1, 2, 2, 3]), [False, True, False, True])
+        self.assertEqual(self.store.check_and_add_timestamps(self.device_id, []), [])
+
+    def test_concurrent_check_and_add(self):
+        # Test that a timestamp sent concurrently many times is added exactly once
+        results = run_multiples_threads(self.store.check_and_add_timestamp, [[self.device_id, 1]] * 50)
+        self.assertEqual(results.count(True), 1)
+
+    def test_stats(self):
+        # Test that the memory is reported against the retention, projected until the store covers it
+        for i in range(100):
+            self.store.check_and_add_timestamp(self.device_id, i)
+        self.clock.now = 5
+        stats = self.store.stats()
+        self.assertEqual((stats["backend"], stats["size"], stats["buckets"]), ("ttl", 100, 1))
+        self.assertEqual(stats["oldest_age_s"], 5)
+        self.assertEqual(stats["window_fill"], 0.5)
+        self.assertGreater(stats["bytes"], 100 * 100)
+        self.assertEqual(stats["window_bytes"], 2 * stats["bytes"])
+        self.assertEqual(TtlTimestampStore().stats()["window_bytes"], 0)
+
+    def test_clear(self):
+        # Test that clear forgets every timestamp
+        self.store.check_and_add_timestamp(self.device_id, 1)
+        self.store.clear()
+        self.assertEqual(len(self.store), 0)
+        self.assertTrue(self.store.check_and_add_timestamp(self.device_id, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+from device_readings_service import COUNT_OUT_OF_RANGE, DeviceReadingsService
+from models import DeviceReadings, Reading
+from config.base import Settings
+from persistence.wal import HEADER, RECORD, WriteAheadLog, create_wal
+from stores.in_mem_device_store import InMemoryDeviceStore
+from stores.in_memory_ts_store import InMemoryTimestampStore
+
+
+class TestWriteAheadLog(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "readings.wal")
+        self.device_id = uuid.uuid4()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_append_and_read(self):
+        # Test that records are read back in order after the log is reopened, for every fsync policy
+        for policy in ("always", "group", "none"):
+            path = os.path.join(self.directory, f"{policy}.wal")
+            wal = WriteAheadLog(path, fsync_policy=policy, group_commit_ms=1)
+            records = [(self.device_id.bytes, i, i * 2, 0) for i in range(5)]
+            wal.commit(wal.append(records[:2]))
+            wal.commit(wal.append(records[2:]))
+            wal.close()
+
+            wal = WriteAheadLog(path, fsync_policy=policy)
+            self.assertEqual(list(wal.records()), records)
+            self.assertEqual(len(wal), 5)
+            wal.close()
+
+    def test_group_commit(self):
+        # Test that a commit with the group policy returns once the flusher has synced its records
+        wal = WriteAheadLog(self.path, fsync_policy="group", group_commit_ms=1)
+        wal.commit(wal.append([(self.device_id.bytes, 1, 1, 0)]))
+        self.assertGreaterEqual(wal.fsyncs, 1)
+        wal.close()
+
+    def test_torn_tail_is_cut_off(self):
+        # Test that a partially written record at the end of the file is removed when the log is opened
+        wal = WriteAheadLog(self.path, fsync_policy="none")
+        wal.commit(wal.append([(self.device_id.bytes, 1, 1, 0), (self.device_id.bytes, 2, 1, 0)]))
+        wal.close()
+        with open(self.path, "ab") as file:
+            file.write(b"\x00" * (RECORD.size // 2))
+
+        wal = WriteAheadLog(self.path, fsync_policy="none")
+        self.assertEqual(os.path.getsize(self.path), HEADER.size + 2 * RECORD.size)
+        wal.commit(wal.append([(self.device_id.bytes, 3, 1, 0)]))
+        self.assertEqual([record[1] for record in wal.records()], [1, 2, 3])
+        wal.close()
+
+    def test_corrupt_record_is_skipped(self):
+        # Test that a record with a bad checksum is skipped without losing the records after it
+        wal = WriteAheadLog(self.path, fsync_policy="none")
+        wal.commit(wal.append([(self.device_id.bytes, i, 1, 0) for i in range(3)]))
+        wal.close()
+        with open(self.path, "r+b") as file:
+            file.seek(HEADER.size + RECORD.size + 20)
+            file.write(b"\xff")
+
+        wal = WriteAheadLog(self.path, fsync_policy="none")
+        self.assertEqual([record[1] for record in wal.records()], [0, 2])
+        self.assertEqual(wal.corrupt_records, 1)
+        wal.close()
+
+    def test_invalid_file(self):
+        # Test that a file which is not a log is rejected
+        with open(self.path, "wb") as file:
+            file.write(b"not a write-ahead log")
+        with self.assertRaises(ValueError):
+            WriteAheadLog(self.path)
+
+    def test_unknown_policy(self):
+        # Test that an unknown fsync policy is rejected
+        with self.assertRaises(ValueError):
+            WriteAheadLog(self.path, fsync_policy="sometimes")
+
+    def test_create_wal(self):
+        # Test that the log is opened in sync mode only, and refused before touching the disk in async mode
+        self.assertIsNone(create_wal(Settings(WAL_ENABLED=False, INGEST_MODE="async")))
+        wal = create_wal(Settings(WAL_ENABLED=True, WAL_PATH=self.path, WAL_FSYNC_POLICY="none"))
+        wal.close()
+        os.remove(self.path)
+        with self.assertRaises(ValueError) as context:
+            create_wal(Settings(WAL_ENABLED=True, WAL_PATH=self.path, INGEST_MODE="async"))
+        self.assertIn("INGEST_MODE=async", str(context.exception))
+        self.assertFalse(os.path.exists(self.path))
+
+
+class TestServiceRecovery(unittest.TestCase):
+    """
+    Functional tests of the service with a write-ahead log, restarted with empty stores.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "readings.wal")
+        self.device_id = uuid.uuid4()
+        self.timestamp = datetime.datetime(2024, 9, 29, 12, 0, 0, tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _service(self):
+        """Create a service over empty stores and the log."""
+        return DeviceReadingsService(device_store=InMemoryDeviceStore(capacity=10),
+                                     ts_store=InMemoryTimestampStore(capacity=100),
+                                     wal=WriteAheadLog(self.path, fsync_policy="always"))
+
+    def test_restart_keeps_counts_and_dedupe_history(self):
+        # Test that counts, latest timestamps and dedupe history survive a restart
+        service = self._service()
+        later = self.timestamp + datetime.timedelta(minutes=1)
+        service.add_device_readings(DeviceReadings(id=self.device_id, readings=[
+            Reading(timestamp=self.timestamp, count=5), Reading(timestamp=self.timestamp, count=5)]))
+        other_device_id = uuid.uuid4()
+        service.add_device_readings_batch([
+            DeviceReadings(id=self.device_id, readings=[Reading(timestamp=later, count=2)]),
+            DeviceReadings(id=other_device_id, readings=[Reading(timestamp=self.timestamp, count=1)]),
+        ])
+        service.wal.close()
+
+        service = self._service()
+        self.assertEqual(service.replay(service.wal.records()), 3)
+        self.assertEqual(service.get_cumulative_count(self.device_id), (7, None))
+        self.assertEqual(service.get_cumulative_count(other_device_id), (1, None))
+        latest_timestamp, _ = service.get_latest_timestamp(self.device_id)
+        self.assertEqual(latest_timestamp, later)
+        self.assertEqual(latest_timestamp.utcoffset(), later.utcoffset())
+
+        # A reading re-sent after the restart is still a duplicate
+        service.add_device_readings(DeviceReadings(id=self.device_id, readings=[Reading(timestamp=later, count=2)]))
+        self.assertEqual(service.get_cumulative_count(self.device_id), (7, None))
+        self.assertEqual(len(service.wal), 3)
+        self.assertIn("wal", service.get_store_stats())
+        service.wal.close()
+
+    def test_count_out_of_range(self):
+        # Test that readings with a count that does not fit in a record are refused before any store is updated
+        service = self._service()
+        too_large = Reading(timestamp=self.timestamp, count=2 ** 63)
+        err = service.add_device_readings(DeviceReadings(id=self.device_id, readings=[too_large]))
+        self.assertEqual(err, COUNT_OUT_OF_RANGE)
+        other_device_id = uuid.uuid4()
+        errors = service.add_device_readings_batch([
+            DeviceReadings(id=self.device_id, readings=[too_large]),
+            DeviceReadings(id=other_device_id, readings=[Reading(timestamp=self.timestamp, count=-2 ** 63)]),
+        ])
+        self.assertEqual(errors, {self.device_id: COUNT_OUT_OF_RANGE, other_device_id: ""})
+        err = service.add_encoded_readings(self.device_id, [(0, 2 ** 63, 0)])
+        self.assertEqual(err, COUNT_OUT_OF_RANGE)
+        self.assertEqual(service.get_cumulative_count(self.device_id)[0], 0)
+        self.assertEqual(len(service.wal), 1)
+        # The refused reading was not recorded as seen
+        service.add_device_readings(DeviceReadings(id=self.device_id,
+                                                   readings=[Reading(timestamp=self.timestamp, count=1)]))
+        self.assertEqual(service.get_cumulative_count(self.device_id), (1, None))
+        service.wal.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
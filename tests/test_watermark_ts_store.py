@@ -0,0 +1,115 @@
+import unittest
+import uuid
+from .utils import run_multiples_threads
+from stores.in_memory_ts_store import InMemoryTimestampStore
+from stores.watermark_ts_store import WatermarkTimestampStore
+
+
+class TestWatermarkTimestampStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = WatermarkTimestampStore(window_slots=8, resolution_us=1)
+        self.device_id = uuid.uuid4()
+        self.timestamp = 1622540800000000
+
+    def test_in_order_readings(self):
+        # Test that readings newer than the watermark are accepted and advance it
+        for i in range(20):
+            self.assertTrue(self.store.check_and_add_timestamp(self.device_id, self.timestamp + i))
+        window = self.store.windows[self.device_id.int]
+        self.assertEqual(window.watermark, self.timestamp + 19)
+        self.assertEqual(window.bits, 0xFF)
+
+    def test_duplicate_inside_window(self):
+        # Test that duplicates of the watermark and of older readings inside the window are rejected
+        self.store.check_and_add_timestamp(self.device_id, self.timestamp)
+        self.store.check_and_add_timestamp(self.device_id, self.timestamp + 5)
+        self.assertFalse(self.store.check_and_add_timestamp(self.device_id, self.timestamp + 5))
+        self.assertFalse(self.store.check_and_add_timestamp(self.device_id, self.timestamp))
+
+    def test_out_of_order_inside_window(self):
+        # Test that an unseen reading below the watermark but inside the window is accepted once
+        self.store.check_and_add_timestamp(self.device_id, self.timestamp + 5)
+        self.assertTrue(self.store.check_and_add_timestamp(self.device_id, self.timestamp + 2))
+        self.assertFalse(self.store.check_and_add_timestamp(self.device_id, self.timestamp + 2))
+
+    def test_late_reading_rejected(self):
+        # Test that readings older than the window are rejected with the reject policy
+        self.store.check_and_add_timestamp(self.device_id, self.timestamp + 100)
+        self.assertFalse(self.store.check_and_add_timestamp(self.device_id, self.timestamp))
+        self.assertEqual(self.store.late_rejections, 1)
+
+    def test_late_reading_exact_fallback(self):
+        # Test that readings older than the window are checked against the fallback store with the exact policy
+        fallback_store = InMemoryTimestampStore()
+        store = WatermarkTimestampStore(window_slots=8, resolution_us=1, late_policy="exact",
+                                        fallback_store=fallback_store)
+        store.check_and_add_timestamp(self.device_id, self.timestamp + 100)
+        self.assertTrue(store.check_and_add_timestamp(self.device_id, self.timestamp))
+        self.assertFalse(store.check_and_add_timestamp(self.device_id, self.timestamp))
+        # Only the late reading is in the fallback store, readings inside the window are not
+        self.assertEqual(len(fallback_store.store), 1)
+
+    def test_resend_after_slide_exact_fallback(self):
+        # Test that a reading accepted inside the window is still a duplicate once the window slid past it
+        store = WatermarkTimestampStore(window_slots=8, resolution_us=1, late_policy="exact",
+                                        fallback_store=InMemoryTimestampStore())
+        self.assertTrue(store.check_and_add_timestamp(self.device_id, self.timestamp + 100))
+        self.assertTrue(store.check_and_add_timestamp(self.device_id, self.timestamp + 200))
+        self.assertFalse(store.check_and_add_timestamp(self.device_id, self.timestamp + 100))
+        self.assertEqual(store.check_and_add_timestamps(self.device_id, [self.timestamp + 300, self.timestamp + 200,
+                                                                         self.timestamp + 300]), [True, False, False])
+
+    def test_slots_spilled_on_slide(self):
+        # Test that the slots seen are moved to the fallback store as they fall off the window, and only then
+        fallback_store = InMemoryTimestampStore()
+        store = WatermarkTimestampStore(window_slots=8, resolution_us=10, late_policy="exact",
+                                        fallback_store=fallback_store)
+        store.check_and_add_timestamps(self.device_id, [self.timestamp, self.timestamp + 25, self.timestamp + 70])
+        self.assertEqual(len(fallback_store.store), 0)
+        store.check_and_add_timestamp(self.device_id, self.timestamp + 100)
+        self.assertEqual(len(fallback_store.store), 2)
+        # A resend of a reading that fell off the window is a duplicate of its slot
+        self.assertFalse(store.check_and_add_timestamp(self.device_id, self.timestamp + 29))
+        self.assertTrue(store.check_and_add_timestamp(self.device_id, self.timestamp + 10))
+
+    def test_resolution(self):
+        # Test that readings in the same slot are treated as duplicates
+        store = WatermarkTimestampStore(window_slots=8, resolution_us=1_000_000)
+        self.assertTrue(store.check_and_add_timestamp(self.device_id, self.timestamp))
+        self.assertFalse(store.check_and_add_timestamp(self.device_id, self.timestamp + 999_999))
+        self.assertTrue(store.check_and_add_timestamp(self.device_id, self.timestamp + 1_000_000))
+
+    def test_default_resolution(self):
+        # Test that distinct readings less than a second apart are both accepted with the default resolution
+        store = WatermarkTimestampStore()
+        self.assertTrue(store.check_and_add_timestamp(self.device_id, self.timestamp))
+        self.assertTrue(store.check_and_add_timestamp(self.device_id, self.timestamp + 500_000))
+        self.assertFalse(store.check_and_add_timestamp(self.device_id, self.timestamp + 500_000))
+
+    def test_devices_are_independent(self):
+        # Test that the watermark of one device does not affect another device
+        self.store.check_and_add_timestamp(self.device_id, self.timestamp + 100)
+        self.assertTrue(self.store.check_and_add_timestamp(uuid.uuid4(), self.timestamp))
+
+    def test_check_and_add_timestamps(self):
+        # Test that the batch call matches the single calls, including late readings
+        timestamps = [self.timestamp + 10, self.timestamp + 9, self.timestamp + 10, self.timestamp]
+        self.assertEqual(self.store.check_and_add_timestamps(self.device_id, timestamps), [True, True, False, False])
+
+    def test_invalid_policy(self):
+        # Test that unknown policies and the exact policy without a fallback store are rejected
+        with self.assertRaises(ValueError):
+            WatermarkTimestampStore(late_policy="unknown")
+        with self.assertRaises(ValueError):
+            WatermarkTimestampStore(late_policy="exact")
+
+    def test_concurrent_addition_of_same_timestamp(self):
+        # Test that concurrent addition of the same timestamp is handled correctly
+        args = [(self.device_id, self.timestamp)] * 10
+        result = run_multiples_threads(self.store.check_and_add_timestamp, args)
+        self.assertEqual(result.count(True), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()